@@ -1,10 +1,10 @@
 import os
 from flask import Flask
 from apps import create_app
-from apps.config import Config
+from apps.config import get_config
 
 # Create Flask app using factory pattern
-app = create_app(Config)
+app = create_app(get_config())
 
 def run_flask():
     """Run Flask app."""
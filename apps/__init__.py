@@ -1,12 +1,22 @@
 import os
 from datetime import timedelta
-from flask import Flask, session, g
+from flask import Flask, session, g, send_from_directory
 from flask_wtf.csrf import CSRFProtect
 from importlib import import_module
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime # Added for date formatting
 
 from apps.config import Config
-from apps.db import get_db_connection
+from apps.cache_versions import init_cache_versions
+from apps.db import get_db_connection, init_db
+from apps.query_stats import init_query_stats
+from apps.server_sessions import init_server_sessions
+from apps.summaries import init_summaries, rebuild_summaries_command
+from apps.score_writer import add_scores_unique_key_command
+from apps.seed_data import seed_benchmark_data_command
+from apps.benchmark import benchmark_reports_command
+from apps.job_runner import purge_jobs_command
+from apps.pagination import add_listing_indexes_command
 
 # Initialize Flask extensions
 csrf = CSRFProtect()
@@ -14,6 +24,17 @@ csrf = CSRFProtect()
 def register_extensions(app):
     """Initialize Flask extensions."""
     csrf.init_app(app)
+    init_db(app)
+    init_query_stats(app)
+    init_cache_versions(app)
+    init_server_sessions(app)
+    init_summaries(app)
+    app.cli.add_command(rebuild_summaries_command)
+    app.cli.add_command(add_scores_unique_key_command)
+    app.cli.add_command(seed_benchmark_data_command)
+    app.cli.add_command(benchmark_reports_command)
+    app.cli.add_command(purge_jobs_command)
+    app.cli.add_command(add_listing_indexes_command)
 
 
 
@@ -73,17 +94,36 @@ def register_blueprints(app):
         'other_products', 'department_h_products', 'dep_restock', 'division',
         'subject_assign', 'results_update', 'add_marks','assessment','term',
         'classteacher_assign','grade_analysis','eot_reports','past_reports',
-        'subject_comments','headmaster_comments','classteacher_comments','locations','suppliers','fixed_assets','asset_inventory'
+        'subject_comments','headmaster_comments','classteacher_comments','locations','suppliers','fixed_assets','asset_inventory',
+        'monitoring', 'jobs'
     ]
 
     for module_name in modules:
         module = import_module(f'apps.{module_name}.routes')
         app.register_blueprint(module.blueprint)
 
+def register_uploads(app):
+    """Serve /static/uploads/ from UPLOAD_FOLDER when it lives outside static/."""
+    folder = os.path.abspath(app.config['UPLOAD_FOLDER'])
+    if folder == os.path.join(os.path.abspath(app.static_folder), 'uploads'):
+        return
+
+    def uploaded_file(filename):
+        return send_from_directory(folder, filename)
+
+    # More specific than /static/<path:filename>, so it wins for uploads
+    app.add_url_rule('/static/uploads/<path:filename>', 'uploaded_file', uploaded_file)
+
+
 def create_app(config_class=Config):
     """Create and configure the Flask application."""
     app = Flask(__name__)
     app.config.from_object(config_class)
+    config_class.init_app(app)
+
+    if app.config.get('PROXY_FIX_HOPS'):
+        hops = app.config['PROXY_FIX_HOPS']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops, x_host=hops)
 
     # Set session lifetime
     app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
@@ -97,6 +137,7 @@ def create_app(config_class=Config):
     app.jinja_env.filters['date_format'] = format_date
     
     register_blueprints(app)
+    register_uploads(app)
 
     @app.before_request
     def before_request():
@@ -9,6 +9,10 @@ import random
 import logging
 import re  # <-- Add this line
 from apps import get_db_connection
+from apps.reference_data import reference_rows
+from apps.summaries import refresh_summaries
+from apps.report_cache import invalidate_reports
+from apps.score_writer import has_unique_key, write_scores
 from jinja2 import TemplateNotFound
 import numpy as np 
 from datetime import datetime
@@ -32,20 +36,12 @@ def add_marks():
     cursor = connection.cursor(dictionary=True)
 
     # Load dropdown values
-    cursor.execute("SELECT * FROM classes")
-    class_list = cursor.fetchall()
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
-    cursor.execute("SELECT * FROM subjects")
-    subjects = cursor.fetchall()
-    cursor.execute("SELECT * FROM stream")
-    streams = cursor.fetchall()
-    cursor.execute("SELECT * FROM pupils")
-    pupils = cursor.fetchall()
+    class_list = reference_rows('classes')
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
+    subjects = reference_rows('subjects')
+    streams = reference_rows('stream')
 
     # --- NO DATA INSERTION LOGIC HERE ---
 
@@ -66,7 +62,7 @@ def add_marks():
         return render_template('add_marks/add_marks.html',
             add_marks=[], class_list=class_list, study_years=study_years,
             terms=terms, subjects=subjects, assessments=assessments,
-            streams=streams, pupils=pupils,
+            streams=streams,
             selected_class_id=class_id,
             selected_study_year_id=year_id,
             selected_term_id=term_id,
@@ -147,7 +143,6 @@ def add_marks():
         subjects=subjects,
         assessments=assessments,
         streams=streams,
-        pupils=pupils,
         selected_class_id=class_id,
         selected_study_year_id=year_id,
         selected_term_id=term_id,
@@ -201,12 +196,10 @@ def teacher_add_marks():
     study_years = cursor.fetchall()
 
     # Terms (likely fixed for all, can be filtered similarly if needed)
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
+    terms = reference_rows('terms')
 
     # Assessments (assumed to be global, keep all)
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
+    assessments = reference_rows('assessment')
 
     # Subjects assigned to this teacher
     cursor.execute("""
@@ -226,16 +219,6 @@ def teacher_add_marks():
     """, (user_id,))
     streams = cursor.fetchall()
 
-    cursor.execute("""
-    SELECT DISTINCT p.*
-    FROM pupils p
-    JOIN subject_assignment sa 
-        ON p.stream_id = sa.stream_id
-       AND sa.year_id = p.year_id
-    WHERE sa.user_id = %s
-    """, (user_id,))
-    pupils = cursor.fetchall()
-
 
     # Filter parameters
     class_id = request.args.get('class_id', type=int)
@@ -253,7 +236,7 @@ def teacher_add_marks():
         return render_template('add_marks/teacher_add_marks.html',
             add_marks=[], class_list=class_list, study_years=study_years,
             terms=terms, subjects=subjects, assessments=assessments,
-            streams=streams, pupils=pupils,
+            streams=streams,
             selected_class_id=class_id,
             selected_study_year_id=year_id,
             selected_term_id=term_id,
@@ -337,7 +320,6 @@ def teacher_add_marks():
         subjects=subjects,
         assessments=assessments,
         streams=streams,
-        pupils=pupils,
         selected_class_id=class_id,
         selected_study_year_id=year_id,
         selected_term_id=term_id,
@@ -390,72 +372,65 @@ def action_add_marks():
         flash("No marks submitted.", "warning")
         return redirect(request.referrer or url_for('reports_blueprint.reports'))
 
-    try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-        success_count = 0
-        errors = []
-
-        for pupil_id, mark_str in add_marks.items():
-            try:
-                mark = float(mark_str)
-                if mark < 0 or mark > 100:
-                    errors.append(f"Invalid mark {mark} for pupil ID {pupil_id}. Skipped.")
-                    continue
-            except ValueError:
-                errors.append(f"Invalid mark input for pupil ID {pupil_id}. Skipped.")
-                continue
-
-            remark = add_remarks.get(pupil_id, '')
+    upsert = request.form.get('upsert') == '1'
+    required = ['reg_no', 'class_id', 'stream_id', 'term_id', 'year_id', 'assessment_id', 'subject_id']
 
-            # Fetch other fields from hidden inputs
-            def get_field(field): return request.form.get(f"{field}[{pupil_id}]")
+    # Step 2: Validate every row before touching the database
+    rows = []
+    errors = []
+    kampala_time = get_kampala_time()
 
-            reg_no = get_field("reg_no")
-            class_id = get_field("class_id")
-            stream_id = get_field("stream_id")
-            term_id = get_field("term_id")
-            year_id = get_field("year_id")
-            assessment_id = get_field("assessment_id")
-            subject_id = get_field("subject_id")
-
-            # Check required fields
-            missing = [f for f in ['reg_no', 'class_id', 'stream_id', 'term_id', 'year_id', 'assessment_id', 'subject_id']
-                       if not locals()[f]]
-            if missing:
-                errors.append(f"Missing fields {missing} for pupil ID {pupil_id}. Skipped.")
+    for pupil_id, mark_str in add_marks.items():
+        try:
+            mark = float(mark_str)
+            if mark < 0 or mark > 100:
+                errors.append(f"Invalid mark {mark} for pupil ID {pupil_id}. Skipped.")
                 continue
+        except ValueError:
+            errors.append(f"Invalid mark input for pupil ID {pupil_id}. Skipped.")
+            continue
+
+        # Fetch other fields from hidden inputs
+        fields = {f: request.form.get(f"{f}[{pupil_id}]") for f in required}
+        missing = [f for f in required if not fields[f]]
+        if missing:
+            errors.append(f"Missing fields {missing} for pupil ID {pupil_id}. Skipped.")
+            continue
+
+        try:
+            ids = {f: int(fields[f]) for f in required if f != 'reg_no'}
+        except ValueError:
+            errors.append(f"Invalid class/term/subject details for pupil ID {pupil_id}. Skipped.")
+            continue
+
+        rows.append({
+            'user_id': user_id,
+            'reg_no': fields['reg_no'],
+            **ids,
+            'Mark': mark,
+            'notes': add_remarks.get(pupil_id, ''),
+            'created_at': kampala_time,
+            'updated_at': kampala_time,
+        })
+
+    connection = cursor = None
+    success_count = 0
+    try:
+        connection = get_db_connection()
+        cursor = connection.cursor()
 
-            kampala_time = get_kampala_time()
-
-            # Insert into `scores` table
-            cursor.execute("""
-                INSERT INTO scores
-                (user_id, reg_no, class_id, stream_id, term_id, year_id,
-                 assessment_id, subject_id, Mark, notes, created_at, updated_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                user_id, reg_no, int(class_id), int(stream_id), int(term_id),
-                int(year_id), int(assessment_id), int(subject_id),
-                mark, remark, kampala_time, kampala_time
-            ))
-
-            new_score_id = cursor.lastrowid
-
-            # Insert into `add_score_logs`
-            cursor.execute("""
-                INSERT INTO add_score_logs
-                (score_id, user_id, reg_no, class_id, stream_id, term_id,
-                 year_id, assessment_id, subject_id, new_mark, notes, created_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                new_score_id, user_id, reg_no, int(class_id), int(stream_id),
-                int(term_id), int(year_id), int(assessment_id), int(subject_id),
-                mark, remark, kampala_time
-            ))
-
-            success_count += 1
-
+        if upsert and not has_unique_key(cursor):
+            flash("Overwriting marks needs the scores unique key "
+                  "(run 'flask add-scores-unique-key'). Nothing was saved.", "danger")
+            return redirect(request.referrer or url_for('reports_blueprint.reports'))
+
+        # Step 3: One multi-row insert for the scores and one for the audit log
+        if rows:
+            success_count = write_scores(connection, rows, upsert=upsert)
+            refresh_summaries(connection, {
+                (r['reg_no'], r['year_id'], r['term_id'], r['assessment_id']) for r in rows
+            })
+        invalidate_reports({(r['class_id'], r['year_id'], r['term_id']) for r in rows})
         connection.commit()
 
         if success_count:
@@ -464,7 +439,8 @@ def action_add_marks():
             flash("Some issues occurred:<br>" + "<br>".join(errors), "warning")
 
     except Exception as e:
-        connection.rollback()
+        if connection:
+            connection.rollback()
         flash(f"An error occurred while saving: {str(e)}", "danger")
 
     finally:
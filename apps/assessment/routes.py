@@ -9,6 +9,7 @@ import random
 import logging
 import re  # <-- Add this line
 from apps import get_db_connection
+from apps.reference_data import invalidate_reference_data
 from jinja2 import TemplateNotFound
 
 from datetime import datetime
@@ -75,6 +76,7 @@ def add_assessment():
                         ''',
                         (assessment_name, description)
                     )
+                    invalidate_reference_data('assessment')
                     connection.commit()
 
                     # Retrieve the new assessment ID
@@ -159,6 +161,7 @@ def edit_assessment(assessment_id):
                 SET assessment_name = %s, description = %s
                 WHERE assessment_id = %s
             """, (assessment_name, description, assessment_id))
+            invalidate_reference_data('assessment')
             connection.commit()
 
             # Optional: Insert into edit_assessment_logs for audit trail
@@ -242,6 +245,7 @@ def delete_assessment(assessment_id):
 
         # Delete the assessment
         cursor.execute("DELETE FROM assessment WHERE assessment_id = %s", (assessment_id,))
+        invalidate_reference_data('assessment')
         connection.commit()
 
         flash("Assessment deleted successfully and deletion logged.", "success")
@@ -2,41 +2,52 @@ from apps.asset_inventory import blueprint
 from flask import render_template, request, redirect, url_for, flash, session
 from mysql.connector import Error
 from apps import get_db_connection
+from apps.pagination import SortKey, keyset_page
 from jinja2 import TemplateNotFound
 
 
 
 
 
+INVENTORY_SELECT = """
+    ai.InventoryID,
+    f.IdentificationNumber,
+    f.AssetDescription,
+    l.LocationName,
+    ai.RecordedQuantity,
+    ai.VerifiedQuantity,
+    ai.LastVerified,
+    ai.AssetCondition,
+    ai.Remarks
+"""
+
+INVENTORY_FROM = """
+    FROM asset_inventory ai
+    JOIN fixed_assets f ON ai.AssetID = f.AssetID
+    JOIN locations l ON ai.LocationID = l.LocationID
+"""
+
+INVENTORY_SORTS = {
+    'description': SortKey('Description', ['f.AssetDescription', 'ai.InventoryID']),
+    'newest': SortKey('Added', ['ai.InventoryID']),
+}
+
+
 @blueprint.route('/assets_inventory_index')
 def assets_inventory_index():
     """Fetches all inventory records and renders the Asset Inventory page."""
     connection = get_db_connection()
     cursor = connection.cursor(dictionary=True)
 
-    # ✅ SQL query joins inventory with fixed_assets and locations
-    cursor.execute("""
-        SELECT 
-            ai.InventoryID,
-            f.IdentificationNumber,
-            f.AssetDescription,
-            l.LocationName,
-            ai.RecordedQuantity,
-            ai.VerifiedQuantity,
-            ai.LastVerified,
-            ai.AssetCondition,
-            ai.Remarks
-        FROM asset_inventory ai
-        JOIN fixed_assets f ON ai.AssetID = f.AssetID
-        JOIN locations l ON ai.LocationID = l.LocationID
-        ORDER BY f.AssetDescription ASC
-    """)
-    inventory = cursor.fetchall()
+    # Inventory joined with fixed_assets and locations, a page at a time
+    page = keyset_page(cursor, 'asset_inventory', INVENTORY_SELECT, INVENTORY_FROM, [], [],
+                       INVENTORY_SORTS, 'description', count_table='asset_inventory')
+    inventory = page['rows']
 
     cursor.close()
     connection.close()
 
-    return render_template('asset_inventory/asset_inventory.html', inventory=inventory)
+    return render_template('asset_inventory/asset_inventory.html', inventory=inventory, page=page)
 
 
 
@@ -0,0 +1,65 @@
+"""Audit rows for mark and stock changes, in as few statements as possible.
+
+The audit tables (``add_score_logs``, ``score_edit_logs``,
+``scores_del_logs``, ``inventory_logs``) are written in the transaction of
+the change they record, so a change and its audit commit or roll back
+together.  There are two ways in:
+
+- ``log_rows(connection, table, rows)`` buffers rows built by the view.
+  Nothing is sent until ``connection.commit()``.  Then each table gets one
+  multi-row ``INSERT`` per ``BATCH_SIZE`` rows, however many times the
+  view logged.  A rollback drops the buffer.
+- ``log_select(cursor, table, columns, select_sql, params)`` copies the
+  affected rows straight from their table with one ``INSERT ... SELECT``,
+  right away.  Use it when the audit row is the changed row itself: the
+  scores about to be deleted, or the scores just written.
+
+Either way an operation costs at most one audit statement per table.
+"""
+BATCH_SIZE = 500
+PENDING_KEY = 'audit_log'
+
+
+def _insert(cursor, table, columns, rows):
+    placeholders = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    for start in range(0, len(rows), BATCH_SIZE):
+        chunk = rows[start:start + BATCH_SIZE]
+        cursor.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+            + ', '.join([placeholders] * len(chunk)),
+            [row[column] for row in chunk for column in columns]
+        )
+
+
+def _flush(connection):
+    buffered = connection.pending.pop(PENDING_KEY, {})
+    if not buffered:
+        return
+    with connection.cursor() as cursor:
+        for (table, columns), rows in buffered.items():
+            _insert(cursor, table, columns, rows)
+
+
+def log_rows(connection, table, rows):
+    """Buffer audit ``rows`` (dicts with the same keys) for ``table``.
+
+    They are inserted when the request's transaction commits.
+    """
+    rows = list(rows)
+    if not rows:
+        return
+    buffered = connection.pending.get(PENDING_KEY)
+    if buffered is None:
+        buffered = connection.pending[PENDING_KEY] = {}
+        connection.before_commit(lambda: _flush(connection))
+    for row in rows:
+        buffered.setdefault((table, tuple(row)), []).append(row)
+
+
+def log_select(cursor, table, columns, select_sql, params=()):
+    """Copy the rows ``select_sql`` returns into ``table`` now; returns the count.
+
+    ``select_sql`` is a full ``SELECT`` whose list gives ``columns`` in order.
+    """
+    cursor.execute(f"INSERT INTO {table} ({', '.join(columns)}) {select_sql}", params)
+    return cursor.rowcount
@@ -2,7 +2,7 @@ from flask import (
     render_template, redirect, request, url_for, flash, session, current_app, jsonify
 )
 from werkzeug.utils import secure_filename
-from datetime import datetime, timedelta
+from datetime import datetime
 from PIL import Image
 import os
 import mysql.connector
@@ -10,6 +10,9 @@ import mysql.connector
 
 from apps import get_db_connection
 from apps.authentication import blueprint
+from apps.presence import online_snapshot, set_status, statuses_since
+from apps.server_sessions import end_user_sessions
+from apps.pagination import SortKey, keyset_page
 from apps.utils.decorators import login_required  # Adjust path as needed
         
 from werkzeug.utils import secure_filename
@@ -43,7 +46,6 @@ def route_default():
 
 
 
-import uuid
 @blueprint.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -71,23 +73,15 @@ def login():
                         "INSERT INTO user_activity (user_id, login_time) VALUES (%s, %s)",
                         (user['id'], login_time)
                     )
-                    cursor.execute(
-                        "UPDATE users SET is_online = 1 WHERE id = %s",
-                        (user['id'],)
-                    )
 
-                    # Generate and store session token
-                    session_token = str(uuid.uuid4())
-                    session['token'] = session_token
-                    cursor.execute(
-                        "UPDATE users SET session_token = %s WHERE id = %s",
-                        (session_token, user['id'])
-                    )
+                    # One session per user: a login ends the user's other sessions
+                    end_user_sessions(cursor, user['id'])
 
                     # Commit changes
                     conn.commit()
 
-                    # Set session values
+                    # Set session values, under a fresh session id
+                    session.regenerate()
                     session.update({
                         'loggedin': True,
                         'id': user['id'],
@@ -96,8 +90,8 @@ def login():
                         'first_name': user.get('first_name'),
                         'role': user.get('role'),
                         'role1': user.get('role1'),
-                        'last_activity': login_time
                     })
+                    set_status(user['id'], True)
 
                     session.permanent = False  # Session ends with browser close
 
@@ -111,24 +105,13 @@ def login():
 
 
 @blueprint.before_app_request
-def check_token_validity():
-    if 'loggedin' in session:
-        user_id = session.get('id')
-        token = session.get('token')
-
-        with get_db_connection() as connection:
-            with connection.cursor(dictionary=True) as cursor:
-                cursor.execute("SELECT session_token FROM users WHERE id = %s", (user_id,))
-                result = cursor.fetchone()
-
-                if result and token != result['session_token']:
-                    session.clear()
-                    flash('You were logged out by an administrator.', 'info')
-                    return redirect(url_for('authentication_blueprint.login'))
-
+def check_session_revoked():
+    """Log out users whose session was ended by a forced logout or a login elsewhere."""
+    if getattr(session, 'ended', None) == 'revoked':
+        flash('You were logged out by an administrator.', 'info')
+        return redirect(url_for('authentication_blueprint.login'))
 
 
-import uuid
 
 @login_required
 @blueprint.route('/force_logout/<int:user_id>')
@@ -143,7 +126,7 @@ def force_logout(user_id):
             with connection.cursor(dictionary=True) as cursor:
                 current_time = get_kampala_time().replace(tzinfo=None)
 
-                # Update user activity and is_online
+                # Close the user's activity log entry
                 cursor.execute("""
                     UPDATE user_activity
                     SET logout_time = %s
@@ -152,13 +135,11 @@ def force_logout(user_id):
                     LIMIT 1
                 """, (current_time, user_id))
 
-                cursor.execute("UPDATE users SET is_online = 0 WHERE id = %s", (user_id,))
-
-                # Invalidate session by changing token
-                new_token = str(uuid.uuid4())
-                cursor.execute("UPDATE users SET session_token = %s WHERE id = %s", (new_token, user_id))
+                # Their next request, on any worker, finds the session revoked
+                end_user_sessions(cursor, user_id)
 
                 connection.commit()
+                set_status(user_id, False)
 
         flash("User has been signed out successfully.", "success")
     except Exception as e:
@@ -174,47 +155,30 @@ def force_logout(user_id):
 @login_required
 @blueprint.before_app_request
 def check_inactivity():
-    """Check for session timeout due to inactivity."""
-    if 'loggedin' in session:
-        last_activity_str = session.get('last_activity')
-        if last_activity_str:
-            try:
-                # Parse ISO 8601 string with timezone info
-                last_activity = datetime.fromisoformat(last_activity_str)
-            except Exception:
-                last_activity = None
+    """Record the logout of a session the store timed out for inactivity.
 
-            current_time = get_kampala_time()
-
-            if last_activity:
-                time_diff = current_time - last_activity
-                # Timeout after 30 minutes of inactivity
-                if time_diff > timedelta(minutes=30):
-                    try:
-                        with get_db_connection() as connection:
-                            with connection.cursor(dictionary=True) as cursor:
-                                # Strip tzinfo before storing in MariaDB DATETIME
-                                logout_time_naive = current_time.replace(tzinfo=None)
-
-                                cursor.execute("""
-                                    UPDATE user_activity 
-                                    SET logout_time = %s 
-                                    WHERE user_id = %s AND logout_time IS NULL
-                                """, (logout_time_naive, session['id']))
-
-                                cursor.execute("UPDATE users SET is_online = 0 WHERE id = %s", (session['id'],))
-                                connection.commit()
+    The store ends sessions idle for SESSION_IDLE_TIMEOUT seconds; this
+    request arrives with a fresh, empty session.
+    """
+    if getattr(session, 'ended', None) == 'inactive':
+        try:
+            with get_db_connection() as connection:
+                with connection.cursor(dictionary=True) as cursor:
+                    # Strip tzinfo before storing in MariaDB DATETIME
+                    logout_time_naive = get_kampala_time().replace(tzinfo=None)
 
-                        session.clear()
-                        flash('Session expired due to inactivity.', 'warning')
-                        return redirect(url_for('authentication_blueprint.login'))
-                    except Exception as e:
-                        flash(f"An error occurred while updating the logout status: {str(e)}", 'danger')
-                        session.clear()
-                        return redirect(url_for('authentication_blueprint.login'))
+                    cursor.execute("""
+                        UPDATE user_activity 
+                        SET logout_time = %s 
+                        WHERE user_id = %s AND logout_time IS NULL
+                    """, (logout_time_naive, session.ended_user_id))
+                    connection.commit()
+            set_status(session.ended_user_id, False)
 
-        # Update last_activity timestamp on each request as ISO string with timezone
-        session['last_activity'] = get_kampala_time().isoformat()
+            flash('Session expired due to inactivity.', 'warning')
+        except Exception as e:
+            flash(f"An error occurred while updating the logout status: {str(e)}", 'danger')
+        return redirect(url_for('authentication_blueprint.login'))
 
 
 
@@ -253,9 +217,6 @@ def logout():
                         WHERE user_id = %s AND logout_time IS NULL
                     """, (current_time_naive, user_id))
 
-                    print(f"Setting is_online = 0 for user_id={user_id}")
-                    cursor.execute("UPDATE users SET is_online = 0 WHERE id = %s", (user_id,))
-
                     connection.commit()
                     print(f"User '{username}' logged out successfully.")
 
@@ -267,7 +228,8 @@ def logout():
             print(f"Exception in logout route: {e}")
             flash(f"An error occurred while updating the logout status: {str(e)}", 'danger')
 
-    session.clear()
+    set_status(user_id, False)
+    session.clear()  # the store deletes the session row
     flash('You have been logged out successfully.', 'success')
     return redirect(url_for('authentication_blueprint.login'))
 
@@ -320,7 +282,6 @@ def manage_users():
                         username,
                         role,
                         name_sf,
-                        is_online,
                         CONCAT_WS(' ', last_name, first_name, other_name) AS full_name,
                         profile_image,
                         sign_image
@@ -330,12 +291,24 @@ def manage_users():
                 """
                 cursor.execute(query, tuple(excluded_roles))
                 users = cursor.fetchall()
+        presence_token, online = online_snapshot()
+        for user in users:
+            user['is_online'] = user['id'] in online
 
     except Exception:
         flash("Error fetching user data.", "danger")
         return redirect(url_for('home_blueprint.index'))
 
-    return render_template('accounts/manage_users.html', users=users, num=len(users))
+    return render_template('accounts/manage_users.html', users=users, num=len(users),
+                           presence_token=presence_token)
+
+
+@blueprint.route('/user_statuses')
+def user_statuses():
+    """Online/offline changes since the page's ``since`` token (see apps.presence)."""
+    if session.get('role') not in ('admin', 'inventory_manager', 'super_admin'):
+        return jsonify({'error': 'forbidden'}), 403
+    return jsonify(statuses_since(request.args.get('since')))
 
 
 
@@ -350,9 +323,13 @@ def get_all_user_statuses():
     try:
         with get_db_connection() as connection:
             with connection.cursor(dictionary=True) as cursor:
-                cursor.execute("SELECT id, is_online FROM users")
+                cursor.execute("SELECT id FROM users")
                 statuses = cursor.fetchall()
-                return jsonify(statuses)
+        # Online = has a live session in the session store (apps.presence)
+        _, online = online_snapshot()
+        for status in statuses:
+            status['is_online'] = int(status['id'] in online)
+        return jsonify(statuses)
     except Exception as e:
         return jsonify([]), 500
 
@@ -360,24 +337,23 @@ def get_all_user_statuses():
 
 
 
+ACTIVITY_SELECT = "ua.login_time, ua.logout_time, u.username, u.first_name, u.last_name"
+ACTIVITY_FROM = "FROM user_activity ua JOIN users u ON ua.user_id = u.id"
+ACTIVITY_SORTS = {'login': SortKey('Login time', ['ua.login_time', 'ua.id'])}
+
+
 @login_required
 @blueprint.route('/activity_logs/<int:id>', methods=['GET', 'POST'])
 def activity_logs(id):
     try:
         with get_db_connection() as connection:
             with connection.cursor(dictionary=True) as cursor:
-                # SQL JOIN query to combine user_activity and users tables
-                query = """
-                SELECT ua.login_time, ua.logout_time, u.username, u.first_name, u.last_name
-                FROM user_activity ua
-                JOIN users u ON ua.user_id = u.id
-                WHERE ua.user_id = %s
-                ORDER BY ua.login_time DESC
-                """
-                cursor.execute(query, (id,))
-                activities = cursor.fetchall()
+                # user_activity joined with users, a page at a time
+                page = keyset_page(cursor, 'activity_logs', ACTIVITY_SELECT, ACTIVITY_FROM,
+                                   ['ua.user_id = %s'], [id], ACTIVITY_SORTS, 'login', default_dir='desc')
+                activities = page['rows']
 
-                return render_template('accounts/activity_logs.html', activities=activities)
+                return render_template('accounts/activity_logs.html', activities=activities, page=page)
     except Exception as e:
         flash(f"An error occurred: {str(e)}", 'danger')
         return redirect(url_for('authentication_blueprint.login'))
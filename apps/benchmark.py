@@ -0,0 +1,364 @@
+"""Benchmark harness for the report and write routes.
+
+``flask benchmark-reports`` drives the routes below through the Flask
+test client as ``bench_admin``, against a database filled by ``flask
+seed-benchmark-data``; it refuses to run where the seeder's ``BN`` rows
+are missing and only touches those:
+
+- ``vd_eot_reports``, ``scores_positions_eot_reports`` and
+  ``grade_count_analysis`` for the largest stream of the current term;
+- ``term_report_card`` for a pupil of that stream;
+- ``pupload_excel`` with a generated workbook of ``--import-rows`` marks
+  under a dedicated ``BENCH IMPORT`` assessment.  The marks and their
+  audit rows are removed after each run, the assessment at the end.
+  The import runs as a background job, so its timing runs until the job
+  has ended and its query count is the submitting request's;
+- ``save_sale`` with one cart line for a ``BN`` product and customer.
+  Each sale, its inventory log and its stock movement are undone after
+  the run.
+
+Each case gets a warm-up request and then ``--runs`` timed ones.  The
+report cache is switched off (unless ``--cached``) so the timings are
+the views' own; query counts come from the ``X-DB-Stats`` header.  The
+results are printed as latency percentiles, compared with the previous
+entry of ``--history``, and appended to it with the git commit so runs
+can be tracked from commit to commit.
+"""
+import datetime
+import io
+import json
+import os
+import subprocess
+import time
+
+import click
+import numpy as np
+import pandas as pd
+from flask import current_app
+from flask.cli import with_appcontext
+
+from apps.db import get_db_connection
+from apps.job_runner import ACTIVE_STATUSES, get_job
+from apps.reference_data import invalidate_reference_data
+from apps.report_cache import invalidate_reports
+from apps.summaries import SUMMARY_TABLE, subject_groups
+
+IMPORT_ASSESSMENT = 'BENCH IMPORT'
+BENCH_USER = 'bench_admin'
+# LIKE patterns of the rows flask seed-benchmark-data tags
+SEEDED_REG_NO = 'BN/%'
+SEEDED_NAME = 'BN %'
+PERCENTILES = (50, 90, 95)
+
+
+def _rows(cursor, sql, params=()):
+    cursor.execute(sql, params)
+    return cursor.fetchall()
+
+
+def _scope(cursor):
+    """Parameters for the routes, taken from the seeded ``BN`` rows.
+
+    Raises ClickException when the database was not filled by
+    ``flask seed-benchmark-data``.
+    """
+    user = _rows(cursor, "SELECT id, username, role FROM users WHERE username = %s", (BENCH_USER,))
+    row = _rows(cursor, """
+        SELECT p.class_id, p.stream_id, p.year_id, p.term_id, COUNT(*) AS pupils
+        FROM pupils p
+        JOIN scores s ON s.reg_no = p.reg_no AND s.year_id = p.year_id AND s.term_id = p.term_id
+        WHERE p.reg_no LIKE %s
+        GROUP BY p.class_id, p.stream_id, p.year_id, p.term_id
+        ORDER BY pupils DESC
+        LIMIT 1
+    """, (SEEDED_REG_NO,))
+    product = _rows(cursor, """
+        SELECT ProductID FROM product_list WHERE name LIKE %s AND quantity > 1000
+        ORDER BY ProductID LIMIT 1
+    """, (SEEDED_NAME,))
+    customer = _rows(cursor, """
+        SELECT CustomerID FROM customer_list WHERE name LIKE %s ORDER BY CustomerID LIMIT 1
+    """, (SEEDED_NAME,))
+    if not (user and row and product and customer):
+        raise click.ClickException(
+            "This database has no seeded benchmark data (BN pupils with scores, BN product "
+            f"and customer, {BENCH_USER}); run `flask seed-benchmark-data` on a scratch database first."
+        )
+    scope = row[0]
+    scope['user'] = user[0]
+    scope['product_id'] = product[0]['ProductID']
+    scope['customer_id'] = customer[0]['CustomerID']
+
+    scope['assessments'] = [r['assessment_name'] for r in _rows(cursor, """
+        SELECT DISTINCT a.assessment_name
+        FROM scores s JOIN assessment a ON a.assessment_id = s.assessment_id
+        WHERE s.class_id = %s AND s.year_id = %s AND s.term_id = %s AND a.assessment_name <> %s
+          AND s.reg_no LIKE %s
+    """, (scope['class_id'], scope['year_id'], scope['term_id'], IMPORT_ASSESSMENT, SEEDED_REG_NO))]
+
+    scope['reg_no'] = _rows(cursor, """
+        SELECT reg_no FROM pupils
+        WHERE stream_id = %s AND year_id = %s AND term_id = %s AND reg_no LIKE %s
+        ORDER BY reg_no LIMIT 1
+    """, (scope['stream_id'], scope['year_id'], scope['term_id'], SEEDED_REG_NO))[0]['reg_no']
+    return scope
+
+
+def _import_assessment(connection, cursor):
+    rows = _rows(cursor, "SELECT assessment_id FROM assessment WHERE assessment_name = %s",
+                 (IMPORT_ASSESSMENT,))
+    if rows:
+        return rows[0]['assessment_id']
+    cursor.execute("INSERT INTO assessment (assessment_name, description) VALUES (%s, %s)",
+                   (IMPORT_ASSESSMENT, 'Used by flask benchmark-reports'))
+    assessment_id = cursor.lastrowid
+    invalidate_reference_data('assessment')
+    connection.commit()
+    return assessment_id
+
+
+def _import_workbook(cursor, scope, rows):
+    """An .xlsx of ``rows`` marks for the stream in ``scope``."""
+    names = _rows(cursor, """
+        SELECT c.class_name, st.stream_name, y.year_name, t.term_name
+        FROM classes c, stream st, study_year y, terms t
+        WHERE c.class_id = %s AND st.stream_id = %s AND y.year_id = %s AND t.term_id = %s
+    """, (scope['class_id'], scope['stream_id'], scope['year_id'], scope['term_id']))[0]
+    reg_nos = [r['reg_no'] for r in _rows(cursor, """
+        SELECT reg_no FROM pupils WHERE class_id = %s AND reg_no LIKE %s ORDER BY reg_no
+    """, (scope['class_id'], SEEDED_REG_NO))]
+    subjects = subject_groups(scope['class_id'])[0]
+
+    pairs = [(reg_no, subject) for reg_no in reg_nos for subject in subjects][:rows]
+    frame = pd.DataFrame({
+        'reg_no': [p[0] for p in pairs],
+        'class': names['class_name'],
+        'stream': names['stream_name'],
+        'study_year': names['year_name'],
+        'term': names['term_name'],
+        'assessment': IMPORT_ASSESSMENT,
+        'subject': [p[1] for p in pairs],
+        'mark': np.random.default_rng(0).integers(0, 101, len(pairs)),
+    })
+    buffer = io.BytesIO()
+    frame.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def _remove_import(assessment_id):
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM scores WHERE assessment_id = %s", (assessment_id,))
+            cursor.execute("DELETE FROM add_score_logs WHERE assessment_id = %s", (assessment_id,))
+            cursor.execute(f"DELETE FROM {SUMMARY_TABLE} WHERE assessment_id = %s", (assessment_id,))
+        invalidate_reports()
+        connection.commit()
+
+
+def _remove_assessment(assessment_id):
+    _remove_import(assessment_id)
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM assessment WHERE assessment_id = %s", (assessment_id,))
+        invalidate_reference_data('assessment')
+        connection.commit()
+
+
+def _remove_sales(scope):
+    """Undo the benchmark's sales: the rows, their inventory logs and the stock taken."""
+    params = (scope['product_id'], scope['customer_id'], scope['user']['id'])
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT COALESCE(SUM(qty), 0) FROM sales
+                WHERE ProductID = %s AND customer_id = %s AND user_id = %s
+            """, params)
+            sold = cursor.fetchone()[0]
+            cursor.execute("""
+                DELETE FROM sales WHERE ProductID = %s AND customer_id = %s AND user_id = %s
+            """, params)
+            cursor.execute("""
+                DELETE FROM inventory_logs WHERE product_id = %s AND user_id = %s AND reason = 'sale'
+            """, (scope['product_id'], scope['user']['id']))
+            cursor.execute("UPDATE product_list SET quantity = quantity + %s WHERE ProductID = %s",
+                           (sold, scope['product_id']))
+        connection.commit()
+
+
+def _cases(cursor, scope, import_rows, assessment_id):
+    """(name, request kwargs factory, cleanup or None) per benchmarked route."""
+    report_args = {
+        'class_id': scope['class_id'], 'stream_id': scope['stream_id'],
+        'year_id': scope['year_id'], 'term_id': scope['term_id'],
+        'assessment_name': scope['assessments'],
+    }
+    cases = [
+        ('vd_eot_reports', lambda: {'path': '/vd_eot_reports', 'query_string': report_args}, None),
+        ('scores_positions_eot_reports',
+         lambda: {'path': '/scores_positions_eot_reports', 'query_string': report_args}, None),
+        ('grade_count_analysis', lambda: {'path': '/grade_count_analysis', 'query_string': report_args}, None),
+        ('term_report_card', lambda: {'path': f"/term_report_card/{scope['reg_no']}"}, None),
+    ]
+
+    if import_rows:
+        workbook = _import_workbook(cursor, scope, import_rows)
+        cases.append((
+            'pupload_excel',
+            lambda: {'path': '/pupload_excel', 'method': 'POST',
+                     'data': {'file': (io.BytesIO(workbook), 'benchmark.xlsx')},
+                     'content_type': 'multipart/form-data',
+                     'headers': {'Accept': 'application/json'}},
+            lambda: _remove_import(assessment_id),
+        ))
+
+    sale = {'customer_id': scope['customer_id'],
+            'cart_items': [{'product_id': scope['product_id'], 'quantity': 1, 'price': 1000, 'discount': 0}]}
+    cases.append(('save_sale', lambda: {'path': '/save_sale', 'method': 'POST', 'json': sale},
+                  lambda: _remove_sales(scope)))
+    return cases
+
+
+def _queries(response):
+    for part in response.headers.get('X-DB-Stats', '').split(';'):
+        key, _, value = part.strip().partition('=')
+        if key == 'queries':
+            return int(value)
+    return None
+
+
+def _wait_for_job(response, timeout=600):
+    """Block until the background job a 202 response started has ended."""
+    job_id = response.get_json()['job_id']
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = get_job(job_id)
+        if job is None or job['status'] not in ACTIVE_STATUSES:
+            return job
+        time.sleep(0.05)
+    raise click.ClickException(f"Job {job_id} did not finish within {timeout}s.")
+
+
+def _measure(client, make_request, cleanup, runs):
+    latencies, queries, statuses = [], [], {}
+    for i in range(runs + 1):  # the first request only warms up
+        started = time.perf_counter()
+        response = client.open(**make_request())
+        status = response.status_code
+        if status == 202:
+            job = _wait_for_job(response)
+            status = f"job {job['status'] if job else 'missing'}"
+        elapsed = (time.perf_counter() - started) * 1000
+        response.close()
+        if cleanup:
+            cleanup()
+        if i == 0:
+            continue
+        latencies.append(elapsed)
+        queries.append(_queries(response))
+        statuses[status] = statuses.get(status, 0) + 1
+
+    counts = [q for q in queries if q is not None]
+    result = {f'p{p}_ms': round(float(np.percentile(latencies, p)), 2) for p in PERCENTILES}
+    result.update({
+        'max_ms': round(max(latencies), 2),
+        'mean_ms': round(sum(latencies) / len(latencies), 2),
+        'queries': round(sum(counts) / len(counts), 1) if counts else None,
+        'statuses': {str(k): v for k, v in statuses.items()},
+    })
+    return result
+
+
+def _failed(status):
+    if status.startswith('job '):
+        return status != 'job finished'
+    return int(status) >= 400
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _previous(history):
+    if not os.path.exists(history):
+        return None
+    with open(history) as f:
+        lines = [line for line in f if line.strip()]
+    return json.loads(lines[-1]) if lines else None
+
+
+def _delta(now, before):
+    if before in (None, 0) or now is None:
+        return ''
+    return f'{(now - before) / before * 100:+.0f}%'
+
+
+def run_benchmark(runs=20, import_rows=2000, cached=False, history='benchmark_history.jsonl', log=print):
+    """Time the routes; returns the history entry that was written."""
+    app = current_app._get_current_object()
+
+    with get_db_connection() as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            scope = _scope(cursor)
+            assessment_id = _import_assessment(connection, cursor) if import_rows else None
+            cases = _cases(cursor, scope, import_rows, assessment_id)
+
+    saved = {key: app.config.get(key) for key in ('REPORT_CACHE_ENABLED', 'QUERY_STATS_ENABLED', 'WTF_CSRF_ENABLED')}
+    app.config.update(REPORT_CACHE_ENABLED=cached, QUERY_STATS_ENABLED=True, WTF_CSRF_ENABLED=False)
+    results = {}
+    try:
+        with app.test_client() as client:
+            user = scope['user']
+            with client.session_transaction() as session:
+                session.update({
+                    'loggedin': True, 'id': user['id'], 'role': user['role'],
+                    'username': user['username'],
+                })
+            for name, make_request, cleanup in cases:
+                log(f"{name} ...")
+                results[name] = _measure(client, make_request, cleanup, runs)
+    finally:
+        app.config.update(saved)
+        if assessment_id:
+            _remove_assessment(assessment_id)
+
+    entry = {
+        'commit': _git_commit(),
+        'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'runs': runs,
+        'import_rows': import_rows,
+        'cached': cached,
+        'scope': {k: scope[k] for k in ('class_id', 'stream_id', 'year_id', 'term_id', 'pupils')},
+        'results': results,
+    }
+
+    before = _previous(history) or {}
+    before_results = before.get('results', {})
+    log(f"\n{'route':<30}{'p50':>10}{'p90':>10}{'p95':>10}{'max':>10}{'queries':>9}  vs {before.get('commit') or '-'}")
+    for name, r in results.items():
+        old = before_results.get(name, {})
+        log(f"{name:<30}{r['p50_ms']:>10}{r['p90_ms']:>10}{r['p95_ms']:>10}{r['max_ms']:>10}"
+            f"{r['queries'] if r['queries'] is not None else '-':>9}  "
+            f"p50 {_delta(r['p50_ms'], old.get('p50_ms')) or '-'}, "
+            f"queries {_delta(r['queries'], old.get('queries')) or '-'}"
+            f"{'  statuses ' + json.dumps(r['statuses']) if any(_failed(k) for k in r['statuses']) else ''}")
+
+    if history:
+        with open(history, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+    return entry
+
+
+@click.command('benchmark-reports')
+@click.option('--runs', default=20, show_default=True, help='Timed requests per route.')
+@click.option('--import-rows', default=2000, show_default=True, help='Marks in the pupload_excel workbook (0 skips it).')
+@click.option('--cached', is_flag=True, help='Leave the report cache on.')
+@click.option('--history', default='benchmark_history.jsonl', show_default=True,
+              help='JSON lines file the results are compared with and appended to.')
+@with_appcontext
+def benchmark_reports_command(runs, import_rows, cached, history):
+    """Time the report and write routes against a seeded benchmark database."""
+    run_benchmark(runs, import_rows, cached, history, log=click.echo)
@@ -0,0 +1,185 @@
+"""Cache invalidation shared by every worker process, through the database.
+
+The in-process caches (reference data, grade scales, report pages, the
+pupil index) each own one or more named regions, such as ``grading``,
+``reference:classes`` or ``reports:3:1:2``.  A view that changes the data behind a region
+calls the cache's ``invalidate_*`` function just before it commits.
+That calls ``bump()``, which raises the region's version in the
+``cache_versions`` table inside the same transaction.  The change and its
+version bump are therefore committed, or rolled back, together.  This
+worker drops its own copy once the commit succeeds.
+
+A version is the database clock in microseconds, and always above the
+region's previous version.  Each bump only writes the rows of its own
+regions, so only writers of the same region wait on each other.
+
+Other workers notice through ``check_versions()``, which runs before a
+request at most once every ``CACHE_VERSION_INTERVAL`` seconds.  It is one
+indexed query for the rows with a version in the last
+``CACHE_VERSION_WINDOW`` seconds before the newest one seen.  Because the
+query looks back over that window, it still catches a transaction that
+commits a while after its bump.  Each region is dropped once per version.
+A transaction that stays open longer than the window after its bump is
+missed, and the cache's TTL is the backstop.
+"""
+import logging
+import threading
+import time
+
+from flask import current_app, request
+from mysql.connector import Error, errorcode
+
+from apps.db import get_db_connection
+
+VERSIONS_TABLE = 'cache_versions'
+
+CREATE_VERSIONS_TABLE = f"""
+    CREATE TABLE IF NOT EXISTS {VERSIONS_TABLE} (
+        name VARCHAR(100) NOT NULL PRIMARY KEY,
+        version BIGINT UNSIGNED NOT NULL,
+        KEY idx_cache_versions_version (version)
+    )
+"""
+
+# The database clock, in microseconds
+CLOCK_SQL = "CAST(UNIX_TIMESTAMP(NOW(6)) * 1000000 AS UNSIGNED)"
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_handlers = {}  # region prefix -> [handler(key or None)]
+_handled = {}  # region -> version this worker already dropped
+_state = {'newest': None, 'checked_at': 0.0, 'checking': False}
+_table_ready = False
+_warned = False
+
+
+def on_change(prefix, handler):
+    """Call ``handler(key)`` when a region ``prefix`` or ``prefix:key`` is bumped.
+
+    ``key`` is None for the bare prefix.  Handlers run on request threads
+    and must only drop cached data.
+    """
+    _handlers.setdefault(prefix, []).append(handler)
+
+
+def _dispatch(region):
+    prefix, _, key = region.partition(':')
+    for handler in _handlers.get(prefix, ()):
+        try:
+            handler(key or None)
+        except Exception:
+            log.exception("Cache handler for %s failed", region)
+
+
+def _apply_local(versions):
+    with _lock:
+        for region, version in versions.items():
+            if version is not None:
+                _handled[region] = max(_handled.get(region, 0), version)
+    for region in versions:
+        _dispatch(region)
+
+
+def bump(*regions):
+    """Raise the version of ``regions`` in the current transaction.
+
+    Call it after the data change and just before ``connection.commit()``
+    on the request's connection.  This worker's copy is dropped once the
+    commit succeeds; nothing happens if the transaction is rolled back.
+    """
+    global _warned
+    regions = sorted({str(region)[:100] for region in regions})
+    if not regions:
+        return
+    versions = dict.fromkeys(regions)
+    with get_db_connection() as connection:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {VERSIONS_TABLE} (name, version) VALUES "
+                    + ', '.join([f'(%s, {CLOCK_SQL})'] * len(regions))
+                    + " ON DUPLICATE KEY UPDATE version = GREATEST(version + 1, VALUES(version))",
+                    regions
+                )
+                # Our own rows, so this worker can tell its bumps from others'
+                cursor.execute(
+                    f"SELECT name, version FROM {VERSIONS_TABLE} "
+                    f"WHERE name IN ({', '.join(['%s'] * len(regions))})",
+                    regions
+                )
+                versions.update(cursor.fetchall())
+        except Error as e:
+            if e.errno != errorcode.ER_NO_SUCH_TABLE:
+                raise
+            # Not set up yet (the first request creates it): this worker only
+            if not _warned:
+                log.warning("%s table missing; cache changes stay in this worker", VERSIONS_TABLE)
+                _warned = True
+        connection.after_commit(lambda: _apply_local(versions))
+
+
+def _ensure_table(cursor):
+    global _table_ready
+    if not _table_ready:
+        cursor.execute(CREATE_VERSIONS_TABLE)
+        _table_ready = True
+
+
+def check_versions():
+    """Drop the regions other workers bumped since the last check."""
+    config = current_app.config
+    interval = config.get('CACHE_VERSION_INTERVAL', 0.5)
+    window = int(config.get('CACHE_VERSION_WINDOW', 60) * 1000000)
+    with _lock:
+        if _state['checking'] or time.monotonic() - _state['checked_at'] < interval:
+            return
+        _state['checking'] = True
+        newest = _state['newest']
+
+    rows = []
+    try:
+        with get_db_connection() as connection:
+            with connection.cursor() as cursor:
+                _ensure_table(cursor)
+                if newest is None:
+                    # Nothing is cached yet; start from the database clock
+                    cursor.execute(f"SELECT {CLOCK_SQL}")
+                    newest = cursor.fetchone()[0]
+                else:
+                    cursor.execute(
+                        f"SELECT name, version FROM {VERSIONS_TABLE} WHERE version > %s",
+                        (max(newest - window, 0),)
+                    )
+                    rows = cursor.fetchall()
+                    newest = max([newest] + [version for _, version in rows])
+    except Error as e:
+        log.warning("Could not read %s: %s", VERSIONS_TABLE, e)
+    finally:
+        changed = []
+        with _lock:
+            for name, version in rows:
+                if _handled.get(name, 0) < version:
+                    _handled[name] = version
+                    changed.append(name)
+            if newest is not None:
+                _state['newest'] = newest
+                # Versions this old are no longer read back
+                for name in [name for name, version in _handled.items() if version <= newest - window]:
+                    del _handled[name]
+            _state.update(checked_at=time.monotonic(), checking=False)
+
+    for region in changed:
+        _dispatch(region)
+
+
+def init_cache_versions(app):
+    """Check for other workers' bumps before each request."""
+    app.config.setdefault('CACHE_VERSION_INTERVAL', 0.5)
+    app.config.setdefault('CACHE_VERSION_WINDOW', 60)
+
+    @app.before_request
+    def _check_cache_versions():
+        if request.endpoint != 'static':
+            check_versions()
+
@@ -9,6 +9,7 @@ import random
 import logging
 import re  # <-- Add this line
 from apps import get_db_connection
+from apps.reference_data import invalidate_reference_data
 from jinja2 import TemplateNotFound
 
 
@@ -97,6 +98,7 @@ def add_classes():
                         INSERT INTO classes (class_name, year, teacher_in_charge) 
                         VALUES (%s, %s, %s)
                     ''', (class_name, year, teacher_in_charge_id))
+                    invalidate_reference_data('classes')
                     connection.commit()
 
                     flash("Class successfully added!", "success")
@@ -169,6 +171,7 @@ def edit_classes(class_id):
                 SET class_name = %s, year = %s, teacher_in_charge = %s
                 WHERE class_id = %s
             """, (class_name, year, teacher_in_charge, class_id))
+            invalidate_reference_data('classes')
             connection.commit()
 
             flash("Class updated successfully!", "success")
@@ -209,6 +212,7 @@ def delete_classes(class_id):
     try:
         # Delete the classes with the specified ID
         cursor.execute('DELETE FROM classes WHERE class_id = %s', (class_id,))
+        invalidate_reference_data('classes')
         connection.commit()
         flash("class deleted successfully.", "success")
     except Exception as e:
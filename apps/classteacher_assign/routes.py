@@ -18,6 +18,7 @@ from mysql.connector import Error
 
 from apps.classteacher_assign import blueprint
 from apps import get_db_connection
+from apps.report_cache import invalidate_reports
 
 import numpy as np
 
@@ -194,6 +195,7 @@ def action_classteacher_assign():
             'Inserted new classteacher assignment'
         ))
 
+        invalidate_reports()
         connection.commit()
         flash('New assignment created and logged successfully.', 'success')
 
@@ -356,6 +358,7 @@ def action_classteacher_unassign():
     try:
         for assignment_id in assignment_ids:
             cursor.execute("DELETE FROM classteacher_assignment WHERE id = %s", (assignment_id,))
+        invalidate_reports()
         connection.commit()
         flash(f"{len(assignment_ids)} assignment(s) successfully unassigned.", 'success')
     except Exception as e:
@@ -9,6 +9,7 @@ import random
 import logging
 import re  # <-- Add this line
 from apps import get_db_connection
+from apps.report_cache import invalidate_reports
 from jinja2 import TemplateNotFound
 
 
@@ -128,6 +129,7 @@ def add_classteacher_comments():
                     """, (
                         teacher_user_id, stream_id, min_score, max_score, comment, now, now
                     ))
+                    invalidate_reports()
                     connection.commit()
                     flash("Class teacher comment added successfully.", "success")
                     return redirect(url_for('classteacher_comments_blueprint.add_classteacher_comments'))
@@ -228,6 +230,7 @@ def edit_classteacher_comments(comment_id):
                 WHERE comment_id = %s AND user_id IN ({})
             '''.format(format_strings),
             [stream_id, min_score, max_score, comment, updated_at, comment_id] + teacher_user_ids)
+            invalidate_reports()
             connection.commit()
 
             flash("Comment updated successfully!", "success")
@@ -283,6 +286,7 @@ def delete_classteacher_comments(comment_id):
             "DELETE FROM classteacher_comments WHERE comment_id = %s AND user_id = %s",
             (comment_id, user_id)
         )
+        invalidate_reports()
         connection.commit()
         flash("Comment deleted successfully.", "success")
 
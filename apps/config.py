@@ -1,18 +1,69 @@
-import random
-import string
+import logging
 import os
+import secrets
+import tempfile
+
+
+def _read_key(path):
+    """The key kept in ``path``, or None if the file is missing or empty."""
+    try:
+        with open(path) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _secret_key(path):
+    """SECRET_KEY from the environment, else from ``path``, created once.
+
+    Every worker process reads the same key, so signed values (CSRF
+    tokens) survive restarts and are accepted by every worker.  The key is
+    written to a temporary file first and then linked into place, so
+    ``path`` never exists without its key.  If several processes start at
+    once, the first link wins and the others read that key.
+    """
+    if os.getenv('SECRET_KEY'):
+        return os.getenv('SECRET_KEY')
+    key = _read_key(path)
+    if key:
+        return key
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix='.secret_key-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.link(temp_path, path)
+        except FileExistsError:
+            if _read_key(path) is None:
+                # An empty file left behind by an interrupted write
+                os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return _read_key(path)
+
 
 class Config:
     """Base configuration class."""
     # Absolute path to the current directory
     basedir = os.path.abspath(os.path.dirname(__file__))
 
-    # Upload folder paths
-    UPLOAD_FOLDER = os.path.join(basedir, 'static', 'uploads')
+    # Upload folder paths.  Uploads are served at /static/uploads/; point
+    # UPLOAD_FOLDER at shared storage when several nodes serve the app
+    UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', os.path.join(basedir, 'static', 'uploads'))
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif','xlsx', 'xls'}
 
-    # Secret key for Flask (generated securely)
-    SECRET_KEY = ''.join(random.choices(string.ascii_letters + string.digits, k=32))
+    # Secret key for Flask: SECRET_KEY, else a key kept in SECRET_KEY_FILE so
+    # that every worker and restart signs with the same key
+    SECRET_KEY_FILE = os.getenv('SECRET_KEY_FILE', os.path.join(os.path.dirname(basedir), 'instance', 'secret_key'))
+    SECRET_KEY = _secret_key(SECRET_KEY_FILE)
+
+    # Reverse proxies in front of the app (X-Forwarded-For/-Proto/-Host hops to trust)
+    PROXY_FIX_HOPS = int(os.getenv('PROXY_FIX_HOPS', 0))
 
     # MySQL Configuration
     MYSQL_HOST = os.getenv('MYSQL_HOST', 'localhost')
@@ -20,9 +71,137 @@ class Config:
     MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD', '')
     MYSQL_DATABASE = os.getenv('MYSQL_DATABASE', 'shpsk')
 
+    # Connection pool (one pool per worker process, so the server sees
+    # at most workers * DB_POOL_SIZE connections)
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))  # seconds to wait for a free connection
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))  # max connection age in seconds
+    DB_POOL_PING_INTERVAL = int(os.getenv('DB_POOL_PING_INTERVAL', 30))  # ping connections idle longer than this
+
+    # SQL instrumentation (apps.query_stats), per worker process
+    QUERY_STATS_ENABLED = os.getenv('QUERY_STATS_ENABLED', '1') == '1'
+    QUERY_STATS_WINDOW = int(os.getenv('QUERY_STATS_WINDOW', 100))  # requests kept per endpoint
+    N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', 10))  # repeats of one statement shape
+    SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', 1000))  # log requests slower than this
+    SLOW_REQUEST_QUERIES = int(os.getenv('SLOW_REQUEST_QUERIES', 100))  # or issuing more statements
+
+    # Seconds between checks of the cache_versions table (apps.cache_versions),
+    # i.e. how long another worker's cache change can take to reach this one
+    CACHE_VERSION_INTERVAL = float(os.getenv('CACHE_VERSION_INTERVAL', 0.5))
+    # Seconds a write may stay uncommitted after its cache bump and still
+    # reach the other workers (the caches' TTLs cover anything slower)
+    CACHE_VERSION_WINDOW = int(os.getenv('CACHE_VERSION_WINDOW', 60))
+
+    # Server-side sessions (apps.server_sessions): seconds of inactivity before
+    # a login ends, seconds between a session's last_seen refreshes and between
+    # the batched writes of those refreshes, sessions kept in each worker's
+    # front cache, and seconds between purges of ended sessions
+    SESSION_IDLE_TIMEOUT = int(os.getenv('SESSION_IDLE_TIMEOUT', 1800))
+    SESSION_TOUCH_INTERVAL = int(os.getenv('SESSION_TOUCH_INTERVAL', 60))
+    SESSION_FLUSH_INTERVAL = int(os.getenv('SESSION_FLUSH_INTERVAL', 15))
+    SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', 1000))
+    SESSION_PURGE_INTERVAL = int(os.getenv('SESSION_PURGE_INTERVAL', 600))
+
+    # Online status (apps.presence): seconds between refreshes of a worker's
+    # online list, and status changes kept for the page's delta polls
+    PRESENCE_REFRESH = int(os.getenv('PRESENCE_REFRESH', 5))
+    PRESENCE_HISTORY = int(os.getenv('PRESENCE_HISTORY', 1000))
+
+    # Seconds before the cached grade/division scales are reloaded anyway
+    GRADING_CACHE_TTL = int(os.getenv('GRADING_CACHE_TTL', 300))
+
+    # Seconds before the cached dropdown tables (apps.reference_data) are reloaded anyway
+    REFERENCE_CACHE_TTL = int(os.getenv('REFERENCE_CACHE_TTL', 300))
+
+    # Seconds before the pupil search index (apps.pupil_search) is rebuilt anyway
+    PUPIL_INDEX_TTL = int(os.getenv('PUPIL_INDEX_TTL', 300))
+
+    # Rendered report pages (apps.report_cache), per worker process
+    REPORT_CACHE_ENABLED = os.getenv('REPORT_CACHE_ENABLED', '1') == '1'
+    REPORT_CACHE_TTL = int(os.getenv('REPORT_CACHE_TTL', 600))  # seconds
+    REPORT_CACHE_SIZE = int(os.getenv('REPORT_CACHE_SIZE', 200))  # pages kept
+
+    # Batch report cards (apps.report_cards): rendering processes (1 renders in
+    # the request) and the smallest batch worth sending to them
+    REPORT_BATCH_WORKERS = int(os.getenv('REPORT_BATCH_WORKERS', min(4, os.cpu_count() or 1)))
+    REPORT_BATCH_POOL_MIN = int(os.getenv('REPORT_BATCH_POOL_MIN', 200))
+
+    # Background jobs (apps.job_runner), run on threads of each worker process
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))  # jobs running at once
+    JOB_LIMITS = os.getenv('JOB_LIMITS', '')  # per-type overrides, e.g. "score_import=2,report_cards=1"
+    JOB_PROGRESS_INTERVAL = float(os.getenv('JOB_PROGRESS_INTERVAL', 1.0))  # seconds between progress writes
+    JOB_STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', 3600))  # silent this long = worker gone
+    JOB_RESULT_FOLDER = os.getenv('JOB_RESULT_FOLDER', os.path.join(basedir, 'job_results'))
+
+    # Streamed CSV/XLSX exports (apps.exports): rows fetched per round trip and
+    # CSV rows per chunk sent to the client
+    EXPORT_FETCH_ROWS = int(os.getenv('EXPORT_FETCH_ROWS', 1000))
+    EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', 500))
+
+    # Listing pages (apps.pagination): rows per page, the most a client may ask
+    # for, and seconds a listing's row count is reused
+    PAGE_SIZE = int(os.getenv('PAGE_SIZE', 50))
+    PAGE_SIZE_MAX = int(os.getenv('PAGE_SIZE_MAX', 500))
+    PAGE_COUNT_TTL = int(os.getenv('PAGE_COUNT_TTL', 300))
+
     @staticmethod
     def init_app(app):
         """Initialize the app with the configuration."""
-        app.config.from_object(Config)
         # Ensure the upload folder exists
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
\ No newline at end of file
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+
+class ProductionConfig(Config):
+    """Several worker processes per node, several nodes behind a balancer.
+
+    Size a node with WEB_WORKERS processes of WEB_THREADS threads each
+    (gunicorn.conf.py reads the same variables).  Each process has its own
+    connection pool, job threads and caches, so the database sees up to
+    WEB_WORKERS * DB_POOL_SIZE connections.
+    """
+    DEBUG = False
+
+    WEB_WORKERS = int(os.getenv('WEB_WORKERS', (os.cpu_count() or 1) * 2 + 1))
+    WEB_THREADS = int(os.getenv('WEB_THREADS', 4))
+
+    # Request threads plus job threads, so neither waits on the other for a connection
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', WEB_THREADS + Config.JOB_WORKERS))
+
+    # Card rendering processes per worker: WEB_WORKERS of them per node
+    REPORT_BATCH_WORKERS = int(os.getenv('REPORT_BATCH_WORKERS', 1))
+
+    SESSION_COOKIE_SECURE = os.getenv('SESSION_COOKIE_SECURE', '1') == '1'
+    SESSION_COOKIE_HTTPONLY = True
+    SESSION_COOKIE_SAMESITE = 'Lax'
+    PREFERRED_URL_SCHEME = 'https'
+
+    @staticmethod
+    def init_app(app):
+        """Refuse settings that only work with a single process."""
+        Config.init_app(app)
+        config = app.config
+        if not os.getenv('SECRET_KEY') and not os.getenv('SECRET_KEY_FILE'):
+            raise RuntimeError(
+                "Set SECRET_KEY (or SECRET_KEY_FILE on storage shared by every node) in production, "
+                "so all workers and nodes accept the same signed forms."
+            )
+        if config['DB_POOL_SIZE'] < config['WEB_THREADS']:
+            logging.warning(
+                "DB_POOL_SIZE (%s) is smaller than WEB_THREADS (%s); requests will queue for connections.",
+                config['DB_POOL_SIZE'], config['WEB_THREADS']
+            )
+
+
+CONFIGS = {
+    'development': Config,
+    'production': ProductionConfig,
+}
+
+
+def get_config():
+    """The configuration named by APP_CONFIG (development by default)."""
+    name = os.getenv('APP_CONFIG', 'development')
+    try:
+        return CONFIGS[name]
+    except KeyError:
+        raise RuntimeError(f"Unknown APP_CONFIG {name!r}; use one of {', '.join(CONFIGS)}.")
@@ -1,12 +1,291 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
 import mysql.connector
-from flask import current_app
+from mysql.connector import errors
+from flask import current_app, g
+
+from apps.query_stats import instrument
+
+
+class ConnectionPool:
+    """A small thread-safe pool of MySQL connections for one worker process.
+
+    Connections are opened lazily up to ``size``.  A checkout waits at most
+    ``timeout`` seconds for a free connection, connections older than
+    ``recycle`` seconds are replaced, and connections that sat idle for more
+    than ``ping_interval`` seconds are pinged before being handed out.
+    """
+
+    def __init__(self, size=10, timeout=10, recycle=1800, ping_interval=30, **connect_args):
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        self.connect_args = connect_args
+        self.pid = os.getpid()
+
+        self._idle = deque()  # (connection, created_at, last_used)
+        self._open = 0
+        self._lock = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'exhausted': 0,
+            'created': 0,
+            'recycled': 0,
+            'failed_pings': 0,
+        }
+
+    def _connect(self):
+        connection = mysql.connector.connect(**self.connect_args)
+        with self._lock:
+            self._stats['created'] += 1
+        return connection, time.monotonic()
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except errors.Error:
+            pass
+
+    def acquire(self):
+        """Check a connection out of the pool, opening one if there is room."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        entry = None
+
+        with self._lock:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['exhausted'] += 1
+                    logging.warning(
+                        "MySQL pool exhausted: %s connections in use, waited %.2fs",
+                        self._open, self.timeout
+                    )
+                    raise errors.PoolError(
+                        f"No database connection available after {self.timeout}s "
+                        f"(pool size {self.size})"
+                    )
+                waited = True
+                self._lock.wait(remaining)
+
+            wait_time = time.monotonic() - started
+            self._stats['checkouts'] += 1
+            if waited:
+                self._stats['waits'] += 1
+                self._stats['wait_time_total'] += wait_time
+                self._stats['wait_time_max'] = max(self._stats['wait_time_max'], wait_time)
+
+        try:
+            if entry is None:
+                return self._connect()
+            return self._validate(*entry)
+        except Exception:
+            # The slot was reserved for us; give it back before failing.
+            with self._lock:
+                self._open -= 1
+                self._lock.notify()
+            raise
+
+    def _validate(self, connection, created_at, last_used):
+        now = time.monotonic()
+        if self.recycle and now - created_at > self.recycle:
+            self._discard(connection)
+            with self._lock:
+                self._stats['recycled'] += 1
+            return self._connect()
+
+        if now - last_used > self.ping_interval:
+            try:
+                connection.ping(reconnect=False)
+            except errors.Error:
+                self._discard(connection)
+                with self._lock:
+                    self._stats['failed_pings'] += 1
+                return self._connect()
+
+        return connection, created_at
+
+    def release(self, connection, created_at):
+        """Return a connection to the pool, dropping it if it is unusable."""
+        healthy = True
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+        except errors.Error:
+            healthy = False
+
+        with self._lock:
+            if healthy and os.getpid() == self.pid:
+                self._idle.append((connection, created_at, time.monotonic()))
+            else:
+                self._open -= 1
+            self._lock.notify()
+
+        if not healthy:
+            self._discard(connection)
+
+    def stats(self):
+        """Return a snapshot of the pool counters."""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot.update({
+                'pid': self.pid,
+                'size': self.size,
+                'open': self._open,
+                'idle': len(self._idle),
+                'in_use': self._open - len(self._idle),
+            })
+        checkouts = snapshot['checkouts']
+        snapshot['wait_time_avg'] = snapshot['wait_time_total'] / checkouts if checkouts else 0.0
+        return snapshot
+
+
+class RequestConnection:
+    """Handle on the connection shared by one app context.
+
+    Views call ``close()`` (directly or through ``with``) when they are done,
+    which only ends the current transaction once every handle has been
+    closed.  The connection itself goes back to the pool at teardown.
+    Callbacks registered with ``before_commit()`` run just before the
+    current transaction commits, those registered with ``after_commit()``
+    once it has, and both are dropped if it is rolled back.  ``pending``
+    holds whatever the transaction has buffered for its commit (audit
+    rows, for instance) and is emptied with it.
+    """
+
+    def __init__(self, state):
+        self._state = state
+        self._closed = False
+        state['handles'] += 1
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._state['handles'] -= 1
+        if self._state['handles'] == 0:
+            connection = self._state['connection']
+            self._end_transaction()
+            try:
+                if connection.in_transaction:
+                    connection.rollback()
+            except errors.Error:
+                pass
+
+    def cursor(self, *args, **kwargs):
+        return instrument(self._state['connection'].cursor(*args, **kwargs))
+
+    @property
+    def pending(self):
+        """Dict of data buffered for the current transaction's commit."""
+        return self._state['pending']
+
+    def before_commit(self, callback):
+        """Run ``callback()`` in the current transaction, just before it commits."""
+        self._state['before_commit'].append(callback)
+
+    def after_commit(self, callback):
+        """Run ``callback()`` once the current transaction has committed."""
+        self._state['after_commit'].append(callback)
+
+    def _end_transaction(self):
+        self._state['before_commit'] = []
+        self._state['after_commit'] = []
+        self._state['pending'] = {}
+
+    def commit(self):
+        # Callbacks may buffer more work; run until none are left
+        while self._state['before_commit']:
+            callbacks, self._state['before_commit'] = self._state['before_commit'], []
+            for callback in callbacks:
+                callback()
+        self._state['connection'].commit()
+        callbacks = self._state['after_commit']
+        self._end_transaction()
+        for callback in callbacks:
+            callback()
+
+    def rollback(self):
+        self._end_transaction()
+        self._state['connection'].rollback()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._state['connection'], name)
+
+
+def _get_pool(app):
+    pool = app.extensions.get('mysql_pool')
+    # A pool inherited across fork() shares sockets with the parent.
+    if pool is None or pool.pid != os.getpid():
+        pool = ConnectionPool(
+            size=app.config['DB_POOL_SIZE'],
+            timeout=app.config['DB_POOL_TIMEOUT'],
+            recycle=app.config['DB_POOL_RECYCLE'],
+            ping_interval=app.config['DB_POOL_PING_INTERVAL'],
+            host=app.config['MYSQL_HOST'],
+            user=app.config['MYSQL_USER'],
+            password=app.config['MYSQL_PASSWORD'],
+            database=app.config['MYSQL_DATABASE']
+        )
+        app.extensions['mysql_pool'] = pool
+    return pool
+
+
+def get_pool_stats():
+    """Pool counters for the current worker process."""
+    return _get_pool(current_app._get_current_object()).stats()
+
 
 def get_db_connection():
-    """Get a connection to the MySQL database."""
-    connection = mysql.connector.connect(
-        host=current_app.config['MYSQL_HOST'],
-        user=current_app.config['MYSQL_USER'],
-        password=current_app.config['MYSQL_PASSWORD'],
-        database=current_app.config['MYSQL_DATABASE']
-    )
-    return connection
+    """Get the pooled MySQL connection for the current request."""
+    state = g.get('_db_state')
+    if state is None:
+        connection, created_at = _get_pool(current_app._get_current_object()).acquire()
+        state = g._db_state = {
+            'connection': connection,
+            'created_at': created_at,
+            'handles': 0,
+            'before_commit': [],
+            'after_commit': [],
+            'pending': {},
+        }
+    return RequestConnection(state)
+
+
+def release_db_connection(exception=None):
+    """Teardown hook returning the request's connection to the pool."""
+    state = g.pop('_db_state', None)
+    if state is not None:
+        _get_pool(current_app._get_current_object()).release(
+            state['connection'], state['created_at']
+        )
+
+
+def init_db(app):
+    """Register the pool teardown hook on the application."""
+    app.config.setdefault('DB_POOL_SIZE', 10)
+    app.config.setdefault('DB_POOL_TIMEOUT', 10)
+    app.config.setdefault('DB_POOL_RECYCLE', 1800)
+    app.config.setdefault('DB_POOL_PING_INTERVAL', 30)
+    app.teardown_appcontext(release_db_connection)
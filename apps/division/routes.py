@@ -9,6 +9,8 @@ import random
 import logging
 import re  # <-- Add this line
 from apps import get_db_connection
+from apps.grading import invalidate_grading
+from apps.summaries import submit_rebuild
 from jinja2 import TemplateNotFound
 
 
@@ -71,8 +73,10 @@ def add_division():
                         INSERT INTO division (division_name, min_score, max_score) 
                         VALUES (%s, %s, %s)
                     ''', (division_name, min_score, max_score))
+                    invalidate_grading()
                     connection.commit()
                     flash("Division successfully added!", "success")
+                    submit_rebuild(url_for('division_blueprint.division'))
 
             except mysql.connector.Error as err:
                 flash(f"Database Error: {err}", "danger")
@@ -141,8 +145,10 @@ def edit_division(division_id):
                 SET division_name = %s, min_score = %s, max_score = %s
                 WHERE division_id = %s
             """, (division_name, min_score, max_score, division_id))
+            invalidate_grading()
             connection.commit()
             flash("Division updated successfully!", "success")
+            submit_rebuild(url_for('division_blueprint.division'))
 
         except mysql.connector.Error as err:
             flash(f"Database Error: {err}", "danger")
@@ -202,8 +208,10 @@ def delete_division(grade_id):
 
         # Proceed with deletion
         cursor.execute("DELETE FROM division WHERE grade_id = %s", (grade_id,))
+        invalidate_grading()
         connection.commit()
         flash("Grade deleted successfully.", "success")
+        submit_rebuild(url_for('division_blueprint.division'))
 
     except Exception as e:
         flash(f"An error occurred while deleting the grade: {str(e)}", "danger")
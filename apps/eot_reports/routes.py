@@ -1,5 +1,6 @@
 from apps.eot_reports import blueprint
-from flask import render_template, request, redirect, url_for, flash, session
+from flask import (render_template, request, redirect, url_for, flash, session, jsonify,
+                   Response, stream_template, stream_with_context)
 import mysql.connector
 from werkzeug.utils import secure_filename
 from mysql.connector import Error
@@ -9,6 +10,21 @@ import random
 import logging
 import re  # <-- Add this line
 from apps import get_db_connection
+from apps.audit_log import log_select
+from apps.reference_data import reference_rows
+from apps.grading import attach_grades
+from apps.results_engine import compute_term_results
+from apps.rankings import pupil_positions
+from apps.report_cards import (BATCH_JOB, PRINT_TEMPLATE, batch_progress, batch_title, build_term_card,
+                               card_filename, card_page, class_card_contexts, new_batch_id,
+                               render_class_cards, zip_stream)
+from apps.job_runner import job_response, submit
+from apps.exports import EXPORT_FORMATS, export_response, stream_query
+from apps.pagination import SortKey, keyset_page
+from apps.utils.decorators import login_required
+from apps.summaries import SUMMARY_COLUMNS, SUMMARY_TABLE, refresh_summaries, summary_score_rows
+from apps.report_cache import cached_report, invalidate_reports
+from apps.report_lookups import ReportLookups
 from jinja2 import TemplateNotFound
 import numpy as np 
 
@@ -16,6 +32,105 @@ import numpy as np
 
 
 
+EOT_REPORT_COLUMNS = [
+    ('reg_no', 'Reg No'), ('full_name', 'Full Name'), ('stream_name', 'Stream'),
+    ('year_name', 'Year'), ('term_name', 'Term'), ('assessment_name', 'Assessment'),
+    ('subject_name', 'Subject'), ('Mark', 'Mark'),
+]
+
+
+def _eot_report_filters():
+    """The eot_reports filters from the query string."""
+    return {
+        'class_id': request.args.get('class_id', type=int),
+        'year_id': request.args.get('year_id', type=int),
+        'term_id': request.args.get('term_id', type=int),
+        'subject_id': request.args.get('subject_id', type=int),
+        'assessment_name': request.args.get('assessment_name', type=str),
+        'stream_id': request.args.get('stream_id', type=int),
+        'pupil_name': request.args.get('pupil_name', type=str),
+        'reg_no': request.args.get('reg_no', type=str),
+    }
+
+
+EOT_REPORT_SELECT = """
+    p.reg_no,
+    CONCAT_WS(' ', p.last_name, p.first_name, p.other_name) AS full_name,
+    t.term_name,
+    a.assessment_name,
+    sub.subject_name,
+    s.Mark,
+    p.pupil_id,
+    y.year_name,
+    str.stream_name,
+    s.score_id
+"""
+
+EOT_REPORT_FROM = """
+    FROM 
+        pupils p
+    LEFT JOIN 
+        scores s ON p.reg_no = s.reg_no
+    LEFT JOIN 
+        assessment a ON s.assessment_id = a.assessment_id
+    LEFT JOIN 
+        terms t ON s.term_id = t.term_id
+    LEFT JOIN 
+        subjects sub ON s.subject_id = sub.subject_id
+    LEFT JOIN 
+        study_year y ON s.year_id = y.year_id
+    LEFT JOIN
+        stream str ON p.stream_id = str.stream_id
+"""
+
+# Pupils without marks have one row with a NULL score_id
+EOT_REPORT_SORTS = {
+    'name': SortKey('Name', ['p.last_name', 'p.first_name', 'p.pupil_id', 's.score_id']),
+    'reg_no': SortKey('Reg No', ['p.reg_no', 'p.pupil_id', 's.score_id']),
+}
+
+
+def _eot_reports_where(filters):
+    """(clauses, params) for pupil marks per subject, including pupils without marks."""
+    where, params = [], []
+
+    if filters['class_id']:
+        where.append("p.class_id = %s")
+        params.append(filters['class_id'])
+    if filters['stream_id']:
+        where.append("p.stream_id = %s")
+        params.append(filters['stream_id'])
+    if filters['year_id']:
+        where.append("(y.year_id = %s OR y.year_id IS NULL)")
+        params.append(filters['year_id'])
+    if filters['term_id']:
+        where.append("(t.term_id = %s OR t.term_id IS NULL)")
+        params.append(filters['term_id'])
+    if filters['subject_id']:
+        where.append("(sub.subject_id = %s OR sub.subject_id IS NULL)")
+        params.append(filters['subject_id'])
+    if filters['assessment_name']:
+        where.append("(a.assessment_name = %s OR a.assessment_name IS NULL)")
+        params.append(filters['assessment_name'])
+    if filters['pupil_name']:
+        where.append("TRIM(CONCAT(p.first_name, ' ', COALESCE(p.other_name, ''), ' ', p.last_name)) LIKE %s")
+        params.append(f"%{filters['pupil_name']}%")
+    if filters['reg_no']:
+        where.append("p.reg_no = %s")
+        params.append(filters['reg_no'])
+
+    return where, params
+
+
+def _eot_reports_query(filters):
+    """The whole eot_reports listing as one query, for exports."""
+    where, params = _eot_reports_where(filters)
+    query = f"SELECT {EOT_REPORT_SELECT} {EOT_REPORT_FROM}"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    return query + " ORDER BY p.last_name, p.first_name, p.other_name", params
+
+
 @blueprint.route('/eot_reports', methods=['GET'])
 def eot_reports():
     """Fetches pupil marks per subject for a given assessment and renders the eot_reports page,
@@ -24,47 +139,18 @@ def eot_reports():
     cursor = connection.cursor(dictionary=True)
 
     # Fetch dropdown filter data
-    cursor.execute("SELECT * FROM classes")
-    class_list = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM subjects")
-    subjects = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM stream")
-    streams = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM pupils")
-    pupils = cursor.fetchall()
+    class_list = reference_rows('classes')
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
+    subjects = reference_rows('subjects')
+    streams = reference_rows('stream')
 
     # Retrieve query parameters
-    class_id = request.args.get('class_id', type=int)
-    year_id = request.args.get('year_id', type=int)
-    term_id = request.args.get('term_id', type=int)
-    subject_id = request.args.get('subject_id', type=int)
-    assessment_name = request.args.get('assessment_name', type=str)
-    stream_id = request.args.get('stream_id', type=int)
-    pupil_name = request.args.get('pupil_name', type=str)
-    reg_no = request.args.get('reg_no', type=str)
-
-    filters = {
-        'class_id': class_id,
-        'year_id': year_id,
-        'term_id': term_id,
-        'subject_id': subject_id,
-        'assessment_name': assessment_name,
-        'stream_id': stream_id,
-        'pupil_name': pupil_name,
-        'reg_no': reg_no
-    }
+    filters = _eot_report_filters()
+    class_id, year_id, term_id = filters['class_id'], filters['year_id'], filters['term_id']
+    subject_id, assessment_name = filters['subject_id'], filters['assessment_name']
+    stream_id, pupil_name, reg_no = filters['stream_id'], filters['pupil_name'], filters['reg_no']
 
     if not any(filters.values()):
         cursor.close()
@@ -78,7 +164,6 @@ def eot_reports():
             subjects=subjects,
             assessments=assessments,
             streams=streams,
-            pupils=pupils,
             selected_class_id=None,
             selected_study_year_id=None,
             selected_term_id=None,
@@ -90,57 +175,10 @@ def eot_reports():
             segment='eot_reports'
         )
 
-    # Construct the query
-    query = """
-    SELECT 
-        p.reg_no,
-        CONCAT_WS(' ', p.last_name, p.first_name, p.other_name) AS full_name,
-        t.term_name,
-        a.assessment_name,
-        sub.subject_name,
-        s.Mark,
-        p.pupil_id,
-        y.year_name,
-        str.stream_name,
-        s.score_id
-    FROM 
-        pupils p
-    LEFT JOIN 
-        scores s ON p.reg_no = s.reg_no
-    LEFT JOIN 
-        assessment a ON s.assessment_id = a.assessment_id
-    LEFT JOIN 
-        terms t ON s.term_id = t.term_id
-    LEFT JOIN 
-        subjects sub ON s.subject_id = sub.subject_id
-    LEFT JOIN 
-        study_year y ON s.year_id = y.year_id
-    LEFT JOIN
-        stream str ON p.stream_id = str.stream_id
-    WHERE 1=1
-    """
-
-    if class_id:
-        query += f" AND p.class_id = {class_id}"
-    if stream_id:
-        query += f" AND p.stream_id = {stream_id}"
-    if year_id:
-        query += f" AND (y.year_id = {year_id} OR y.year_id IS NULL)"
-    if term_id:
-        query += f" AND (t.term_id = {term_id} OR t.term_id IS NULL)"
-    if subject_id:
-        query += f" AND (sub.subject_id = {subject_id} OR sub.subject_id IS NULL)"
-    if assessment_name:
-        query += f" AND (a.assessment_name = '{assessment_name}' OR a.assessment_name IS NULL)"
-    if pupil_name:
-        query += f" AND TRIM(CONCAT(p.first_name, ' ', COALESCE(p.other_name, ''), ' ', p.last_name)) LIKE '%{pupil_name}%'"
-    if reg_no:
-        query += f" AND p.reg_no = '{reg_no}'"
-
-    query += " ORDER BY p.last_name, p.first_name, p.other_name"
-
-    cursor.execute(query)
-    eot_reports = cursor.fetchall()
+    where, params = _eot_reports_where(filters)
+    page = keyset_page(cursor, 'eot_reports', EOT_REPORT_SELECT, EOT_REPORT_FROM, where, params,
+                       EOT_REPORT_SORTS, 'name')
+    eot_reports = page['rows']
 
     cursor.close()
     connection.close()
@@ -148,13 +186,13 @@ def eot_reports():
     return render_template(
         'eot_reports/eot_reports.html',
         eot_reports=eot_reports,
+        page=page,
         class_list=class_list,
         study_years=study_years,
         terms=terms,
         subjects=subjects,
         assessments=assessments,
         streams=streams,
-        pupils=pupils,
         selected_class_id=class_id,
         selected_study_year_id=year_id,
         selected_term_id=term_id,
@@ -167,6 +205,18 @@ def eot_reports():
     )
 
 
+@blueprint.route('/eot_reports/export', methods=['GET'])
+@login_required
+def eot_reports_export():
+    """The eot_reports rows as CSV or XLSX (format=csv|xlsx), same filters as the page."""
+    output = request.args.get('format', 'csv')
+    if output not in EXPORT_FORMATS:
+        return jsonify({'error': 'format must be csv or xlsx.'}), 400
+    query, params = _eot_reports_query(_eot_report_filters())
+    return export_response(output, 'eot_reports', EOT_REPORT_COLUMNS, stream_query(query, params),
+                           sheet_title='EOT Reports')
+
+
 
 
 
@@ -184,6 +234,11 @@ def get_kampala_time():
     kampala = pytz.timezone("Africa/Kampala")
     return datetime.now(kampala)
 
+DELETE_LOG_COLUMNS = [
+    'score_id', 'user_id', 'reg_no', 'class_id', 'stream_id', 'term_id', 'year_id',
+    'assessment_id', 'subject_id', 'Mark', 'notes', 'deleted_at'
+]
+
 @blueprint.route('/delete_scores', methods=['POST'])
 def delete_scores():
     """Deletes selected scores and logs them with optional notes."""
@@ -207,26 +262,22 @@ def delete_scores():
         cursor.execute(f"SELECT * FROM scores WHERE score_id IN ({format_strings})", score_ids)
         rows_to_log = cursor.fetchall()
 
-        # Prepare insert query for logs (includes notes and deleted_at)
-        log_query = """
-            INSERT INTO scores_del_logs
-            (score_id, user_id, reg_no, class_id, stream_id, term_id, year_id, assessment_id, subject_id, Mark, notes, deleted_at)
-            VALUES (%(score_id)s, %(user_id)s, %(reg_no)s, %(class_id)s, %(stream_id)s, %(term_id)s, %(year_id)s,
-                    %(assessment_id)s, %(subject_id)s, %(Mark)s, %(notes)s, %(deleted_at)s)
-        """
-
-        kampala_time = get_kampala_time()
-
-        # Insert each deleted row into the logs table with your deletion notes
-        for row in rows_to_log:
-            row['deleted_at'] = kampala_time
-            # Use deletion notes from form; if none provided, fallback to existing notes or NULL
-            row['notes'] = deletion_notes if deletion_notes else row.get('notes', None)
-            cursor.execute(log_query, row)
+        # Copy the rows into the logs in one statement, with the deletion notes
+        # from the form or, if none were given, the score's own notes
+        log_select(cursor, 'scores_del_logs', DELETE_LOG_COLUMNS, f"""
+            SELECT score_id, user_id, reg_no, class_id, stream_id, term_id, year_id,
+                   assessment_id, subject_id, Mark, COALESCE(%s, notes), %s
+            FROM scores WHERE score_id IN ({format_strings})
+        """, [deletion_notes or None, get_kampala_time()] + score_ids)
 
         # Now delete from scores table
         cursor.execute(f"DELETE FROM scores WHERE score_id IN ({format_strings})", score_ids)
 
+        refresh_summaries(connection, {
+            (row['reg_no'], row['year_id'], row['term_id'], row['assessment_id'])
+            for row in rows_to_log
+        })
+        invalidate_reports({(row['class_id'], row['year_id'], row['term_id']) for row in rows_to_log})
         connection.commit()
 
         flash(f"{cursor.rowcount} score(s) deleted and logged successfully.", 'success')
@@ -345,17 +396,10 @@ def term_eot_reports():
     cursor = connection.cursor(dictionary=True)
 
     # Fetch dropdowns
-    cursor.execute("SELECT * FROM classes")
-    class_list = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
+    class_list = reference_rows('classes')
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
 
     # Filters
     class_id = request.args.get('class_id', type=int)
@@ -396,8 +440,6 @@ def term_eot_reports():
         a.assessment_name,
         sub.subject_name,
         s.Mark,
-        g.grade_letter,
-        g.remark,
         p.pupil_id,
         y.year_name
     FROM 
@@ -407,7 +449,6 @@ def term_eot_reports():
     JOIN terms t ON s.term_id = t.term_id
     JOIN subjects sub ON s.subject_id = sub.subject_id
     JOIN study_year y ON s.year_id = y.year_id
-    JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
     WHERE 1=1
     """
 
@@ -427,6 +468,7 @@ def term_eot_reports():
 
     cursor.execute(query, params)
     raw_data = cursor.fetchall()
+    raw_data = attach_grades(raw_data, drop_ungraded=True)
 
     # Identify only used subjects
     subject_names = sorted(set(row['subject_name'] for row in raw_data))
@@ -484,14 +526,10 @@ def scores_eot_reports():
     cursor = connection.cursor(dictionary=True)
 
     # Load dropdowns
-    cursor.execute("SELECT * FROM classes")
-    class_list = cursor.fetchall()
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
+    class_list = reference_rows('classes')
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
 
     # Get filters
     class_id = request.args.get('class_id', type=int)
@@ -523,16 +561,13 @@ def scores_eot_reports():
         t.term_name,
         a.assessment_name,
         sub.subject_name,
-        s.Mark,
-        g.grade_letter,
-        g.remark
+        s.Mark
     FROM scores s
     JOIN pupils p ON s.reg_no = p.reg_no
     JOIN assessment a ON s.assessment_id = a.assessment_id
     JOIN terms t ON s.term_id = t.term_id
     JOIN subjects sub ON s.subject_id = sub.subject_id
     JOIN study_year y ON s.year_id = y.year_id
-    LEFT JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
     WHERE 1=1
     """
     params = []
@@ -554,44 +589,10 @@ def scores_eot_reports():
     cursor.close()
     connection.close()
 
-    # Process and pivot using NumPy
     subject_names = sorted({row['subject_name'] for row in raw_data})
-    student_map = {}
-
-    for row in raw_data:
-        reg = row['reg_no']
-        if reg not in student_map:
-            student_map[reg] = {
-                'reg_no': reg,
-                'full_name': row['full_name'],
-                'year_name': row['year_name'],
-                'term_name': row['term_name'],
-                'assessment_name': row['assessment_name'],
-                'marks': {},
-                'grades': {},
-                'remarks': {}
-            }
-        subject = row['subject_name']
-        mark = row['Mark']
-
-        student_map[reg]['marks'][subject] = mark if mark is not None else np.nan
-        student_map[reg]['grades'][subject] = row['grade_letter'] or ''
-        student_map[reg]['remarks'][subject] = row['remark'] or ''
-
-    # Calculate total and average using NumPy
-    eot_reports = []
-    for student in student_map.values():
-        marks_array = np.array([
-            student['marks'].get(subject, np.nan) for subject in subject_names
-        ], dtype=np.float64)
 
-        total = np.nansum(marks_array)
-        count = np.count_nonzero(~np.isnan(marks_array))
-        avg = np.round(total / count, 2) if count > 0 else 0
-
-        student['total_score'] = total
-        student['average_score'] = avg
-        eot_reports.append(student)
+    # Totals and averages over the subjects each pupil sat
+    eot_reports = compute_term_results(raw_data, strict_aggregate=False, incomplete_last=False)
 
     return render_template('eot_reports/scores_eot_reports.html',
         eot_reports=eot_reports, subject_names=subject_names,
@@ -625,14 +626,10 @@ def scores_positions_eot_reports_remarks():
     cursor = connection.cursor(dictionary=True)
 
     # Load dropdown options
-    cursor.execute("SELECT * FROM classes")
-    class_list = cursor.fetchall()
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
+    class_list = reference_rows('classes')
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
 
     # Get filter parameters
     class_id = request.args.get('class_id', type=int)
@@ -658,103 +655,20 @@ def scores_positions_eot_reports_remarks():
             t.term_name, t.term_id,
             a.assessment_name,
             sub.subject_name,
-            s.Mark,
-            g.grade_letter,
-            g.remark,
-            g.weight
+            s.Mark
         FROM scores s
         JOIN pupils p ON s.reg_no = p.reg_no
         JOIN assessment a ON s.assessment_id = a.assessment_id
         JOIN terms t ON s.term_id = t.term_id
         JOIN study_year y ON s.year_id = y.year_id
         JOIN subjects sub ON s.subject_id = sub.subject_id
-        LEFT JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
         WHERE p.class_id = %s AND s.year_id = %s AND s.term_id = %s AND a.assessment_name = %s
     """, (class_id, year_id, term_id, assessment_name))
     rows = cursor.fetchall()
-
     subject_names = sorted({row['subject_name'] for row in rows})
 
-    # Organize by student
-    student_map = {}
-    for row in rows:
-        reg_no = row['reg_no']
-        if reg_no not in student_map:
-            student_map[reg_no] = {
-                'reg_no': reg_no,
-                'full_name': row['full_name'],
-                'class_id': row['class_id'],
-                'stream_id': row['stream_id'],
-                'year_id': row['year_id'],
-                'term_id': row['term_id'],
-                'year_name': row['year_name'],
-                'term_name': row['term_name'],
-                'assessment_name': row['assessment_name'],
-                'marks': {},
-                'grades': {},
-                'remarks': {},
-                'weights': {}
-            }
-        student_map[reg_no]['marks'][row['subject_name']] = row['Mark'] if row['Mark'] is not None else float('nan')
-        student_map[reg_no]['grades'][row['subject_name']] = row['grade_letter'] or ''
-        student_map[reg_no]['remarks'][row['subject_name']] = row['remark'] or ''
-        student_map[reg_no]['weights'][row['subject_name']] = row['weight'] or 0
-
-    # Compute totals, averages, aggregates, and lookup division
-    eot_reports = []
-    for student in student_map.values():
-        marks = np.array([student['marks'].get(sub, float('nan')) for sub in subject_names], dtype=np.float64)
-        weights = [student['weights'].get(sub, 0) for sub in subject_names]
-
-        total_score = np.nansum(marks)
-        count = np.count_nonzero(~np.isnan(marks))
-        average_score = round(total_score / count, 2) if count else 0
-        aggregate = sum(weights)
-
-        # Look up division based on aggregate
-        cursor.execute("""
-            SELECT division_name FROM division
-            WHERE %s BETWEEN min_score AND max_score
-            LIMIT 1
-        """, (aggregate,))
-        division_row = cursor.fetchone()
-        division_name = division_row['division_name'] if division_row else 'N/A'
-
-        student['total_score'] = total_score
-        student['average_score'] = average_score
-        student['aggregate'] = aggregate
-        student['division'] = division_name
-        eot_reports.append(student)
-
-    # Rank students by average (stream and class)
-    for student in eot_reports:
-        reg_no = student['reg_no']
-        stream_id = student['stream_id']
-        class_id = student['class_id']
-        term_id = student['term_id']
-        year_id = student['year_id']
-
-        # Stream position based on average
-        cursor.execute("""
-            SELECT p.reg_no, AVG(s.Mark) AS avg
-            FROM scores s
-            JOIN pupils p ON s.reg_no = p.reg_no
-            WHERE p.stream_id = %s AND s.term_id = %s AND s.year_id = %s
-            GROUP BY p.reg_no ORDER BY avg DESC
-        """, (stream_id, term_id, year_id))
-        stream_ranks = cursor.fetchall()
-        student['stream_position'] = next((i + 1 for i, r in enumerate(stream_ranks) if r['reg_no'] == reg_no), None)
-
-        # Class position based on average
-        cursor.execute("""
-            SELECT p.reg_no, AVG(s.Mark) AS avg
-            FROM scores s
-            JOIN pupils p ON s.reg_no = p.reg_no
-            WHERE p.class_id = %s AND s.term_id = %s AND s.year_id = %s
-            GROUP BY p.reg_no ORDER BY avg DESC
-        """, (class_id, term_id, year_id))
-        class_ranks = cursor.fetchall()
-        student['class_position'] = next((i + 1 for i, r in enumerate(class_ranks) if r['reg_no'] == reg_no), None)
+    # Totals, aggregates, divisions and stream/class positions by average
+    eot_reports = compute_term_results(rows, strict_aggregate=False, incomplete_last=False)
 
     cursor.close()
     connection.close()
@@ -793,17 +707,10 @@ def assessment_report():
     cursor = connection.cursor(dictionary=True)
 
     # Load dropdown data
-    cursor.execute("SELECT * FROM classes")
-    class_list = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
+    class_list = reference_rows('classes')
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
 
     # Get filters from request
     class_id = request.args.get('class_id', type=int)
@@ -966,16 +873,6 @@ def term_report_card(reg_no):
     if not pupil:
         return "Pupil not found", 404
 
-    # Load grade scale
-    cursor.execute("SELECT * FROM grades ORDER BY weight")
-    grade_scale = cursor.fetchall()
-
-    def get_grade(score):
-        for g in grade_scale:
-            if g['min_score'] <= score <= g['max_score']:
-                return g['grade_letter'], g['remark']
-        return '-', '-'
-
     # Get all scores
     cursor.execute("""
         SELECT a.assessment_name, sub.subject_name, s.Mark
@@ -987,89 +884,71 @@ def term_report_card(reg_no):
     """, (reg_no,))
     results = cursor.fetchall()
 
-    # Process assessment data
-    subject_scores = {}
-    assessment_names = set()
+    cursor.close()
+    connection.close()
 
-    for row in results:
-        subject = row['subject_name']
-        assess = row['assessment_name']
-        mark = float(row['Mark']) if row['Mark'] is not None else None
-        assessment_names.add(assess)
+    # Stream and class position, ranked once per class and term
+    stream_position, class_position = pupil_positions(
+        reg_no, pupil['class_id'], pupil['year_id'], pupil['term_id']
+    )
 
-        if subject not in subject_scores:
-            subject_scores[subject] = {}
-        subject_scores[subject][assess] = mark
+    return render_template("eot_reports/term_report_card.html",
+        **build_term_card(pupil, results, stream_position, class_position)
+    )
 
-    assessment_list = sorted(assessment_names)
 
-    subjects_data = []
-    overall_total = 0
-    subject_count = 0
-
-    for subject, scores in subject_scores.items():
-        total = sum([m for m in scores.values() if m is not None])
-        count = sum([1 for m in scores.values() if m is not None])
-        average = round(total / count, 2) if count else 0
-        grade_letter, remark = get_grade(average)
-        subject_entry = {
-            'subject': subject,
-            'marks': [],
-            'total': total,
-            'average': average,
-            'grade': grade_letter,
-            'remark': remark
-        }
+@blueprint.route('/term_report_cards', methods=['GET'])
+@login_required
+def term_report_cards():
+    """Every report card of a class (or stream) for a term, as one
+    printable page (format=html) or a zip of per-pupil pages (format=zip).
+    With background=1 the file is built by a background job instead."""
+    class_id = request.args.get('class_id', type=int)
+    year_id = request.args.get('year_id', type=int)
+    term_id = request.args.get('term_id', type=int)
+    stream_id = request.args.get('stream_id', type=int)
+    output = request.args.get('format', 'html')
+    # Clients may pick the id up front to poll term_report_cards_progress
+    batch_id = request.args.get('batch_id') or new_batch_id()
 
-        for assessment in assessment_list:
-            mark = scores.get(assessment)
-            if mark is not None:
-                g, r = get_grade(mark)
-                subject_entry['marks'].append({'mark': mark, 'grade': g, 'remark': r})
-            else:
-                subject_entry['marks'].append({'mark': '-', 'grade': '-', 'remark': '-'})
-        
-        subjects_data.append(subject_entry)
-        overall_total += average
-        subject_count += 1
-
-    overall_average = round(overall_total / subject_count, 2) if subject_count else 0
-    overall_grade, overall_remark = get_grade(overall_average)
-
-    # Stream and class position
-    cursor.execute("""
-        SELECT p.reg_no, AVG(s.Mark) AS avg
-        FROM scores s
-        JOIN pupils p ON s.reg_no = p.reg_no
-        WHERE p.stream_id = %s AND p.term_id = %s AND p.year_id = %s
-        GROUP BY p.reg_no ORDER BY avg DESC
-    """, (pupil['stream_id'], pupil['term_id'], pupil['year_id']))
-    stream_position = next((i+1 for i, r in enumerate(cursor.fetchall()) if r['reg_no'] == reg_no), None)
+    if not (class_id and year_id and term_id) or output not in ('html', 'zip'):
+        return jsonify({'error': 'class_id, year_id and term_id are required; format is html or zip.'}), 400
 
-    cursor.execute("""
-        SELECT p.reg_no, AVG(s.Mark) AS avg
-        FROM scores s
-        JOIN pupils p ON s.reg_no = p.reg_no
-        JOIN stream strm ON p.stream_id = strm.stream_id
-        WHERE strm.class_id = %s AND p.term_id = %s AND p.year_id = %s
-        GROUP BY p.reg_no ORDER BY avg DESC
-    """, (pupil['class_id'], pupil['term_id'], pupil['year_id']))
-    class_position = next((i+1 for i, r in enumerate(cursor.fetchall()) if r['reg_no'] == reg_no), None)
+    if request.args.get('background') == '1':
+        job_id = submit(BATCH_JOB, {
+            'class_id': class_id, 'year_id': year_id, 'term_id': term_id, 'stream_id': stream_id,
+            'output': output, 'back_url': request.referrer,
+        }, user_id=session.get('id'))
+        return job_response(job_id)
 
-    cursor.close()
-    connection.close()
+    try:
+        contexts = class_card_contexts(class_id, year_id, term_id, stream_id)
+    except Error as e:
+        return jsonify({'error': f'Database error: {e}'}), 500
+    if not contexts:
+        return jsonify({'error': 'No pupils found for the selected class and term.'}), 404
+
+    scope = {'class_id': class_id, 'year_id': year_id, 'term_id': term_id, 'stream_id': stream_id}
+    cards = render_class_cards(contexts, batch_id, scope)
+    title = batch_title(contexts)
+
+    if output == 'zip':
+        files = ((card_filename(pupil), card_page(pupil, card)) for pupil, card in cards)
+        response = Response(stream_with_context(zip_stream(files)), mimetype='application/zip')
+        response.headers['Content-Disposition'] = f'attachment; filename="{secure_filename(title)}.zip"'
+    else:
+        response = Response(stream_template(PRINT_TEMPLATE, title=title, cards=(card for _, card in cards)))
+    response.headers['X-Batch-Id'] = batch_id
+    return response
 
-    return render_template("eot_reports/term_report_card.html",
-        pupil=pupil,
-        subjects=subjects_data,
-        assessments=assessment_list,
-        overall_average=overall_average,
-        overall_grade=overall_grade,
-        overall_remark=overall_remark,
-        stream_position=stream_position,
-        class_position=class_position,
-        print_date=datetime.now()
-    )
+
+@blueprint.route('/term_report_cards/progress/<batch_id>', methods=['GET'])
+@login_required
+def term_report_cards_progress(batch_id):
+    progress = batch_progress(batch_id)
+    if progress is None:
+        return jsonify({'error': 'Unknown batch.'}), 404
+    return jsonify(progress)
 
 
 
@@ -1087,17 +966,10 @@ def scores_p_eot_reports():
     cursor = connection.cursor(dictionary=True)
 
     # Load dropdown data
-    cursor.execute("SELECT * FROM classes")
-    class_list = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
+    class_list = reference_rows('classes')
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
 
     # Get filters from request
     class_id = request.args.get('class_id', type=int)
@@ -1130,16 +1002,13 @@ def scores_p_eot_reports():
         t.term_name,
         a.assessment_name,
         sub.subject_name,
-        s.Mark,
-        g.grade_letter,
-        g.remark
+        s.Mark
     FROM scores s
     JOIN pupils p ON s.reg_no = p.reg_no
     JOIN assessment a ON s.assessment_id = a.assessment_id
     JOIN terms t ON s.term_id = t.term_id
     JOIN subjects sub ON s.subject_id = sub.subject_id
     JOIN study_year y ON s.year_id = y.year_id
-    LEFT JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
     WHERE 1=1
     """
 
@@ -1163,58 +1032,13 @@ def scores_p_eot_reports():
     cursor.close()
     connection.close()
 
-    # Extract subject names and initialize student mapping
     subject_names = sorted({row['subject_name'] for row in raw_data})
-    student_map = {}
-
-    for row in raw_data:
-        reg = row['reg_no']
-        if reg not in student_map:
-            student_map[reg] = {
-                'reg_no': reg,
-                'full_name': row['full_name'],
-                'year_name': row['year_name'],
-                'term_name': row['term_name'],
-                'assessment_name': row['assessment_name'],
-                'marks': {},
-                'grades': {},
-                'remarks': {}
-            }
-
-        subject = row['subject_name']
-        mark = row['Mark']
-
-        student_map[reg]['marks'][subject] = mark if mark is not None else np.nan
-        student_map[reg]['grades'][subject] = row['grade_letter'] or ''
-        student_map[reg]['remarks'][subject] = row['remark'] or ''
-
-    # Calculate totals, averages, and prepare for ranking
-    eot_reports = []
-    for student in student_map.values():
-        marks_array = np.array([
-            student['marks'].get(subject, np.nan) for subject in subject_names
-        ], dtype=np.float64)
-
-        total = np.nansum(marks_array)
-        count = np.count_nonzero(~np.isnan(marks_array))
-        average = np.round(total / count, 2) if count > 0 else 0
-
-        student['total_score'] = total
-        student['average_score'] = average
-        eot_reports.append(student)
-
-    # Sort and assign positions
-    eot_reports.sort(key=lambda x: x['average_score'], reverse=True)
 
-    current_position = 1
-    last_average = None
-    for index, student in enumerate(eot_reports):
-        if student['average_score'] == last_average:
-            student['position'] = current_position  # same position for tie
-        else:
-            current_position = index + 1
-            student['position'] = current_position
-            last_average = student['average_score']
+    # Totals, averages and tie-aware positions, best average first
+    eot_reports = compute_term_results(raw_data, strict_aggregate=False, incomplete_last=False)
+    for student in eot_reports:
+        student['position'] = student['class_position']
+    eot_reports.sort(key=lambda x: x['position'])
 
     # Render template with results
     return render_template('eot_reports/scores_p_eot_reports.html',
@@ -1250,73 +1074,36 @@ def scores_p_eot_reports():
 
 
 
-@blueprint.route('/scores_positions_eot_reports', methods=['GET'])
-def scores_positions_eot_reports():
-    connection = get_db_connection()
-    cursor = connection.cursor(dictionary=True)
-
-    # Load dropdown data
-    cursor.execute("SELECT * FROM classes WHERE class_id IN (4, 30, 31, 32)")
-    class_list = cursor.fetchall()
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
-    cursor.execute("SELECT * FROM stream")
-    streams = cursor.fetchall()
-
-    # Read filters
-    class_id = request.args.get('class_id', type=int)
-    year_id = request.args.get('year_id', type=int)
-    term_id = request.args.get('term_id', type=int)
-    assessment_name = request.args.get('assessment_name', type=str)
-    stream_id = request.args.get('stream_id', type=int)
+POSITION_COLUMNS = [
+    ('full_name', 'Full Name'), ('reg_no', 'Reg No'), ('stream_name', 'Stream'), ('year_name', 'Year'),
+    ('term_name', 'Term'), ('assessment_name', 'Assessment'),
+]
+POSITION_TOTAL_COLUMNS = [
+    ('total_score', 'Total Score'), ('average_score', 'Average Score'), ('aggregate', 'Aggregate'),
+    ('division', 'Division'), ('stream_position', 'Stream Position'), ('class_position', 'Class Position'),
+]
 
-    if not all([class_id, year_id, term_id, assessment_name]):
-        cursor.close()
-        connection.close()
-        return render_template(
-            'eot_reports/scores_positions_eot_reports.html',
-            eot_reports=[],
-            subject_names=[],
-            class_list=class_list,
-            study_years=study_years,
-            terms=terms,
-            assessments=assessments,
-            streams=streams,
-            selected_stream_id=stream_id,
-            selected_class_id=class_id,
-            selected_study_year_id=year_id,
-            selected_term_id=term_id,
-            selected_assessment_name=assessment_name,
-            segment='eot_reports'
-        )
 
+def _positions_results(cursor, class_id, year_id, term_id, assessment_name, stream_id=None):
+    """(students in class-position order, subject names) for one assessment."""
     core_subjects = ['MTC', 'ENGLISH', 'SST', 'SCIE']
 
     # Fetch scores and related data
-    sql = """
+    sql = f"""
         SELECT 
             p.reg_no, p.stream_id, p.class_id,
             CONCAT_WS(' ', p.last_name, p.first_name, p.other_name) AS full_name,
             y.year_name, y.year_id,
             t.term_name, t.term_id,
             a.assessment_name,
-            sub.subject_name,
-            s.Mark,
-            g.grade_letter,
-            g.weight,
+            {SUMMARY_COLUMNS},
             st.stream_name
-        FROM scores s
+        FROM {SUMMARY_TABLE} s
         JOIN pupils p ON s.reg_no = p.reg_no
         JOIN assessment a ON s.assessment_id = a.assessment_id
         JOIN terms t ON s.term_id = t.term_id
         JOIN study_year y ON s.year_id = y.year_id
-        JOIN subjects sub ON s.subject_id = sub.subject_id
         JOIN stream st ON p.stream_id = st.stream_id
-        LEFT JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
         WHERE p.class_id = %s AND s.year_id = %s AND s.term_id = %s AND a.assessment_name = %s
     """
     args = [class_id, year_id, term_id, assessment_name]
@@ -1327,92 +1114,60 @@ def scores_positions_eot_reports():
 
     cursor.execute(sql, args)
     rows = cursor.fetchall()
+    rows, summaries = summary_score_rows(rows, core_subjects)
 
     subject_names = sorted({row['subject_name'] for row in rows})
 
-    # Build student data map
-    student_map = {}
-    for row in rows:
-        reg_no = row['reg_no']
-        if reg_no not in student_map:
-            student_map[reg_no] = {
-                'reg_no': reg_no,
-                'full_name': row['full_name'],
-                'class_id': row['class_id'],
-                'stream_id': row['stream_id'],
-                'stream_name': row['stream_name'],
-                'year_id': row['year_id'],
-                'term_id': row['term_id'],
-                'year_name': row['year_name'],
-                'term_name': row['term_name'],
-                'assessment_name': row['assessment_name'],
-                'marks': {},
-                'grades': {},
-                'weights': {}
-            }
-        student_map[reg_no]['marks'][row['subject_name']] = row['Mark']
-        student_map[reg_no]['grades'][row['subject_name']] = row['grade_letter'] or ''
-        student_map[reg_no]['weights'][row['subject_name']] = row['weight'] or 0
+    # Average is always divided by the number of core subjects (4)
+    students = compute_term_results(
+        rows, total_subjects=core_subjects, average_over_all=True, summaries=summaries
+    )
+    students.sort(key=lambda s: (s['class_position'], s['reg_no']))
 
-    # Calculate totals, averages, aggregate, division
-    for student in student_map.values():
-        core_marks = [student['marks'].get(sub) for sub in core_subjects]
+    return students, subject_names
 
-        # Replace missing marks with zero for total and average calculation
-        marks_values = [m if m is not None else 0 for m in core_marks]
-        total_score = sum(marks_values)
 
-        # Average is always divided by total number of core subjects (4)
-        avg_score = round(total_score / len(core_subjects), 2)
+@blueprint.route('/scores_positions_eot_reports', methods=['GET'])
+@cached_report
+def scores_positions_eot_reports():
+    connection = get_db_connection()
+    cursor = connection.cursor(dictionary=True)
 
-        incomplete = any(m is None for m in core_marks)
-        if incomplete:
-            aggregate = 'X'
-            division = 'X'
-        else:
-            aggregate = sum(student['weights'].get(sub, 0) for sub in core_subjects)
-            cursor.execute("""
-                SELECT division_name FROM division
-                WHERE %s BETWEEN min_score AND max_score LIMIT 1
-            """, (aggregate,))
-            div_row = cursor.fetchone()
-            division = div_row['division_name'] if div_row else 'N/A'
-
-        student.update({
-            'total_score': total_score,
-            'average_score': avg_score,
-            'aggregate': aggregate,
-            'division': division
-        })
+    # Load dropdown data
+    class_list = reference_rows('classes', ids=(4, 30, 31, 32))
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
+    streams = reference_rows('stream')
 
-    students = list(student_map.values())
-
-    def assign_positions(student_list, pos_key):
-        # Sort students: aggregate 'X' last, others by descending average_score
-        student_list.sort(key=lambda s: (float('inf') if s['aggregate'] == 'X' else -s['average_score'], s['reg_no']))
-        prev_score = None
-        prev_position = 0
-        for idx, student in enumerate(student_list, start=1):
-            # Assign numeric position regardless of 'X' aggregate
-            if student['aggregate'] == 'X':
-                student[pos_key] = idx
-            else:
-                if student['average_score'] != prev_score:
-                    prev_position = idx
-                student[pos_key] = prev_position
-                prev_score = student['average_score']
-
-    # Assign class positions
-    assign_positions(students, 'class_position')
-
-    # Assign stream positions
-    from collections import defaultdict
-    stream_groups = defaultdict(list)
-    for student in students:
-        stream_groups[student['stream_id']].append(student)
-
-    for group in stream_groups.values():
-        assign_positions(group, 'stream_position')
+    # Read filters
+    class_id = request.args.get('class_id', type=int)
+    year_id = request.args.get('year_id', type=int)
+    term_id = request.args.get('term_id', type=int)
+    assessment_name = request.args.get('assessment_name', type=str)
+    stream_id = request.args.get('stream_id', type=int)
+
+    if not all([class_id, year_id, term_id, assessment_name]):
+        cursor.close()
+        connection.close()
+        return render_template(
+            'eot_reports/scores_positions_eot_reports.html',
+            eot_reports=[],
+            subject_names=[],
+            class_list=class_list,
+            study_years=study_years,
+            terms=terms,
+            assessments=assessments,
+            streams=streams,
+            selected_stream_id=stream_id,
+            selected_class_id=class_id,
+            selected_study_year_id=year_id,
+            selected_term_id=term_id,
+            selected_assessment_name=assessment_name,
+            segment='eot_reports'
+        )
+
+    students, subject_names = _positions_results(cursor, class_id, year_id, term_id, assessment_name, stream_id)
 
     cursor.close()
     connection.close()
@@ -1448,22 +1203,73 @@ def scores_positions_eot_reports():
 
 
 
+@blueprint.route('/scores_positions_eot_reports/export', methods=['GET'])
+@login_required
+def scores_positions_eot_reports_export():
+    """The positions table as CSV or XLSX (format=csv|xlsx), same filters as the page.
+
+    Positions need the whole class, so one class is ranked in memory and
+    its rows are then written out as they go.
+    """
+    output = request.args.get('format', 'csv')
+    class_id = request.args.get('class_id', type=int)
+    year_id = request.args.get('year_id', type=int)
+    term_id = request.args.get('term_id', type=int)
+    assessment_name = request.args.get('assessment_name', type=str)
+    stream_id = request.args.get('stream_id', type=int)
+
+    if not all([class_id, year_id, term_id, assessment_name]) or output not in EXPORT_FORMATS:
+        return jsonify({'error': 'class_id, year_id, term_id and assessment_name are required; '
+                                 'format is csv or xlsx.'}), 400
+
+    with get_db_connection() as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            students, subject_names = _positions_results(
+                cursor, class_id, year_id, term_id, assessment_name, stream_id
+            )
+
+    columns = list(POSITION_COLUMNS)
+    for subject in subject_names:
+        columns += [(('mark', subject), f'{subject} (Mark)'), (('grade', subject), f'{subject} (Grade)')]
+    columns += POSITION_TOTAL_COLUMNS
+
+    def rows():
+        for student in students:
+            row = dict(student)
+            for subject in subject_names:
+                row['mark', subject] = student['marks'].get(subject)
+                row['grade', subject] = student['grades'].get(subject)
+            yield row
+
+    return export_response(output, f'positions_{assessment_name}', columns, rows(),
+                           sheet_title='Positions')
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
 @blueprint.route('/vd_eot_reports', methods=['GET'])
+@cached_report
 def vd_eot_reports():
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
 
     # --- Load dropdown options ---
-    cursor.execute("SELECT * FROM classes WHERE class_id IN (4,30,31,32,33)")
-    class_list = cursor.fetchall()
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
-    cursor.execute("SELECT * FROM stream")
-    streams = cursor.fetchall()
+    class_list = reference_rows('classes', ids=(4, 30, 31, 32, 33))
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
+    streams = reference_rows('stream')
 
     # --- URL query parameters ---
     class_id = request.args.get('class_id', type=int)
@@ -1517,18 +1323,15 @@ def vd_eot_reports():
                CONCAT_WS(' ', p.last_name, p.first_name, p.other_name) AS full_name,
                p.image, c.class_name, st.stream_name,
                y.year_name, t.term_name, a.assessment_name,
-               sub.subject_id, sub.subject_name, s.Mark,
-               g.grade_letter, g.weight,
+               {SUMMARY_COLUMNS},
                cc.total_class_size, sc.total_stream_size
-        FROM scores s
+        FROM {SUMMARY_TABLE} s
         JOIN pupils p USING (reg_no)
         JOIN classes c ON p.class_id = c.class_id
         JOIN stream st ON p.stream_id = st.stream_id
         JOIN study_year y ON s.year_id = y.year_id
         JOIN terms t ON s.term_id = t.term_id
         JOIN assessment a ON s.assessment_id = a.assessment_id
-        JOIN subjects sub ON s.subject_id = sub.subject_id
-        LEFT JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
         JOIN (
             SELECT class_id, COUNT(*) total_class_size
             FROM pupils GROUP BY class_id
@@ -1546,133 +1349,48 @@ def vd_eot_reports():
     params = [class_id, year_id, term_id] + assessment_names
     cursor.execute(sql, params)
     rows = cursor.fetchall()
-
     core_subjects = ['MTC', 'ENGLISH', 'SST', 'SCIE']
-    grouped = {}
-    subject_names = set()
-    subject_ranks_data = defaultdict(lambda: defaultdict(list))
-
-    for r in rows:
-        key = (r['reg_no'], r['assessment_name'])
-        subject_names.add(r['subject_name'])
-        subject_ranks_data[r['assessment_name']][r['subject_name']].append({
-            'reg_no': r['reg_no'], 'Mark': r['Mark']
-        })
-        if key not in grouped:
-            grouped[key] = {
-                'reg_no': r['reg_no'],
-                'index_number': r['index_number'],
-                'full_name': r['full_name'],
-                'image': r['image'],
-                'class_name': r['class_name'],
-                'stream_name': r['stream_name'],
-                'assessment_name': r['assessment_name'],
-                'marks': {}, 'grades': {}, 'weights': {},
-                'subject_comments': {},
-                'class_teacher': class_teacher,
-                'total_class_size': r['total_class_size'],
-                'total_stream_size': r['total_stream_size'],
-                'stream_id': r['stream_id'],
-                # add sign images once per student
-                'class_teacher_sign_image': class_teacher_sign_image,
-                'headmaster_sign_image': headmaster_sign_image
-            }
-        stu = grouped[key]
-        stu['marks'][r['subject_name']] = r['Mark']
-        stu['grades'][r['subject_name']] = r['grade_letter']
-        stu['weights'][r['subject_name']] = r['weight'] or 0
-
-        # subject_comments fetch
-        if r['Mark'] is not None:
-            cursor.execute("""
-                SELECT sc.comment, u.name_sf
-                FROM subject_comments sc
-                LEFT JOIN users u ON sc.user_id = u.id
-                WHERE sc.subject_id = %s
-                  AND sc.stream_id = %s
-                  AND %s BETWEEN sc.min_score AND sc.max_score
-                ORDER BY sc.updated_at DESC
-                LIMIT 1
-            """, (r['subject_id'], r['stream_id'], r['Mark']))
-            cm = cursor.fetchone()
-            stu['subject_comments'][r['subject_name']] = {
-                'text': cm['comment'] if cm else '',
-                'by': cm['name_sf'] if cm else ''
-            }
+    rows, summaries = summary_score_rows(rows, core_subjects, by_assessment=True)
+    # Comments for every pupil come from a few prefetched tables
+    lookups = ReportLookups(cursor, {r['stream_id'] for r in rows})
+
+    subject_names = {r['subject_name'] for r in rows}
+    subject_ids = {r['subject_name']: r['subject_id'] for r in rows}
+
+    reports_list = compute_term_results(
+        rows,
+        total_subjects=core_subjects,
+        by_assessment=True,
+        strict_aggregate=False,
+        incomplete_last=False,
+        summaries=summaries
+    )
 
-    # rank computation
-    subject_ranks = defaultdict(lambda: defaultdict(dict))
-    for asmt, subjmap in subject_ranks_data.items():
-        for subj, entries in subjmap.items():
-            entries.sort(key=lambda e: -e['Mark'] if e['Mark'] is not None else float('-inf'))
-            prev = None
-            rank = 0
-            for idx, e in enumerate(entries):
-                if e['Mark'] != prev:
-                    rank = idx + 1
-                subject_ranks[asmt][subj][e['reg_no']] = rank
-                prev = e['Mark']
-
-    # build reports_list with aggregates, comments
-    reports_list = []
-    for stu in grouped.values():
-        core = [stu['marks'].get(s) for s in core_subjects if stu['marks'].get(s) is not None]
-        total = sum(core)
-        avg = round(total / len(core), 2) if core else 0
-        agg = sum(stu['weights'].get(s, 0) for s in core_subjects) if core else 0
-
-        cursor.execute("""
-            SELECT division_name FROM division
-            WHERE %s BETWEEN min_score AND max_score LIMIT 1
-        """, (agg,))
-        dv = cursor.fetchone()
-        division = dv['division_name'] if dv else 'N/A'
-
-        # headmaster comment
-        cursor.execute("""
-            SELECT comment FROM headmaster_comments
-            WHERE %s BETWEEN min_score AND max_score
-            ORDER BY updated_at DESC LIMIT 1
-        """, (avg,))
-        ht = cursor.fetchone()
-
-        # class teacher comment
-        cursor.execute("""
-            SELECT cc.comment, u.name_sf
-            FROM classteacher_comments cc
-            LEFT JOIN users u ON cc.user_id = u.id
-            WHERE cc.stream_id = %s
-              AND %s BETWEEN cc.min_score AND cc.max_score
-            ORDER BY cc.updated_at DESC LIMIT 1
-        """, (stu['stream_id'], avg))
-        ctcm = cursor.fetchone()
+    for stu in reports_list:
+        # subject comments, resolved from the prefetched ranges
+        stu['subject_comments'] = {}
+        for subj, mark in stu['marks'].items():
+            if mark is not None:
+                cm = lookups.subject_comment(subject_ids[subj], stu['stream_id'], mark)
+                stu['subject_comments'][subj] = {
+                    'text': cm['comment'] if cm else '',
+                    'by': cm['name_sf'] if cm else ''
+                }
+
+        # headmaster and class teacher comments
+        ht = lookups.headteacher_comment(stu['average_score'])
+        ctcm = lookups.classteacher_comment(stu['stream_id'], stu['average_score'])
 
         stu.update({
-            'total_score': total,
-            'average_score': avg,
-            'aggregate': agg,
-            'division': division,
+            'class_teacher': class_teacher,
+            'class_teacher_sign_image': class_teacher_sign_image,
+            'headmaster_sign_image': headmaster_sign_image,
             'headteacher_comment': ht['comment'] if ht else '',
             'classteacher_comment': ctcm['comment'] if ctcm else '',
-            'classteacher_comment_by': ctcm['name_sf'] if ctcm else '',
-            'subject_ranks': {subj: subject_ranks[stu['assessment_name']].get(subj, {}).get(stu['reg_no'])
-                              for subj in subject_names}
+            'classteacher_comment_by': ctcm['name_sf'] if ctcm else ''
         })
 
-        reports_list.append(stu)
-
-    # assign positions
     reports_list.sort(key=lambda x: (-x['average_score'], x['full_name']))
-    for idx, stu in enumerate(reports_list, 1):
-        stu['class_position'] = idx
-
-    by_stream = defaultdict(list)
-    for stu in reports_list:
-        by_stream[(stu['assessment_name'], stu['stream_name'])].append(stu)
-    for group in by_stream.values():
-        group.sort(key=lambda x: -x['average_score'])
-        for idx, stu in enumerate(group, 1):
-            stu['stream_position'] = idx
 
     cursor.close()
     conn.close()
@@ -1708,20 +1426,11 @@ def vd_eot_reports_2():
     cursor = conn.cursor(dictionary=True)
 
     # Load dropdown data for filters
-    cursor.execute("SELECT * FROM classes WHERE class_id IN (28, 27)")
-    class_list = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM stream")
-    streams = cursor.fetchall()
+    class_list = reference_rows('classes', ids=(28, 27))
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
+    streams = reference_rows('stream')
 
     # Read filter parameters from request
     class_id = request.args.get('class_id', type=int)
@@ -1775,18 +1484,15 @@ def vd_eot_reports_2():
                CONCAT_WS(' ', p.last_name, p.first_name, p.other_name) AS full_name,
                p.image, c.class_name, st.stream_name,
                y.year_name, y.year_id, t.term_name, t.term_id,
-               a.assessment_name, sub.subject_name, s.Mark,
-               g.grade_letter, g.weight,
+               a.assessment_name, {SUMMARY_COLUMNS},
                class_counts.total_class_size, stream_counts.total_stream_size
-        FROM scores s
+        FROM {SUMMARY_TABLE} s
         JOIN pupils p USING (reg_no)
         JOIN classes c ON p.class_id = c.class_id
         JOIN stream st ON p.stream_id = st.stream_id
         JOIN study_year y ON s.year_id = y.year_id
         JOIN terms t ON s.term_id = t.term_id
         JOIN assessment a ON s.assessment_id = a.assessment_id
-        JOIN subjects sub ON s.subject_id = sub.subject_id
-        LEFT JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
         JOIN (SELECT class_id, COUNT(*) AS total_class_size FROM pupils GROUP BY class_id) class_counts
           ON class_counts.class_id = p.class_id
         JOIN (SELECT class_id, stream_id, COUNT(*) AS total_stream_size FROM pupils GROUP BY class_id, stream_id) stream_counts
@@ -1798,129 +1504,20 @@ def vd_eot_reports_2():
     class_params = [class_id, year_id, term_id] + assessment_name_list
     cursor.execute(class_query, class_params)
     class_rows = cursor.fetchall()
-
-    # Group data by student and assessment
-    class_grouped = {}
-    subject_names = set()
-    subject_rankings = defaultdict(lambda: defaultdict(list))
-
-    for row in class_rows:
-        key = (row['reg_no'], row['assessment_name'])
-        subject_names.add(row['subject_name'])
-
-        # Collect marks for ranking calculation
-        subject_rankings[row['assessment_name']][row['subject_name']].append({
-            'reg_no': row['reg_no'],
-            'Mark': int(row['Mark']) if row['Mark'] is not None else None
-        })
-
-        if key not in class_grouped:
-            class_grouped[key] = {
-                'reg_no': row['reg_no'],
-                'index_number': row['index_number'],
-                'full_name': row['full_name'],
-                'image': row['image'],
-                'class_id': row['class_id'],
-                'stream_id': row['stream_id'],
-                'class_name': row['class_name'],
-                'stream_name': row['stream_name'],
-                'year_id': row['year_id'],
-                'term_id': row['term_id'],
-                'year_name': row['year_name'],
-                'term_name': row['term_name'],
-                'assessment_name': row['assessment_name'],
-                'marks': {},
-                'grades': {},
-                'weights': {},
-                'total_class_size': row['total_class_size'],
-                'total_stream_size': row['total_stream_size']
-            }
-
-        student = class_grouped[key]
-        student['marks'][row['subject_name']] = int(row['Mark']) if row['Mark'] is not None else None
-        student['grades'][row['subject_name']] = row['grade_letter'] or ''
-        student['weights'][row['subject_name']] = row['weight'] or 0
-
-    # Compute subject ranks per assessment and subject
-    subject_ranks = defaultdict(lambda: defaultdict(dict))
-    for assessment, subjects in subject_rankings.items():
-        for subject, entries in subjects.items():
-            # Sort descending by mark (None marks go last)
-            entries.sort(key=lambda x: -x['Mark'] if x['Mark'] is not None else float('-inf'))
-            prev_mark, prev_rank = None, 0
-            for idx, entry in enumerate(entries):
-                if entry['Mark'] != prev_mark:
-                    prev_rank = idx + 1
-                subject_ranks[assessment][subject][entry['reg_no']] = prev_rank
-                prev_mark = entry['Mark']
-
-    # Calculate totals, averages, aggregates, divisions, and ranks for each student
-    for student in class_grouped.values():
-        # Total and average of selected subjects
-        total_marks = [student['marks'].get(sub) for sub in total_avg_subjects if student['marks'].get(sub) is not None]
-        total_score = sum(total_marks)
-        avg_score = round(total_score / len(total_marks), 2) if total_marks else 0
-
-        # Aggregate and division from core subjects
-        core_marks = [student['marks'].get(sub) for sub in aggregate_subjects]
-        if any(mark is None for mark in core_marks):
-            agg = 'X'
-            division = 'X'
-        else:
-            core_weights = [student['weights'].get(sub, 0) for sub in aggregate_subjects]
-            agg = sum(core_weights)
-            cursor.execute(
-                "SELECT division_name FROM division WHERE %s BETWEEN min_score AND max_score LIMIT 1",
-                (agg,)
-            )
-            div_row = cursor.fetchone()
-            division = div_row['division_name'] if div_row else 'N/A'
-
-        # Get subject ranks for this student
-        ranks = {}
-        for subject in subject_names:
-            ranks[subject] = subject_ranks[student['assessment_name']][subject].get(student['reg_no'])
-
-        # Update student record
-        student.update({
-            'total_score': total_score,
-            'average_score': avg_score,
-            'aggregate': agg,
-            'division': division,
-            'subject_ranks': ranks
-        })
-
-    # Calculate class positions based on average_score
-    assessment_groups_class = defaultdict(list)
-    for student in class_grouped.values():
-        assessment_groups_class[student['assessment_name']].append(student)
-
-    for group in assessment_groups_class.values():
-        group.sort(key=lambda x: -x['average_score'] if isinstance(x['average_score'], (int, float)) else float('-inf'))
-        prev_score, prev_position = None, 0
-        for idx, rpt in enumerate(group):
-            if rpt['average_score'] != prev_score:
-                prev_position = idx + 1
-            rpt['class_position'] = prev_position
-            prev_score = rpt['average_score']
-
-    # Calculate stream positions based on average_score within streams
-    assessment_groups_stream = defaultdict(list)
-    for rpt in class_grouped.values():
-        assessment_groups_stream[rpt['assessment_name']].append(rpt)
-
-    for group in assessment_groups_stream.values():
-        streams_group = defaultdict(list)
-        for rpt in group:
-            streams_group[rpt['stream_id']].append(rpt)
-        for sgroup in streams_group.values():
-            sgroup.sort(key=lambda x: -x['average_score'] if isinstance(x['average_score'], (int, float)) else float('-inf'))
-            prev_score, prev_position = None, 0
-            for idx, rpt in enumerate(sgroup):
-                if rpt['average_score'] != prev_score:
-                    prev_position = idx + 1
-                rpt['stream_position'] = prev_position
-                prev_score = rpt['average_score']
+    class_rows, summaries = summary_score_rows(
+        class_rows, total_avg_subjects, aggregate_subjects, by_assessment=True
+    )
+    subject_names = {row['subject_name'] for row in class_rows}
+
+    # Totals, aggregates, divisions and ranks per student and assessment
+    reports = compute_term_results(
+        class_rows,
+        total_subjects=total_avg_subjects,
+        aggregate_subjects=aggregate_subjects,
+        by_assessment=True,
+        incomplete_last=False,
+        summaries=summaries
+    )
 
     # Close DB connections
     cursor.close()
@@ -1929,7 +1526,7 @@ def vd_eot_reports_2():
     # Render the template with all data including the class teacher
     return render_template(
         'eot_reports/vd_eot_reports_2.html',
-        eot_reports=list(class_grouped.values()),
+        eot_reports=reports,
         subject_names=sorted(subject_names),
         class_list=class_list,
         study_years=study_years,
@@ -1959,16 +1556,11 @@ def scores_positions_eot_reports_2():
     cursor = connection.cursor(dictionary=True)
 
     # Load dropdown data
-    cursor.execute("SELECT * FROM classes WHERE class_id IN (28,27)")
-    class_list = cursor.fetchall()
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
-    cursor.execute("SELECT * FROM stream")
-    streams = cursor.fetchall()
+    class_list = reference_rows('classes', ids=(28, 27))
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
+    streams = reference_rows('stream')
 
     # Read filters
     class_id = request.args.get('class_id', type=int)
@@ -2002,26 +1594,21 @@ def scores_positions_eot_reports_2():
     aggregate_subjects = sorted(['MTC', 'ENGLISH', 'LITERACY 1A', 'LITERACY 1B'])  # aggregate & division
 
     # Fetch scores
-    sql = """
+    sql = f"""
         SELECT 
             p.reg_no, p.stream_id, p.class_id,
             CONCAT_WS(' ', p.last_name, p.first_name, p.other_name) AS full_name,
             y.year_name, y.year_id,
             t.term_name, t.term_id,
             a.assessment_name,
-            sub.subject_name,
-            s.Mark,
-            g.grade_letter,
-            g.weight,
+            {SUMMARY_COLUMNS},
             st.stream_name
-        FROM scores s
+        FROM {SUMMARY_TABLE} s
         JOIN pupils p ON s.reg_no = p.reg_no
         JOIN assessment a ON s.assessment_id = a.assessment_id
         JOIN terms t ON s.term_id = t.term_id
         JOIN study_year y ON s.year_id = y.year_id
-        JOIN subjects sub ON s.subject_id = sub.subject_id
         JOIN stream st ON p.stream_id = st.stream_id
-        LEFT JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
         WHERE p.class_id = %s AND s.year_id = %s AND s.term_id = %s AND a.assessment_name = %s
     """
     args = [class_id, year_id, term_id, assessment_name]
@@ -2032,85 +1619,15 @@ def scores_positions_eot_reports_2():
 
     cursor.execute(sql, args)
     rows = cursor.fetchall()
+    rows, summaries = summary_score_rows(rows, total_avg_subjects, aggregate_subjects)
 
     subject_names = sorted({row['subject_name'] for row in rows})
 
-    # Build student map
-    student_map = {}
-    for row in rows:
-        reg_no = row['reg_no']
-        if reg_no not in student_map:
-            student_map[reg_no] = {
-                'reg_no': reg_no,
-                'full_name': row['full_name'],
-                'class_id': row['class_id'],
-                'stream_id': row['stream_id'],
-                'stream_name': row['stream_name'],
-                'year_id': row['year_id'],
-                'term_id': row['term_id'],
-                'year_name': row['year_name'],
-                'term_name': row['term_name'],
-                'assessment_name': row['assessment_name'],
-                'marks': {},
-                'grades': {},
-                'weights': {}
-            }
-        student_map[reg_no]['marks'][row['subject_name']] = row['Mark']
-        student_map[reg_no]['grades'][row['subject_name']] = row['grade_letter'] or ''
-        student_map[reg_no]['weights'][row['subject_name']] = row['weight'] or 0
-
-    # Calculate totals, averages, aggregate, division
-    for student in student_map.values():
-        # --- Total & Average ---
-        total_marks = [student['marks'].get(sub) for sub in total_avg_subjects if student['marks'].get(sub) is not None]
-        total_score = sum(total_marks)
-        avg_score = round(total_score / len(total_marks), 2) if total_marks else 0
-
-        # --- Aggregate & Division ---
-        core_marks = [student['marks'].get(sub) for sub in aggregate_subjects]
-        if any(mark is None for mark in core_marks):
-            aggregate = 'X'
-            division = 'X'
-        else:
-            aggregate = sum(student['weights'].get(sub, 0) for sub in aggregate_subjects)
-            cursor.execute("""
-                SELECT division_name FROM division
-                WHERE %s BETWEEN min_score AND max_score LIMIT 1
-            """, (aggregate,))
-            div_row = cursor.fetchone()
-            division = div_row['division_name'] if div_row else 'N/A'
-
-        student.update({
-            'total_score': total_score,
-            'average_score': avg_score,
-            'aggregate': aggregate,
-            'division': division
-        })
-
-    students = list(student_map.values())
-
-    # Positioning
-    def assign_positions(student_list, pos_key):
-        student_list.sort(key=lambda s: (float('inf') if s['aggregate'] == 'X' else -s['average_score'], s['reg_no']))
-        prev_score, prev_position = None, 0
-        for idx, student in enumerate(student_list, start=1):
-            if student['aggregate'] == 'X':
-                student[pos_key] = idx
-            else:
-                if student['average_score'] != prev_score:
-                    prev_position = idx
-                student[pos_key] = prev_position
-                prev_score = student['average_score']
-
-    assign_positions(students, 'class_position')
-
-    from collections import defaultdict
-    stream_groups = defaultdict(list)
-    for student in students:
-        stream_groups[student['stream_id']].append(student)
-
-    for group in stream_groups.values():
-        assign_positions(group, 'stream_position')
+    students = compute_term_results(
+        rows, total_subjects=total_avg_subjects, aggregate_subjects=aggregate_subjects,
+        summaries=summaries
+    )
+    students.sort(key=lambda s: (s['class_position'], s['reg_no']))
 
     cursor.close()
     connection.close()
@@ -2146,16 +1663,11 @@ def vd_eot_reports_3():
     cursor = conn.cursor(dictionary=True)
 
     # Load dropdown data
-    cursor.execute("SELECT * FROM classes WHERE class_id IN (29)")
-    class_list = cursor.fetchall()
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
-    cursor.execute("SELECT * FROM stream")
-    streams = cursor.fetchall()
+    class_list = reference_rows('classes', ids=(29,))
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
+    streams = reference_rows('stream')
 
     # Read filters
     class_id = request.args.get('class_id', type=int)
@@ -2188,18 +1700,15 @@ def vd_eot_reports_3():
                CONCAT_WS(' ', p.last_name, p.first_name, p.other_name) AS full_name,
                p.image, c.class_name, st.stream_name,
                y.year_name, y.year_id, t.term_name, t.term_id,
-               a.assessment_name, sub.subject_name, s.Mark,
-               g.grade_letter, g.weight,
+               a.assessment_name, {SUMMARY_COLUMNS},
                class_counts.total_class_size, stream_counts.total_stream_size
-        FROM scores s
+        FROM {SUMMARY_TABLE} s
         JOIN pupils p USING (reg_no)
         JOIN classes c ON p.class_id = c.class_id
         JOIN stream st ON p.stream_id = st.stream_id
         JOIN study_year y ON s.year_id = y.year_id
         JOIN terms t ON s.term_id = t.term_id
         JOIN assessment a ON s.assessment_id = a.assessment_id
-        JOIN subjects sub ON s.subject_id = sub.subject_id
-        LEFT JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
         JOIN (SELECT class_id, COUNT(*) AS total_class_size FROM pupils GROUP BY class_id) class_counts
           ON class_counts.class_id = p.class_id
         JOIN (SELECT class_id, stream_id, COUNT(*) AS total_stream_size FROM pupils GROUP BY class_id, stream_id) stream_counts
@@ -2211,120 +1720,26 @@ def vd_eot_reports_3():
     class_params = [class_id, year_id, term_id] + assessment_name_list
     cursor.execute(class_query, class_params)
     class_rows = cursor.fetchall()
-
-    class_grouped = {}
-    subject_names = set()
-    subject_rankings = defaultdict(lambda: defaultdict(list))
-
-    for row in class_rows:
-        key = (row['reg_no'], row['assessment_name'])
-        subject_names.add(row['subject_name'])
-
-        subject_rankings[row['assessment_name']][row['subject_name']].append({
-            'reg_no': row['reg_no'],
-            'Mark': int(row['Mark']) if row['Mark'] is not None else None
-        })
-
-        if key not in class_grouped:
-            class_grouped[key] = {
-                'reg_no': row['reg_no'], 'index_number': row['index_number'],
-                'full_name': row['full_name'], 'image': row['image'],
-                'class_id': row['class_id'], 'stream_id': row['stream_id'],
-                'class_name': row['class_name'], 'stream_name': row['stream_name'],
-                'year_id': row['year_id'], 'term_id': row['term_id'],
-                'year_name': row['year_name'], 'term_name': row['term_name'],
-                'assessment_name': row['assessment_name'],
-                'marks': {}, 'grades': {}, 'weights': {},
-                'total_class_size': row['total_class_size'],
-                'total_stream_size': row['total_stream_size']
-            }
-
-        student = class_grouped[key]
-        student['marks'][row['subject_name']] = int(row['Mark']) if row['Mark'] is not None else None
-        student['grades'][row['subject_name']] = row['grade_letter'] or ''
-        student['weights'][row['subject_name']] = row['weight'] or 0
-
-    # Compute subject ranks
-    subject_ranks = defaultdict(lambda: defaultdict(dict))
-    for assessment, subjects in subject_rankings.items():
-        for subject, entries in subjects.items():
-            entries.sort(key=lambda x: -x['Mark'] if x['Mark'] is not None else float('-inf'))
-            prev_mark, prev_rank = None, 0
-            for idx, entry in enumerate(entries):
-                if entry['Mark'] != prev_mark:
-                    prev_rank = idx + 1
-                subject_ranks[assessment][subject][entry['reg_no']] = prev_rank
-                prev_mark = entry['Mark']
-
-    for student in class_grouped.values():
-        # Total & average from total_avg_subjects
-        total_marks = [student['marks'].get(sub) for sub in total_avg_subjects if student['marks'].get(sub) is not None]
-        total_score = sum(total_marks)
-        avg_score = round(total_score / len(total_marks), 2) if total_marks else 0
-
-        # Aggregate & Division from aggregate_subjects
-        core_marks = [student['marks'].get(sub) for sub in aggregate_subjects]
-        if any(mark is None for mark in core_marks):
-            agg = 'X'
-            division = 'X'
-        else:
-            core_weights = [student['weights'].get(sub, 0) for sub in aggregate_subjects]
-            agg = sum(core_weights)
-            cursor.execute("SELECT division_name FROM division WHERE %s BETWEEN min_score AND max_score LIMIT 1", (agg,))
-            div_row = cursor.fetchone()
-            division = div_row['division_name'] if div_row else 'N/A'
-
-        # Subject ranks
-        ranks = {}
-        for subject in subject_names:
-            rank = subject_ranks[student['assessment_name']][subject].get(student['reg_no'])
-            ranks[subject] = rank
-
-        student.update({
-            'total_score': total_score,
-            'average_score': avg_score,
-            'aggregate': agg,
-            'division': division,
-            'subject_ranks': ranks
-        })
-
-    # Class positions
-    assessment_groups_class = defaultdict(list)
-    for student in class_grouped.values():
-        assessment_groups_class[student['assessment_name']].append(student)
-
-    for group in assessment_groups_class.values():
-        group.sort(key=lambda x: -x['average_score'] if isinstance(x['average_score'], (int, float)) else float('-inf'))
-        prev_score, prev_position = None, 0
-        for idx, rpt in enumerate(group):
-            if rpt['average_score'] != prev_score:
-                prev_position = idx + 1
-            rpt['class_position'] = prev_position
-            prev_score = rpt['average_score']
-
-    # Stream positions
-    assessment_groups_stream = defaultdict(list)
-    for rpt in class_grouped.values():
-        assessment_groups_stream[rpt['assessment_name']].append(rpt)
-
-    for group in assessment_groups_stream.values():
-        streams_group = defaultdict(list)
-        for rpt in group:
-            streams_group[rpt['stream_id']].append(rpt)
-        for sgroup in streams_group.values():
-            sgroup.sort(key=lambda x: -x['average_score'] if isinstance(x['average_score'], (int, float)) else float('-inf'))
-            prev_score, prev_position = None, 0
-            for idx, rpt in enumerate(sgroup):
-                if rpt['average_score'] != prev_score:
-                    prev_position = idx + 1
-                rpt['stream_position'] = prev_position
-                prev_score = rpt['average_score']
+    class_rows, summaries = summary_score_rows(
+        class_rows, total_avg_subjects, aggregate_subjects, by_assessment=True
+    )
+    subject_names = {row['subject_name'] for row in class_rows}
+
+    # Totals, aggregates, divisions and ranks per student and assessment
+    reports = compute_term_results(
+        class_rows,
+        total_subjects=total_avg_subjects,
+        aggregate_subjects=aggregate_subjects,
+        by_assessment=True,
+        incomplete_last=False,
+        summaries=summaries
+    )
 
     cursor.close()
     conn.close()
 
     return render_template('eot_reports/vd_eot_reports_3.html',
-        eot_reports=list(class_grouped.values()),
+        eot_reports=reports,
         subject_names=sorted(subject_names),
         class_list=class_list, study_years=study_years,
         terms=terms, assessments=assessments, streams=streams,
@@ -2350,16 +1765,11 @@ def scores_positions_eot_reports_3():
     cursor = connection.cursor(dictionary=True)
 
     # Load dropdown data
-    cursor.execute("SELECT * FROM classes WHERE class_id IN (29)")
-    class_list = cursor.fetchall()
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
-    cursor.execute("SELECT * FROM stream")
-    streams = cursor.fetchall()
+    class_list = reference_rows('classes', ids=(29,))
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
+    streams = reference_rows('stream')
 
     # Read filters
     class_id = request.args.get('class_id', type=int)
@@ -2393,26 +1803,21 @@ def scores_positions_eot_reports_3():
     aggregate_subjects = sorted(['MTC', 'ENGLISH', 'LITERACY 1A', 'LITERACY 1B'])  # aggregate & division
 
     # Fetch scores
-    sql = """
+    sql = f"""
         SELECT 
             p.reg_no, p.stream_id, p.class_id,
             CONCAT_WS(' ', p.last_name, p.first_name, p.other_name) AS full_name,
             y.year_name, y.year_id,
             t.term_name, t.term_id,
             a.assessment_name,
-            sub.subject_name,
-            s.Mark,
-            g.grade_letter,
-            g.weight,
+            {SUMMARY_COLUMNS},
             st.stream_name
-        FROM scores s
+        FROM {SUMMARY_TABLE} s
         JOIN pupils p ON s.reg_no = p.reg_no
         JOIN assessment a ON s.assessment_id = a.assessment_id
         JOIN terms t ON s.term_id = t.term_id
         JOIN study_year y ON s.year_id = y.year_id
-        JOIN subjects sub ON s.subject_id = sub.subject_id
         JOIN stream st ON p.stream_id = st.stream_id
-        LEFT JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
         WHERE p.class_id = %s AND s.year_id = %s AND s.term_id = %s AND a.assessment_name = %s
     """
     args = [class_id, year_id, term_id, assessment_name]
@@ -2423,85 +1828,15 @@ def scores_positions_eot_reports_3():
 
     cursor.execute(sql, args)
     rows = cursor.fetchall()
+    rows, summaries = summary_score_rows(rows, total_avg_subjects, aggregate_subjects)
 
     subject_names = sorted({row['subject_name'] for row in rows})
 
-    # Build student map
-    student_map = {}
-    for row in rows:
-        reg_no = row['reg_no']
-        if reg_no not in student_map:
-            student_map[reg_no] = {
-                'reg_no': reg_no,
-                'full_name': row['full_name'],
-                'class_id': row['class_id'],
-                'stream_id': row['stream_id'],
-                'stream_name': row['stream_name'],
-                'year_id': row['year_id'],
-                'term_id': row['term_id'],
-                'year_name': row['year_name'],
-                'term_name': row['term_name'],
-                'assessment_name': row['assessment_name'],
-                'marks': {},
-                'grades': {},
-                'weights': {}
-            }
-        student_map[reg_no]['marks'][row['subject_name']] = row['Mark']
-        student_map[reg_no]['grades'][row['subject_name']] = row['grade_letter'] or ''
-        student_map[reg_no]['weights'][row['subject_name']] = row['weight'] or 0
-
-    # Calculate totals, averages, aggregate, division
-    for student in student_map.values():
-        # --- Total & Average ---
-        total_marks = [student['marks'].get(sub) for sub in total_avg_subjects if student['marks'].get(sub) is not None]
-        total_score = sum(total_marks)
-        avg_score = round(total_score / len(total_marks), 2) if total_marks else 0
-
-        # --- Aggregate & Division ---
-        core_marks = [student['marks'].get(sub) for sub in aggregate_subjects]
-        if any(mark is None for mark in core_marks):
-            aggregate = 'X'
-            division = 'X'
-        else:
-            aggregate = sum(student['weights'].get(sub, 0) for sub in aggregate_subjects)
-            cursor.execute("""
-                SELECT division_name FROM division
-                WHERE %s BETWEEN min_score AND max_score LIMIT 1
-            """, (aggregate,))
-            div_row = cursor.fetchone()
-            division = div_row['division_name'] if div_row else 'N/A'
-
-        student.update({
-            'total_score': total_score,
-            'average_score': avg_score,
-            'aggregate': aggregate,
-            'division': division
-        })
-
-    students = list(student_map.values())
-
-    # Positioning
-    def assign_positions(student_list, pos_key):
-        student_list.sort(key=lambda s: (float('inf') if s['aggregate'] == 'X' else -s['average_score'], s['reg_no']))
-        prev_score, prev_position = None, 0
-        for idx, student in enumerate(student_list, start=1):
-            if student['aggregate'] == 'X':
-                student[pos_key] = idx
-            else:
-                if student['average_score'] != prev_score:
-                    prev_position = idx
-                student[pos_key] = prev_position
-                prev_score = student['average_score']
-
-    assign_positions(students, 'class_position')
-
-    from collections import defaultdict
-    stream_groups = defaultdict(list)
-    for student in students:
-        stream_groups[student['stream_id']].append(student)
-
-    for group in stream_groups.values():
-        assign_positions(group, 'stream_position')
+    students = compute_term_results(
+        rows, total_subjects=total_avg_subjects, aggregate_subjects=aggregate_subjects,
+        summaries=summaries
+    )
+    students.sort(key=lambda s: (s['class_position'], s['reg_no']))
 
     cursor.close()
     connection.close()
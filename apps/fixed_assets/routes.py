@@ -6,6 +6,7 @@ from werkzeug.utils import secure_filename
 from mysql.connector import Error
 from apps import get_db_connection
 from apps.fixed_assets import blueprint
+from apps.pagination import SortKey, keyset_page
 import mysql.connector
 from datetime import datetime 
 
@@ -29,6 +30,26 @@ def allowed_file(filename):
 
 
 
+ASSET_SELECT = """
+    fa.*,
+    d.name AS department_name,
+    s.name AS section_name,
+    CONCAT(u.first_name, ' ', u.last_name) AS user_name
+"""
+
+ASSET_FROM = """
+    FROM fixed_assets fa
+    LEFT JOIN departments d ON fa.department_id = d.department_id
+    LEFT JOIN sections s ON fa.section_id = s.section_id
+    LEFT JOIN users u ON fa.user_id = u.id
+"""
+
+ASSET_SORTS = {
+    'description': SortKey('Description', ['fa.AssetDescription', 'fa.AssetID']),
+    'newest': SortKey('Added', ['fa.AssetID']),
+}
+
+
 @blueprint.route('/fixed_assets')
 def fixed_assets():
     """Render the Fixed Assets page with optional filters for department, section, and other fields."""
@@ -45,20 +66,6 @@ def fixed_assets():
         ownership_status = request.args.get('ownership_status', '').strip()
         asset_condition = request.args.get('asset_condition', '').strip()
 
-        # --- Base Query with joins ---
-        query = """
-            SELECT 
-                fa.*,
-                d.name AS department_name,
-                s.name AS section_name,
-                CONCAT(u.first_name, ' ', u.last_name) AS user_name
-            FROM fixed_assets fa
-            LEFT JOIN departments d ON fa.department_id = d.department_id
-            LEFT JOIN sections s ON fa.section_id = s.section_id
-            LEFT JOIN users u ON fa.user_id = u.id
-            WHERE 1=1
-        """
-
         # --- Apply filters dynamically ---
         filters = []
         params = {}
@@ -85,14 +92,10 @@ def fixed_assets():
             filters.append("fa.AssetCondition = %(asset_condition)s")
             params["asset_condition"] = asset_condition
 
-        if filters:
-            query += " AND " + " AND ".join(filters)
-
-        query += " ORDER BY fa.AssetDescription"
-
-        # --- Execute query ---
-        cursor.execute(query, params)
-        assets = cursor.fetchall()
+        # --- One page of the filtered assets ---
+        page = keyset_page(cursor, 'fixed_assets', ASSET_SELECT, ASSET_FROM, filters, params,
+                           ASSET_SORTS, 'description', count_table='fixed_assets')
+        assets = page['rows']
 
         # --- Lookup data for dropdowns ---
         cursor.execute("SELECT department_id, name FROM departments ORDER BY name")
@@ -118,6 +121,7 @@ def fixed_assets():
     return render_template(
         'fixed_assets/fixed_assets.html',
         assets=assets,
+        page=page,
         departments=departments,
         sections=sections,
         users=users,  # updated variable
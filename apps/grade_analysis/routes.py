@@ -9,6 +9,14 @@ import random
 import logging
 import re  # <-- Add this line
 from apps import get_db_connection
+from apps.audit_log import log_select
+from apps.reference_data import reference_rows
+from apps.grading import attach_grades, ordered_grade_letters
+from apps.results_engine import compute_term_results
+from apps.rankings import pupil_positions
+from apps.report_cards import build_term_card
+from apps.summaries import SUMMARY_COLUMNS, SUMMARY_TABLE, refresh_summaries, summary_score_rows
+from apps.report_cache import cached_report, invalidate_reports
 from jinja2 import TemplateNotFound
 import numpy as np 
 
@@ -24,26 +32,12 @@ def grade_analysis():
     cursor = connection.cursor(dictionary=True)
 
     # Fetch dropdown filter data
-    cursor.execute("SELECT * FROM classes")
-    class_list = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM subjects")
-    subjects = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM stream")
-    streams = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM pupils")
-    pupils = cursor.fetchall()
+    class_list = reference_rows('classes')
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
+    subjects = reference_rows('subjects')
+    streams = reference_rows('stream')
 
     # Retrieve query parameters
     class_id = request.args.get('class_id', type=int)
@@ -78,7 +72,6 @@ def grade_analysis():
             subjects=subjects,
             assessments=assessments,
             streams=streams,
-            pupils=pupils,
             selected_class_id=None,
             selected_study_year_id=None,
             selected_term_id=None,
@@ -154,7 +147,6 @@ def grade_analysis():
         subjects=subjects,
         assessments=assessments,
         streams=streams,
-        pupils=pupils,
         selected_class_id=class_id,
         selected_study_year_id=year_id,
         selected_term_id=term_id,
@@ -184,6 +176,11 @@ def get_kampala_time():
     kampala = pytz.timezone("Africa/Kampala")
     return datetime.now(kampala)
 
+DELETE_LOG_COLUMNS = [
+    'score_id', 'user_id', 'reg_no', 'class_id', 'stream_id', 'term_id', 'year_id',
+    'assessment_id', 'subject_id', 'Mark', 'notes', 'deleted_at'
+]
+
 @blueprint.route('/delete_scores', methods=['POST'])
 def delete_scores():
     """Deletes selected scores and logs them with optional notes."""
@@ -207,26 +204,22 @@ def delete_scores():
         cursor.execute(f"SELECT * FROM scores WHERE score_id IN ({format_strings})", score_ids)
         rows_to_log = cursor.fetchall()
 
-        # Prepare insert query for logs (includes notes and deleted_at)
-        log_query = """
-            INSERT INTO scores_del_logs
-            (score_id, user_id, reg_no, class_id, stream_id, term_id, year_id, assessment_id, subject_id, Mark, notes, deleted_at)
-            VALUES (%(score_id)s, %(user_id)s, %(reg_no)s, %(class_id)s, %(stream_id)s, %(term_id)s, %(year_id)s,
-                    %(assessment_id)s, %(subject_id)s, %(Mark)s, %(notes)s, %(deleted_at)s)
-        """
-
-        kampala_time = get_kampala_time()
-
-        # Insert each deleted row into the logs table with your deletion notes
-        for row in rows_to_log:
-            row['deleted_at'] = kampala_time
-            # Use deletion notes from form; if none provided, fallback to existing notes or NULL
-            row['notes'] = deletion_notes if deletion_notes else row.get('notes', None)
-            cursor.execute(log_query, row)
+        # Copy the rows into the logs in one statement, with the deletion notes
+        # from the form or, if none were given, the score's own notes
+        log_select(cursor, 'scores_del_logs', DELETE_LOG_COLUMNS, f"""
+            SELECT score_id, user_id, reg_no, class_id, stream_id, term_id, year_id,
+                   assessment_id, subject_id, Mark, COALESCE(%s, notes), %s
+            FROM scores WHERE score_id IN ({format_strings})
+        """, [deletion_notes or None, get_kampala_time()] + score_ids)
 
         # Now delete from scores table
         cursor.execute(f"DELETE FROM scores WHERE score_id IN ({format_strings})", score_ids)
 
+        refresh_summaries(connection, {
+            (row['reg_no'], row['year_id'], row['term_id'], row['assessment_id'])
+            for row in rows_to_log
+        })
+        invalidate_reports({(row['class_id'], row['year_id'], row['term_id']) for row in rows_to_log})
         connection.commit()
 
         flash(f"{cursor.rowcount} score(s) deleted and logged successfully.", 'success')
@@ -345,17 +338,10 @@ def term_grade_analysis():
     cursor = connection.cursor(dictionary=True)
 
     # Fetch dropdowns
-    cursor.execute("SELECT * FROM classes")
-    class_list = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
+    class_list = reference_rows('classes')
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
 
     # Filters
     class_id = request.args.get('class_id', type=int)
@@ -396,8 +382,6 @@ def term_grade_analysis():
         a.assessment_name,
         sub.subject_name,
         s.Mark,
-        g.grade_letter,
-        g.remark,
         p.pupil_id,
         y.year_name
     FROM 
@@ -407,7 +391,6 @@ def term_grade_analysis():
     JOIN terms t ON s.term_id = t.term_id
     JOIN subjects sub ON s.subject_id = sub.subject_id
     JOIN study_year y ON s.year_id = y.year_id
-    JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
     WHERE 1=1
     """
 
@@ -427,6 +410,7 @@ def term_grade_analysis():
 
     cursor.execute(query, params)
     raw_data = cursor.fetchall()
+    raw_data = attach_grades(raw_data, drop_ungraded=True)
 
     # Identify only used subjects
     subject_names = sorted(set(row['subject_name'] for row in raw_data))
@@ -484,14 +468,10 @@ def scores_grade_analysis():
     cursor = connection.cursor(dictionary=True)
 
     # Load dropdowns
-    cursor.execute("SELECT * FROM classes")
-    class_list = cursor.fetchall()
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
+    class_list = reference_rows('classes')
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
 
     # Get filters
     class_id = request.args.get('class_id', type=int)
@@ -523,16 +503,13 @@ def scores_grade_analysis():
         t.term_name,
         a.assessment_name,
         sub.subject_name,
-        s.Mark,
-        g.grade_letter,
-        g.remark
+        s.Mark
     FROM scores s
     JOIN pupils p ON s.reg_no = p.reg_no
     JOIN assessment a ON s.assessment_id = a.assessment_id
     JOIN terms t ON s.term_id = t.term_id
     JOIN subjects sub ON s.subject_id = sub.subject_id
     JOIN study_year y ON s.year_id = y.year_id
-    LEFT JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
     WHERE 1=1
     """
     params = []
@@ -554,44 +531,10 @@ def scores_grade_analysis():
     cursor.close()
     connection.close()
 
-    # Process and pivot using NumPy
     subject_names = sorted({row['subject_name'] for row in raw_data})
-    student_map = {}
-
-    for row in raw_data:
-        reg = row['reg_no']
-        if reg not in student_map:
-            student_map[reg] = {
-                'reg_no': reg,
-                'full_name': row['full_name'],
-                'year_name': row['year_name'],
-                'term_name': row['term_name'],
-                'assessment_name': row['assessment_name'],
-                'marks': {},
-                'grades': {},
-                'remarks': {}
-            }
-        subject = row['subject_name']
-        mark = row['Mark']
-
-        student_map[reg]['marks'][subject] = mark if mark is not None else np.nan
-        student_map[reg]['grades'][subject] = row['grade_letter'] or ''
-        student_map[reg]['remarks'][subject] = row['remark'] or ''
-
-    # Calculate total and average using NumPy
-    grade_analysis = []
-    for student in student_map.values():
-        marks_array = np.array([
-            student['marks'].get(subject, np.nan) for subject in subject_names
-        ], dtype=np.float64)
-
-        total = np.nansum(marks_array)
-        count = np.count_nonzero(~np.isnan(marks_array))
-        avg = np.round(total / count, 2) if count > 0 else 0
 
-        student['total_score'] = total
-        student['average_score'] = avg
-        grade_analysis.append(student)
+    # Totals and averages over the subjects each pupil sat
+    grade_analysis = compute_term_results(raw_data, strict_aggregate=False, incomplete_last=False)
 
     return render_template('grade_analysis/scores_grade_analysis.html',
         grade_analysis=grade_analysis, subject_names=subject_names,
@@ -625,14 +568,10 @@ def scores_positions_grade_analysis_remarks():
     cursor = connection.cursor(dictionary=True)
 
     # Load dropdown options
-    cursor.execute("SELECT * FROM classes")
-    class_list = cursor.fetchall()
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
+    class_list = reference_rows('classes')
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
 
     # Get filter parameters
     class_id = request.args.get('class_id', type=int)
@@ -658,103 +597,20 @@ def scores_positions_grade_analysis_remarks():
             t.term_name, t.term_id,
             a.assessment_name,
             sub.subject_name,
-            s.Mark,
-            g.grade_letter,
-            g.remark,
-            g.weight
+            s.Mark
         FROM scores s
         JOIN pupils p ON s.reg_no = p.reg_no
         JOIN assessment a ON s.assessment_id = a.assessment_id
         JOIN terms t ON s.term_id = t.term_id
         JOIN study_year y ON s.year_id = y.year_id
         JOIN subjects sub ON s.subject_id = sub.subject_id
-        LEFT JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
         WHERE p.class_id = %s AND s.year_id = %s AND s.term_id = %s AND a.assessment_name = %s
     """, (class_id, year_id, term_id, assessment_name))
     rows = cursor.fetchall()
-
     subject_names = sorted({row['subject_name'] for row in rows})
 
-    # Organize by student
-    student_map = {}
-    for row in rows:
-        reg_no = row['reg_no']
-        if reg_no not in student_map:
-            student_map[reg_no] = {
-                'reg_no': reg_no,
-                'full_name': row['full_name'],
-                'class_id': row['class_id'],
-                'stream_id': row['stream_id'],
-                'year_id': row['year_id'],
-                'term_id': row['term_id'],
-                'year_name': row['year_name'],
-                'term_name': row['term_name'],
-                'assessment_name': row['assessment_name'],
-                'marks': {},
-                'grades': {},
-                'remarks': {},
-                'weights': {}
-            }
-        student_map[reg_no]['marks'][row['subject_name']] = row['Mark'] if row['Mark'] is not None else float('nan')
-        student_map[reg_no]['grades'][row['subject_name']] = row['grade_letter'] or ''
-        student_map[reg_no]['remarks'][row['subject_name']] = row['remark'] or ''
-        student_map[reg_no]['weights'][row['subject_name']] = row['weight'] or 0
-
-    # Compute totals, averages, aggregates, and lookup division
-    grade_analysis = []
-    for student in student_map.values():
-        marks = np.array([student['marks'].get(sub, float('nan')) for sub in subject_names], dtype=np.float64)
-        weights = [student['weights'].get(sub, 0) for sub in subject_names]
-
-        total_score = np.nansum(marks)
-        count = np.count_nonzero(~np.isnan(marks))
-        average_score = round(total_score / count, 2) if count else 0
-        aggregate = sum(weights)
-
-        # Look up division based on aggregate
-        cursor.execute("""
-            SELECT division_name FROM division
-            WHERE %s BETWEEN min_score AND max_score
-            LIMIT 1
-        """, (aggregate,))
-        division_row = cursor.fetchone()
-        division_name = division_row['division_name'] if division_row else 'N/A'
-
-        student['total_score'] = total_score
-        student['average_score'] = average_score
-        student['aggregate'] = aggregate
-        student['division'] = division_name
-        grade_analysis.append(student)
-
-    # Rank students by average (stream and class)
-    for student in grade_analysis:
-        reg_no = student['reg_no']
-        stream_id = student['stream_id']
-        class_id = student['class_id']
-        term_id = student['term_id']
-        year_id = student['year_id']
-
-        # Stream position based on average
-        cursor.execute("""
-            SELECT p.reg_no, AVG(s.Mark) AS avg
-            FROM scores s
-            JOIN pupils p ON s.reg_no = p.reg_no
-            WHERE p.stream_id = %s AND s.term_id = %s AND s.year_id = %s
-            GROUP BY p.reg_no ORDER BY avg DESC
-        """, (stream_id, term_id, year_id))
-        stream_ranks = cursor.fetchall()
-        student['stream_position'] = next((i + 1 for i, r in enumerate(stream_ranks) if r['reg_no'] == reg_no), None)
-
-        # Class position based on average
-        cursor.execute("""
-            SELECT p.reg_no, AVG(s.Mark) AS avg
-            FROM scores s
-            JOIN pupils p ON s.reg_no = p.reg_no
-            WHERE p.class_id = %s AND s.term_id = %s AND s.year_id = %s
-            GROUP BY p.reg_no ORDER BY avg DESC
-        """, (class_id, term_id, year_id))
-        class_ranks = cursor.fetchall()
-        student['class_position'] = next((i + 1 for i, r in enumerate(class_ranks) if r['reg_no'] == reg_no), None)
+    # Totals, aggregates, divisions and stream/class positions by average
+    grade_analysis = compute_term_results(rows, strict_aggregate=False, incomplete_last=False)
 
     cursor.close()
     connection.close()
@@ -793,17 +649,10 @@ def assessment_report():
     cursor = connection.cursor(dictionary=True)
 
     # Load dropdown data
-    cursor.execute("SELECT * FROM classes")
-    class_list = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
+    class_list = reference_rows('classes')
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
 
     # Get filters from request
     class_id = request.args.get('class_id', type=int)
@@ -966,16 +815,6 @@ def term_report_card(reg_no):
     if not pupil:
         return "Pupil not found", 404
 
-    # Load grade scale
-    cursor.execute("SELECT * FROM grades ORDER BY weight")
-    grade_scale = cursor.fetchall()
-
-    def get_grade(score):
-        for g in grade_scale:
-            if g['min_score'] <= score <= g['max_score']:
-                return g['grade_letter'], g['remark']
-        return '-', '-'
-
     # Get all scores
     cursor.execute("""
         SELECT a.assessment_name, sub.subject_name, s.Mark
@@ -987,88 +826,16 @@ def term_report_card(reg_no):
     """, (reg_no,))
     results = cursor.fetchall()
 
-    # Process assessment data
-    subject_scores = {}
-    assessment_names = set()
-
-    for row in results:
-        subject = row['subject_name']
-        assess = row['assessment_name']
-        mark = float(row['Mark']) if row['Mark'] is not None else None
-        assessment_names.add(assess)
-
-        if subject not in subject_scores:
-            subject_scores[subject] = {}
-        subject_scores[subject][assess] = mark
-
-    assessment_list = sorted(assessment_names)
-
-    subjects_data = []
-    overall_total = 0
-    subject_count = 0
-
-    for subject, scores in subject_scores.items():
-        total = sum([m for m in scores.values() if m is not None])
-        count = sum([1 for m in scores.values() if m is not None])
-        average = round(total / count, 2) if count else 0
-        grade_letter, remark = get_grade(average)
-        subject_entry = {
-            'subject': subject,
-            'marks': [],
-            'total': total,
-            'average': average,
-            'grade': grade_letter,
-            'remark': remark
-        }
-
-        for assessment in assessment_list:
-            mark = scores.get(assessment)
-            if mark is not None:
-                g, r = get_grade(mark)
-                subject_entry['marks'].append({'mark': mark, 'grade': g, 'remark': r})
-            else:
-                subject_entry['marks'].append({'mark': '-', 'grade': '-', 'remark': '-'})
-        
-        subjects_data.append(subject_entry)
-        overall_total += average
-        subject_count += 1
-
-    overall_average = round(overall_total / subject_count, 2) if subject_count else 0
-    overall_grade, overall_remark = get_grade(overall_average)
-
-    # Stream and class position
-    cursor.execute("""
-        SELECT p.reg_no, AVG(s.Mark) AS avg
-        FROM scores s
-        JOIN pupils p ON s.reg_no = p.reg_no
-        WHERE p.stream_id = %s AND p.term_id = %s AND p.year_id = %s
-        GROUP BY p.reg_no ORDER BY avg DESC
-    """, (pupil['stream_id'], pupil['term_id'], pupil['year_id']))
-    stream_position = next((i+1 for i, r in enumerate(cursor.fetchall()) if r['reg_no'] == reg_no), None)
-
-    cursor.execute("""
-        SELECT p.reg_no, AVG(s.Mark) AS avg
-        FROM scores s
-        JOIN pupils p ON s.reg_no = p.reg_no
-        JOIN stream strm ON p.stream_id = strm.stream_id
-        WHERE strm.class_id = %s AND p.term_id = %s AND p.year_id = %s
-        GROUP BY p.reg_no ORDER BY avg DESC
-    """, (pupil['class_id'], pupil['term_id'], pupil['year_id']))
-    class_position = next((i+1 for i, r in enumerate(cursor.fetchall()) if r['reg_no'] == reg_no), None)
-
     cursor.close()
     connection.close()
 
+    # Stream and class position, ranked once per class and term
+    stream_position, class_position = pupil_positions(
+        reg_no, pupil['class_id'], pupil['year_id'], pupil['term_id']
+    )
+
     return render_template("grade_analysis/term_report_card.html",
-        pupil=pupil,
-        subjects=subjects_data,
-        assessments=assessment_list,
-        overall_average=overall_average,
-        overall_grade=overall_grade,
-        overall_remark=overall_remark,
-        stream_position=stream_position,
-        class_position=class_position,
-        print_date=datetime.now()
+        **build_term_card(pupil, results, stream_position, class_position)
     )
 
 
@@ -1087,17 +854,10 @@ def scores_p_grade_analysis():
     cursor = connection.cursor(dictionary=True)
 
     # Load dropdown data
-    cursor.execute("SELECT * FROM classes")
-    class_list = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
+    class_list = reference_rows('classes')
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
 
     # Get filters from request
     class_id = request.args.get('class_id', type=int)
@@ -1130,16 +890,13 @@ def scores_p_grade_analysis():
         t.term_name,
         a.assessment_name,
         sub.subject_name,
-        s.Mark,
-        g.grade_letter,
-        g.remark
+        s.Mark
     FROM scores s
     JOIN pupils p ON s.reg_no = p.reg_no
     JOIN assessment a ON s.assessment_id = a.assessment_id
     JOIN terms t ON s.term_id = t.term_id
     JOIN subjects sub ON s.subject_id = sub.subject_id
     JOIN study_year y ON s.year_id = y.year_id
-    LEFT JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
     WHERE 1=1
     """
 
@@ -1163,58 +920,13 @@ def scores_p_grade_analysis():
     cursor.close()
     connection.close()
 
-    # Extract subject names and initialize student mapping
     subject_names = sorted({row['subject_name'] for row in raw_data})
-    student_map = {}
-
-    for row in raw_data:
-        reg = row['reg_no']
-        if reg not in student_map:
-            student_map[reg] = {
-                'reg_no': reg,
-                'full_name': row['full_name'],
-                'year_name': row['year_name'],
-                'term_name': row['term_name'],
-                'assessment_name': row['assessment_name'],
-                'marks': {},
-                'grades': {},
-                'remarks': {}
-            }
-
-        subject = row['subject_name']
-        mark = row['Mark']
-
-        student_map[reg]['marks'][subject] = mark if mark is not None else np.nan
-        student_map[reg]['grades'][subject] = row['grade_letter'] or ''
-        student_map[reg]['remarks'][subject] = row['remark'] or ''
-
-    # Calculate totals, averages, and prepare for ranking
-    grade_analysis = []
-    for student in student_map.values():
-        marks_array = np.array([
-            student['marks'].get(subject, np.nan) for subject in subject_names
-        ], dtype=np.float64)
-
-        total = np.nansum(marks_array)
-        count = np.count_nonzero(~np.isnan(marks_array))
-        average = np.round(total / count, 2) if count > 0 else 0
 
-        student['total_score'] = total
-        student['average_score'] = average
-        grade_analysis.append(student)
-
-    # Sort and assign positions
-    grade_analysis.sort(key=lambda x: x['average_score'], reverse=True)
-
-    current_position = 1
-    last_average = None
-    for index, student in enumerate(grade_analysis):
-        if student['average_score'] == last_average:
-            student['position'] = current_position  # same position for tie
-        else:
-            current_position = index + 1
-            student['position'] = current_position
-            last_average = student['average_score']
+    # Totals, averages and tie-aware positions, best average first
+    grade_analysis = compute_term_results(raw_data, strict_aggregate=False, incomplete_last=False)
+    for student in grade_analysis:
+        student['position'] = student['class_position']
+    grade_analysis.sort(key=lambda x: x['position'])
 
     # Render template with results
     return render_template('grade_analysis/scores_p_grade_analysis.html',
@@ -1250,21 +962,17 @@ def scores_p_grade_analysis():
 
 
 @blueprint.route('/grade_count_analysis', methods=['GET'])
+@cached_report
 def grade_count_analysis():
     connection = get_db_connection()
     cursor = connection.cursor(dictionary=True)
 
     # Load dropdown data for filters
-    cursor.execute("SELECT * FROM classes")
-    class_list = cursor.fetchall()
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
-    cursor.execute("SELECT * FROM stream")
-    streams = cursor.fetchall()
+    class_list = reference_rows('classes')
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
+    streams = reference_rows('stream')
 
     # Read filters from query parameters
     class_id = request.args.get('class_id', type=int)
@@ -1328,21 +1036,19 @@ def grade_count_analysis():
     cursor.execute(subject_query, subject_args)
     subject_names = sorted([row['subject_name'] for row in cursor.fetchall()])
 
-    # Fetch ordered grade letters
-    cursor.execute("SELECT grade_letter FROM grades ORDER BY weight ASC")
-    grade_letters = [row['grade_letter'] for row in cursor.fetchall()]
+    # Grade letters ordered by weight
+    grade_letters = ordered_grade_letters()
 
     # Prepare grade count matrix
     grade_counts = {subject: {grade: 0 for grade in grade_letters} for subject in subject_names}
 
     # Fetch scores with matching grades
     score_query = """
-        SELECT sub.subject_name, g.grade_letter
+        SELECT sub.subject_name, s.Mark
         FROM scores s
         JOIN pupils p ON s.reg_no = p.reg_no
         JOIN subjects sub ON s.subject_id = sub.subject_id
         JOIN assessment a ON s.assessment_id = a.assessment_id
-        LEFT JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
         WHERE p.class_id = %s AND s.year_id = %s AND s.term_id = %s AND a.assessment_name = %s
     """
     score_args = [class_id, year_id, term_id, assessment_name]
@@ -1351,7 +1057,7 @@ def grade_count_analysis():
         score_args.append(stream_id)
 
     cursor.execute(score_query, score_args)
-    for row in cursor.fetchall():
+    for row in attach_grades(cursor.fetchall()):
         subject = row['subject_name']
         grade = row['grade_letter'] or 'N/A'
         if subject in grade_counts and grade in grade_counts[subject]:
@@ -1403,16 +1109,11 @@ def vd_grade_analysis():
     cursor = conn.cursor(dictionary=True)
 
     # Load dropdown data
-    cursor.execute("SELECT * FROM classes WHERE class_id IN (4, 30, 31, 32)")
-    class_list = cursor.fetchall()
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
-    cursor.execute("SELECT * FROM stream")
-    streams = cursor.fetchall()
+    class_list = reference_rows('classes', ids=(4, 30, 31, 32))
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
+    streams = reference_rows('stream')
 
     # Get filters from query parameters
     class_id = request.args.get('class_id', type=int)
@@ -1457,18 +1158,15 @@ def vd_grade_analysis():
                CONCAT_WS(' ', p.last_name, p.first_name, p.other_name) AS full_name,
                p.image, c.class_name, st.stream_name,
                y.year_name, y.year_id, t.term_name, t.term_id,
-               a.assessment_name, sub.subject_name, s.Mark,
-               g.grade_letter, g.weight,
+               a.assessment_name, {SUMMARY_COLUMNS},
                class_counts.total_class_size, stream_counts.total_stream_size
-        FROM scores s
+        FROM {SUMMARY_TABLE} s
         JOIN pupils p USING (reg_no)
         JOIN classes c ON p.class_id = c.class_id
         JOIN stream st ON p.stream_id = st.stream_id
         JOIN study_year y ON s.year_id = y.year_id
         JOIN terms t ON s.term_id = t.term_id
         JOIN assessment a ON s.assessment_id = a.assessment_id
-        JOIN subjects sub ON s.subject_id = sub.subject_id
-        LEFT JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
         JOIN (SELECT class_id, COUNT(*) AS total_class_size FROM pupils GROUP BY class_id) class_counts
             ON class_counts.class_id = p.class_id
         JOIN (SELECT class_id, stream_id, COUNT(*) AS total_stream_size FROM pupils GROUP BY class_id, stream_id) stream_counts
@@ -1479,122 +1177,22 @@ def vd_grade_analysis():
     """
     cursor.execute(query, [class_id, year_id, term_id] + assessment_name_list)
     rows = cursor.fetchall()
+    rows, summaries = summary_score_rows(rows, core_subjects, by_assessment=True)
+    subject_names = {row['subject_name'] for row in rows}
 
-    # Organize data
-    from collections import defaultdict
-
-    grouped = {}
-    subject_names = set()
-    subject_ranks_data = defaultdict(lambda: defaultdict(list))
-
-    for row in rows:
-        key = (row['reg_no'], row['assessment_name'])
-        subject_names.add(row['subject_name'])
-
-        # Collect for ranking
-        subject_ranks_data[row['assessment_name']][row['subject_name']].append({
-            'reg_no': row['reg_no'],
-            'Mark': int(row['Mark']) if row['Mark'] is not None else None
-        })
-
-        if key not in grouped:
-            grouped[key] = {
-                'reg_no': row['reg_no'], 'index_number': row['index_number'],
-                'full_name': row['full_name'], 'image': row['image'],
-                'class_id': row['class_id'], 'stream_id': row['stream_id'],
-                'class_name': row['class_name'], 'stream_name': row['stream_name'],
-                'year_id': row['year_id'], 'term_id': row['term_id'],
-                'year_name': row['year_name'], 'term_name': row['term_name'],
-                'assessment_name': row['assessment_name'],
-                'marks': {}, 'grades': {}, 'weights': {},
-                'total_class_size': row['total_class_size'],
-                'total_stream_size': row['total_stream_size'],
-                'class_teacher': class_teacher  # ✅ Correct key name
-            }
-
-        student = grouped[key]
-        student['marks'][row['subject_name']] = int(row['Mark']) if row['Mark'] is not None else None
-        student['grades'][row['subject_name']] = row['grade_letter'] or ''
-        student['weights'][row['subject_name']] = row['weight'] or 0
-
-    # Rank students by subject
-    subject_ranks = defaultdict(lambda: defaultdict(dict))
-    for assessment, subjects in subject_ranks_data.items():
-        for subject, entries in subjects.items():
-            entries.sort(key=lambda x: -x['Mark'] if x['Mark'] is not None else float('-inf'))
-            prev_mark, prev_rank = None, 0
-            for i, entry in enumerate(entries):
-                if entry['Mark'] != prev_mark:
-                    prev_rank = i + 1
-                subject_ranks[assessment][subject][entry['reg_no']] = prev_rank
-                prev_mark = entry['Mark']
-
-    # Compute totals, aggregates, divisions
-    for student in grouped.values():
-        marks = [student['marks'].get(s) for s in core_subjects]
-        total_score = sum(m for m in marks if m is not None)
-        count = len([m for m in marks if m is not None])
-        avg_score = round(total_score / count, 2) if count else 0
-
-        if any(m is None for m in marks):
-            division, agg = 'X', 'X'
-        else:
-            weights = [student['weights'].get(s, 0) for s in core_subjects]
-            agg = sum(weights)
-            cursor.execute("SELECT division_name FROM division WHERE %s BETWEEN min_score AND max_score LIMIT 1", (agg,))
-            div_row = cursor.fetchone()
-            division = div_row['division_name'] if div_row else 'N/A'
-
-        ranks = {
-            subject: subject_ranks[student['assessment_name']][subject].get(student['reg_no'])
-            for subject in subject_names
-        }
-
-        student.update({
-            'total_score': total_score,
-            'average_score': avg_score,
-            'aggregate': agg,
-            'division': division,
-            'subject_ranks': ranks
-        })
-
-    # Class positions
-    class_group = defaultdict(list)
-    for s in grouped.values():
-        class_group[s['assessment_name']].append(s)
-
-    for students in class_group.values():
-        students.sort(key=lambda s: -s['average_score'] if isinstance(s['average_score'], (int, float)) else float('-inf'))
-        prev_score, prev_rank = None, 0
-        for i, s in enumerate(students):
-            if s['average_score'] != prev_score:
-                prev_rank = i + 1
-            s['class_position'] = prev_rank
-            prev_score = s['average_score']
-
-    # Stream positions
-    stream_group = defaultdict(list)
-    for s in grouped.values():
-        stream_group[s['assessment_name']].append(s)
-
-    for students in stream_group.values():
-        stream_map = defaultdict(list)
-        for s in students:
-            stream_map[s['stream_id']].append(s)
-        for sgroup in stream_map.values():
-            sgroup.sort(key=lambda s: -s['average_score'] if isinstance(s['average_score'], (int, float)) else float('-inf'))
-            prev_score, prev_rank = None, 0
-            for i, s in enumerate(sgroup):
-                if s['average_score'] != prev_score:
-                    prev_rank = i + 1
-                s['stream_position'] = prev_rank
-                prev_score = s['average_score']
+    # Totals, aggregates, divisions and ranks per student and assessment
+    reports_list = compute_term_results(
+        rows, total_subjects=core_subjects, by_assessment=True, incomplete_last=False,
+        summaries=summaries
+    )
+    for student in reports_list:
+        student['class_teacher'] = class_teacher
 
     cursor.close()
     conn.close()
 
     return render_template('grade_analysis/vd_grade_analysis.html',
-        grade_analysis=list(grouped.values()),
+        grade_analysis=reports_list,
         subject_names=sorted(subject_names),
         class_list=class_list, study_years=study_years,
         terms=terms, assessments=assessments, streams=streams,
@@ -1624,20 +1222,11 @@ def vd_grade_analysis_2():
     cursor = conn.cursor(dictionary=True)
 
     # Load dropdown data for filters
-    cursor.execute("SELECT * FROM classes WHERE class_id IN (28, 27)")
-    class_list = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM stream")
-    streams = cursor.fetchall()
+    class_list = reference_rows('classes', ids=(28, 27))
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
+    streams = reference_rows('stream')
 
     # Read filter parameters from request
     class_id = request.args.get('class_id', type=int)
@@ -1691,18 +1280,15 @@ def vd_grade_analysis_2():
                CONCAT_WS(' ', p.last_name, p.first_name, p.other_name) AS full_name,
                p.image, c.class_name, st.stream_name,
                y.year_name, y.year_id, t.term_name, t.term_id,
-               a.assessment_name, sub.subject_name, s.Mark,
-               g.grade_letter, g.weight,
+               a.assessment_name, {SUMMARY_COLUMNS},
                class_counts.total_class_size, stream_counts.total_stream_size
-        FROM scores s
+        FROM {SUMMARY_TABLE} s
         JOIN pupils p USING (reg_no)
         JOIN classes c ON p.class_id = c.class_id
         JOIN stream st ON p.stream_id = st.stream_id
         JOIN study_year y ON s.year_id = y.year_id
         JOIN terms t ON s.term_id = t.term_id
         JOIN assessment a ON s.assessment_id = a.assessment_id
-        JOIN subjects sub ON s.subject_id = sub.subject_id
-        LEFT JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
         JOIN (SELECT class_id, COUNT(*) AS total_class_size FROM pupils GROUP BY class_id) class_counts
           ON class_counts.class_id = p.class_id
         JOIN (SELECT class_id, stream_id, COUNT(*) AS total_stream_size FROM pupils GROUP BY class_id, stream_id) stream_counts
@@ -1714,129 +1300,20 @@ def vd_grade_analysis_2():
     class_params = [class_id, year_id, term_id] + assessment_name_list
     cursor.execute(class_query, class_params)
     class_rows = cursor.fetchall()
-
-    # Group data by student and assessment
-    class_grouped = {}
-    subject_names = set()
-    subject_rankings = defaultdict(lambda: defaultdict(list))
-
-    for row in class_rows:
-        key = (row['reg_no'], row['assessment_name'])
-        subject_names.add(row['subject_name'])
-
-        # Collect marks for ranking calculation
-        subject_rankings[row['assessment_name']][row['subject_name']].append({
-            'reg_no': row['reg_no'],
-            'Mark': int(row['Mark']) if row['Mark'] is not None else None
-        })
-
-        if key not in class_grouped:
-            class_grouped[key] = {
-                'reg_no': row['reg_no'],
-                'index_number': row['index_number'],
-                'full_name': row['full_name'],
-                'image': row['image'],
-                'class_id': row['class_id'],
-                'stream_id': row['stream_id'],
-                'class_name': row['class_name'],
-                'stream_name': row['stream_name'],
-                'year_id': row['year_id'],
-                'term_id': row['term_id'],
-                'year_name': row['year_name'],
-                'term_name': row['term_name'],
-                'assessment_name': row['assessment_name'],
-                'marks': {},
-                'grades': {},
-                'weights': {},
-                'total_class_size': row['total_class_size'],
-                'total_stream_size': row['total_stream_size']
-            }
-
-        student = class_grouped[key]
-        student['marks'][row['subject_name']] = int(row['Mark']) if row['Mark'] is not None else None
-        student['grades'][row['subject_name']] = row['grade_letter'] or ''
-        student['weights'][row['subject_name']] = row['weight'] or 0
-
-    # Compute subject ranks per assessment and subject
-    subject_ranks = defaultdict(lambda: defaultdict(dict))
-    for assessment, subjects in subject_rankings.items():
-        for subject, entries in subjects.items():
-            # Sort descending by mark (None marks go last)
-            entries.sort(key=lambda x: -x['Mark'] if x['Mark'] is not None else float('-inf'))
-            prev_mark, prev_rank = None, 0
-            for idx, entry in enumerate(entries):
-                if entry['Mark'] != prev_mark:
-                    prev_rank = idx + 1
-                subject_ranks[assessment][subject][entry['reg_no']] = prev_rank
-                prev_mark = entry['Mark']
-
-    # Calculate totals, averages, aggregates, divisions, and ranks for each student
-    for student in class_grouped.values():
-        # Total and average of selected subjects
-        total_marks = [student['marks'].get(sub) for sub in total_avg_subjects if student['marks'].get(sub) is not None]
-        total_score = sum(total_marks)
-        avg_score = round(total_score / len(total_marks), 2) if total_marks else 0
-
-        # Aggregate and division from core subjects
-        core_marks = [student['marks'].get(sub) for sub in aggregate_subjects]
-        if any(mark is None for mark in core_marks):
-            agg = 'X'
-            division = 'X'
-        else:
-            core_weights = [student['weights'].get(sub, 0) for sub in aggregate_subjects]
-            agg = sum(core_weights)
-            cursor.execute(
-                "SELECT division_name FROM division WHERE %s BETWEEN min_score AND max_score LIMIT 1",
-                (agg,)
-            )
-            div_row = cursor.fetchone()
-            division = div_row['division_name'] if div_row else 'N/A'
-
-        # Get subject ranks for this student
-        ranks = {}
-        for subject in subject_names:
-            ranks[subject] = subject_ranks[student['assessment_name']][subject].get(student['reg_no'])
-
-        # Update student record
-        student.update({
-            'total_score': total_score,
-            'average_score': avg_score,
-            'aggregate': agg,
-            'division': division,
-            'subject_ranks': ranks
-        })
-
-    # Calculate class positions based on average_score
-    assessment_groups_class = defaultdict(list)
-    for student in class_grouped.values():
-        assessment_groups_class[student['assessment_name']].append(student)
-
-    for group in assessment_groups_class.values():
-        group.sort(key=lambda x: -x['average_score'] if isinstance(x['average_score'], (int, float)) else float('-inf'))
-        prev_score, prev_position = None, 0
-        for idx, rpt in enumerate(group):
-            if rpt['average_score'] != prev_score:
-                prev_position = idx + 1
-            rpt['class_position'] = prev_position
-            prev_score = rpt['average_score']
-
-    # Calculate stream positions based on average_score within streams
-    assessment_groups_stream = defaultdict(list)
-    for rpt in class_grouped.values():
-        assessment_groups_stream[rpt['assessment_name']].append(rpt)
-
-    for group in assessment_groups_stream.values():
-        streams_group = defaultdict(list)
-        for rpt in group:
-            streams_group[rpt['stream_id']].append(rpt)
-        for sgroup in streams_group.values():
-            sgroup.sort(key=lambda x: -x['average_score'] if isinstance(x['average_score'], (int, float)) else float('-inf'))
-            prev_score, prev_position = None, 0
-            for idx, rpt in enumerate(sgroup):
-                if rpt['average_score'] != prev_score:
-                    prev_position = idx + 1
-                rpt['stream_position'] = prev_position
-                prev_score = rpt['average_score']
+    class_rows, summaries = summary_score_rows(
+        class_rows, total_avg_subjects, aggregate_subjects, by_assessment=True
+    )
+    subject_names = {row['subject_name'] for row in class_rows}
+
+    # Totals, aggregates, divisions and ranks per student and assessment
+    reports = compute_term_results(
+        class_rows,
+        total_subjects=total_avg_subjects,
+        aggregate_subjects=aggregate_subjects,
+        by_assessment=True,
+        incomplete_last=False,
+        summaries=summaries
+    )
 
     # Close DB connections
     cursor.close()
@@ -1845,7 +1322,7 @@ def vd_grade_analysis_2():
     # Render the template with all data including the class teacher
     return render_template(
         'grade_analysis/vd_grade_analysis_2.html',
-        grade_analysis=list(class_grouped.values()),
+        grade_analysis=reports,
         subject_names=sorted(subject_names),
         class_list=class_list,
         study_years=study_years,
@@ -1875,16 +1352,11 @@ def scores_positions_grade_analysis_2():
     cursor = connection.cursor(dictionary=True)
 
     # Load dropdown data
-    cursor.execute("SELECT * FROM classes WHERE class_id IN (28,27)")
-    class_list = cursor.fetchall()
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
-    cursor.execute("SELECT * FROM stream")
-    streams = cursor.fetchall()
+    class_list = reference_rows('classes', ids=(28, 27))
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
+    streams = reference_rows('stream')
 
     # Read filters
     class_id = request.args.get('class_id', type=int)
@@ -1918,26 +1390,21 @@ def scores_positions_grade_analysis_2():
     aggregate_subjects = sorted(['MTC', 'ENGLISH', 'LITERACY 1A', 'LITERACY 1B'])  # aggregate & division
 
     # Fetch scores
-    sql = """
+    sql = f"""
         SELECT 
             p.reg_no, p.stream_id, p.class_id,
             CONCAT_WS(' ', p.last_name, p.first_name, p.other_name) AS full_name,
             y.year_name, y.year_id,
             t.term_name, t.term_id,
             a.assessment_name,
-            sub.subject_name,
-            s.Mark,
-            g.grade_letter,
-            g.weight,
+            {SUMMARY_COLUMNS},
             st.stream_name
-        FROM scores s
+        FROM {SUMMARY_TABLE} s
         JOIN pupils p ON s.reg_no = p.reg_no
         JOIN assessment a ON s.assessment_id = a.assessment_id
         JOIN terms t ON s.term_id = t.term_id
         JOIN study_year y ON s.year_id = y.year_id
-        JOIN subjects sub ON s.subject_id = sub.subject_id
         JOIN stream st ON p.stream_id = st.stream_id
-        LEFT JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
         WHERE p.class_id = %s AND s.year_id = %s AND s.term_id = %s AND a.assessment_name = %s
     """
     args = [class_id, year_id, term_id, assessment_name]
@@ -1948,85 +1415,15 @@ def scores_positions_grade_analysis_2():
 
     cursor.execute(sql, args)
     rows = cursor.fetchall()
+    rows, summaries = summary_score_rows(rows, total_avg_subjects, aggregate_subjects)
 
     subject_names = sorted({row['subject_name'] for row in rows})
 
-    # Build student map
-    student_map = {}
-    for row in rows:
-        reg_no = row['reg_no']
-        if reg_no not in student_map:
-            student_map[reg_no] = {
-                'reg_no': reg_no,
-                'full_name': row['full_name'],
-                'class_id': row['class_id'],
-                'stream_id': row['stream_id'],
-                'stream_name': row['stream_name'],
-                'year_id': row['year_id'],
-                'term_id': row['term_id'],
-                'year_name': row['year_name'],
-                'term_name': row['term_name'],
-                'assessment_name': row['assessment_name'],
-                'marks': {},
-                'grades': {},
-                'weights': {}
-            }
-        student_map[reg_no]['marks'][row['subject_name']] = row['Mark']
-        student_map[reg_no]['grades'][row['subject_name']] = row['grade_letter'] or ''
-        student_map[reg_no]['weights'][row['subject_name']] = row['weight'] or 0
-
-    # Calculate totals, averages, aggregate, division
-    for student in student_map.values():
-        # --- Total & Average ---
-        total_marks = [student['marks'].get(sub) for sub in total_avg_subjects if student['marks'].get(sub) is not None]
-        total_score = sum(total_marks)
-        avg_score = round(total_score / len(total_marks), 2) if total_marks else 0
-
-        # --- Aggregate & Division ---
-        core_marks = [student['marks'].get(sub) for sub in aggregate_subjects]
-        if any(mark is None for mark in core_marks):
-            aggregate = 'X'
-            division = 'X'
-        else:
-            aggregate = sum(student['weights'].get(sub, 0) for sub in aggregate_subjects)
-            cursor.execute("""
-                SELECT division_name FROM division
-                WHERE %s BETWEEN min_score AND max_score LIMIT 1
-            """, (aggregate,))
-            div_row = cursor.fetchone()
-            division = div_row['division_name'] if div_row else 'N/A'
-
-        student.update({
-            'total_score': total_score,
-            'average_score': avg_score,
-            'aggregate': aggregate,
-            'division': division
-        })
-
-    students = list(student_map.values())
-
-    # Positioning
-    def assign_positions(student_list, pos_key):
-        student_list.sort(key=lambda s: (float('inf') if s['aggregate'] == 'X' else -s['average_score'], s['reg_no']))
-        prev_score, prev_position = None, 0
-        for idx, student in enumerate(student_list, start=1):
-            if student['aggregate'] == 'X':
-                student[pos_key] = idx
-            else:
-                if student['average_score'] != prev_score:
-                    prev_position = idx
-                student[pos_key] = prev_position
-                prev_score = student['average_score']
-
-    assign_positions(students, 'class_position')
-
-    from collections import defaultdict
-    stream_groups = defaultdict(list)
-    for student in students:
-        stream_groups[student['stream_id']].append(student)
-
-    for group in stream_groups.values():
-        assign_positions(group, 'stream_position')
+    students = compute_term_results(
+        rows, total_subjects=total_avg_subjects, aggregate_subjects=aggregate_subjects,
+        summaries=summaries
+    )
+    students.sort(key=lambda s: (s['class_position'], s['reg_no']))
 
     cursor.close()
     connection.close()
@@ -2062,16 +1459,11 @@ def vd_grade_analysis_3():
     cursor = conn.cursor(dictionary=True)
 
     # Load dropdown data
-    cursor.execute("SELECT * FROM classes WHERE class_id IN (29)")
-    class_list = cursor.fetchall()
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
-    cursor.execute("SELECT * FROM stream")
-    streams = cursor.fetchall()
+    class_list = reference_rows('classes', ids=(29,))
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
+    streams = reference_rows('stream')
 
     # Read filters
     class_id = request.args.get('class_id', type=int)
@@ -2104,18 +1496,15 @@ def vd_grade_analysis_3():
                CONCAT_WS(' ', p.last_name, p.first_name, p.other_name) AS full_name,
                p.image, c.class_name, st.stream_name,
                y.year_name, y.year_id, t.term_name, t.term_id,
-               a.assessment_name, sub.subject_name, s.Mark,
-               g.grade_letter, g.weight,
+               a.assessment_name, {SUMMARY_COLUMNS},
                class_counts.total_class_size, stream_counts.total_stream_size
-        FROM scores s
+        FROM {SUMMARY_TABLE} s
         JOIN pupils p USING (reg_no)
         JOIN classes c ON p.class_id = c.class_id
         JOIN stream st ON p.stream_id = st.stream_id
         JOIN study_year y ON s.year_id = y.year_id
         JOIN terms t ON s.term_id = t.term_id
         JOIN assessment a ON s.assessment_id = a.assessment_id
-        JOIN subjects sub ON s.subject_id = sub.subject_id
-        LEFT JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
         JOIN (SELECT class_id, COUNT(*) AS total_class_size FROM pupils GROUP BY class_id) class_counts
           ON class_counts.class_id = p.class_id
         JOIN (SELECT class_id, stream_id, COUNT(*) AS total_stream_size FROM pupils GROUP BY class_id, stream_id) stream_counts
@@ -2127,120 +1516,26 @@ def vd_grade_analysis_3():
     class_params = [class_id, year_id, term_id] + assessment_name_list
     cursor.execute(class_query, class_params)
     class_rows = cursor.fetchall()
-
-    class_grouped = {}
-    subject_names = set()
-    subject_rankings = defaultdict(lambda: defaultdict(list))
-
-    for row in class_rows:
-        key = (row['reg_no'], row['assessment_name'])
-        subject_names.add(row['subject_name'])
-
-        subject_rankings[row['assessment_name']][row['subject_name']].append({
-            'reg_no': row['reg_no'],
-            'Mark': int(row['Mark']) if row['Mark'] is not None else None
-        })
-
-        if key not in class_grouped:
-            class_grouped[key] = {
-                'reg_no': row['reg_no'], 'index_number': row['index_number'],
-                'full_name': row['full_name'], 'image': row['image'],
-                'class_id': row['class_id'], 'stream_id': row['stream_id'],
-                'class_name': row['class_name'], 'stream_name': row['stream_name'],
-                'year_id': row['year_id'], 'term_id': row['term_id'],
-                'year_name': row['year_name'], 'term_name': row['term_name'],
-                'assessment_name': row['assessment_name'],
-                'marks': {}, 'grades': {}, 'weights': {},
-                'total_class_size': row['total_class_size'],
-                'total_stream_size': row['total_stream_size']
-            }
-
-        student = class_grouped[key]
-        student['marks'][row['subject_name']] = int(row['Mark']) if row['Mark'] is not None else None
-        student['grades'][row['subject_name']] = row['grade_letter'] or ''
-        student['weights'][row['subject_name']] = row['weight'] or 0
-
-    # Compute subject ranks
-    subject_ranks = defaultdict(lambda: defaultdict(dict))
-    for assessment, subjects in subject_rankings.items():
-        for subject, entries in subjects.items():
-            entries.sort(key=lambda x: -x['Mark'] if x['Mark'] is not None else float('-inf'))
-            prev_mark, prev_rank = None, 0
-            for idx, entry in enumerate(entries):
-                if entry['Mark'] != prev_mark:
-                    prev_rank = idx + 1
-                subject_ranks[assessment][subject][entry['reg_no']] = prev_rank
-                prev_mark = entry['Mark']
-
-    for student in class_grouped.values():
-        # Total & average from total_avg_subjects
-        total_marks = [student['marks'].get(sub) for sub in total_avg_subjects if student['marks'].get(sub) is not None]
-        total_score = sum(total_marks)
-        avg_score = round(total_score / len(total_marks), 2) if total_marks else 0
-
-        # Aggregate & Division from aggregate_subjects
-        core_marks = [student['marks'].get(sub) for sub in aggregate_subjects]
-        if any(mark is None for mark in core_marks):
-            agg = 'X'
-            division = 'X'
-        else:
-            core_weights = [student['weights'].get(sub, 0) for sub in aggregate_subjects]
-            agg = sum(core_weights)
-            cursor.execute("SELECT division_name FROM division WHERE %s BETWEEN min_score AND max_score LIMIT 1", (agg,))
-            div_row = cursor.fetchone()
-            division = div_row['division_name'] if div_row else 'N/A'
-
-        # Subject ranks
-        ranks = {}
-        for subject in subject_names:
-            rank = subject_ranks[student['assessment_name']][subject].get(student['reg_no'])
-            ranks[subject] = rank
-
-        student.update({
-            'total_score': total_score,
-            'average_score': avg_score,
-            'aggregate': agg,
-            'division': division,
-            'subject_ranks': ranks
-        })
-
-    # Class positions
-    assessment_groups_class = defaultdict(list)
-    for student in class_grouped.values():
-        assessment_groups_class[student['assessment_name']].append(student)
-
-    for group in assessment_groups_class.values():
-        group.sort(key=lambda x: -x['average_score'] if isinstance(x['average_score'], (int, float)) else float('-inf'))
-        prev_score, prev_position = None, 0
-        for idx, rpt in enumerate(group):
-            if rpt['average_score'] != prev_score:
-                prev_position = idx + 1
-            rpt['class_position'] = prev_position
-            prev_score = rpt['average_score']
-
-    # Stream positions
-    assessment_groups_stream = defaultdict(list)
-    for rpt in class_grouped.values():
-        assessment_groups_stream[rpt['assessment_name']].append(rpt)
-
-    for group in assessment_groups_stream.values():
-        streams_group = defaultdict(list)
-        for rpt in group:
-            streams_group[rpt['stream_id']].append(rpt)
-        for sgroup in streams_group.values():
-            sgroup.sort(key=lambda x: -x['average_score'] if isinstance(x['average_score'], (int, float)) else float('-inf'))
-            prev_score, prev_position = None, 0
-            for idx, rpt in enumerate(sgroup):
-                if rpt['average_score'] != prev_score:
-                    prev_position = idx + 1
-                rpt['stream_position'] = prev_position
-                prev_score = rpt['average_score']
+    class_rows, summaries = summary_score_rows(
+        class_rows, total_avg_subjects, aggregate_subjects, by_assessment=True
+    )
+    subject_names = {row['subject_name'] for row in class_rows}
+
+    # Totals, aggregates, divisions and ranks per student and assessment
+    reports = compute_term_results(
+        class_rows,
+        total_subjects=total_avg_subjects,
+        aggregate_subjects=aggregate_subjects,
+        by_assessment=True,
+        incomplete_last=False,
+        summaries=summaries
+    )
 
     cursor.close()
     conn.close()
 
     return render_template('grade_analysis/vd_grade_analysis_3.html',
-        grade_analysis=list(class_grouped.values()),
+        grade_analysis=reports,
         subject_names=sorted(subject_names),
         class_list=class_list, study_years=study_years,
         terms=terms, assessments=assessments, streams=streams,
@@ -2266,16 +1561,11 @@ def scores_positions_grade_analysis_3():
     cursor = connection.cursor(dictionary=True)
 
     # Load dropdown data
-    cursor.execute("SELECT * FROM classes WHERE class_id IN (29)")
-    class_list = cursor.fetchall()
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
-    cursor.execute("SELECT * FROM stream")
-    streams = cursor.fetchall()
+    class_list = reference_rows('classes', ids=(29,))
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
+    streams = reference_rows('stream')
 
     # Read filters
     class_id = request.args.get('class_id', type=int)
@@ -2309,26 +1599,21 @@ def scores_positions_grade_analysis_3():
     aggregate_subjects = sorted(['MTC', 'ENGLISH', 'LITERACY 1A', 'LITERACY 1B'])  # aggregate & division
 
     # Fetch scores
-    sql = """
+    sql = f"""
         SELECT 
             p.reg_no, p.stream_id, p.class_id,
             CONCAT_WS(' ', p.last_name, p.first_name, p.other_name) AS full_name,
             y.year_name, y.year_id,
             t.term_name, t.term_id,
             a.assessment_name,
-            sub.subject_name,
-            s.Mark,
-            g.grade_letter,
-            g.weight,
+            {SUMMARY_COLUMNS},
             st.stream_name
-        FROM scores s
+        FROM {SUMMARY_TABLE} s
         JOIN pupils p ON s.reg_no = p.reg_no
         JOIN assessment a ON s.assessment_id = a.assessment_id
         JOIN terms t ON s.term_id = t.term_id
         JOIN study_year y ON s.year_id = y.year_id
-        JOIN subjects sub ON s.subject_id = sub.subject_id
         JOIN stream st ON p.stream_id = st.stream_id
-        LEFT JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score
         WHERE p.class_id = %s AND s.year_id = %s AND s.term_id = %s AND a.assessment_name = %s
     """
     args = [class_id, year_id, term_id, assessment_name]
@@ -2339,85 +1624,15 @@ def scores_positions_grade_analysis_3():
 
     cursor.execute(sql, args)
     rows = cursor.fetchall()
+    rows, summaries = summary_score_rows(rows, total_avg_subjects, aggregate_subjects)
 
     subject_names = sorted({row['subject_name'] for row in rows})
 
-    # Build student map
-    student_map = {}
-    for row in rows:
-        reg_no = row['reg_no']
-        if reg_no not in student_map:
-            student_map[reg_no] = {
-                'reg_no': reg_no,
-                'full_name': row['full_name'],
-                'class_id': row['class_id'],
-                'stream_id': row['stream_id'],
-                'stream_name': row['stream_name'],
-                'year_id': row['year_id'],
-                'term_id': row['term_id'],
-                'year_name': row['year_name'],
-                'term_name': row['term_name'],
-                'assessment_name': row['assessment_name'],
-                'marks': {},
-                'grades': {},
-                'weights': {}
-            }
-        student_map[reg_no]['marks'][row['subject_name']] = row['Mark']
-        student_map[reg_no]['grades'][row['subject_name']] = row['grade_letter'] or ''
-        student_map[reg_no]['weights'][row['subject_name']] = row['weight'] or 0
-
-    # Calculate totals, averages, aggregate, division
-    for student in student_map.values():
-        # --- Total & Average ---
-        total_marks = [student['marks'].get(sub) for sub in total_avg_subjects if student['marks'].get(sub) is not None]
-        total_score = sum(total_marks)
-        avg_score = round(total_score / len(total_marks), 2) if total_marks else 0
-
-        # --- Aggregate & Division ---
-        core_marks = [student['marks'].get(sub) for sub in aggregate_subjects]
-        if any(mark is None for mark in core_marks):
-            aggregate = 'X'
-            division = 'X'
-        else:
-            aggregate = sum(student['weights'].get(sub, 0) for sub in aggregate_subjects)
-            cursor.execute("""
-                SELECT division_name FROM division
-                WHERE %s BETWEEN min_score AND max_score LIMIT 1
-            """, (aggregate,))
-            div_row = cursor.fetchone()
-            division = div_row['division_name'] if div_row else 'N/A'
-
-        student.update({
-            'total_score': total_score,
-            'average_score': avg_score,
-            'aggregate': aggregate,
-            'division': division
-        })
-
-    students = list(student_map.values())
-
-    # Positioning
-    def assign_positions(student_list, pos_key):
-        student_list.sort(key=lambda s: (float('inf') if s['aggregate'] == 'X' else -s['average_score'], s['reg_no']))
-        prev_score, prev_position = None, 0
-        for idx, student in enumerate(student_list, start=1):
-            if student['aggregate'] == 'X':
-                student[pos_key] = idx
-            else:
-                if student['average_score'] != prev_score:
-                    prev_position = idx
-                student[pos_key] = prev_position
-                prev_score = student['average_score']
-
-    assign_positions(students, 'class_position')
-
-    from collections import defaultdict
-    stream_groups = defaultdict(list)
-    for student in students:
-        stream_groups[student['stream_id']].append(student)
-
-    for group in stream_groups.values():
-        assign_positions(group, 'stream_position')
+    students = compute_term_results(
+        rows, total_subjects=total_avg_subjects, aggregate_subjects=aggregate_subjects,
+        summaries=summaries
+    )
+    students.sort(key=lambda s: (s['class_position'], s['reg_no']))
 
     cursor.close()
     connection.close()
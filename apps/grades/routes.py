@@ -9,6 +9,8 @@ import random
 import logging
 import re  # <-- Add this line
 from apps import get_db_connection
+from apps.grading import invalidate_grading
+from apps.summaries import submit_rebuild
 from jinja2 import TemplateNotFound
 
 
@@ -68,8 +70,10 @@ def add_grades():
                         INSERT INTO grades (min_score, max_score, grade_letter, remark) 
                         VALUES (%s, %s, %s, %s)
                     ''', (min_score, max_score, grade_letter, remark if remark else None))
+                    invalidate_grading()
                     connection.commit()
                     flash("Grade successfully added!", "success")
+                    submit_rebuild(url_for('grades_blueprint.grades'))
 
             except mysql.connector.Error as err:
                 flash(f"Error: {err}", "danger")
@@ -137,9 +141,11 @@ def edit_grades(grade_id):
                     weight = %s
                 WHERE grade_id = %s
             """, (min_score, max_score, grade_letter, remark, weight, grade_id))
+            invalidate_grading()
             connection.commit()
 
             flash("Grade updated successfully!", "success")
+            submit_rebuild(url_for('grades_blueprint.grades'))
 
         except ValueError:
             flash("Scores and weight must be valid numbers (e.g., 79.99).", "danger")
@@ -197,8 +203,10 @@ def delete_grades(grade_id):
 
         # Proceed with deletion
         cursor.execute("DELETE FROM grades WHERE grade_id = %s", (grade_id,))
+        invalidate_grading()
         connection.commit()
         flash("Grade deleted successfully.", "success")
+        submit_rebuild(url_for('grades_blueprint.grades'))
 
     except Exception as e:
         flash(f"An error occurred while deleting the grade: {str(e)}", "danger")
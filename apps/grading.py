@@ -0,0 +1,171 @@
+"""Grade and division scales shared by the report routes.
+
+The ``grades`` and ``division`` tables are small and rarely edited, so
+they are loaded once per process and kept until the grades/division
+blueprints call ``invalidate_grading()`` before committing, which drops
+them in every worker (region ``grading`` in ``apps.cache_versions``, bumped
+together with ``reports``), or
+until ``GRADING_CACHE_TTL`` expires.  Marks and aggregates are then classified in memory with a
+binary search over the sorted band bounds instead of a
+``JOIN grades g ON s.Mark BETWEEN g.min_score AND g.max_score``.
+
+``scale_version()`` fingerprints both scales, so a value stored with a
+grade or division (the pupil summaries) can tell it was computed with
+bands that have since changed.
+"""
+import hashlib
+import threading
+import time
+
+import numpy as np
+from flask import current_app
+
+from apps.cache_versions import bump, on_change
+from apps.db import get_db_connection
+
+
+class RangeScale:
+    """Non-overlapping [min_score, max_score] bands sorted by min_score."""
+
+    def __init__(self, rows):
+        self.rows = sorted(
+            (r for r in rows if r['min_score'] is not None and r['max_score'] is not None),
+            key=lambda r: r['min_score']
+        )
+        self.mins = np.array([float(r['min_score']) for r in self.rows], dtype=np.float64)
+        self.maxs = np.array([float(r['max_score']) for r in self.rows], dtype=np.float64)
+        self.fingerprint = hashlib.sha1(
+            repr([sorted(r.items()) for r in self.rows]).encode()
+        ).hexdigest()[:16]
+
+    def classify(self, values):
+        """Band index for every value (-1 where no band matches)."""
+        values = np.array(
+            [np.nan if v is None else float(v) for v in values], dtype=np.float64
+        )
+        if not self.rows:
+            return np.full(values.shape, -1, dtype=np.int64)
+        idx = np.searchsorted(self.mins, values, side='right') - 1
+        safe = np.clip(idx, 0, None)
+        matched = (idx >= 0) & (values <= self.maxs[safe])  # NaN compares False
+        return np.where(matched, idx, -1)
+
+    def lookup(self, value):
+        """Matching band row for a single value, or None."""
+        i = self.classify([value])[0]
+        return self.rows[i] if i >= 0 else None
+
+
+_lock = threading.Lock()
+_version = 0
+_cache = {'version': None, 'loaded_at': 0.0, 'grades': None, 'divisions': None}
+
+
+def invalidate_grading():
+    """Drop the cached scales, and the report pages graded with them, in
+    every worker; call before committing a write to grades or division."""
+    bump('grading', 'reports')
+
+
+def _drop(key):
+    global _version
+    with _lock:
+        _version += 1
+
+
+on_change('grading', _drop)
+
+
+def _load():
+    with get_db_connection() as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            cursor.execute("SELECT grade_letter, remark, weight, min_score, max_score FROM grades")
+            grades = RangeScale(cursor.fetchall())
+            cursor.execute("SELECT division_name, min_score, max_score FROM division")
+            divisions = RangeScale(cursor.fetchall())
+    return grades, divisions
+
+
+def _scales():
+    ttl = current_app.config.get('GRADING_CACHE_TTL', 300)
+    with _lock:
+        version = _version
+        fresh = (
+            _cache['version'] == version
+            and time.monotonic() - _cache['loaded_at'] < ttl
+        )
+        if fresh:
+            return _cache['grades'], _cache['divisions']
+
+    grades, divisions = _load()
+    with _lock:
+        # Only keep what we loaded if nobody invalidated in the meantime
+        if _version == version:
+            _cache.update({
+                'version': version,
+                'loaded_at': time.monotonic(),
+                'grades': grades,
+                'divisions': divisions,
+            })
+    return grades, divisions
+
+
+def get_scales():
+    """(grade scale, division scale), loaded together."""
+    return _scales()
+
+
+def scale_version(scales=None):
+    """Fingerprint of the grade and division bands in ``scales`` (default: the current ones)."""
+    grades, divisions = scales or _scales()
+    return grades.fingerprint + divisions.fingerprint
+
+
+def get_grade_scale():
+    return _scales()[0]
+
+
+def get_division_scale():
+    return _scales()[1]
+
+
+def ordered_grade_letters():
+    """Grade letters ordered by weight (best grade first)."""
+    rows = sorted(get_grade_scale().rows, key=lambda r: (r['weight'] is None, r['weight']))
+    return [r['grade_letter'] for r in rows]
+
+
+def attach_grades(rows, mark_key='Mark', drop_ungraded=False):
+    """Add grade_letter, remark and weight to each row from its mark.
+
+    Rows whose mark falls outside every band get None values, like the old
+    LEFT JOIN; with ``drop_ungraded`` they are removed instead (inner JOIN).
+    """
+    scale = get_grade_scale()
+    indices = scale.classify([row[mark_key] for row in rows])
+    graded = []
+    for row, i in zip(rows, indices):
+        band = scale.rows[i] if i >= 0 else None
+        if band is None and drop_ungraded:
+            continue
+        row['grade_letter'] = band['grade_letter'] if band else None
+        row['remark'] = band['remark'] if band else None
+        row['weight'] = band['weight'] if band else None
+        graded.append(row)
+    return graded
+
+
+def grade_for(mark):
+    """(grade_letter, remark) for one mark, ('-', '-') when ungraded."""
+    band = get_grade_scale().lookup(mark)
+    return (band['grade_letter'], band['remark']) if band else ('-', '-')
+
+
+def divisions_for(aggregates, scale=None):
+    """Division names for a sequence of aggregates ('N/A' when unmatched)."""
+    scale = scale or get_division_scale()
+    return [scale.rows[i]['division_name'] if i >= 0 else 'N/A' for i in scale.classify(aggregates)]
+
+
+def division_for(aggregate):
+    return divisions_for([aggregate])[0]
@@ -9,6 +9,7 @@ import random
 import logging
 import re  # <-- Add this line
 from apps import get_db_connection
+from apps.report_cache import invalidate_reports
 from jinja2 import TemplateNotFound
 
 
@@ -93,6 +94,7 @@ def add_headmaster_comments():
                     ''', (
                         user_id, min_score, max_score, comment, now, now
                     ))
+                    invalidate_reports()
                     connection.commit()
                     flash("Headmaster comment added successfully.", "success")
                     return redirect(url_for('headmaster_comments_blueprint.add_headmaster_comments'))
@@ -166,6 +168,7 @@ def edit_headmaster_comments(comment_id):
                 SET min_score = %s, max_score = %s, comment = %s, updated_at = %s
                 WHERE comment_id = %s AND user_id = %s
             ''', (min_score, max_score, comment, updated_at, comment_id, user_id))
+            invalidate_reports()
             connection.commit()
 
             flash("Comment updated successfully!", "success")
@@ -214,6 +217,7 @@ def delete_headmaster_comments(comment_id):
 
         # Delete the comment
         cursor.execute("DELETE FROM headmaster_comments WHERE comment_id = %s AND user_id = %s", (comment_id, user_id))
+        invalidate_reports()
         connection.commit()
         flash("Comment deleted successfully.", "success")
 
@@ -0,0 +1,379 @@
+"""Background jobs for long imports, batch reports and bulk updates.
+
+Views ``submit()`` a registered job type with JSON parameters and
+answer straight away with the job id (``job_response``).  The job runs
+on a thread of this worker process with its own app context and
+database connection.  Its state lives in the ``background_jobs`` table,
+so any worker can report progress, accept a cancellation or serve the
+result file.
+
+Job functions are registered with ``@job_type(name, limit)`` and called
+as ``func(job, **params)``.  They report progress with
+``job.progress(done, total, message)``.  That call raises
+``JobCancelled`` once cancellation has been asked for, so a job stops at
+its next progress point.  A function returns a JSON-able result dict
+and may write a file to ``job.result_path(name)`` for download.
+
+At most ``limit`` jobs of a type (``JOB_LIMITS`` can override it) and
+``JOB_WORKERS`` jobs in all run at once per worker process; the rest
+wait their turn in memory.  A queued or running job that has not been
+updated for ``JOB_STALE_SECONDS`` (its worker was restarted) is
+reported as failed.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, jsonify, redirect, request, url_for
+from flask.cli import with_appcontext
+
+from apps.db import get_db_connection
+
+JOBS_TABLE = 'background_jobs'
+ACTIVE_STATUSES = ('queued', 'running')
+
+CREATE_JOBS_TABLE = f"""
+    CREATE TABLE IF NOT EXISTS {JOBS_TABLE} (
+        job_id CHAR(32) NOT NULL PRIMARY KEY,
+        job_type VARCHAR(50) NOT NULL,
+        status VARCHAR(20) NOT NULL,
+        user_id INT NULL,
+        params MEDIUMTEXT NULL,
+        done INT NOT NULL DEFAULT 0,
+        total INT NULL,
+        message VARCHAR(255) NULL,
+        result MEDIUMTEXT NULL,
+        result_file VARCHAR(255) NULL,
+        cancel_requested TINYINT(1) NOT NULL DEFAULT 0,
+        created_at DATETIME NOT NULL,
+        started_at DATETIME NULL,
+        finished_at DATETIME NULL,
+        updated_at DATETIME NOT NULL,
+        KEY idx_background_jobs_user (user_id, created_at),
+        KEY idx_background_jobs_status (status, updated_at)
+    )
+"""
+
+log = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """Raised by ``Job.progress`` once the job has been cancelled."""
+
+
+_job_types = {}  # name -> (func, default limit)
+
+_lock = threading.Lock()
+_executor = None
+_running = Counter()
+_waiting = defaultdict(deque)  # job_type -> job ids
+_cancelled = set()  # cancelled here while queued or running
+_active = set()  # running on this process
+_table_ready = False
+
+
+def job_type(name, limit=1):
+    """Register ``func(job, **params)`` as a job type."""
+    def register(func):
+        _job_types[name] = (func, limit)
+        return func
+    return register
+
+
+def _limit(job_type_name):
+    overrides = dict(
+        part.split('=', 1) for part in current_app.config.get('JOB_LIMITS', '').split(',') if '=' in part
+    )
+    try:
+        return max(1, int(overrides[job_type_name]))
+    except (KeyError, ValueError):
+        return _job_types[job_type_name][1]
+
+
+def _ensure_table(cursor):
+    global _table_ready
+    if not _table_ready:
+        cursor.execute(CREATE_JOBS_TABLE)
+        _table_ready = True
+
+
+def _update(app, job_id, **fields):
+    """Write job fields on a connection of their own, never the job's."""
+    fields['updated_at'] = datetime.now()
+    with app.app_context():
+        with get_db_connection() as connection:
+            with connection.cursor() as cursor:
+                _ensure_table(cursor)
+                cursor.execute(
+                    f"UPDATE {JOBS_TABLE} SET {', '.join(f'{k} = %s' for k in fields)} WHERE job_id = %s",
+                    list(fields.values()) + [job_id]
+                )
+                connection.commit()
+
+
+def _read(app, job_id):
+    with app.app_context():
+        with get_db_connection() as connection:
+            with connection.cursor(dictionary=True) as cursor:
+                _ensure_table(cursor)
+                cursor.execute(f"SELECT * FROM {JOBS_TABLE} WHERE job_id = %s", (job_id,))
+                return cursor.fetchone()
+
+
+class Job:
+    """Handle passed to a running job function."""
+
+    def __init__(self, app, row):
+        self.app = app
+        self.id = row['job_id']
+        self.type = row['job_type']
+        self.user_id = row['user_id']
+        self.result_file = None
+        self._written_at = 0.0
+
+    def cancelled(self):
+        with _lock:
+            if self.id in _cancelled:
+                return True
+        row = _read(self.app, self.id)
+        return bool(row and row['cancel_requested'])
+
+    def progress(self, done, total=None, message=None):
+        """Record progress; raises JobCancelled if the job was cancelled."""
+        with _lock:
+            if self.id in _cancelled:
+                raise JobCancelled()
+        interval = self.app.config.get('JOB_PROGRESS_INTERVAL', 1.0)
+        if time.monotonic() - self._written_at < interval and done != total:
+            return
+        self._written_at = time.monotonic()
+        fields = {'done': done}
+        if total is not None:
+            fields['total'] = total
+        if message is not None:
+            fields['message'] = message[:255]
+        _update(self.app, self.id, **fields)
+        if self.cancelled():
+            raise JobCancelled()
+
+    def result_path(self, filename):
+        """Where to write the job's downloadable result."""
+        folder = os.path.join(self.app.config['JOB_RESULT_FOLDER'], self.id)
+        os.makedirs(folder, exist_ok=True)
+        self.result_file = os.path.join(folder, filename)
+        return self.result_file
+
+
+def _run(app, job_id, job_type_name):
+    try:
+        row = _read(app, job_id)
+        if row is None or row['status'] != 'queued' or row['cancel_requested']:
+            return
+        with _lock:
+            _active.add(job_id)
+        _update(app, job_id, status='running', started_at=datetime.now())
+        job = Job(app, row)
+        func = _job_types[job_type_name][0]
+        try:
+            with app.app_context():
+                result = func(job, **json.loads(row['params'] or '{}'))
+        except JobCancelled:
+            _update(app, job_id, status='cancelled', message='Cancelled.', finished_at=datetime.now())
+        except Exception as e:
+            log.exception("Job %s (%s) failed", job_id, job_type_name)
+            _update(app, job_id, status='failed', message=str(e)[:255], finished_at=datetime.now())
+        else:
+            result = result or {}
+            _update(
+                app, job_id, status='finished', finished_at=datetime.now(),
+                message=(result.get('message') or 'Finished.')[:255],
+                result=json.dumps(result, default=str), result_file=job.result_file
+            )
+    except Exception:
+        log.exception("Job %s could not be run", job_id)
+    finally:
+        with _lock:
+            _cancelled.discard(job_id)
+            _active.discard(job_id)
+        _release(app, job_type_name)
+
+
+def _start(app, job_id, job_type_name):
+    """Run now if the type has room, else queue; caller holds ``_lock``."""
+    global _executor
+    if _running[job_type_name] >= _limit(job_type_name):
+        _waiting[job_type_name].append(job_id)
+        return
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=app.config.get('JOB_WORKERS', 4), thread_name_prefix='job'
+        )
+    _running[job_type_name] += 1
+    _executor.submit(_run, app, job_id, job_type_name)
+
+
+def _release(app, job_type_name):
+    with _lock:
+        _running[job_type_name] -= 1
+        if _waiting[job_type_name]:
+            with app.app_context():
+                _start(app, _waiting[job_type_name].popleft(), job_type_name)
+
+
+def submit(job_type_name, params=None, user_id=None, message=None):
+    """Queue a job; returns its id straight away."""
+    if job_type_name not in _job_types:
+        raise ValueError(f"Unknown job type: {job_type_name}")
+    app = current_app._get_current_object()
+    job_id = uuid.uuid4().hex
+    now = datetime.now()
+    with app.app_context():
+        with get_db_connection() as connection:
+            with connection.cursor() as cursor:
+                _ensure_table(cursor)
+                cursor.execute(f"""
+                    INSERT INTO {JOBS_TABLE}
+                    (job_id, job_type, status, user_id, params, message, created_at, updated_at)
+                    VALUES (%s, %s, 'queued', %s, %s, %s, %s, %s)
+                """, (job_id, job_type_name, user_id, json.dumps(params or {}, default=str),
+                      (message or 'Queued.')[:255], now, now))
+                connection.commit()
+    with _lock:
+        _start(app, job_id, job_type_name)
+    return job_id
+
+
+def _public(row):
+    """A job row as the JSON the status endpoints return."""
+    job = dict(row)
+    job['params'] = json.loads(job['params'] or '{}')
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    job['has_file'] = bool(job.pop('result_file'))
+    job['cancel_requested'] = bool(job['cancel_requested'])
+    job['percent'] = round(job['done'] * 100 / job['total'], 1) if job['total'] else None
+    for key in ('created_at', 'started_at', 'finished_at', 'updated_at'):
+        job[key] = job[key].isoformat() if job[key] else None
+    return job
+
+
+def _expire_if_stale(row):
+    stale_after = timedelta(seconds=current_app.config.get('JOB_STALE_SECONDS', 3600))
+    if row['status'] in ACTIVE_STATUSES and datetime.now() - row['updated_at'] > stale_after:
+        with _lock:
+            local = row['job_id'] in _active or any(row['job_id'] in q for q in _waiting.values())
+        if not local:
+            message = 'Interrupted: the worker running this job stopped.'
+            _update(current_app._get_current_object(), row['job_id'], status='failed',
+                    message=message, finished_at=datetime.now())
+            row.update(status='failed', message=message)
+    return row
+
+
+def get_job(job_id, raw=False):
+    """The job's status dict, or None."""
+    row = _read(current_app._get_current_object(), job_id)
+    if row is None:
+        return None
+    row = _expire_if_stale(row)
+    return row if raw else _public(row)
+
+
+def list_jobs(user_id=None, limit=20):
+    """Most recent jobs, of one user when ``user_id`` is given."""
+    with current_app.app_context():
+        with get_db_connection() as connection:
+            with connection.cursor(dictionary=True) as cursor:
+                _ensure_table(cursor)
+                sql = f"SELECT * FROM {JOBS_TABLE}"
+                params = []
+                if user_id is not None:
+                    sql += " WHERE user_id = %s"
+                    params.append(user_id)
+                cursor.execute(sql + " ORDER BY created_at DESC LIMIT %s", params + [limit])
+                rows = cursor.fetchall()
+    return [_public(_expire_if_stale(row)) for row in rows]
+
+
+def active_job(job_type_name):
+    """Id of a queued or running job of this type that is not stale, or None."""
+    stale_after = timedelta(seconds=current_app.config.get('JOB_STALE_SECONDS', 3600))
+    with current_app.app_context():
+        with get_db_connection() as connection:
+            with connection.cursor() as cursor:
+                _ensure_table(cursor)
+                cursor.execute(f"""
+                    SELECT job_id FROM {JOBS_TABLE}
+                    WHERE job_type = %s AND status IN (%s, %s) AND updated_at > %s
+                    ORDER BY created_at DESC LIMIT 1
+                """, (job_type_name, *ACTIVE_STATUSES, datetime.now() - stale_after))
+                row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def cancel_job(job_id):
+    """Ask a job to stop; a queued job is cancelled at once."""
+    app = current_app._get_current_object()
+    row = _read(app, job_id)
+    if row is None or row['status'] not in ACTIVE_STATUSES:
+        return False
+    with _lock:
+        _cancelled.add(job_id)
+        for queue in _waiting.values():
+            if job_id in queue:
+                queue.remove(job_id)
+                _cancelled.discard(job_id)
+    if row['status'] == 'queued':
+        _update(app, job_id, status='cancelled', cancel_requested=1,
+                message='Cancelled.', finished_at=datetime.now())
+    else:
+        _update(app, job_id, cancel_requested=1, message='Cancelling...')
+    return True
+
+
+def job_response(job_id):
+    """202 with the job id for JSON clients, else the job's status page."""
+    if request.accept_mimetypes.best == 'application/json' or request.is_json:
+        return jsonify({
+            'job_id': job_id,
+            'status_url': url_for('jobs_blueprint.job_status', job_id=job_id),
+            'page_url': url_for('jobs_blueprint.job_page', job_id=job_id),
+        }), 202
+    return redirect(url_for('jobs_blueprint.job_page', job_id=job_id))
+
+
+def purge_jobs(days):
+    """Delete finished jobs older than ``days`` and their result files."""
+    cutoff = datetime.now() - timedelta(days=days)
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            _ensure_table(cursor)
+            cursor.execute(
+                f"SELECT job_id FROM {JOBS_TABLE} WHERE status NOT IN ('queued', 'running') AND created_at < %s",
+                (cutoff,)
+            )
+            job_ids = [row[0] for row in cursor.fetchall()]
+            for start in range(0, len(job_ids), 500):
+                chunk = job_ids[start:start + 500]
+                cursor.execute(
+                    f"DELETE FROM {JOBS_TABLE} WHERE job_id IN ({', '.join(['%s'] * len(chunk))})", chunk
+                )
+            connection.commit()
+    for job_id in job_ids:
+        shutil.rmtree(os.path.join(current_app.config['JOB_RESULT_FOLDER'], job_id), ignore_errors=True)
+    return len(job_ids)
+
+
+@click.command('purge-jobs')
+@click.option('--days', default=30, show_default=True, help='Keep jobs newer than this.')
+@with_appcontext
+def purge_jobs_command(days):
+    """Delete old background jobs and their result files."""
+    click.echo(f"Deleted {purge_jobs(days)} job(s).")
@@ -0,0 +1,59 @@
+import os
+
+from flask import abort, jsonify, render_template, send_file, session
+
+from apps.jobs import blueprint
+from apps.job_runner import cancel_job, get_job, list_jobs
+from apps.utils.decorators import login_required
+
+
+ADMIN_ROLES = ['admin', 'super_admin']
+
+
+def _visible_job(job_id, raw=False):
+    """The job if the current user may see it (their own, or any for admins)."""
+    job = get_job(job_id, raw=raw)
+    if job is None:
+        abort(404)
+    if session.get('role') not in ADMIN_ROLES and job['user_id'] != session.get('id'):
+        abort(403)
+    return job
+
+
+@blueprint.route('/', methods=['GET'])
+@login_required
+def jobs():
+    """The current user's recent jobs (everyone's for admins)."""
+    user_id = None if session.get('role') in ADMIN_ROLES else session.get('id')
+    return jsonify(list_jobs(user_id))
+
+
+@blueprint.route('/<job_id>', methods=['GET'])
+@login_required
+def job_page(job_id):
+    return render_template('jobs/job.html', job=_visible_job(job_id), segment='jobs')
+
+
+@blueprint.route('/<job_id>/status', methods=['GET'])
+@login_required
+def job_status(job_id):
+    return jsonify(_visible_job(job_id))
+
+
+@blueprint.route('/<job_id>/cancel', methods=['POST'])
+@login_required
+def job_cancel(job_id):
+    _visible_job(job_id)
+    if not cancel_job(job_id):
+        return jsonify({'error': 'The job has already ended.'}), 409
+    return jsonify(get_job(job_id))
+
+
+@blueprint.route('/<job_id>/download', methods=['GET'])
+@login_required
+def job_download(job_id):
+    job = _visible_job(job_id, raw=True)
+    path = job['result_file']
+    if job['status'] != 'finished' or not path or not os.path.exists(path):
+        abort(404)
+    return send_file(path, as_attachment=True, download_name=os.path.basename(path))
@@ -0,0 +1,36 @@
+from apps.monitoring import blueprint
+from flask import jsonify, session
+from apps.db import get_pool_stats
+from apps.query_stats import query_stats_summary
+from apps.report_cache import report_cache_stats
+from apps.utils.decorators import login_required
+
+
+ADMIN_ROLES = ['admin', 'super_admin']
+
+
+@blueprint.route('/db_pool', methods=['GET'])
+@login_required
+def db_pool():
+    """Connection pool counters for this worker, used to size DB_POOL_SIZE."""
+    if session.get('role') not in ADMIN_ROLES:
+        return jsonify({'error': 'forbidden'}), 403
+    return jsonify(get_pool_stats())
+
+
+@blueprint.route('/report_cache', methods=['GET'])
+@login_required
+def report_cache():
+    """Report page cache hit/miss counters for this worker."""
+    if session.get('role') not in ADMIN_ROLES:
+        return jsonify({'error': 'forbidden'}), 403
+    return jsonify(report_cache_stats())
+
+
+@blueprint.route('/queries', methods=['GET'])
+@login_required
+def queries():
+    """Rolling per-endpoint SQL counts and timings for this worker."""
+    if session.get('role') not in ADMIN_ROLES:
+        return jsonify({'error': 'forbidden'}), 403
+    return jsonify(query_stats_summary())
@@ -83,7 +83,6 @@ def restock_item():
             # Update the product's quantity
             new_quantity = product['quantity'] + restock_quantity
             cursor.execute('UPDATE product_list SET quantity = %s WHERE sku = %s', (new_quantity, sku))
-            connection.commit()
 
             # Log the inventory change (restock) with user_id
             cursor.execute("""
@@ -0,0 +1,245 @@
+"""Keyset pagination and server-side sorting for the listing pages.
+
+A listing passes its select list, FROM clause, filters and sort
+options to ``keyset_page()``::
+
+    PUPIL_SORTS = {
+        'name': SortKey('Name', ['p.last_name', 'p.first_name', 'p.pupil_id']),
+        'reg_no': SortKey('Reg No', ['p.reg_no', 'p.pupil_id']),
+    }
+
+Every sort ends with a unique column, so a page boundary is exactly one
+row.  There is no OFFSET.  The next page starts after the boundary row's
+sort values (``a > x OR (a = x AND b > y) ...``, NULLs sorting first as
+MySQL does), and an index on the sort columns can seek straight to it.
+Page time stays flat however deep the reader goes.  Boundaries travel as
+opaque ``after``/``before`` tokens in the query string, next to
+``sort``, ``dir`` and ``per_page``.  ``flask add-listing-indexes`` adds
+the indexes the sorts rely on.
+
+Totals are estimates.  A listing's ``COUNT(*)`` for a filter set runs at
+most once per ``PAGE_COUNT_TTL`` seconds per worker process.  Unfiltered
+listings read the table's row estimate from ``information_schema``
+instead.
+"""
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import click
+from flask import current_app, request, url_for
+from flask.cli import with_appcontext
+
+from apps.db import get_db_connection
+
+SortKey = namedtuple('SortKey', 'label columns')
+
+KEEP_COUNTS = 500
+
+# (table, index name, columns) behind the listing sorts
+LISTING_INDEXES = [
+    ('pupils', 'idx_pupils_name', ['last_name', 'first_name', 'pupil_id']),
+    ('pupils', 'idx_pupils_reg_no', ['reg_no', 'pupil_id']),
+    ('fixed_assets', 'idx_fixed_assets_description', ['AssetDescription', 'AssetID']),
+    ('sales', 'idx_sales_date', ['date_updated', 'salesID']),
+    ('user_activity', 'idx_user_activity_login', ['user_id', 'login_time', 'id']),
+]
+
+_lock = threading.Lock()
+_counts = OrderedDict()  # (listing, filters, params) -> (count, is_estimate, stored_at)
+
+
+def _encode(values):
+    raw = json.dumps(values, default=str, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode(token, length):
+    """Boundary values from a token, or None if it is missing or not ours."""
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) and len(values) == length else None
+
+
+def _bind(params, value):
+    """Add a value to the query's params, named or positional like the rest."""
+    if isinstance(params, dict):
+        name = f'_k{len(params)}'
+        params[name] = value
+        return f'%({name})s'
+    params.append(value)
+    return '%s'
+
+
+def _seek(columns, values, ascending, params):
+    """WHERE clause for the rows that sort after ``values``."""
+    branches = []
+    for i, column in enumerate(columns):
+        value = values[i]
+        # NULLs sort first: every non-NULL follows a NULL ascending, nothing does descending
+        if value is None and not ascending:
+            continue
+        terms = [
+            f"{prior} IS NULL" if prior_value is None else f"{prior} = {_bind(params, prior_value)}"
+            for prior, prior_value in zip(columns[:i], values[:i])
+        ]
+        if value is None:
+            terms.append(f"{column} IS NOT NULL")
+        elif ascending:
+            terms.append(f"{column} > {_bind(params, value)}")
+        else:
+            terms.append(f"({column} < {_bind(params, value)} OR {column} IS NULL)")
+        branches.append('(' + ' AND '.join(terms) + ')')
+    return '(' + (' OR '.join(branches) or '1 = 0') + ')'
+
+
+def _page_url(**changes):
+    args = request.args.to_dict(flat=False)
+    for key, value in changes.items():
+        if value is None:
+            args.pop(key, None)
+        else:
+            args[key] = value
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+
+def _params_key(params):
+    items = params.items() if isinstance(params, dict) else enumerate(params)
+    return json.dumps(sorted((str(k), v) for k, v in items), default=str)
+
+
+def estimated_count(cursor, listing, from_sql, where, params, table=None):
+    """(row count, is_estimate) for a listing's filter set, cached for a while."""
+    key = (listing, tuple(where), _params_key(params))
+    ttl = current_app.config.get('PAGE_COUNT_TTL', 300)
+    with _lock:
+        entry = _counts.get(key)
+        if entry and time.monotonic() - entry[2] < ttl:
+            _counts.move_to_end(key)
+            return entry[0], entry[1]
+
+    if not where and table:
+        cursor.execute("""
+            SELECT TABLE_ROWS AS total FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        """, (table,))
+        is_estimate = True
+    else:
+        cursor.execute(
+            f"SELECT COUNT(*) AS total {from_sql}" + (" WHERE " + " AND ".join(where) if where else ""),
+            params
+        )
+        is_estimate = False
+    row = cursor.fetchone()
+    total = int(row['total'] or 0) if row else 0
+
+    with _lock:
+        _counts[key] = (total, is_estimate, time.monotonic())
+        while len(_counts) > KEEP_COUNTS:
+            _counts.popitem(last=False)
+    return total, is_estimate
+
+
+def keyset_page(cursor, listing, select_sql, from_sql, where, params, sorts, default_sort,
+                default_dir='asc', count_table=None):
+    """One page of a listing, in the order asked for by the query string.
+
+    ``cursor`` must return dicts.  ``where`` is a list of AND-ed clauses
+    whose placeholders are in ``params`` (a dict for ``%(name)s``, a list
+    for ``%s``).  Returns a dict with the page's ``rows``, ``next_url``
+    and ``prev_url`` (None at either end), the ``sort`` links, the page
+    size and the (estimated) ``total``.
+    """
+    config = current_app.config
+    sort = request.args.get('sort')
+    sort = sort if sort in sorts else default_sort
+    direction = request.args.get('dir', default_dir)
+    direction = direction if direction in ('asc', 'desc') else default_dir
+    per_page = request.args.get('per_page', type=int) or config.get('PAGE_SIZE', 50)
+    per_page = max(1, min(per_page, config.get('PAGE_SIZE_MAX', 500)))
+    columns = sorts[sort].columns
+
+    after = _decode(request.args.get('after'), len(columns))
+    before = None if after else _decode(request.args.get('before'), len(columns))
+    # A previous page is the rows before the boundary, read in reverse
+    backwards = before is not None
+    ascending = (direction == 'asc') != backwards
+
+    page_params = dict(params) if isinstance(params, dict) else list(params)
+    clauses = list(where)
+    boundary = before if backwards else after
+    if boundary is not None:
+        clauses.append(_seek(columns, boundary, ascending, page_params))
+
+    keys = ', '.join(f"{column} AS _k{i}" for i, column in enumerate(columns))
+    order = ', '.join(f"{column} {'ASC' if ascending else 'DESC'}" for column in columns)
+    cursor.execute(
+        f"SELECT {select_sql}, {keys} {from_sql}"
+        + (" WHERE " + " AND ".join(clauses) if clauses else "")
+        + f" ORDER BY {order} LIMIT {per_page + 1}",
+        page_params
+    )
+    rows = cursor.fetchall()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+    bounds = [[row.pop(f'_k{i}') for i in range(len(columns))] for row in rows]
+
+    has_next = boundary is not None if backwards else more
+    has_prev = more if backwards else boundary is not None
+    total, is_estimate = estimated_count(cursor, listing, from_sql, where, params, count_table)
+
+    return {
+        'rows': rows,
+        'next_url': _page_url(after=_encode(bounds[-1]), before=None) if has_next and bounds else None,
+        'prev_url': _page_url(before=_encode(bounds[0]), after=None) if has_prev and bounds else None,
+        'first_url': _page_url(after=None, before=None) if boundary is not None else None,
+        'sorts': [
+            {
+                'label': key.label,
+                'active': name == sort,
+                'dir': direction if name == sort else None,
+                'url': _page_url(sort=name, after=None, before=None,
+                                 dir=('desc' if direction == 'asc' else 'asc') if name == sort else 'asc'),
+            }
+            for name, key in sorts.items()
+        ],
+        'per_page': per_page,
+        'per_page_urls': [
+            (size, _page_url(per_page=size, after=None, before=None))
+            for size in (25, 50, 100, 250) if size <= config.get('PAGE_SIZE_MAX', 500)
+        ],
+        'total': total,
+        'total_is_estimate': is_estimate,
+    }
+
+
+@click.command('add-listing-indexes')
+@with_appcontext
+def add_listing_indexes_command():
+    """Add the indexes behind the listing pages' keyset sorts.
+
+    An index of the same name over other columns is replaced.
+    """
+    with get_db_connection() as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            for table, name, columns in LISTING_INDEXES:
+                cursor.execute("""
+                    SELECT COLUMN_NAME FROM information_schema.STATISTICS
+                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+                    ORDER BY SEQ_IN_INDEX
+                """, (table, name))
+                existing = [row['COLUMN_NAME'] for row in cursor.fetchall()]
+                if existing == columns:
+                    click.echo(f"{table} already has {name}.")
+                    continue
+                drop = f"DROP INDEX {name}, " if existing else ""
+                cursor.execute(f"ALTER TABLE {table} {drop}ADD INDEX {name} ({', '.join(columns)})")
+                click.echo(f"Rebuilt {name} on {table}." if existing else f"Added {name} to {table}.")
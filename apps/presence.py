@@ -0,0 +1,130 @@
+"""Who is online, for the user management page.
+
+A user is online while they have a session the store has seen within
+``SESSION_IDLE_TIMEOUT`` (see ``apps.server_sessions``).  Each worker
+keeps a snapshot of the online user ids, refreshed from ``user_sessions``
+at most every ``PRESENCE_REFRESH`` seconds with one query over the live
+sessions.  Every refresh is compared with the last one, and each user
+who came or went is logged as a numbered change.  Logins, logouts and
+forced logouts handled by this worker are logged straight away through
+``set_status()``.
+
+The page polls ``statuses_since(token)`` and gets only the changes after
+its token.  A token from another worker, or one older than the
+``PRESENCE_HISTORY`` changes kept, gets the full online list instead.
+Tokens are ``<worker epoch>.<version>``.
+"""
+import secrets
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+
+from apps.db import get_db_connection
+from apps.server_sessions import SESSIONS_TABLE, online_since
+
+_lock = threading.Lock()
+_epoch = secrets.token_hex(4)
+_state = {'online': set(), 'version': 0, 'refreshed_at': None, 'refreshing': False}
+_changes = deque()  # (version, user_id, online), oldest first
+_pinned = {}  # user_id -> until when a local login/logout outranks the table
+
+
+def _record(user_id, online):
+    """Log a change of one user; caller holds ``_lock``."""
+    if (user_id in _state['online']) == online:
+        return
+    if online:
+        _state['online'].add(user_id)
+    else:
+        _state['online'].discard(user_id)
+    _state['version'] += 1
+    _changes.append((_state['version'], user_id, online))
+    history = current_app.config.get('PRESENCE_HISTORY', 1000)
+    while len(_changes) > history:
+        _changes.popleft()
+
+
+def set_status(user_id, online):
+    """Record a login (True) or logout (False) handled by this worker."""
+    if user_id is None:
+        return
+    interval = current_app.config.get('PRESENCE_REFRESH', 5)
+    with _lock:
+        _record(int(user_id), online)
+        # The session row is written after the response; don't let a refresh undo this
+        _pinned[int(user_id)] = time.monotonic() + 2 * interval
+
+
+def _online_users():
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT DISTINCT user_id FROM {SESSIONS_TABLE}
+                WHERE last_seen > %s AND revoked = 0 AND user_id IS NOT NULL
+            """, (online_since(),))
+            return {int(row[0]) for row in cursor.fetchall()}
+
+
+def _refresh():
+    interval = current_app.config.get('PRESENCE_REFRESH', 5)
+    with _lock:
+        fresh = _state['refreshed_at'] is not None and time.monotonic() - _state['refreshed_at'] < interval
+        if fresh or _state['refreshing']:
+            return
+        _state['refreshing'] = True
+    try:
+        online = _online_users()
+        now = time.monotonic()
+        with _lock:
+            for user_id, until in list(_pinned.items()):
+                if until < now:
+                    del _pinned[user_id]
+            for user_id in sorted(_state['online'] - online - set(_pinned)):
+                _record(user_id, False)
+            for user_id in sorted(online - _state['online'] - set(_pinned)):
+                _record(user_id, True)
+            _state['refreshed_at'] = now
+    finally:
+        with _lock:
+            _state['refreshing'] = False
+
+
+def _token():
+    return f"{_epoch}.{_state['version']}"
+
+
+def online_snapshot():
+    """(token, set of online user ids) for rendering the page."""
+    _refresh()
+    with _lock:
+        return _token(), set(_state['online'])
+
+
+def statuses_since(token=None):
+    """What changed after ``token``, as a JSON-ready dict.
+
+    ``{'token', 'full': False, 'changes': [{'id', 'online'}, ...]}`` when
+    this worker still has every change after ``token``, otherwise
+    ``{'token', 'full': True, 'online': [ids]}``.
+    """
+    _refresh()
+    epoch, _, version = (token or '').partition('.')
+    with _lock:
+        oldest = _changes[0][0] if _changes else _state['version'] + 1
+        try:
+            version = int(version)
+        except ValueError:
+            version = None
+        if epoch == _epoch and version is not None and oldest - 1 <= version <= _state['version']:
+            latest = {}
+            for number, user_id, online in _changes:
+                if number > version:
+                    latest[user_id] = online
+            return {
+                'token': _token(),
+                'full': False,
+                'changes': [{'id': user_id, 'online': online} for user_id, online in latest.items()],
+            }
+        return {'token': _token(), 'full': True, 'online': sorted(_state['online'])}
@@ -18,6 +18,8 @@ from mysql.connector import Error
 
 from apps.promote import blueprint
 from apps import get_db_connection
+from apps.report_cache import invalidate_reports
+from apps.job_runner import job_response, job_type, submit
 
 import numpy as np
 
@@ -129,79 +131,132 @@ def get_kampala_time():
     kampala = pytz.timezone("Africa/Kampala")
     return datetime.now(kampala)
 
+PROMOTE_CHUNK = 1000
+PROMOTE_SCOPES = ('selected', 'class', 'stream', 'school')
+
+# Pupils not already in the target term (NULL terms are promoted too)
+NOT_IN_TERM = "(p.term_id IS NULL OR p.term_id <> %s)"
+
+
 @blueprint.route('/promote_pupil', methods=['POST'])
 def promote_pupil():
-    assigned_by = session.get('id')
+    """Promote the ticked pupils, or a whole class, stream or school
+    (scope=class|stream|school), to a term as a background job."""
+    scope = request.form.get('scope', 'selected')
     selected_pupil_ids = request.form.getlist('pupil_ids')
-    term_id = request.form.get('term')
-    flash_messages = []
+    term_id = request.form.get('term', type=int)
+    class_id = request.form.get('class_id', type=int)
+    stream_id = request.form.get('stream_id', type=int)
+
+    if scope not in PROMOTE_SCOPES:
+        flash('Unknown promotion scope.', 'warning')
+        return redirect(url_for('promote_blueprint.ppr_promote'))
 
-    if not selected_pupil_ids:
+    if scope == 'selected' and not selected_pupil_ids:
         flash('No pupils were selected.', 'warning')
-        return redirect(url_for('promote_blueprint.pr_promote'))
+        return redirect(url_for('promote_blueprint.ppr_promote'))
+
+    if (scope == 'class' and not class_id) or (scope == 'stream' and not stream_id):
+        flash(f'No {scope} was selected.', 'warning')
+        return redirect(url_for('promote_blueprint.ppr_promote'))
 
     if not term_id:
         flash('No term was selected.', 'warning')
-        return redirect(url_for('promote_blueprint.pr_promote'))
+        return redirect(url_for('promote_blueprint.ppr_promote'))
+
+    job_id = submit('promotion', {
+        'scope': scope,
+        'pupil_ids': [int(pupil_id) for pupil_id in selected_pupil_ids if pupil_id.isdigit()],
+        'class_id': class_id,
+        'stream_id': stream_id,
+        'term_id': term_id,
+        'assigned_by': session.get('id'),
+        'back_url': url_for('promote_blueprint.ppr_promote'),
+    }, user_id=session.get('id'))
+    return job_response(job_id)
+
+
+def _promotion_batches(scope, pupil_ids, class_id, stream_id):
+    """(WHERE clause on pupils p, params, pupil ids asked for or None) per batch."""
+    if scope == 'selected':
+        for start in range(0, len(pupil_ids), PROMOTE_CHUNK):
+            chunk = pupil_ids[start:start + PROMOTE_CHUNK]
+            yield f"p.pupil_id IN ({', '.join(['%s'] * len(chunk))})", list(chunk), chunk
+    elif scope == 'class':
+        yield "p.class_id = %s", [class_id], None
+    elif scope == 'stream':
+        yield "p.stream_id = %s", [stream_id], None
+    else:
+        yield "1 = 1", [], None
+
+
+@job_type('promotion', limit=1)
+def promote_pupils_job(job, term_id, scope='selected', pupil_ids=(), class_id=None, stream_id=None,
+                       assigned_by=None, back_url=None):
+    """Move pupils to a term with one INSERT ... SELECT into enrollment_history
+    and one UPDATE per batch, instead of three statements per pupil."""
+    pupil_ids = list(dict.fromkeys(int(pupil_id) for pupil_id in pupil_ids))
+    batches = list(_promotion_batches(scope, pupil_ids, class_id, stream_id))
+    skipped = []
+    promoted = 0
+    job.progress(0, len(batches), message='Promoting pupils...')
 
     connection = get_db_connection()
     cursor = connection.cursor(dictionary=True)
 
     try:
-        for pupil_id in selected_pupil_ids:
-            # Get current pupil details
-            cursor.execute("SELECT term_id, class_id, stream_id, year_id FROM pupils WHERE pupil_id = %s", (pupil_id,))
-            result = cursor.fetchone()
-
-            if not result:
-                flash_messages.append(f'Pupil {pupil_id} not found in the database, skipping.')
-                continue
-
-            current_term_id = result['term_id']
-
-            if str(current_term_id) == str(term_id):
-                flash_messages.append(f'Pupil {pupil_id} is already assigned to the selected term.')
-                continue
-
-            # Perform the update
-            cursor.execute("UPDATE pupils SET term_id = %s WHERE pupil_id = %s", (term_id, pupil_id))
-
-            # Log to enrollment_history
-            cursor.execute("""
+        for done, (where, params, asked) in enumerate(batches, 1):
+            # Lock the batch and find the pupils that stay where they are
+            cursor.execute(
+                f"SELECT p.pupil_id, p.reg_no, p.term_id FROM pupils p WHERE {where} FOR UPDATE", params
+            )
+            found = {row['pupil_id']: row for row in cursor.fetchall()}
+            for pupil_id in asked or []:
+                if pupil_id not in found:
+                    skipped.append([pupil_id, None, 'Not found in the database'])
+            for row in found.values():
+                if row['term_id'] is not None and int(row['term_id']) == int(term_id):
+                    skipped.append([row['pupil_id'], row['reg_no'], 'Already assigned to the selected term'])
+
+            # History first: it records the class, stream and year the pupils move in
+            cursor.execute(f"""
                 INSERT INTO enrollment_history (
                     pupil_id, class_id, stream_id, term_id, year_id,
                     action_type, registered_by, notes, timestamp
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                pupil_id,
-                result['class_id'],
-                result['stream_id'],
-                term_id,
-                result['year_id'],
-                'promote',
-                assigned_by,
-                'Promoted to new term',
-                get_kampala_time()
-            ))
-
+                )
+                SELECT p.pupil_id, p.class_id, p.stream_id, %s, p.year_id,
+                       'promote', %s, 'Promoted to new term', %s
+                FROM pupils p
+                WHERE {where} AND {NOT_IN_TERM}
+            """, [term_id, assigned_by, get_kampala_time()] + params + [term_id])
+
+            cursor.execute(
+                f"UPDATE pupils p SET p.term_id = %s WHERE {where} AND {NOT_IN_TERM}",
+                [term_id] + params + [term_id]
+            )
+            promoted += cursor.rowcount
+
+            # Cancelling rolls the whole promotion back
+            job.progress(done, len(batches))
+
+        invalidate_reports()
         connection.commit()
 
-        # Flash all warning/success messages
-        for message in flash_messages:
-            flash(message, 'warning' if 'already' in message or 'skipping' in message else 'success')
-
-        if not flash_messages or all('already' not in msg and 'skipping' not in msg for msg in flash_messages):
-            flash(f'{len(selected_pupil_ids)} pupil(s) promoted successfully.', 'success')
-
-    except Exception as e:
+    except Exception:
         connection.rollback()
-        flash(f'Error while promoting pupils: {str(e)}', 'danger')
+        raise
 
     finally:
         cursor.close()
         connection.close()
 
-    return redirect(url_for('promote_blueprint.pr_promote'))
+    return {
+        'message': f'{promoted} pupil(s) promoted successfully.',
+        'counts': {'promoted': promoted, 'skipped': len(skipped)},
+        'columns': ['Pupil ID', 'Reg No', 'Reason skipped'],
+        'rows': skipped,
+        'back_url': back_url,
+    }
 
 
 
@@ -0,0 +1,221 @@
+"""Bulk pupil import from the admissions workbook.
+
+The sheet is cleaned and validated as a whole DataFrame, reg_no clashes
+are looked up only for the reg_nos in the file, and new pupils are
+written with multi-row INSERTs.  When a batch fails, it is split in
+half and retried until the offending rows are isolated; the rest of the
+batch still goes in.
+
+Everything ends up in an import report::
+
+    {'inserted':   [(row_no, reg_no), ...],
+     'duplicates': [(row_no, reg_no, reason), ...],
+     'invalid':    [(row_no, reg_no, reason), ...]}
+
+where ``row_no`` is the Excel row number.  Uploads run as the
+``pupil_import`` background job, whose result lists the report's
+duplicate and invalid rows.
+"""
+import os
+
+import pandas as pd
+from mysql.connector import DataError, IntegrityError, errorcode
+
+from apps.db import get_db_connection
+from apps.job_runner import job_type
+from apps.pupil_search import invalidate_pupil_index
+from apps.reference_data import reference_names
+from apps.report_cache import invalidate_reports
+
+REQUIRED_COLUMNS = [
+    "reg_no", "first_name", "other_name", "last_name", "nin_number", "emis_number",
+    "date_of_birth", "gender", "class", "admission_date", "study_year",
+    "home_district", "address", "emergency_contact", "medical_info", "special_needs",
+    "attendance_record", "academic_performance", "notes", "residential_status"
+]
+TEXT_COLUMNS = [
+    'reg_no', 'first_name', 'other_name', 'last_name', 'nin_number', 'emis_number',
+    'gender', 'home_district', 'address', 'emergency_contact', 'medical_info',
+    'special_needs', 'attendance_record', 'academic_performance', 'notes', 'residential_status'
+]
+DATE_COLUMNS = ['date_of_birth', 'admission_date']
+PUPIL_COLUMNS = [
+    'reg_no', 'first_name', 'other_name', 'last_name', 'nin_number', 'emis_number',
+    'date_of_birth', 'gender', 'class_id', 'admission_date', 'year_id',
+    'home_district', 'address', 'emergency_contact', 'medical_info', 'special_needs',
+    'attendance_record', 'academic_performance', 'notes', 'residential_status'
+]
+BATCH_SIZE = 500
+IMPORT_JOB = 'pupil_import'
+
+
+def new_report():
+    return {'inserted': [], 'duplicates': [], 'invalid': []}
+
+
+def _chunks(items, size=BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def existing_reg_nos(cursor, reg_nos):
+    """The subset of ``reg_nos`` already used by a pupil."""
+    found = set()
+    for chunk in _chunks(sorted(reg_nos)):
+        cursor.execute(
+            f"SELECT reg_no FROM pupils WHERE reg_no IN ({','.join(['%s'] * len(chunk))})",
+            chunk
+        )
+        found.update(str(row[0]).strip() for row in cursor.fetchall())
+    return found
+
+
+def prepare_pupils(df, cursor, report):
+    """Clean and validate the sheet; returns the pupil rows to insert.
+
+    Rejected rows are added to ``report``.  Each returned row is a tuple
+    of (row_no, values in PUPIL_COLUMNS order).
+    """
+    df = df.dropna(how='all')
+    if df.empty:
+        return []
+
+    class_map = {str(name).strip(): int(id_) for id_, name in reference_names('classes').items()}
+    year_map = {str(name).strip(): int(id_) for id_, name in reference_names('study_year').items()}
+
+    def clean(column):
+        values = df[column] if column in df else pd.Series(None, index=df.index, dtype=object)
+        return values.where(values.notna(), '').astype(str).str.strip()
+
+    frame = pd.DataFrame({c: clean(c) for c in TEXT_COLUMNS + ['class', 'study_year']}, index=df.index)
+    frame['residential_status'] = frame['residential_status'].str.lower()
+    frame['row_no'] = df.index + 2  # Excel row numbers
+    frame['class_id'] = frame['class'].map(class_map)
+    frame['year_id'] = frame['study_year'].map(year_map)
+
+    bad_dates = {}
+    for column in DATE_COLUMNS:
+        parsed = pd.to_datetime(df[column], errors='coerce')
+        bad_dates[column] = parsed.isna() & df[column].notna()
+        frame[column] = parsed.dt.date.astype(object).where(parsed.notna(), None)
+
+    missing = frame[['reg_no', 'class', 'study_year']].eq('').any(axis=1)
+    repeated = frame['reg_no'].duplicated(keep='first') & ~missing
+    rejected = missing | repeated | frame['class_id'].isna() | frame['year_id'].isna()
+    for mask in bad_dates.values():
+        rejected |= mask
+
+    # Messages are only built for the rejected rows
+    for idx in frame.index[rejected]:
+        row_no, reg_no = int(frame.at[idx, 'row_no']), frame.at[idx, 'reg_no']
+        if missing[idx]:
+            report['invalid'].append((row_no, reg_no, "Missing required fields."))
+        elif repeated[idx]:
+            report['duplicates'].append((row_no, reg_no, "Repeated in file."))
+        else:
+            reasons = []
+            if pd.isna(frame.at[idx, 'class_id']):
+                reasons.append(f"Invalid class '{frame.at[idx, 'class']}'.")
+            if pd.isna(frame.at[idx, 'year_id']):
+                reasons.append(f"Invalid study year '{frame.at[idx, 'study_year']}'.")
+            for column, mask in bad_dates.items():
+                if mask[idx]:
+                    reasons.append(f"Invalid {column.replace('_', ' ')} '{df.at[idx, column]}'.")
+            report['invalid'].append((row_no, reg_no, ' '.join(reasons)))
+
+    frame = frame[~rejected]
+    taken = existing_reg_nos(cursor, set(frame['reg_no']))
+    clash = frame['reg_no'].isin(taken)
+    for row_no, reg_no in frame.loc[clash, ['row_no', 'reg_no']].itertuples(index=False):
+        report['duplicates'].append((int(row_no), reg_no, "Already registered."))
+    frame = frame[~clash]
+
+    frame = frame.astype({'class_id': int, 'year_id': int})
+    return [
+        (int(row[0]), tuple(row[1:]))
+        for row in frame[['row_no'] + PUPIL_COLUMNS].astype(object).itertuples(index=False, name=None)
+    ]
+
+
+def _insert(cursor, rows, report):
+    """Insert ``rows``, bisecting a failed batch down to the rows at fault."""
+    placeholders = '(' + ', '.join(['%s'] * len(PUPIL_COLUMNS)) + ')'
+    try:
+        cursor.execute(
+            f"INSERT INTO pupils ({', '.join(PUPIL_COLUMNS)}) VALUES "
+            + ', '.join([placeholders] * len(rows)),
+            [value for _, values in rows for value in values]
+        )
+    except (IntegrityError, DataError) as e:
+        # InnoDB undoes just the failed statement; the transaction goes on
+        if len(rows) > 1:
+            middle = len(rows) // 2
+            _insert(cursor, rows[:middle], report)
+            _insert(cursor, rows[middle:], report)
+        elif e.errno == errorcode.ER_DUP_ENTRY:
+            report['duplicates'].append((rows[0][0], rows[0][1][0], "Already registered."))
+        else:
+            report['invalid'].append((rows[0][0], rows[0][1][0], e.msg))
+        return
+    report['inserted'].extend((row_no, values[0]) for row_no, values in rows)
+
+
+def insert_pupils(connection, rows, report, progress=None):
+    """Write prepared pupil rows in batches and commit.
+
+    ``progress(done, total)`` is called after each batch.
+    """
+    cursor = connection.cursor()
+    try:
+        done = 0
+        for chunk in _chunks(rows):
+            _insert(cursor, chunk, report)
+            done += len(chunk)
+            if progress:
+                progress(done, len(rows))
+        invalidate_pupil_index()
+        # Pupils arrive without a term, so every cached report may list them
+        invalidate_reports()
+        connection.commit()
+    finally:
+        cursor.close()
+    return report
+
+
+@job_type(IMPORT_JOB, limit=1)
+def import_pupils_job(job, file_path, back_url=None):
+    """Validate and import an uploaded admissions workbook."""
+    job.progress(0, message='Reading the workbook...')
+    try:
+        df = pd.read_excel(file_path)
+    except pd.errors.EmptyDataError:
+        raise ValueError('Uploaded Excel file is empty.')
+    finally:
+        # The upload has a one-off name; nothing reads it again
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+    missing_cols = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing_cols:
+        raise ValueError(f"Missing required columns: {', '.join(missing_cols)}")
+
+    report = new_report()
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            rows = prepare_pupils(df, cursor, report)
+        job.progress(0, len(rows), message=f'Importing {len(rows)} pupil(s)...')
+        insert_pupils(connection, rows, report, job.progress)
+
+    issues = sorted(
+        [(row_no, reg_no, 'Invalid', reason) for row_no, reg_no, reason in report['invalid']]
+        + [(row_no, reg_no, 'Duplicate', reason) for row_no, reg_no, reason in report['duplicates']]
+    )
+    return {
+        'message': (f"{len(report['inserted'])} record(s) uploaded, {len(report['duplicates'])} duplicate(s) "
+                    f"and {len(report['invalid'])} invalid row(s) skipped."),
+        'counts': {'inserted': len(report['inserted']), 'duplicate': len(report['duplicates']),
+                   'invalid': len(report['invalid'])},
+        'columns': ['Row', 'Reg No', 'Status', 'Reason'],
+        'rows': [list(issue) for issue in issues],
+        'back_url': back_url,
+    }
@@ -0,0 +1,165 @@
+"""In-memory pupil search behind the name pickers.
+
+The index holds a few columns per pupil (names, reg_no, index_number,
+emis_number, class and stream) instead of whole ``pupils`` rows.  It is
+built once per process and rebuilt after the views that add, edit,
+delete, import or move pupils call ``invalidate_pupil_index()`` before
+committing (region ``pupils`` in ``apps.cache_versions``, so every
+worker rebuilds), or after ``PUPIL_INDEX_TTL`` expires.
+
+Every word of a query must be a prefix of one of the pupil's tokens;
+when that finds too few pupils, queries of three or more characters
+fall back to trigram similarity so typos and mid-word fragments still
+match.
+"""
+import heapq
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from flask import current_app
+
+from apps.cache_versions import bump, on_change
+from apps.db import get_db_connection
+
+_lock = threading.Lock()
+_version = 0
+_cache = {'version': None, 'loaded_at': 0.0, 'index': None}
+
+_WORD = re.compile(r'[\w.]+')
+
+
+def invalidate_pupil_index():
+    """Rebuild the index in every worker; call before committing a write to pupils."""
+    bump('pupils')
+
+
+def _drop(key):
+    global _version
+    with _lock:
+        _version += 1
+
+
+on_change('pupils', _drop)
+
+
+def _trigrams(text):
+    text = f"  {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class PupilIndex:
+    """Prefix and trigram lookups over a list of pupil records."""
+
+    def __init__(self, rows):
+        self.records = []
+        tokens = []
+        self.grams = defaultdict(set)
+        for row in rows:
+            # Same form as the pages' TRIM(CONCAT(first, ' ', other, ' ', last)) filter
+            full_name = f"{row['first_name'] or ''} {row.get('other_name') or ''} {row['last_name'] or ''}".strip()
+            record = {
+                'pupil_id': row['pupil_id'],
+                'reg_no': row['reg_no'],
+                'full_name': full_name,
+                'index_number': row.get('index_number'),
+                'emis_number': row.get('emis_number'),
+                'class_id': row.get('class_id'),
+                'stream_id': row.get('stream_id'),
+            }
+            i = len(self.records)
+            self.records.append(record)
+
+            numbers = [str(v).lower() for v in (row['reg_no'], row.get('index_number'), row.get('emis_number'))
+                       if v not in (None, '')]
+            searchable = ' '.join([full_name.lower()] + numbers)
+            # Whole numbers ("shp/2021/0001") as well as their parts ("0001")
+            for token in set(_WORD.findall(searchable)) | set(numbers):
+                tokens.append((token, i))
+            for gram in _trigrams(searchable):
+                self.grams[gram].add(i)
+        tokens.sort()
+        self.tokens = tokens
+        self.names = [r['full_name'].lower() for r in self.records]
+
+    def _prefix_matches(self, term):
+        """{record: 2 for an exact token, 1 for a prefix}."""
+        matches = {}
+        pos = bisect_left(self.tokens, (term,))
+        while pos < len(self.tokens) and self.tokens[pos][0].startswith(term):
+            token, i = self.tokens[pos]
+            matches[i] = max(matches.get(i, 0), 2 if token == term else 1)
+            pos += 1
+        return matches
+
+    def search(self, query, limit=10, class_id=None, stream_id=None):
+        terms = query.lower().split()
+        if not terms:
+            return []
+
+        def wanted(i):
+            record = self.records[i]
+            return ((class_id is None or record['class_id'] == class_id)
+                    and (stream_id is None or record['stream_id'] == stream_id))
+
+        scores = None
+        for term in terms:
+            matches = self._prefix_matches(term)
+            if scores is None:
+                scores = matches
+            else:
+                scores = {i: s + matches[i] for i, s in scores.items() if i in matches}
+            if not scores:
+                break
+        scores = {i: float(s) for i, s in scores.items() if wanted(i)}
+
+        # Too few prefix hits: rank by shared trigrams, below every prefix hit.
+        # Grams found in most pupils ("shp", "/20") say little and cost a lot.
+        query_grams = _trigrams(' '.join(terms))
+        if len(scores) < limit and len(' '.join(terms)) >= 3:
+            common = max(len(self.records) // 4, 50)
+            overlap = Counter()
+            for gram in query_grams:
+                postings = self.grams.get(gram, ())
+                if len(postings) <= common:
+                    overlap.update(postings)
+            needed = max(2, len(query_grams) // 2)
+            for i, shared in overlap.items():
+                if shared >= needed and i not in scores and wanted(i):
+                    scores[i] = shared / len(query_grams) - 1
+
+        best = heapq.nsmallest(limit, scores, key=lambda i: (-scores[i], self.names[i]))
+        return [dict(self.records[i]) for i in best]
+
+
+def _load():
+    with get_db_connection() as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            cursor.execute("""
+                SELECT pupil_id, reg_no, first_name, other_name, last_name,
+                       index_number, emis_number, class_id, stream_id
+                FROM pupils
+            """)
+            return PupilIndex(cursor.fetchall())
+
+
+def get_pupil_index():
+    ttl = current_app.config.get('PUPIL_INDEX_TTL', 300)
+    with _lock:
+        version = _version
+        if _cache['version'] == version and time.monotonic() - _cache['loaded_at'] < ttl:
+            return _cache['index']
+
+    index = _load()
+    with _lock:
+        # Only keep what we loaded if nobody invalidated in the meantime
+        if _version == version:
+            _cache.update({'version': version, 'loaded_at': time.monotonic(), 'index': index})
+    return index
+
+
+def search_pupils(query, limit=10, class_id=None, stream_id=None):
+    """Best ``limit`` matches for ``query``, optionally within a class/stream."""
+    return get_pupil_index().search(query, limit, class_id, stream_id)
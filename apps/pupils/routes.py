@@ -8,6 +8,7 @@ from jinja2 import TemplateNotFound
 from io import BytesIO
 import os
 import random
+import uuid
 import re
 import logging
 import pandas as pd
@@ -18,6 +19,13 @@ from mysql.connector import Error
 
 from apps.pupils import blueprint
 from apps import get_db_connection
+from apps.reference_data import reference_rows
+from apps.job_runner import job_response, submit
+from apps.pupil_import import IMPORT_JOB
+from apps.pagination import SortKey, keyset_page
+from apps.pupil_search import invalidate_pupil_index, search_pupils
+from apps.report_cache import invalidate_reports
+from apps.utils.decorators import login_required
 
 import numpy as np
 
@@ -44,6 +52,23 @@ def get_districts():
     return jsonify(districts)
 
 
+@blueprint.route('/api/pupils/search', methods=['GET'])
+@login_required
+def pupil_search():
+    """Typeahead for the pupil pickers: top matches for ?q= as JSON."""
+    query = request.args.get('q', '', type=str).strip()
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    if not query:
+        return jsonify({'results': []})
+
+    results = search_pupils(
+        query, limit,
+        class_id=request.args.get('class_id', type=int),
+        stream_id=request.args.get('stream_id', type=int),
+    )
+    return jsonify({'results': results})
+
+
 
 
 # Access the upload folder from the current Flask app configuration
@@ -55,24 +80,52 @@ def allowed_file(filename):
 
 
 
+PUPIL_LIST_SELECT = """
+    p.pupil_id,
+    p.reg_no,
+    p.index_number,
+    p.emis_number,
+    CONCAT_WS(' ', p.last_name, p.first_name, p.other_name) AS full_name,
+    p.gender,
+    p.date_of_birth,
+    p.admission_date,
+    c.class_name,
+    COALESCE(s.stream_name, 'None') AS stream_name,
+    sy.year_name AS study_year,
+    COALESCE(t.term_name, 'None') AS term_name,
+    p.nin_number,
+    p.residential_status,
+    p.home_district,
+    p.image
+"""
+
+PUPIL_LIST_FROM = """
+    FROM pupils p
+    LEFT JOIN classes c ON p.class_id = c.class_id
+    LEFT JOIN stream s ON p.stream_id = s.stream_id
+    LEFT JOIN study_year sy ON p.year_id = sy.year_id
+    LEFT JOIN terms t ON p.term_id = t.term_id
+"""
+
+PUPIL_SORTS = {
+    'name': SortKey('Name', ['p.last_name', 'p.first_name', 'p.pupil_id']),
+    'reg_no': SortKey('Reg No', ['p.reg_no', 'p.pupil_id']),
+    'newest': SortKey('Added', ['p.pupil_id']),
+}
+
+
 @blueprint.route('/pupils')
 def pupils():
     """Filter pupils based on user input. No data is shown until filters are applied."""
     connection = get_db_connection()
     cursor = connection.cursor(dictionary=True)
 
-    # Load dropdown options
-    cursor.execute('SELECT year_id, year_name AS study_year FROM study_year ORDER BY year_name')
-    study_years = cursor.fetchall()
-
-    cursor.execute('SELECT class_id, class_name FROM classes ORDER BY class_name')
-    class_list = cursor.fetchall()
-
-    cursor.execute('SELECT term_id, term_name FROM terms ORDER BY term_name')
-    terms = cursor.fetchall()
-
-    cursor.execute('SELECT stream_id, stream_name FROM stream ORDER BY stream_name')
-    stream_list = cursor.fetchall()
+    # Load dropdown options (cached; the template shows year_name as study_year)
+    study_years = [dict(row, study_year=row['year_name'])
+                   for row in reference_rows('study_year', order_by='year_name')]
+    class_list = reference_rows('classes', order_by='class_name')
+    terms = reference_rows('terms', order_by='term_name')
+    stream_list = reference_rows('stream', order_by='stream_name')
 
     # Get query parameters from form submission
     reg_no = request.args.get('reg_no', '').strip()
@@ -95,6 +148,7 @@ def pupils():
     ])
 
     pupils = []
+    page = None
     params = {}
     filters = []
 
@@ -124,36 +178,11 @@ def pupils():
             """)
             params['name'] = f"%{name}%"
 
-        query = f"""
-            SELECT 
-                p.pupil_id,
-                p.reg_no,
-                p.index_number,
-                p.emis_number,
-                CONCAT_WS(' ', p.last_name, p.first_name, p.other_name) AS full_name,
-                p.gender,
-                p.date_of_birth,
-                p.admission_date,
-                c.class_name,
-                COALESCE(s.stream_name, 'None') AS stream_name,
-                sy.year_name AS study_year,
-                COALESCE(t.term_name, 'None') AS term_name,
-                p.nin_number,
-                p.residential_status,
-                p.home_district,
-                p.image
-            FROM pupils p
-            LEFT JOIN classes c ON p.class_id = c.class_id
-            LEFT JOIN stream s ON p.stream_id = s.stream_id
-            LEFT JOIN study_year sy ON p.year_id = sy.year_id
-            LEFT JOIN terms t ON p.term_id = t.term_id
-            WHERE {" AND ".join(filters)}
-            ORDER BY p.last_name
-        """
-
-
-        cursor.execute(query, params)
-        pupils = cursor.fetchall()
+        page = keyset_page(
+            cursor, 'pupils', PUPIL_LIST_SELECT, PUPIL_LIST_FROM, filters, params,
+            PUPIL_SORTS, 'name', count_table='pupils'
+        )
+        pupils = page['rows']
 
     cursor.close()
     connection.close()
@@ -161,6 +190,7 @@ def pupils():
     return render_template(
         'pupils/pupils.html',
         pupils=pupils,
+        page=page,
         segment='pupils',
         class_list=class_list,
         stream_list=stream_list,
@@ -195,10 +225,8 @@ def add_pupil():
     cursor = connection.cursor(dictionary=True)
 
     # Fetch classes and study years for form population
-    cursor.execute('SELECT * FROM study_year ORDER BY year_name')
-    study_years = cursor.fetchall()
-    cursor.execute('SELECT * FROM classes ORDER BY class_name')
-    classes = cursor.fetchall()
+    study_years = reference_rows('study_year', order_by='year_name')
+    classes = reference_rows('classes', order_by='class_name')
 
     if request.method == 'POST':
         # Retrieve form data
@@ -250,6 +278,9 @@ def add_pupil():
             attendance_record, academic_performance, notes, residential_status
         ))
 
+        invalidate_pupil_index()
+        # The new pupil has no term yet, so no single report scope holds them
+        invalidate_reports()
         connection.commit()
         flash("Pupil successfully added!", "success")
 
@@ -285,11 +316,8 @@ def edit_pupil(pupil_id):
         return redirect(url_for('pupils_blueprint.pupils'))
 
     # Get dropdown options
-    cursor.execute('SELECT * FROM study_year ORDER BY year_name')
-    study_years = cursor.fetchall()
-
-    cursor.execute('SELECT * FROM classes ORDER BY class_name')
-    classes = cursor.fetchall()
+    study_years = reference_rows('study_year', order_by='year_name')
+    classes = reference_rows('classes', order_by='class_name')
 
     if request.method == 'POST':
         # Gather all form inputs
@@ -346,6 +374,11 @@ def edit_pupil(pupil_id):
                 image_filename, form_data['residential_status'], pupil_id
             ))
 
+            invalidate_pupil_index()
+            invalidate_reports({
+                (pupil['class_id'], pupil['year_id'], pupil['term_id']),
+                (pupil['class_id'], form_data['study_year'], pupil['term_id']),
+            })
             connection.commit()
             flash("Pupil updated successfully!", "success")
             return redirect(url_for('pupils_blueprint.pupils'))
@@ -460,22 +493,6 @@ def download_template():
 
 
 
-# Utility functions
-def get_existing_reg_nos():
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT reg_no FROM pupils")
-        return {str(row[0]).strip() for row in cursor.fetchall()}
-
-
-def get_clean(value):
-    return str(value).strip() if pd.notna(value) else ''
-
-
-def safe_date(value):
-    return pd.to_datetime(value).date() if pd.notna(value) else None
-
-
 # Excel Upload Route
 @blueprint.route('/upload_excel', methods=['GET', 'POST'])
 def upload_excel():
@@ -490,194 +507,20 @@ def upload_excel():
             flash('Invalid file format. Please upload a .xlsx Excel file.', 'danger')
             return redirect(request.url)
 
-        filename = secure_filename(file.filename)
+        # Save under a name of its own; the import runs as a background job
+        filename = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
         file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         file.save(file_path)
 
-        try:
-            df = pd.read_excel(file_path)
-            required_columns = [
-                "reg_no", "first_name", "other_name", "last_name", "nin_number", "emis_number",
-                "date_of_birth", "gender", "class", "admission_date", "study_year",
-                "home_district", "address", "emergency_contact", "medical_info", "special_needs",
-                "attendance_record", "academic_performance", "notes", "residential_status"
-            ]
-
-            missing_cols = [col for col in required_columns if col not in df.columns]
-            if missing_cols:
-                flash(f"Missing required columns: {', '.join(missing_cols)}", 'danger')
-                return redirect(request.url)
-
-            existing_reg_nos = get_existing_reg_nos()
-            processed_data, errors, existing_db_dupes, local_dupes = validate_excel_data(df, existing_reg_nos)
-
-            if existing_db_dupes:
-                flash(f"Skipped existing reg_no(s): {', '.join(existing_db_dupes)}", 'warning')
-            if local_dupes:
-                flash(f"Skipped duplicate reg_no(s) in file: {', '.join(local_dupes)}", 'warning')
-            if errors:
-                flash('Errors encountered:\n' + '\n'.join(errors), 'danger')
-                return redirect(request.url)
-
-            insert_into_database(processed_data)
-            flash(f"{len(processed_data)} record(s) uploaded successfully!", 'success')
-
-        except pd.errors.EmptyDataError:
-            flash('Uploaded Excel file is empty.', 'danger')
-        except Exception as e:
-            flash(f'Error processing the file: {str(e)}', 'danger')
-
-        return redirect(url_for('pupils_blueprint.upload_excel'))
+        job_id = submit(IMPORT_JOB, {
+            'file_path': file_path,
+            'back_url': url_for('pupils_blueprint.upload_excel'),
+        }, user_id=session.get('id'))
+        return job_response(job_id)
 
     return render_template('pupils/upload_excel.html')
 
 
-# Data validation
-def validate_excel_data(df, existing_db_reg_nos=None):
-    processed_data = []
-    errors = []
-    existing_reg_nos = []
-    duplicate_reg_nos = []
-    seen_reg_nos = set()
-
-    required_columns = {
-        'reg_no', 'first_name', 'last_name', 'gender', 'class',
-        'study_year', 'date_of_birth', 'admission_date'
-    }
-
-    if existing_db_reg_nos is None:
-        existing_db_reg_nos = get_existing_reg_nos()
-
-    missing_columns = required_columns - set(df.columns)
-    if missing_columns:
-        raise ValueError(f"Missing required columns: {', '.join(missing_columns)}")
-
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT class_name, class_id FROM classes")
-        class_map = {str(row[0]).strip(): int(row[1]) for row in cursor.fetchall()}
-
-        cursor.execute("SELECT year_name, year_id FROM study_year")
-        year_map = {str(row[0]).strip(): int(row[1]) for row in cursor.fetchall()}
-
-        for index, row in df.iterrows():
-            if row.isnull().all():
-                continue
-
-            reg_no = get_clean(row.get('reg_no'))
-            class_name = get_clean(row.get('class'))
-            year_name = get_clean(row.get('study_year'))
-
-            if not reg_no or not class_name or not year_name:
-                errors.append(f"Row {index + 2}: Missing required fields.")
-                continue
-
-            if reg_no in seen_reg_nos:
-                duplicate_reg_nos.append(reg_no)
-                continue
-            seen_reg_nos.add(reg_no)
-
-            if reg_no in existing_db_reg_nos:
-                existing_reg_nos.append(reg_no)
-                continue
-
-            class_id = class_map.get(class_name)
-            year_id = year_map.get(year_name)
-
-            if not class_id:
-                errors.append(f"Row {index + 2}: Invalid class '{class_name}'.")
-            if not year_id:
-                errors.append(f"Row {index + 2}: Invalid study year '{year_name}'.")
-
-            if class_id and year_id:
-                processed_data.append({
-                    'reg_no': reg_no,
-                    'first_name': get_clean(row.get('first_name')),
-                    'other_name': get_clean(row.get('other_name')),
-                    'last_name': get_clean(row.get('last_name')),
-                    'nin_number': get_clean(row.get('nin_number')),
-                    'emis_number': get_clean(row.get('emis_number')),
-                    'date_of_birth': safe_date(row.get('date_of_birth')),
-                    'gender': get_clean(row.get('gender')),
-                    'class_id': class_id,
-                    'admission_date': safe_date(row.get('admission_date')),
-                    'year_id': year_id,
-                    'home_district': get_clean(row.get('home_district')),
-                    'address': get_clean(row.get('address')),
-                    'emergency_contact': get_clean(row.get('emergency_contact')),
-                    'medical_info': get_clean(row.get('medical_info')),
-                    'special_needs': get_clean(row.get('special_needs')),
-                    'attendance_record': get_clean(row.get('attendance_record')),
-                    'academic_performance': get_clean(row.get('academic_performance')),
-                    'notes': get_clean(row.get('notes')),
-                    'residential_status': get_clean(row.get('residential_status')).lower()
-                })
-
-    return processed_data, errors, existing_reg_nos, duplicate_reg_nos
-
-
-
-
-
-
-
-
-def insert_into_database(processed_data):
-    if not processed_data:
-        print("No data to insert.")
-        return
-
-    insert_query = """
-        INSERT INTO `pupils` (
-            `reg_no`, `first_name`, `other_name`, `last_name`,
-            `nin_number`, `emis_number`, `image`, `date_of_birth`,
-            `gender`, `class_id`, `admission_date`, `year_id`,
-            `home_district`, `address`, `emergency_contact`, `medical_info`,
-            `special_needs`, `attendance_record`, `academic_performance`,
-            `notes`, `residential_status`
-        ) VALUES (
-            %(reg_no)s, %(first_name)s, %(other_name)s, %(last_name)s,
-            %(nin_number)s, %(emis_number)s, NULL, %(date_of_birth)s,
-            %(gender)s, %(class_id)s, %(admission_date)s, %(year_id)s,
-            %(home_district)s, %(address)s, %(emergency_contact)s, %(medical_info)s,
-            %(special_needs)s, %(attendance_record)s, %(academic_performance)s,
-            %(notes)s, %(residential_status)s
-        )
-    """
-
-    inserted_count = 0
-    failed_rows = []
-
-    try:
-        with get_db_connection() as connection:
-            cursor = connection.cursor()
-
-            for idx, data in enumerate(processed_data, start=1):
-                try:
-                    for date_field in ['date_of_birth', 'admission_date']:
-                        if isinstance(data[date_field], pd.Timestamp):
-                            data[date_field] = data[date_field].date()
-
-                    cursor.execute(insert_query, data)
-                    inserted_count += 1
-
-                except Exception as row_err:
-                    failed_rows.append((idx, data.get('reg_no'), str(row_err)))
-
-            connection.commit()
-
-    except Exception as e:
-        print("Fatal database error:", e)
-        return
-
-    print(f"{inserted_count} record(s) inserted successfully.")
-    if failed_rows:
-        print("Some rows failed to insert:")
-        for row_num, reg_no, err in failed_rows:
-            print(f"  Row {row_num} (reg_no={reg_no}): {err}")
-
-
 
 
 
@@ -699,7 +542,14 @@ def delete_pupil():
 
     try:
         placeholders = ', '.join(['%s'] * len(pupil_ids))
+        cursor.execute(
+            f"SELECT DISTINCT class_id, year_id, term_id FROM pupils WHERE pupil_id IN ({placeholders})",
+            tuple(pupil_ids)
+        )
+        scopes = set(cursor.fetchall())
         cursor.execute(f"DELETE FROM pupils WHERE pupil_id IN ({placeholders})", tuple(pupil_ids))
+        invalidate_pupil_index()
+        invalidate_reports(scopes)
         connection.commit()
         flash(f"Deleted {cursor.rowcount} pupil(s) successfully.", "success")
     except Exception as e:
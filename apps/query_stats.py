@@ -0,0 +1,178 @@
+"""Per-request SQL instrumentation.
+
+Cursors handed out by ``get_db_connection()`` are wrapped so every
+statement is timed.  At the end of a request the statements are
+summarised (count, total DB time, slowest statements, and statement
+shapes repeated at least ``N_PLUS_ONE_THRESHOLD`` times, the signature
+of a query run once per row):
+
+- admins get the numbers in an ``X-DB-Stats`` response header;
+- each endpoint keeps a rolling window of its last
+  ``QUERY_STATS_WINDOW`` requests, shown at ``/monitoring/queries``;
+- requests slower than ``SLOW_REQUEST_MS`` or issuing more than
+  ``SLOW_REQUEST_QUERIES`` statements are logged as one JSON line on the
+  ``apps.slow_requests`` logger.
+
+Everything is kept per worker process.
+"""
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from flask import current_app, g, has_app_context, request, session
+
+slow_log = logging.getLogger('apps.slow_requests')
+
+ADMIN_ROLES = ['admin', 'super_admin']
+
+_lock = threading.Lock()
+_endpoints = defaultdict(lambda: {'requests': deque(), 'repeated': Counter()})
+
+_SPACE = re.compile(r'\s+')
+_STRING = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*(?:(?:%s|\?)\s*,\s*)+(?:%s|\?)\s*\)')
+
+
+def statement_shape(sql):
+    """``sql`` with literals and placeholder lists collapsed, for grouping."""
+    if isinstance(sql, (bytes, bytearray)):
+        sql = sql.decode('utf-8', 'replace')
+    shape = _STRING.sub('?', sql)
+    shape = _NUMBER.sub('?', shape)
+    shape = shape.replace('%s', '?')
+    shape = _PLACEHOLDER_LIST.sub('(?...)', shape)
+    return _SPACE.sub(' ', shape).strip()[:500]
+
+
+class TimedCursor:
+    """Cursor proxy that records each statement on the request's stats."""
+
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def _timed(self, method, sql, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(sql, *args, **kwargs)
+        finally:
+            self._stats.append((sql, time.perf_counter() - started))
+
+    def execute(self, operation, *args, **kwargs):
+        return self._timed(self._cursor.execute, operation, *args, **kwargs)
+
+    def executemany(self, operation, *args, **kwargs):
+        return self._timed(self._cursor.executemany, operation, *args, **kwargs)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def instrument(cursor):
+    """Wrap ``cursor`` when the current request is being measured."""
+    stats = g.get('_query_stats') if has_app_context() else None
+    return TimedCursor(cursor, stats) if stats is not None else cursor
+
+
+def summarise(statements, threshold, slowest=3):
+    total = sum(duration for _, duration in statements)
+    shapes = Counter(statement_shape(sql) for sql, _ in statements)
+    top = sorted(statements, key=lambda s: s[1], reverse=True)[:slowest]
+    return {
+        'queries': len(statements),
+        'db_time_ms': round(total * 1000, 2),
+        'slowest': [
+            {'sql': statement_shape(sql), 'ms': round(duration * 1000, 2)} for sql, duration in top
+        ],
+        'repeated': {shape: n for shape, n in shapes.most_common() if n >= threshold},
+    }
+
+
+def _start():
+    if current_app.config.get('QUERY_STATS_ENABLED', True):
+        g._query_stats = []
+        g._request_started = time.perf_counter()
+
+
+def _finish(response):
+    statements = g.pop('_query_stats', None)
+    if statements is None:
+        return response
+    config = current_app.config
+    elapsed_ms = round((time.perf_counter() - g.pop('_request_started')) * 1000, 2)
+    summary = summarise(statements, config.get('N_PLUS_ONE_THRESHOLD', 10))
+    endpoint = request.endpoint or '<unmatched>'
+
+    with _lock:
+        entry = _endpoints[endpoint]
+        entry['requests'].append((summary['queries'], summary['db_time_ms'], elapsed_ms))
+        while len(entry['requests']) > config.get('QUERY_STATS_WINDOW', 100):
+            entry['requests'].popleft()
+        entry['repeated'].update(summary['repeated'].keys())
+
+    if session.get('role') in ADMIN_ROLES:
+        response.headers['X-DB-Stats'] = (
+            f"queries={summary['queries']}; db_ms={summary['db_time_ms']}; "
+            f"total_ms={elapsed_ms}; repeated={len(summary['repeated'])}"
+        )
+
+    if (elapsed_ms > config.get('SLOW_REQUEST_MS', 1000)
+            or summary['queries'] > config.get('SLOW_REQUEST_QUERIES', 100)):
+        slow_log.warning(json.dumps({
+            'endpoint': endpoint,
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': response.status_code,
+            'user_id': session.get('id'),
+            'total_ms': elapsed_ms,
+            **summary,
+        }))
+    return response
+
+
+def query_stats_summary():
+    """Rolling per-endpoint figures for this worker, busiest first."""
+    with _lock:
+        snapshot = {
+            endpoint: (list(entry['requests']), entry['repeated'].most_common(5))
+            for endpoint, entry in _endpoints.items()
+        }
+
+    rows = []
+    for endpoint, (requests, repeated) in snapshot.items():
+        if not requests:
+            continue
+        queries = [r[0] for r in requests]
+        db_times = [r[1] for r in requests]
+        totals = sorted(r[2] for r in requests)
+        rows.append({
+            'endpoint': endpoint,
+            'requests': len(requests),
+            'queries_avg': round(sum(queries) / len(queries), 1),
+            'queries_max': max(queries),
+            'db_ms_avg': round(sum(db_times) / len(db_times), 2),
+            'total_ms_avg': round(sum(totals) / len(totals), 2),
+            'total_ms_p95': totals[min(len(totals) - 1, int(len(totals) * 0.95))],
+            'repeated_shapes': [{'sql': shape, 'requests': n} for shape, n in repeated],
+        })
+    rows.sort(key=lambda r: r['queries_avg'] * r['requests'], reverse=True)
+    return rows
+
+
+def init_query_stats(app):
+    """Time every request's SQL when QUERY_STATS_ENABLED is set."""
+    app.before_request(_start)
+    app.after_request(_finish)
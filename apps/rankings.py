@@ -0,0 +1,79 @@
+"""Stream and class positions for the term report cards.
+
+A report card used to fetch every pupil's average in the stream and the
+class and scan both lists for one reg_no, so printing a stream's cards
+one by one repeated the whole-class scan twice per card.  Positions are
+now ranked once per (class_id, year_id, term_id) scope, with one query
+and a pandas ranking pass, and each card is a dictionary lookup.
+
+Ranks are competition ranks ("1, 2, 2, 4"), like the positions pages;
+pupils without a numeric average come last.  A scope is re-ranked when
+its report data version changes (see ``apps.report_cache``) or after
+``REPORT_CACHE_TTL`` seconds.
+"""
+import threading
+import time
+
+import pandas as pd
+from flask import current_app
+
+from apps.db import get_db_connection
+from apps.report_cache import scope_version
+
+_lock = threading.Lock()
+_rankings = {}  # (class_id, year_id, term_id) -> (version, ranked_at, rankings)
+
+
+def rank_averages(rows):
+    """{'stream': {reg_no: pos}, 'class': {reg_no: pos}} from rows of
+    (reg_no, stream_id, avg)."""
+    frame = pd.DataFrame(rows, columns=['reg_no', 'stream_id', 'avg'])
+    if frame.empty:
+        return {'stream': {}, 'class': {}}
+    average = pd.to_numeric(frame['avg'], errors='coerce')
+    class_rank = average.rank(method='min', ascending=False, na_option='bottom')
+    stream_rank = average.groupby(frame['stream_id'], dropna=False).rank(
+        method='min', ascending=False, na_option='bottom'
+    )
+    return {
+        'stream': dict(zip(frame['reg_no'], stream_rank.astype(int).tolist())),
+        'class': dict(zip(frame['reg_no'], class_rank.astype(int).tolist())),
+    }
+
+
+def _load(class_id, year_id, term_id):
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT p.reg_no, p.stream_id, AVG(s.Mark) AS avg
+                FROM scores s
+                JOIN pupils p ON s.reg_no = p.reg_no
+                JOIN stream strm ON p.stream_id = strm.stream_id
+                WHERE strm.class_id = %s AND p.term_id = %s AND p.year_id = %s
+                GROUP BY p.reg_no, p.stream_id
+            """, (class_id, term_id, year_id))
+            return rank_averages(cursor.fetchall())
+
+
+def term_rankings(class_id, year_id, term_id):
+    """Positions of every pupil of the class in the given term."""
+    key = (class_id, year_id, term_id)
+    version = scope_version(*key)
+    ttl = current_app.config.get('REPORT_CACHE_TTL', 600)
+    with _lock:
+        cached = _rankings.get(key)
+    if cached and cached[0] == version and time.monotonic() - cached[1] < ttl:
+        return cached[2]
+
+    rankings = _load(*key)
+    with _lock:
+        # Keep what we ranked only if nothing was written in the meantime
+        if scope_version(*key) == version:
+            _rankings[key] = (version, time.monotonic(), rankings)
+    return rankings
+
+
+def pupil_positions(reg_no, class_id, year_id, term_id):
+    """(stream_position, class_position) of one pupil, None if unranked."""
+    rankings = term_rankings(class_id, year_id, term_id)
+    return rankings['stream'].get(reg_no), rankings['class'].get(reg_no)
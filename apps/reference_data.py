@@ -0,0 +1,111 @@
+"""Process-wide cache of the small reference tables behind the dropdowns.
+
+``classes``, ``study_year``, ``terms``, ``assessment``, ``subjects`` and
+``stream`` are read by almost every listing page but only change through
+their own CRUD blueprints.  Each table is loaded once per process and
+kept until that blueprint calls ``invalidate_reference_data(table)``
+before committing, which drops it in every worker (region
+``reference:<table>`` in ``apps.cache_versions``), or until
+``REFERENCE_CACHE_TTL`` expires.
+
+``reference_rows()`` returns fresh copies of the cached rows, so views
+may decorate them without touching the cache.
+"""
+import threading
+import time
+
+from flask import current_app
+
+from apps.cache_versions import bump, on_change
+from apps.db import get_db_connection
+
+# table -> (id column, name column)
+REFERENCE_TABLES = {
+    'classes': ('class_id', 'class_name'),
+    'study_year': ('year_id', 'year_name'),
+    'terms': ('term_id', 'term_name'),
+    'assessment': ('assessment_id', 'assessment_name'),
+    'subjects': ('subject_id', 'subject_name'),
+    'stream': ('stream_id', 'stream_name'),
+}
+
+_lock = threading.Lock()
+_versions = {table: 0 for table in REFERENCE_TABLES}
+_cache = {}  # table -> {'version', 'loaded_at', 'rows', 'names'}
+
+
+def invalidate_reference_data(table=None):
+    """Drop the cached copy of ``table``, or of every reference table, in
+    every worker.  Call it before committing the change."""
+    # Cached report pages show these names too
+    bump('reports', *(f'reference:{name}' for name in ([table] if table else REFERENCE_TABLES)))
+
+
+def _drop(table):
+    with _lock:
+        for name in ([table] if table in _versions else REFERENCE_TABLES):
+            _versions[name] += 1
+
+
+on_change('reference', _drop)
+
+
+def _load(table):
+    with get_db_connection() as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            cursor.execute(f"SELECT * FROM {table}")
+            return cursor.fetchall()
+
+
+def _entry(table):
+    if table not in REFERENCE_TABLES:
+        raise KeyError(f"{table} is not a cached reference table")
+    ttl = current_app.config.get('REFERENCE_CACHE_TTL', 300)
+    with _lock:
+        version = _versions[table]
+        entry = _cache.get(table)
+        if entry and entry['version'] == version and time.monotonic() - entry['loaded_at'] < ttl:
+            return entry
+
+    rows = _load(table)
+    id_column, name_column = REFERENCE_TABLES[table]
+    entry = {
+        'version': version,
+        'loaded_at': time.monotonic(),
+        'rows': tuple(rows),
+        'names': {row[id_column]: row[name_column] for row in rows},
+    }
+    with _lock:
+        # Only keep what we loaded if nobody invalidated in the meantime
+        if _versions[table] == version:
+            _cache[table] = entry
+    return entry
+
+
+def reference_rows(table, order_by=None, ids=None):
+    """Rows of ``table`` as ``SELECT * FROM table`` returns them.
+
+    ``order_by`` sorts on a column (case-insensitively, like MySQL's
+    default collation) and ``ids`` keeps only the rows with those ids.
+    """
+    rows = _entry(table)['rows']
+    if ids is not None:
+        id_column = REFERENCE_TABLES[table][0]
+        wanted = {int(i) for i in ids}
+        rows = [row for row in rows if row[id_column] in wanted]
+    if order_by:
+        rows = sorted(rows, key=lambda row: (row[order_by] is None, str(row[order_by]).lower()))
+    return [dict(row) for row in rows]
+
+
+def reference_names(table):
+    """{id: name} for ``table``."""
+    return dict(_entry(table)['names'])
+
+
+def reference_name(table, id_):
+    """Name of one reference row, or None."""
+    try:
+        return _entry(table)['names'].get(int(id_))
+    except (TypeError, ValueError):
+        return None
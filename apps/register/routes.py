@@ -18,6 +18,7 @@ from mysql.connector import Error
 
 from apps.register import blueprint
 from apps import get_db_connection
+from apps.pupil_search import invalidate_pupil_index
 
 import numpy as np
 
@@ -231,6 +232,7 @@ def register_pupil():
             else:
                 flash_messages.append(f'Pupil {pupil_id} already has the selected term and class.')
 
+        invalidate_pupil_index()
         connection.commit()
 
         for message in flash_messages:
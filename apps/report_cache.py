@@ -0,0 +1,178 @@
+"""Cache for rendered report pages, with ETag revalidation.
+
+Report pages are keyed by endpoint, query string and user, and stamped
+with the data version of their scope (class_id, year_id, term_id).  The
+views that write scores call ``invalidate_reports([(class_id, year_id,
+term_id)])`` for the scopes they touched; changes to comments, grades,
+divisions and teacher/subject/stream assignments call
+``invalidate_reports()`` to drop every scope.  Both are called just
+before the write commits and reach every worker through
+``apps.cache_versions`` (regions ``reports`` and
+``reports:<class_id>:<year_id>:<term_id>``).  Entries also expire after
+``REPORT_CACHE_TTL`` seconds.
+
+Responses carry an ETag, so a browser reloading an unchanged page gets
+a 304 without the view running.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+
+from apps.cache_versions import bump, on_change
+
+_lock = threading.Lock()
+_global_version = 0
+_scope_versions = {}
+_entries = OrderedDict()  # key -> entry dict, least recently used first
+_stats = {
+    'hits': 0,
+    'misses': 0,
+    'not_modified': 0,
+    'stores': 0,
+    'evictions': 0,
+    'invalidations': 0,
+}
+
+
+def _scope(class_id, year_id, term_id):
+    try:
+        return int(class_id), int(year_id), int(term_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def invalidate_reports(scopes=None):
+    """Drop the cached pages of ``scopes`` ((class_id, year_id, term_id)
+    tuples), or of every report when ``scopes`` is None, in every worker.
+
+    Call it before committing the change.
+    """
+    if scopes is None:
+        bump('reports')
+        return
+    regions = set()
+    for scope in scopes:
+        scope = _scope(*scope)
+        # Unknown scope: play safe and drop everything
+        regions.add('reports' if scope is None else 'reports:%d:%d:%d' % scope)
+    bump(*regions)
+
+
+def _drop(key):
+    """Bump the local data version of a scope ("class:year:term"), or of all."""
+    global _global_version
+    scope = _scope(*key.split(':')) if key and key.count(':') == 2 else None
+    with _lock:
+        _stats['invalidations'] += 1
+        if scope is None:
+            _global_version += 1
+        else:
+            _scope_versions[scope] = _scope_versions.get(scope, 0) + 1
+
+
+on_change('reports', _drop)
+
+
+def _version(scope):
+    with _lock:
+        return _global_version, _scope_versions.get(scope, 0) if scope else 0
+
+
+def scope_version(class_id, year_id, term_id):
+    """Data version of a scope, for caches that live outside this module."""
+    return _version(_scope(class_id, year_id, term_id))
+
+
+def _lookup(key, version, ttl):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        if entry['version'] != version or time.monotonic() - entry['stored_at'] > ttl:
+            del _entries[key]
+            return None
+        _entries.move_to_end(key)
+        return entry
+
+
+def _store(key, version, response, max_entries):
+    body = response.get_data()
+    entry = {
+        'version': version,
+        'stored_at': time.monotonic(),
+        'body': body,
+        'mimetype': response.mimetype,
+        'etag': hashlib.sha1(body).hexdigest(),
+    }
+    with _lock:
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        _stats['stores'] += 1
+        while len(_entries) > max_entries:
+            _entries.popitem(last=False)
+            _stats['evictions'] += 1
+    return entry
+
+
+def _finish(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def cached_report(view):
+    """Serve a GET report view from the cache while its scope is unchanged."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        config = current_app.config
+        # Pages that show flashed messages must not be replayed
+        if not config.get('REPORT_CACHE_ENABLED', True) or '_flashes' in session:
+            return view(*args, **kwargs)
+
+        key = (
+            request.endpoint,
+            tuple(sorted(request.args.items(multi=True))),
+            session.get('id'),
+            session.get('role'),
+        )
+        scope = _scope(
+            request.args.get('class_id'), request.args.get('year_id'), request.args.get('term_id')
+        )
+        version = _version(scope)
+        entry = _lookup(key, version, config.get('REPORT_CACHE_TTL', 600))
+
+        if entry is not None:
+            if request.if_none_match.contains(entry['etag']):
+                with _lock:
+                    _stats['not_modified'] += 1
+                return _finish(make_response('', 304), entry['etag'])
+            with _lock:
+                _stats['hits'] += 1
+            response = make_response(entry['body'])
+            response.mimetype = entry['mimetype']
+            return _finish(response, entry['etag'])
+
+        with _lock:
+            _stats['misses'] += 1
+        response = make_response(view(*args, **kwargs))
+        if response.status_code != 200 or response.direct_passthrough or '_flashes' in session:
+            return response
+        entry = _store(key, version, response, config.get('REPORT_CACHE_SIZE', 200))
+        return _finish(response, entry['etag'])
+    return wrapper
+
+
+def report_cache_stats():
+    """Hit/miss counters for this worker process."""
+    with _lock:
+        stats = dict(_stats)
+        stats['entries'] = len(_entries)
+        stats['bytes'] = sum(len(e['body']) for e in _entries.values())
+    served = stats['hits'] + stats['not_modified']
+    lookups = served + stats['misses']
+    stats['hit_ratio'] = served / lookups if lookups else 0.0
+    return stats
@@ -0,0 +1,320 @@
+"""Term report cards, one at a time or for a whole class.
+
+``build_term_card`` turns a pupil's score rows into the context of
+``eot_reports/term_report_card_body.html``.  The single-card views
+and the batch use it.
+
+``render_class_cards`` reads a class (or one stream) for a term in a few
+queries: the pupils, every pupil's scores in chunked ``IN`` lookups, and
+the positions from ``apps.rankings``.  Batches of at least
+``REPORT_BATCH_POOL_MIN`` cards are rendered in a pool of
+``REPORT_BATCH_WORKERS`` processes, started on first use and kept for
+later batches.  The pool only runs Jinja, so it loads the templates
+itself and needs neither the app nor the database.  Cards come back in
+class order as they finish, and each batch's progress is recorded under
+its id for ``batch_progress()``.  Progress is kept per worker process.
+
+The ``report_cards`` background job renders the same batch to a file
+for download instead of streaming it.
+"""
+import os
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from multiprocessing import get_context
+
+from flask import current_app, render_template
+from jinja2 import Environment, FileSystemLoader
+from werkzeug.utils import secure_filename
+
+from apps.db import get_db_connection
+from apps.grading import grade_for
+from apps.job_runner import job_type
+from apps.rankings import term_rankings
+
+CARD_TEMPLATE = 'eot_reports/term_report_card_body.html'
+PRINT_TEMPLATE = 'eot_reports/term_report_cards_print.html'
+BATCH_JOB = 'report_cards'
+PUPIL_CHUNK = 500
+KEEP_BATCHES = 50
+
+PUPIL_SELECT = """
+    SELECT p.reg_no, CONCAT_WS(' ', p.last_name, p.first_name, p.other_name) AS full_name,
+           p.image, p.gender, p.dorm_id, p.stream_id, p.year_id, p.term_id,
+           y.year_name, t.term_name, s.stream_name, c.class_name, c.class_id
+    FROM pupils p
+    JOIN stream s ON p.stream_id = s.stream_id
+    JOIN classes c ON s.class_id = c.class_id
+    JOIN study_year y ON p.year_id = y.year_id
+    JOIN terms t ON p.term_id = t.term_id
+"""
+
+_lock = threading.Lock()
+_batches = {}  # batch_id -> progress dict, oldest first
+
+
+def build_term_card(pupil, score_rows, stream_position, class_position, print_date=None):
+    """Template context for one card from rows of (assessment_name, subject_name, Mark)."""
+    subject_scores = {}
+    assessment_names = set()
+
+    for row in score_rows:
+        subject = row['subject_name']
+        assess = row['assessment_name']
+        mark = float(row['Mark']) if row['Mark'] is not None else None
+        assessment_names.add(assess)
+        subject_scores.setdefault(subject, {})[assess] = mark
+
+    assessment_list = sorted(assessment_names)
+
+    subjects_data = []
+    overall_total = 0
+    for subject, scores in subject_scores.items():
+        marks = [m for m in scores.values() if m is not None]
+        total = sum(marks)
+        average = round(total / len(marks), 2) if marks else 0
+        grade_letter, remark = grade_for(average)
+        subject_entry = {
+            'subject': subject,
+            'marks': [],
+            'total': total,
+            'average': average,
+            'grade': grade_letter,
+            'remark': remark
+        }
+        for assessment in assessment_list:
+            mark = scores.get(assessment)
+            if mark is not None:
+                g, r = grade_for(mark)
+                subject_entry['marks'].append({'mark': mark, 'grade': g, 'remark': r})
+            else:
+                subject_entry['marks'].append({'mark': '-', 'grade': '-', 'remark': '-'})
+        subjects_data.append(subject_entry)
+        overall_total += average
+
+    overall_average = round(overall_total / len(subjects_data), 2) if subjects_data else 0
+    overall_grade, overall_remark = grade_for(overall_average)
+
+    return {
+        'pupil': pupil,
+        'subjects': subjects_data,
+        'assessments': assessment_list,
+        'overall_average': overall_average,
+        'overall_grade': overall_grade,
+        'overall_remark': overall_remark,
+        'stream_position': stream_position,
+        'class_position': class_position,
+        'print_date': print_date or datetime.now(),
+    }
+
+
+def class_card_contexts(class_id, year_id, term_id, stream_id=None):
+    """Card contexts for every pupil of a class (or stream) in a term."""
+    with get_db_connection() as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            sql = PUPIL_SELECT + " WHERE c.class_id = %s AND p.year_id = %s AND p.term_id = %s"
+            params = [class_id, year_id, term_id]
+            if stream_id:
+                sql += " AND p.stream_id = %s"
+                params.append(stream_id)
+            cursor.execute(sql + " ORDER BY s.stream_name, full_name", params)
+            pupils = cursor.fetchall()
+
+            scores = {}
+            reg_nos = [p['reg_no'] for p in pupils]
+            for start in range(0, len(reg_nos), PUPIL_CHUNK):
+                chunk = reg_nos[start:start + PUPIL_CHUNK]
+                cursor.execute(f"""
+                    SELECT s.reg_no, a.assessment_name, sub.subject_name, s.Mark
+                    FROM scores s
+                    JOIN assessment a ON s.assessment_id = a.assessment_id
+                    JOIN subjects sub ON s.subject_id = sub.subject_id
+                    WHERE s.reg_no IN ({', '.join(['%s'] * len(chunk))})
+                    ORDER BY s.reg_no, sub.subject_name, a.assessment_id
+                """, chunk)
+                for row in cursor.fetchall():
+                    scores.setdefault(row['reg_no'], []).append(row)
+
+    rankings = term_rankings(class_id, year_id, term_id)
+    print_date = datetime.now()
+    return [
+        build_term_card(
+            pupil, scores.get(pupil['reg_no'], []),
+            rankings['stream'].get(pupil['reg_no']), rankings['class'].get(pupil['reg_no']),
+            print_date
+        )
+        for pupil in pupils
+    ]
+
+
+# Worker side: a bare Jinja environment over the app's templates
+_env = None
+_pool = None
+
+
+def _init_worker(template_folder):
+    global _env
+    if _env is None:
+        _env = Environment(loader=FileSystemLoader(template_folder), autoescape=True)
+
+
+def _render_card(context):
+    return _env.get_template(CARD_TEMPLATE).render(**context)
+
+
+def _get_pool(workers, template_folder):
+    """The process pool, started on first use and kept for later batches."""
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(template_folder,),
+            )
+        return _pool
+
+
+def _drop_pool(pool):
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _start_batch(batch_id, total, scope):
+    with _lock:
+        _batches[batch_id] = {
+            'batch_id': batch_id, 'total': total, 'done': 0, 'status': 'running',
+            'started_at': time.time(), 'finished_at': None, **scope,
+        }
+        while len(_batches) > KEEP_BATCHES:
+            _batches.pop(next(iter(_batches)))
+
+
+def _update_batch(batch_id, **fields):
+    with _lock:
+        if batch_id in _batches:
+            _batches[batch_id].update(fields)
+
+
+def batch_progress(batch_id):
+    """Progress of a batch rendered by this process, or None."""
+    with _lock:
+        progress = _batches.get(batch_id)
+        return dict(progress) if progress else None
+
+
+def new_batch_id():
+    return uuid.uuid4().hex
+
+
+def render_class_cards(contexts, batch_id, scope):
+    """Yield (pupil, card_html) in class order, rendering in a process pool."""
+    config = current_app.config
+    template_folder = os.path.join(current_app.root_path, current_app.template_folder)
+    workers = config.get('REPORT_BATCH_WORKERS', 4)
+    _start_batch(batch_id, len(contexts), scope)
+
+    pool = None
+    try:
+        # Small batches render faster here than they ship to the pool
+        if workers > 1 and len(contexts) >= config.get('REPORT_BATCH_POOL_MIN', 200):
+            pool = _get_pool(workers, template_folder)
+            chunksize = max(1, min(32, len(contexts) // (workers * 4)))
+            cards = pool.map(_render_card, contexts, chunksize=chunksize)
+        else:
+            _init_worker(template_folder)
+            cards = map(_render_card, contexts)
+
+        for done, (context, card) in enumerate(zip(contexts, cards), 1):
+            _update_batch(batch_id, done=done)
+            yield context['pupil'], card
+        _update_batch(batch_id, status='finished', finished_at=time.time())
+    except GeneratorExit:
+        _update_batch(batch_id, status='cancelled', finished_at=time.time())
+        raise
+    except Exception as e:
+        _update_batch(batch_id, status='failed', error=str(e), finished_at=time.time())
+        if isinstance(e, BrokenProcessPool) and pool is not None:
+            _drop_pool(pool)
+        raise
+
+
+class _ZipBuffer:
+    """Write-only file for ZipFile; the archive is drained as it grows."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data, self.parts = b''.join(self.parts), []
+        return data
+
+
+def zip_stream(files):
+    """Yield a zip archive of (name, data) pairs chunk by chunk."""
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files:
+            archive.writestr(name, data)
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def batch_title(contexts):
+    pupil = contexts[0]['pupil']
+    return f"{pupil['class_name']} {pupil['term_name']} {pupil['year_name']} report cards"
+
+
+def card_filename(pupil):
+    return f"{secure_filename(pupil['reg_no']) or 'pupil'}.html"
+
+
+def card_page(pupil, card):
+    """A card as a page of its own, for the zip."""
+    return render_template(PRINT_TEMPLATE, title=pupil['full_name'], cards=[card]).encode('utf-8')
+
+
+@job_type(BATCH_JOB, limit=1)
+def report_cards_job(job, class_id, year_id, term_id, stream_id=None, output='html', back_url=None):
+    """Render a class's cards to a file: one printable page or a zip."""
+    job.progress(0, message='Reading marks...')
+    contexts = class_card_contexts(class_id, year_id, term_id, stream_id)
+    if not contexts:
+        raise ValueError('No pupils found for the selected class and term.')
+
+    title = batch_title(contexts)
+    scope = {'class_id': class_id, 'year_id': year_id, 'term_id': term_id, 'stream_id': stream_id}
+    cards = render_class_cards(contexts, job.id, scope)
+    total = len(contexts)
+    job.progress(0, total, message=f'Rendering {total} report card(s)...')
+
+    with open(job.result_path(f"{secure_filename(title)}.{output}"), 'wb') as f:
+        if output == 'zip':
+            with zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for done, (pupil, card) in enumerate(cards, 1):
+                    archive.writestr(card_filename(pupil), card_page(pupil, card))
+                    job.progress(done, total)
+        else:
+            pages = []
+            for done, (_, card) in enumerate(cards, 1):
+                pages.append(card)
+                job.progress(done, total)
+            f.write(render_template(PRINT_TEMPLATE, title=title, cards=pages).encode('utf-8'))
+
+    return {'message': f'{total} report card(s) ready.', 'counts': {'report cards': total},
+            'back_url': back_url}
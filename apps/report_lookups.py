@@ -0,0 +1,118 @@
+"""Score-range lookups used when building report cards.
+
+The comment tables map a score range (min_score..max_score) to a comment.
+Report pages used to resolve them with one ``BETWEEN`` query per mark or
+per pupil; ``ReportLookups`` loads each table once per request and
+resolves scores in memory.  Grades and divisions live in ``apps.grading``.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+
+
+class ScoreRangeIndex:
+    """Find the first row whose [min_score, max_score] range holds a score.
+
+    ``rows`` must already be in preference order (newest first for the
+    comment tables), mirroring the ``ORDER BY ... LIMIT 1`` of the old
+    per-row queries.  Overlapping ranges are resolved when the index is
+    built, so a lookup is a single binary search.
+    """
+
+    def __init__(self, rows):
+        rows = [r for r in rows if r['min_score'] is not None and r['max_score'] is not None]
+        self._bounds = sorted({r['min_score'] for r in rows} | {r['max_score'] for r in rows})
+        # Winner at each bound and across each open gap between two bounds
+        self._at_bound = [self._first(rows, b, b) for b in self._bounds]
+        self._between = [
+            self._first(rows, lo, hi) for lo, hi in zip(self._bounds, self._bounds[1:])
+        ]
+
+    @staticmethod
+    def _first(rows, lo, hi):
+        for row in rows:
+            if row['min_score'] <= lo and hi <= row['max_score']:
+                return row
+        return None
+
+    def lookup(self, score):
+        if score is None or not self._bounds:
+            return None
+        i = bisect_left(self._bounds, score)
+        if i < len(self._bounds) and self._bounds[i] == score:
+            return self._at_bound[i]
+        if 0 < i < len(self._bounds):
+            return self._between[i - 1]
+        return None
+
+
+class ReportLookups:
+    """Per-request cache of the comment tables.
+
+    Each table is fetched with one query the first time it is needed,
+    restricted to ``stream_ids`` where the table is stream-specific.
+    """
+
+    def __init__(self, cursor, stream_ids=()):
+        self.cursor = cursor
+        self.stream_ids = sorted({s for s in stream_ids if s is not None})
+        self._subject_comments = None
+        self._classteacher_comments = None
+        self._headteacher_comments = None
+
+    def _stream_filter(self, column):
+        if not self.stream_ids:
+            return "1=0", []
+        placeholders = ','.join(['%s'] * len(self.stream_ids))
+        return f"{column} IN ({placeholders})", list(self.stream_ids)
+
+    def _grouped_index(self, rows, key):
+        grouped = defaultdict(list)
+        for row in rows:
+            grouped[key(row)].append(row)
+        return {k: ScoreRangeIndex(v) for k, v in grouped.items()}
+
+    def subject_comment(self, subject_id, stream_id, mark):
+        """Latest subject comment for a mark, or None."""
+        if self._subject_comments is None:
+            where, params = self._stream_filter('sc.stream_id')
+            self.cursor.execute(f"""
+                SELECT sc.subject_id, sc.stream_id, sc.min_score, sc.max_score,
+                       sc.comment, u.name_sf
+                FROM subject_comments sc
+                LEFT JOIN users u ON sc.user_id = u.id
+                WHERE {where}
+                ORDER BY sc.updated_at DESC
+            """, params)
+            self._subject_comments = self._grouped_index(
+                self.cursor.fetchall(), lambda r: (r['subject_id'], r['stream_id'])
+            )
+        index = self._subject_comments.get((subject_id, stream_id))
+        return index.lookup(mark) if index else None
+
+    def classteacher_comment(self, stream_id, average):
+        """Latest class teacher comment for a stream average, or None."""
+        if self._classteacher_comments is None:
+            where, params = self._stream_filter('cc.stream_id')
+            self.cursor.execute(f"""
+                SELECT cc.stream_id, cc.min_score, cc.max_score, cc.comment, u.name_sf
+                FROM classteacher_comments cc
+                LEFT JOIN users u ON cc.user_id = u.id
+                WHERE {where}
+                ORDER BY cc.updated_at DESC
+            """, params)
+            self._classteacher_comments = self._grouped_index(
+                self.cursor.fetchall(), lambda r: r['stream_id']
+            )
+        index = self._classteacher_comments.get(stream_id)
+        return index.lookup(average) if index else None
+
+    def headteacher_comment(self, average):
+        """Latest headteacher comment for an average, or None."""
+        if self._headteacher_comments is None:
+            self.cursor.execute("""
+                SELECT min_score, max_score, comment
+                FROM headmaster_comments
+                ORDER BY updated_at DESC
+            """)
+            self._headteacher_comments = ScoreRangeIndex(self.cursor.fetchall())
+        return self._headteacher_comments.lookup(average)
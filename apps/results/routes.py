@@ -9,6 +9,7 @@ from io import BytesIO
 
 import os
 import random
+import uuid
 import re
 import logging
 
@@ -23,6 +24,10 @@ from mysql.connector import Error
 
 from apps.results import blueprint
 from apps import get_db_connection
+from apps.summaries import refresh_summaries
+from apps.report_cache import invalidate_reports
+from apps.reference_data import reference_names, reference_rows
+from apps.job_runner import job_response, job_type, submit
 
 from openpyxl.styles import Font, Alignment
 
@@ -224,27 +229,14 @@ def pdownload_template():
 
 @blueprint.route('/pupload_excel', methods=['GET', 'POST'])
 def pupload_excel():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-
-    # Fetch dropdown data
-    cursor.execute('SELECT year_id, year_name AS study_year FROM study_year ORDER BY year_name')
-    study_years = cursor.fetchall()
-
-    cursor.execute('SELECT class_id, class_name FROM classes ORDER BY class_name')
-    class_list = cursor.fetchall()
-
-    cursor.execute('SELECT term_id, term_name FROM terms ORDER BY term_name')
-    terms = cursor.fetchall()
-
-    cursor.execute('SELECT subject_id, subject_name FROM subjects ORDER BY subject_name')
-    subjects = cursor.fetchall()
-
-    cursor.execute('SELECT assessment_id, assessment_name FROM assessment ORDER BY assessment_name')
-    assessments = cursor.fetchall()
-
-    cursor.execute('SELECT stream_id, stream_name FROM stream ORDER BY stream_name')
-    streams = cursor.fetchall()
+    # Dropdown data (cached; the template shows year_name as study_year)
+    study_years = [dict(row, study_year=row['year_name'])
+                   for row in reference_rows('study_year', order_by='year_name')]
+    class_list = reference_rows('classes', order_by='class_name')
+    terms = reference_rows('terms', order_by='term_name')
+    subjects = reference_rows('subjects', order_by='subject_name')
+    assessments = reference_rows('assessment', order_by='assessment_name')
+    streams = reference_rows('stream', order_by='stream_name')
 
     if request.method == 'POST':
         file = request.files.get('file')
@@ -258,43 +250,17 @@ def pupload_excel():
             flash('Invalid file format. Please upload an Excel (.xlsx) file.', 'danger')
             return redirect(request.url)
 
-        # Save the uploaded file
-        filename = secure_filename(file.filename)
+        # Save the uploaded file under a name of its own; the import runs as a job
+        filename = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
         file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         file.save(file_path)
 
-        try:
-            import pandas as pd
-            df = pd.read_excel(file_path)
-
-            # Custom function to validate and extract the data
-            processed_data, errors, existing_reg_nos, duplicate_reg_nos = validate_excel_data(df)
-
-            if errors:
-                flash('Errors encountered:\n' + '\n'.join(errors), 'danger')
-                return redirect(request.url)
-
-            if duplicate_reg_nos:
-                flash(f"Duplicate reg_no(s) found: {', '.join(duplicate_reg_nos)}", 'danger')
-                return redirect(request.url)
-
-            if existing_reg_nos:
-                flash(f"Existing reg_no(s): {', '.join(existing_reg_nos)} (skipped).", 'warning')
-
-            if processed_data:
-                insert_scores_into_database(processed_data)
-                flash(f"{len(processed_data)} score record(s) uploaded successfully!", 'success')
-            else:
-                flash('No new records to insert.', 'info')
-
-            return redirect(url_for('results_blueprint.pupload_excel'))
-
-        except pd.errors.EmptyDataError:
-            flash('Uploaded file is empty.', 'danger')
-        except Exception as e:
-            flash(f'Error processing the file: {str(e)}', 'danger')
-
-        return redirect(url_for('results_blueprint.pupload_excel'))
+        job_id = submit('score_import', {
+            'file_path': file_path,
+            'user_id': session.get('id'),
+            'back_url': url_for('results_blueprint.pupload_excel'),
+        }, user_id=session.get('id'))
+        return job_response(job_id)
 
     # GET request: render form with all dropdowns
     return render_template(
@@ -320,11 +286,31 @@ def pupload_excel():
 
 
 
-def validate_excel_data(df):
-    processed_data = []
+# Excel column -> (reference table, id column)
+NAME_MAPPINGS = {
+    'class': ('classes', 'class_id'),
+    'stream': ('stream', 'stream_id'),
+    'study_year': ('study_year', 'year_id'),
+    'term': ('terms', 'term_id'),
+    'assessment': ('assessment', 'assessment_id'),
+    'subject': ('subjects', 'subject_id'),
+}
+NAME_LABELS = {
+    'class': 'Class', 'stream': 'Stream', 'study_year': 'Study year',
+    'term': 'Term', 'assessment': 'Assessment', 'subject': 'Subject',
+}
+SCORE_KEY_COLUMNS = ['reg_no', 'class_id', 'stream_id', 'year_id', 'term_id', 'assessment_id', 'subject_id']
+IMPORT_COLUMNS = ['row_no', 'user_id'] + SCORE_KEY_COLUMNS + ['mark', 'notes']
+IMPORT_CHUNK_SIZE = 1000
+
+
+def validate_excel_data(df, user_id):
+    """Map the workbook's names to IDs and validate every row at once.
+
+    Returns (rows, errors): a DataFrame with IMPORT_COLUMNS for the valid
+    rows, and one message per rejected row.
+    """
     errors = []
-    existing_reg_nos = []
-    seen_keys = set()
 
     # Normalize column names
     df.columns = df.columns.str.lower()
@@ -335,193 +321,184 @@ def validate_excel_data(df):
     if missing_columns:
         raise ValueError(f"Missing required columns: {', '.join(missing_columns)}")
 
-    # Get user ID from session
-    user_id = session.get('id')
     if not user_id:
         raise ValueError("Missing or invalid user session ID.")
 
     try:
-        with get_db_connection() as connection:
-            cursor = connection.cursor()
-
-            # Mapping queries
-            mapping_queries = {
-                'classes': "SELECT class_name, class_id FROM classes",
-                'study_year': "SELECT year_name, year_id FROM study_year",
-                'terms': "SELECT term_name, term_id FROM terms",
-                'assessment': "SELECT assessment_name, assessment_id FROM assessment",
-                'subjects': "SELECT subject_name, subject_id FROM subjects",
-                'streams': "SELECT stream_name, stream_id FROM stream"
-            }
-
-            mappings = {}
-            for key, query in mapping_queries.items():
-                cursor.execute(query)
-                mappings[key] = {row[0].strip(): row[1] for row in cursor.fetchall()}
-
-            # Load existing score combinations to avoid duplicates
-            cursor.execute("""
-                SELECT reg_no, class_id, stream_id, year_id, term_id, assessment_id, subject_id 
-                FROM scores
-            """)
-            existing_score_keys = {
-                (row[0], row[1], row[2], row[3], row[4], row[5], row[6]) for row in cursor.fetchall()
-            }
-
-    except Exception as e:
-        errors.append(f"Database error: {str(e)}")
-        return processed_data, errors, existing_reg_nos, []
-
-    # Iterate over Excel rows
-    for index, row in df.iterrows():
-        if row.isnull().all():
-            continue
-
-        reg_no = str(row.get('reg_no')).strip()
-        class_name = str(row.get('class')).strip()
-        stream_name = str(row.get('stream')).strip()
-        year_name = str(row.get('study_year')).strip()
-        term_name = str(row.get('term')).strip()
-        assessment_name = str(row.get('assessment')).strip()
-        subject_name = str(row.get('subject')).strip()
-        mark = row.get('mark')
-        notes = row.get('notes') if 'notes' in row else None
-
-        # Check for missing critical fields
-        if not all([reg_no, class_name, stream_name, year_name, term_name, assessment_name, subject_name]):
-            errors.append(f"Row {index + 2}: Missing one or more required fields.")
-            continue
-
-        if pd.isna(mark):
-            errors.append(f"Row {index + 2}: 'Mark' is missing.")
-            continue
-
-        # Map names to IDs
-        class_id = mappings['classes'].get(class_name)
-        stream_id = mappings['streams'].get(stream_name)
-        year_id = mappings['study_year'].get(year_name)
-        term_id = mappings['terms'].get(term_name)
-        assessment_id = mappings['assessment'].get(assessment_name)
-        subject_id = mappings['subjects'].get(subject_name)
-
-        # Collect errors for missing mappings
-        row_errors = []
-        if not class_id:
-            row_errors.append(f"Class '{class_name}' not found.")
-        if not stream_id:
-            row_errors.append(f"Stream '{stream_name}' not found.")
-        if not year_id:
-            row_errors.append(f"Study year '{year_name}' not found.")
-        if not term_id:
-            row_errors.append(f"Term '{term_name}' not found.")
-        if not assessment_id:
-            row_errors.append(f"Assessment '{assessment_name}' not found.")
-        if not subject_id:
-            row_errors.append(f"Subject '{subject_name}' not found.")
-
-        if row_errors:
-            errors.append(f"Row {index + 2}: " + "; ".join(row_errors))
-            continue
-
-        # Check for duplicates
-        key = (reg_no, class_id, stream_id, year_id, term_id, assessment_id, subject_id)
-        if key in existing_score_keys:
-            existing_reg_nos.append(reg_no)
-            continue
-
-        # Append validated row
-        data = {
-            'user_id': user_id,
-            'reg_no': reg_no,
-            'class_id': class_id,
-            'stream_id': stream_id,
-            'year_id': year_id,
-            'term_id': term_id,
-            'assessment_id': assessment_id,
-            'subject_id': subject_id,
-            'mark': mark,
-            'notes': None if pd.isna(notes) else notes
+        mappings = {
+            column: {str(name).strip(): id_ for id_, name in reference_names(table).items()}
+            for column, (table, _) in NAME_MAPPINGS.items()
         }
-
-        processed_data.append(data)
-
-    return processed_data, errors, existing_reg_nos, []
-
-
-
-
-
-
-
-def insert_scores_into_database(processed_data):
-    if not processed_data:
-        print("⚠️ No score data to insert.")
-        return
-
-    if not isinstance(processed_data, list) or not all(isinstance(item, dict) for item in processed_data):
-        raise ValueError("❌ processed_data must be a list of dictionaries.")
-
-    for idx, data in enumerate(processed_data):
-        if 'mark' not in data or pd.isna(data['mark']):
-            raise ValueError(f"❌ 'mark' is missing or null in record at index {idx}: {data}")
-        data['notes'] = None if pd.isna(data.get('notes')) else data.get('notes')
-
-    insert_query = """
-        INSERT INTO scores (
-            user_id, reg_no, class_id, stream_id, term_id, year_id,
-            assessment_id, subject_id, mark, notes
-        ) VALUES (
-            %(user_id)s, %(reg_no)s, %(class_id)s, %(stream_id)s, %(term_id)s, %(year_id)s,
-            %(assessment_id)s, %(subject_id)s, %(mark)s, %(notes)s
-        )
+    except Error as e:
+        errors.append(f"Database error: {str(e)}")
+        return pd.DataFrame(columns=IMPORT_COLUMNS), errors
+
+    df = df.dropna(how='all')
+    rows = pd.DataFrame({'row_no': df.index + 2}, index=df.index)  # Excel row numbers
+    rows['user_id'] = user_id
+
+    text_columns = ['reg_no'] + list(NAME_MAPPINGS)
+    names = {c: df[c].where(df[c].notna(), '').astype(str).str.strip() for c in text_columns}
+    rows['reg_no'] = names['reg_no']
+    rows['mark'] = pd.to_numeric(df['mark'], errors='coerce')
+    rows['notes'] = df['notes'] if 'notes' in df else None
+
+    missing_fields = pd.concat([names[c].eq('') for c in text_columns], axis=1).any(axis=1)
+    missing_mark = df['mark'].isna()
+    bad_mark = rows['mark'].isna() & ~missing_mark
+
+    unmapped = {}
+    for column, (_, id_column) in NAME_MAPPINGS.items():
+        rows[id_column] = names[column].map(mappings[column])
+        unmapped[column] = rows[id_column].isna() & names[column].ne('')
+
+    bad = missing_fields | missing_mark | bad_mark
+    for mask in unmapped.values():
+        bad |= mask
+
+    # Messages are only built for the rejected rows
+    for idx in rows.index[bad]:
+        row_no = rows.at[idx, 'row_no']
+        if missing_fields[idx]:
+            errors.append(f"Row {row_no}: Missing one or more required fields.")
+        elif missing_mark[idx]:
+            errors.append(f"Row {row_no}: 'Mark' is missing.")
+        elif bad_mark[idx]:
+            errors.append(f"Row {row_no}: 'Mark' must be a number.")
+        else:
+            errors.append(f"Row {row_no}: " + "; ".join(
+                f"{NAME_LABELS[c]} '{names[c][idx]}' not found."
+                for c in NAME_MAPPINGS if unmapped[c][idx]
+            ))
+
+    rows = rows[~bad]
+    for _, id_column in NAME_MAPPINGS.values():
+        rows[id_column] = rows[id_column].astype(int)
+    rows['notes'] = rows['notes'].astype(object).where(rows['notes'].notna(), None)
+
+    # Only the first row of a repeated score key is imported, as before
+    rows = rows.drop_duplicates(SCORE_KEY_COLUMNS, keep='first')
+    return rows[IMPORT_COLUMNS], errors
+
+
+def insert_scores_into_database(rows, progress=None):
+    """Import validated score rows, skipping keys that already have a mark.
+
+    The rows are copied into a temporary staging table in chunks; the
+    duplicate check and the insert are then single set-based statements
+    joined against ``scores`` on the file's keys only.  ``progress(done,
+    total)`` is called after each staged chunk.
+
+    Returns (inserted_count, existing_reg_nos).
     """
+    if rows is None or rows.empty:
+        return 0, []
 
-    check_existing_query = """
-        SELECT COUNT(*) FROM scores
-        WHERE reg_no = %(reg_no)s
-        AND class_id = %(class_id)s
-        AND stream_id = %(stream_id)s
-        AND year_id = %(year_id)s
-        AND term_id = %(term_id)s
-        AND assessment_id = %(assessment_id)s
-        AND subject_id = %(subject_id)s
-    """
+    key_match = " AND ".join(f"s.{c} = st.{c}" for c in SCORE_KEY_COLUMNS)
+    columns = ', '.join(IMPORT_COLUMNS)
+    placeholders = '(' + ', '.join(['%s'] * len(IMPORT_COLUMNS)) + ')'
+    records = list(rows.astype(object).where(rows.notna(), None).itertuples(index=False, name=None))
 
     try:
         with get_db_connection() as connection:
             with connection.cursor() as cursor:
-                inserted_count = 0
-
-                for data in processed_data:
-                    cursor.execute(check_existing_query, {
-                        'reg_no': data['reg_no'],
-                        'class_id': data['class_id'],
-                        'stream_id': data['stream_id'],
-                        'year_id': data['year_id'],
-                        'term_id': data['term_id'],
-                        'assessment_id': data['assessment_id'],
-                        'subject_id': data['subject_id']
-                    })
-                    existing_count = cursor.fetchone()[0]
-
-                    if existing_count == 0:
-                        cursor.execute(insert_query, data)
-                        inserted_count += 1
-
+                cursor.execute("DROP TEMPORARY TABLE IF EXISTS score_import_staging")
+                cursor.execute("""
+                    CREATE TEMPORARY TABLE score_import_staging (
+                        row_no INT NOT NULL,
+                        user_id INT NULL,
+                        reg_no VARCHAR(50) NOT NULL,
+                        class_id INT NOT NULL,
+                        stream_id INT NOT NULL,
+                        year_id INT NOT NULL,
+                        term_id INT NOT NULL,
+                        assessment_id INT NOT NULL,
+                        subject_id INT NOT NULL,
+                        mark DECIMAL(6, 2) NOT NULL,
+                        notes TEXT NULL,
+                        KEY idx_staging_entry (reg_no, year_id, term_id, assessment_id, subject_id)
+                    )
+                """)
+                try:
+                    for start in range(0, len(records), IMPORT_CHUNK_SIZE):
+                        chunk = records[start:start + IMPORT_CHUNK_SIZE]
+                        cursor.execute(
+                            f"INSERT INTO score_import_staging ({columns}) VALUES "
+                            + ', '.join([placeholders] * len(chunk)),
+                            [value for record in chunk for value in record]
+                        )
+                        if progress:
+                            progress(start + len(chunk), len(records))
+
+                    cursor.execute(f"""
+                        SELECT DISTINCT st.reg_no
+                        FROM score_import_staging st
+                        WHERE EXISTS (SELECT 1 FROM scores s WHERE {key_match})
+                        ORDER BY st.reg_no
+                    """)
+                    existing_reg_nos = [row[0] for row in cursor.fetchall()]
+
+                    cursor.execute(f"""
+                        INSERT INTO scores (
+                            user_id, reg_no, class_id, stream_id, term_id, year_id,
+                            assessment_id, subject_id, mark, notes
+                        )
+                        SELECT st.user_id, st.reg_no, st.class_id, st.stream_id, st.term_id, st.year_id,
+                               st.assessment_id, st.subject_id, st.mark, st.notes
+                        FROM score_import_staging st
+                        WHERE NOT EXISTS (SELECT 1 FROM scores s WHERE {key_match})
+                        ORDER BY st.row_no
+                    """)
+                    inserted_count = cursor.rowcount
+                finally:
+                    cursor.execute("DROP TEMPORARY TABLE IF EXISTS score_import_staging")
+
+                refresh_summaries(connection, set(
+                    rows[['reg_no', 'year_id', 'term_id', 'assessment_id']].itertuples(index=False, name=None)
+                ))
+                invalidate_reports(set(rows[['class_id', 'year_id', 'term_id']].itertuples(index=False, name=None)))
                 connection.commit()
-                print(f"✅ Successfully inserted {inserted_count} record(s).")
+                current_app.logger.info("Imported %s score rows", inserted_count)
+                return inserted_count, existing_reg_nos
     except Exception as e:
-        print(f"❌ Error inserting data: {e}")
+        current_app.logger.error("Error importing scores: %s", e)
         raise
 
 
+@job_type('score_import', limit=1)
+def import_scores_job(job, file_path, user_id, back_url=None):
+    """Validate and import an uploaded score workbook."""
+    job.progress(0, message='Reading the workbook...')
+    try:
+        df = pd.read_excel(file_path)
+    except pd.errors.EmptyDataError:
+        raise ValueError('Uploaded file is empty.')
+    finally:
+        # The upload has a one-off name; nothing reads it again
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+    # Map names to IDs and validate the whole sheet
+    processed_data, errors = validate_excel_data(df, user_id)
+    if errors:
+        return {
+            'message': f'{len(errors)} row(s) have errors; nothing was imported.',
+            'counts': {'rejected rows': len(errors)},
+            'columns': ['Error'],
+            'rows': [[error] for error in errors],
+            'back_url': back_url,
+        }
 
-
-
-
-
-
-
+    job.progress(0, len(processed_data), message=f'Importing {len(processed_data)} score(s)...')
+    inserted_count, existing_reg_nos = insert_scores_into_database(processed_data, job.progress)
+    return {
+        'message': (f"{inserted_count} score record(s) uploaded successfully!" if inserted_count
+                    else 'No new records to insert.'),
+        'counts': {'inserted': inserted_count, 'pupils with existing marks (skipped)': len(existing_reg_nos)},
+        'columns': ['Existing reg_no (skipped)'],
+        'rows': [[reg_no] for reg_no in existing_reg_nos],
+        'back_url': back_url,
+    }
 
 
   
@@ -0,0 +1,192 @@
+"""Term results engine shared by the positions and report-card routes.
+
+Score rows for a class/term/assessment set are pivoted into a pupil x
+subject frame once, and totals, averages, aggregates, divisions,
+completeness and tie-aware class/stream/subject ranks are computed with
+column operations instead of per-pupil Python loops.
+"""
+import numpy as np
+import pandas as pd
+
+from apps.grading import divisions_for, get_grade_scale
+
+# Columns that describe one mark rather than the pupil
+_MARK_COLUMNS = {'subject_id', 'subject_name', 'Mark', 'grade_letter', 'remark', 'weight'}
+
+
+def _plain(value):
+    """numpy scalar -> int/float/None, keeping whole numbers as ints."""
+    if value is None:
+        return None
+    if isinstance(value, (float, np.floating)):
+        if np.isnan(value):
+            return None
+        value = float(value)
+        return int(value) if value.is_integer() else value
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+
+def _overlay(computed, stored, field):
+    """``computed`` with the stored summary value wherever a pupil has one."""
+    return pd.Series(
+        [s[field] if s is not None else c for s, c in zip(stored, computed)],
+        index=computed.index
+    )
+
+
+def _positions(frame, score, complete, group_cols, incomplete_last):
+    """Competition ranks ("1, 2, 2, 4") of ``score`` within ``group_cols``.
+
+    With ``incomplete_last`` pupils missing an aggregate subject are ranked
+    after everyone complete in their group, in reg_no order.
+    """
+    if not incomplete_last:
+        return score.groupby([frame[c] for c in group_cols], dropna=False).rank(
+            method='min', ascending=False
+        )
+
+    ranked = score.where(complete).groupby(
+        [frame[c] for c in group_cols], dropna=False
+    ).rank(method='min', ascending=False)
+
+    n_complete = complete.groupby([frame[c] for c in group_cols], dropna=False).transform('sum')
+    incomplete = frame[~complete].sort_values('reg_no')
+    if not incomplete.empty:
+        seq = incomplete.groupby(group_cols, dropna=False).cumcount() + 1
+        ranked.loc[seq.index] = n_complete.loc[seq.index] + seq
+    return ranked
+
+
+def compute_term_results(rows, total_subjects=None, aggregate_subjects=None,
+                         by_assessment=False, average_over_all=False,
+                         strict_aggregate=True, incomplete_last=True, summaries=None):
+    """Build one result record per pupil (per assessment with ``by_assessment``).
+
+    ``rows`` are score rows carrying at least reg_no, stream_id,
+    subject_name and Mark (plus assessment_name when ``by_assessment``);
+    every other column is copied from the pupil's first row.
+
+    - ``total_subjects``: subjects summed into total/average (default: all).
+    - ``aggregate_subjects``: subjects whose grade weights make the aggregate
+      (default: ``total_subjects``).
+    - ``average_over_all``: divide by the number of total subjects, counting
+      missing marks as 0, instead of by the marks present.
+    - ``strict_aggregate``: aggregate and division are 'X' unless every
+      aggregate subject has a mark.
+    - ``incomplete_last``: rank incomplete pupils after the complete ones.
+    - ``summaries``: stored per-pupil totals from ``apps.summaries.summary_score_rows``;
+      pupils found there skip the total/aggregate/division work.
+
+    Records are returned in order of first appearance in ``rows``.
+    """
+    if not rows:
+        return []
+
+    key = ['reg_no', 'assessment_name'] if by_assessment else ['reg_no']
+    frame = pd.DataFrame.from_records(rows)
+    frame['Mark'] = pd.to_numeric(frame['Mark'], errors='coerce')
+    if 'stream_id' not in frame:
+        frame['stream_id'] = None
+
+    scale = get_grade_scale()
+    bands = scale.classify(frame['Mark'].tolist())
+    band_rows = [scale.rows[i] if i >= 0 else None for i in bands]
+    frame['grade_letter'] = [b['grade_letter'] if b else '' for b in band_rows]
+    frame['remark'] = [b['remark'] if b else '' for b in band_rows]
+    frame['weight'] = pd.to_numeric(
+        pd.Series([b['weight'] if b else None for b in band_rows], index=frame.index),
+        errors='coerce'
+    ).fillna(0)
+
+    # Later rows win, as they did when the routes filled dicts row by row
+    last = frame.drop_duplicates(key + ['subject_name'], keep='last')
+    marks = last.pivot(index=key, columns='subject_name', values='Mark')
+    weights = last.pivot(index=key, columns='subject_name', values='weight')
+
+    pupils = frame.drop_duplicates(key, keep='first').set_index(key)
+    marks = marks.reindex(pupils.index)
+    weights = weights.reindex(pupils.index)
+
+    subject_names = sorted(marks.columns)
+    total_cols = list(total_subjects) if total_subjects else subject_names
+    agg_cols = list(aggregate_subjects) if aggregate_subjects else total_cols
+
+    total_marks = marks.reindex(columns=total_cols)
+    present = total_marks.notna().sum(axis=1)
+    total = total_marks.sum(axis=1)
+    agg_marks = marks.reindex(columns=agg_cols)
+    complete = agg_marks.notna().all(axis=1)
+    aggregate = weights.reindex(columns=agg_cols).where(agg_marks.notna()).sum(axis=1)
+    division = pd.Series(divisions_for(aggregate.tolist()), index=aggregate.index)
+
+    stored = [summaries.get(idx) for idx in pupils.index] if summaries else []
+    if any(s is not None for s in stored):
+        total = _overlay(total, stored, 'total_score')
+        present = _overlay(present, stored, 'subjects_count')
+        complete = _overlay(complete, stored, 'complete').astype(bool)
+        aggregate = _overlay(aggregate, stored, 'aggregate')
+        division = _overlay(division, stored, 'division')
+
+    if average_over_all:
+        average = total / len(total_cols)
+    else:
+        average = (total / present.where(present > 0)).fillna(0)
+    average = average.round(2)
+
+    if strict_aggregate:
+        division = division.where(complete, 'X')
+
+    scope = ['_scope'] + (['assessment_name'] if by_assessment else [])
+    flat = pupils.reset_index()[key + ['stream_id']]
+    flat['_scope'] = 0
+    flat.index = pupils.index.set_names([None] * pupils.index.nlevels)
+    class_position = _positions(flat, average, complete, scope, incomplete_last)
+    stream_position = _positions(flat, average, complete, scope + ['stream_id'], incomplete_last)
+
+    if by_assessment:
+        subject_ranks = marks.groupby(level='assessment_name').rank(method='min', ascending=False)
+    else:
+        subject_ranks = marks.rank(method='min', ascending=False)
+
+    # Per-pupil subject dicts, holding only the subjects the pupil has rows for
+    per_pupil = {idx: ({}, {}, {}, {}) for idx in pupils.index}
+    columns = key + ['subject_name', 'Mark', 'grade_letter', 'remark', 'weight']
+    for rec in last[columns].itertuples(index=False):
+        idx = tuple(rec[:len(key)]) if by_assessment else rec[0]
+        pupil_marks, pupil_grades, pupil_remarks, pupil_weights = per_pupil[idx]
+        pupil_marks[rec.subject_name] = _plain(rec.Mark)
+        pupil_grades[rec.subject_name] = rec.grade_letter
+        pupil_remarks[rec.subject_name] = rec.remark
+        pupil_weights[rec.subject_name] = _plain(rec.weight)
+
+    info_columns = [c for c in pupils.columns if c not in _MARK_COLUMNS]
+    info = pupils[info_columns].astype(object).where(pupils[info_columns].notna(), None)
+
+    results = []
+    for idx, row_info, tot, avg, agg, div, ok, cpos, spos, ranks in zip(
+        pupils.index, info.to_dict('records'), total, average, aggregate,
+        division, complete, class_position, stream_position,
+        subject_ranks.to_dict('records')
+    ):
+        record = dict(row_info)
+        record.update(dict(zip(key, idx if by_assessment else (idx,))))
+        pupil_marks, pupil_grades, pupil_remarks, pupil_weights = per_pupil[idx]
+        aggregate_value = _plain(agg) if ok or not strict_aggregate else 'X'
+        record.update({
+            'marks': pupil_marks,
+            'grades': pupil_grades,
+            'remarks': pupil_remarks,
+            'weights': pupil_weights,
+            'total_score': _plain(tot),
+            'average_score': float(avg),
+            'aggregate': aggregate_value,
+            'division': div,
+            'complete': bool(ok),
+            'class_position': _plain(cpos),
+            'stream_position': _plain(spos),
+            'subject_ranks': {s: _plain(ranks.get(s)) for s in subject_names},
+        })
+        results.append(record)
+    return results
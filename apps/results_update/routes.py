@@ -9,6 +9,11 @@ import random
 import logging
 import re  # <-- Add this line
 from apps import get_db_connection
+from apps.audit_log import log_rows
+from apps.reference_data import reference_rows
+from apps.summaries import refresh_summaries
+from apps.report_cache import invalidate_reports
+from apps.pagination import SortKey, keyset_page
 from jinja2 import TemplateNotFound
 import numpy as np 
 
@@ -18,6 +23,37 @@ import numpy as np
 
 from mysql.connector import Error
 
+RESULTS_SELECT = """
+    p.reg_no,
+    CONCAT_WS(' ', p.last_name, p.first_name, p.other_name) AS full_name,
+    t.term_name,
+    a.assessment_name,
+    sub.subject_name,
+    s.Mark,
+    p.pupil_id,
+    y.year_name,
+    str.stream_name,
+    s.score_id
+"""
+
+RESULTS_FROM = """
+    FROM 
+        scores s
+    INNER JOIN pupils p ON p.reg_no = s.reg_no
+    INNER JOIN assessment a ON s.assessment_id = a.assessment_id
+    INNER JOIN terms t ON s.term_id = t.term_id
+    INNER JOIN subjects sub ON s.subject_id = sub.subject_id
+    INNER JOIN study_year y ON s.year_id = y.year_id
+    INNER JOIN stream str ON p.stream_id = str.stream_id
+"""
+
+RESULTS_SORTS = {
+    'name': SortKey('Name', ['p.last_name', 'p.first_name', 's.score_id']),
+    'reg_no': SortKey('Reg No', ['p.reg_no', 's.score_id']),
+    'entered': SortKey('Entered', ['s.score_id']),
+}
+
+
 @blueprint.route('/results_update', methods=['GET'])
 def results_update():
     """Fetches pupil marks per subject for a given assessment, only including those with recorded marks."""
@@ -26,26 +62,12 @@ def results_update():
     cursor = connection.cursor(dictionary=True)
 
     # Dropdown data
-    cursor.execute("SELECT * FROM classes")
-    class_list = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM study_year")
-    study_years = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM terms")
-    terms = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM assessment")
-    assessments = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM subjects")
-    subjects = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM stream")
-    streams = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM pupils")
-    pupils = cursor.fetchall()
+    class_list = reference_rows('classes')
+    study_years = reference_rows('study_year')
+    terms = reference_rows('terms')
+    assessments = reference_rows('assessment')
+    subjects = reference_rows('subjects')
+    streams = reference_rows('stream')
 
     # Filters
     class_id = request.args.get('class_id', type=int)
@@ -80,7 +102,6 @@ def results_update():
             subjects=subjects,
             assessments=assessments,
             streams=streams,
-            pupils=pupils,
             selected_class_id=None,
             selected_study_year_id=None,
             selected_term_id=None,
@@ -92,51 +113,36 @@ def results_update():
             segment='results_update'
         )
 
-    # Query for only pupils with marks
-    query = """
-    SELECT 
-        p.reg_no,
-        CONCAT_WS(' ', p.last_name, p.first_name, p.other_name) AS full_name,
-        t.term_name,
-        a.assessment_name,
-        sub.subject_name,
-        s.Mark,
-        p.pupil_id,
-        y.year_name,
-        str.stream_name,
-        s.score_id
-    FROM 
-        scores s
-    INNER JOIN pupils p ON p.reg_no = s.reg_no
-    INNER JOIN assessment a ON s.assessment_id = a.assessment_id
-    INNER JOIN terms t ON s.term_id = t.term_id
-    INNER JOIN subjects sub ON s.subject_id = sub.subject_id
-    INNER JOIN study_year y ON s.year_id = y.year_id
-    INNER JOIN stream str ON p.stream_id = str.stream_id
-    WHERE 1=1
-    """
-
+    # Only pupils with marks
+    where, params = [], []
     if class_id:
-        query += f" AND p.class_id = {class_id}"
+        where.append("p.class_id = %s")
+        params.append(class_id)
     if stream_id:
-        query += f" AND p.stream_id = {stream_id}"
+        where.append("p.stream_id = %s")
+        params.append(stream_id)
     if year_id:
-        query += f" AND y.year_id = {year_id}"
+        where.append("y.year_id = %s")
+        params.append(year_id)
     if term_id:
-        query += f" AND t.term_id = {term_id}"
+        where.append("t.term_id = %s")
+        params.append(term_id)
     if subject_id:
-        query += f" AND sub.subject_id = {subject_id}"
+        where.append("sub.subject_id = %s")
+        params.append(subject_id)
     if assessment_name:
-        query += f" AND a.assessment_name = '{assessment_name}'"
+        where.append("a.assessment_name = %s")
+        params.append(assessment_name)
     if pupil_name:
-        query += f" AND TRIM(CONCAT(p.first_name, ' ', COALESCE(p.other_name, ''), ' ', p.last_name)) LIKE '%{pupil_name}%'"
+        where.append("TRIM(CONCAT(p.first_name, ' ', COALESCE(p.other_name, ''), ' ', p.last_name)) LIKE %s")
+        params.append(f"%{pupil_name}%")
     if reg_no:
-        query += f" AND p.reg_no = '{reg_no}'"
-
-    query += " ORDER BY p.last_name, p.first_name, p.other_name"
+        where.append("p.reg_no = %s")
+        params.append(reg_no)
 
-    cursor.execute(query)
-    results_update = cursor.fetchall()
+    page = keyset_page(cursor, 'results_update', RESULTS_SELECT, RESULTS_FROM, where, params,
+                       RESULTS_SORTS, 'name')
+    results_update = page['rows']
 
     cursor.close()
     connection.close()
@@ -144,13 +150,13 @@ def results_update():
     return render_template(
         'results_update/results_update.html',
         results_update=results_update,
+        page=page,
         class_list=class_list,
         study_years=study_years,
         terms=terms,
         subjects=subjects,
         assessments=assessments,
         streams=streams,
-        pupils=pupils,
         selected_class_id=class_id,
         selected_study_year_id=year_id,
         selected_term_id=term_id,
@@ -212,6 +218,9 @@ def edit_scores():
 
         success_count = 0
         errors = []
+        summary_keys = set()
+        report_scopes = set()
+        edit_logs = []
 
         for score_id_str, new_mark_str in new_marks.items():
             reason = edit_reasons.get(score_id_str, "").strip()
@@ -245,32 +254,29 @@ def edit_scores():
             # Update score
             cursor.execute("UPDATE scores SET Mark = %s WHERE score_id = %s", (new_mark, score_id))
 
-            # Insert log entry
-            log_query = """
-                INSERT INTO score_edit_logs
-                (score_id, user_id, class_id, stream_id, term_id, year_id, assessment_id, subject_id, old_mark, new_mark, reason, edited_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-
-            kampala_time = get_kampala_time()
-
-            cursor.execute(log_query, (
-                score_id,
-                user_id,
-                row.get('class_id'),
-                row.get('stream_id'),
-                row.get('term_id'),
-                row.get('year_id'),
-                row.get('assessment_id'),
-                row.get('subject_id'),
-                old_mark,
-                new_mark,
-                reason,
-                kampala_time
-            ))
-
+            # Log entry, written with the others when the transaction commits
+            edit_logs.append({
+                'score_id': score_id,
+                'user_id': user_id,
+                'class_id': row.get('class_id'),
+                'stream_id': row.get('stream_id'),
+                'term_id': row.get('term_id'),
+                'year_id': row.get('year_id'),
+                'assessment_id': row.get('assessment_id'),
+                'subject_id': row.get('subject_id'),
+                'old_mark': old_mark,
+                'new_mark': new_mark,
+                'reason': reason,
+                'edited_at': get_kampala_time(),
+            })
+
+            summary_keys.add((row['reg_no'], row['year_id'], row['term_id'], row['assessment_id']))
+            report_scopes.add((row['class_id'], row['year_id'], row['term_id']))
             success_count += 1
 
+        log_rows(connection, 'score_edit_logs', edit_logs)
+        refresh_summaries(connection, summary_keys)
+        invalidate_reports(report_scopes)
         connection.commit()
 
         if success_count > 0:
@@ -3,7 +3,11 @@ from datetime import datetime
 import mysql.connector
 import traceback
 from apps import get_db_connection
+from apps.audit_log import log_rows
 from apps.sales import blueprint
+from apps.exports import EXPORT_FORMATS, export_response, stream_query
+from apps.pagination import SortKey, keyset_page
+from apps.utils.decorators import login_required
 import traceback
 
 from datetime import datetime
@@ -220,19 +224,15 @@ def save_sale():
                 WHERE ProductID = %s
             """, (quantity, product_id))
 
-            # Get new quantity
-            cursor.execute("SELECT quantity FROM product_list WHERE ProductID = %s", (product_id,))
-            updated_product = cursor.fetchone()
-            current_quantity = updated_product['quantity']
-
-            # Log inventory change
-            cursor.execute("""
-                INSERT INTO inventory_logs (
-                    product_id, quantity_change, current_quantity, reason, log_date, user_id
-                ) VALUES (%s, %s, %s, %s, %s, %s)
-            """, (
-                product_id, -quantity, current_quantity, 'sale', date_updated, user_id
-            ))
+            # Log inventory change; the row is locked, so the new quantity is known
+            log_rows(connection, 'inventory_logs', [{
+                'product_id': product_id,
+                'quantity_change': -quantity,
+                'current_quantity': product['quantity'] - quantity,
+                'reason': 'sale',
+                'log_date': date_updated,
+                'user_id': user_id,
+            }])
 
         connection.commit()
         return jsonify({'message': 'Sale and inventory update successful.'}), 201
@@ -264,42 +264,59 @@ def save_sale():
 
 
 
+SALES_SELECT = """
+    s.salesID, 
+    p.name AS product_name, 
+    c.name AS customer_name,  
+    s.qty, 
+    s.date_updated,
+    CONCAT(u.first_name, ' ', u.last_name) AS sold_by
+"""
+
+SALES_FROM = """
+    FROM 
+        sales s
+    INNER JOIN 
+        product_list p ON s.ProductID = p.ProductID
+    INNER JOIN 
+        customer_list c ON s.customer_id = c.CustomerID
+    LEFT JOIN 
+        users u ON s.user_id = u.id
+"""
+
+# Whole days, written so the date_updated index can be used
+SALES_DATES = "s.date_updated >= %s AND s.date_updated < %s + INTERVAL 1 DAY"
+
+# Sales details including user (staff) name
+SALES_DETAILS_SQL = f"SELECT {SALES_SELECT} {SALES_FROM} WHERE {SALES_DATES}"
+
+SALES_SORTS = {
+    'date': SortKey('Date', ['s.date_updated', 's.salesID']),
+    'quantity': SortKey('Quantity', ['s.qty', 's.salesID']),
+}
+
+SALES_COLUMNS = [
+    ('product_name', 'Item Name'), ('customer_name', 'Receiver Name'), ('sold_by', 'User Name'),
+    ('qty', 'Quantity'), ('date_updated', 'Date Updated'),
+]
+
+
+def _sales_dates(values):
+    """(start_date, end_date) from the filter form, today by default."""
+    today = datetime.now().strftime('%Y-%m-%d')
+    return values.get('start_date') or today, values.get('end_date') or today
+
+
 @blueprint.route('/sales_view', methods=['GET', 'POST'])
 def sales_view():
-    from datetime import datetime
     from flask import request, render_template
 
-    start_date = datetime.now().strftime('%Y-%m-%d')
-    end_date = datetime.now().strftime('%Y-%m-%d')
-
-    if request.method == 'POST':
-        start_date = request.form.get('start_date') or start_date
-        end_date = request.form.get('end_date') or end_date
+    # GET carries the dates on the pager links
+    start_date, end_date = _sales_dates(request.form if request.method == 'POST' else request.args)
 
     connection = get_db_connection()
     cursor = connection.cursor(dictionary=True)
 
-    # Get sales details including user (staff) name
-    query_sales_details = """
-        SELECT 
-            s.salesID, 
-            p.name AS product_name, 
-            c.name AS customer_name,  
-            s.qty, 
-            s.date_updated,
-            CONCAT(u.first_name, ' ', u.last_name) AS sold_by
-        FROM 
-            sales s
-        INNER JOIN 
-            product_list p ON s.ProductID = p.ProductID
-        INNER JOIN 
-            customer_list c ON s.customer_id = c.CustomerID
-        LEFT JOIN 
-            users u ON s.user_id = u.id
-        WHERE 
-            DATE(s.date_updated) BETWEEN %s AND %s
-    """
-
     # Get total quantity sold
     query_sales_quantity = """
         SELECT 
@@ -309,11 +326,12 @@ def sales_view():
         INNER JOIN 
             product_list p ON s.ProductID = p.ProductID
         WHERE 
-            DATE(s.date_updated) BETWEEN %s AND %s
+            s.date_updated >= %s AND s.date_updated < %s + INTERVAL 1 DAY
     """
 
-    cursor.execute(query_sales_details, (start_date, end_date))
-    sales = cursor.fetchall()
+    page = keyset_page(cursor, 'sales_view', SALES_SELECT, SALES_FROM, [SALES_DATES], [start_date, end_date],
+                       SALES_SORTS, 'date')
+    sales = page['rows']
 
     cursor.execute(query_sales_quantity, (start_date, end_date))
     total_quantity = cursor.fetchone()['total_quantity']
@@ -326,6 +344,7 @@ def sales_view():
     return render_template(
         'sales/sales_view.html',
         sales=sales,
+        page=page,
         total_quantity=formatted_total_quantity,
         start_date=start_date,
         end_date=end_date,
@@ -333,6 +352,19 @@ def sales_view():
     )
 
 
+@blueprint.route('/sales_view/export', methods=['GET'])
+@login_required
+def sales_view_export():
+    """The sales_view rows as CSV or XLSX (format=csv|xlsx) for start_date..end_date."""
+    output = request.args.get('format', 'csv')
+    if output not in EXPORT_FORMATS:
+        return jsonify({'error': 'format must be csv or xlsx.'}), 400
+    start_date, end_date = _sales_dates(request.args)
+    rows = stream_query(SALES_DETAILS_SQL + " ORDER BY s.date_updated, s.salesID", (start_date, end_date))
+    return export_response(output, f'sales_{start_date}_{end_date}', SALES_COLUMNS, rows,
+                           sheet_title='Stocked_Out_Items')
+
+
 
 
 
@@ -348,12 +380,8 @@ def o_sales_view():
         flash("Please log in to view sales history.", "warning")
         return render_template('auth/login.html')
 
-    start_date = datetime.now().strftime('%Y-%m-%d')
-    end_date = datetime.now().strftime('%Y-%m-%d')
-
-    if request.method == 'POST':
-        start_date = request.form.get('start_date') or start_date
-        end_date = request.form.get('end_date') or end_date
+    # GET carries the dates on the pager links
+    start_date, end_date = _sales_dates(request.form if request.method == 'POST' else request.args)
 
     try:
         connection = get_db_connection()
@@ -445,12 +473,8 @@ def dep_sales_view():
         flash("Please log in to view sales history.", "warning")
         return render_template('auth/login.html')
 
-    start_date = datetime.now().strftime('%Y-%m-%d')
-    end_date = datetime.now().strftime('%Y-%m-%d')
-
-    if request.method == 'POST':
-        start_date = request.form.get('start_date') or start_date
-        end_date = request.form.get('end_date') or end_date
+    # GET carries the dates on the pager links
+    start_date, end_date = _sales_dates(request.form if request.method == 'POST' else request.args)
 
     try:
         connection = get_db_connection()
@@ -0,0 +1,113 @@
+"""Batched writes to the ``scores`` table and its ``add_score_logs`` audit.
+
+Marks are validated by the caller and written here in chunks: one
+multi-row ``INSERT`` into ``scores`` and one ``INSERT ... SELECT`` that
+copies the new rows into ``add_score_logs`` (``apps.audit_log.log_select``),
+so a class sheet costs two round trips instead of two per pupil.
+
+With ``upsert=True`` a mark for an existing (reg_no, year, term,
+assessment, subject) replaces it.  That relies on the ``uq_scores_entry``
+unique key, added with ``flask add-scores-unique-key``.
+"""
+import click
+from flask.cli import with_appcontext
+
+from apps.audit_log import log_select
+from apps.db import get_db_connection
+
+UNIQUE_KEY = 'uq_scores_entry'
+ENTRY_COLUMNS = ['reg_no', 'year_id', 'term_id', 'assessment_id', 'subject_id']
+SCORE_COLUMNS = [
+    'user_id', 'reg_no', 'class_id', 'stream_id', 'term_id', 'year_id',
+    'assessment_id', 'subject_id', 'Mark', 'notes', 'created_at', 'updated_at'
+]
+BATCH_SIZE = 500
+
+_LOG_COLUMNS = [
+    'score_id', 'user_id', 'reg_no', 'class_id', 'stream_id', 'term_id',
+    'year_id', 'assessment_id', 'subject_id', 'new_mark', 'notes', 'created_at'
+]
+_LOG_SELECT = """
+    SELECT score_id, user_id, reg_no, class_id, stream_id, term_id,
+           year_id, assessment_id, subject_id, Mark, notes, updated_at
+    FROM scores
+"""
+
+_unique_key_ready = False
+
+
+def has_unique_key(cursor):
+    """True once ``scores`` carries the uq_scores_entry key (cached when found)."""
+    global _unique_key_ready
+    if not _unique_key_ready:
+        cursor.execute("SHOW INDEX FROM scores WHERE Key_name = %s", (UNIQUE_KEY,))
+        _unique_key_ready = bool(cursor.fetchall())
+    return _unique_key_ready
+
+
+def _placeholders(rows, width):
+    row = '(' + ', '.join(['%s'] * width) + ')'
+    return ', '.join([row] * len(rows))
+
+
+def write_scores(connection, rows, upsert=False):
+    """Write validated score rows and their audit rows; returns the row count.
+
+    ``rows`` are dicts holding SCORE_COLUMNS.  Nothing is committed here.
+    """
+    cursor = connection.cursor()
+    try:
+        for start in range(0, len(rows), BATCH_SIZE):
+            chunk = rows[start:start + BATCH_SIZE]
+            params = [row[c] for row in chunk for c in SCORE_COLUMNS]
+            sql = f"""
+                INSERT INTO scores ({', '.join(SCORE_COLUMNS)})
+                VALUES {_placeholders(chunk, len(SCORE_COLUMNS))}
+            """
+
+            if upsert:
+                sql += """
+                    ON DUPLICATE KEY UPDATE
+                        user_id = VALUES(user_id), class_id = VALUES(class_id),
+                        stream_id = VALUES(stream_id), Mark = VALUES(Mark),
+                        notes = VALUES(notes), updated_at = VALUES(updated_at)
+                """
+            cursor.execute(sql, params)
+            # Inserted and updated rows alike are found by their entry key
+            log_select(cursor, 'add_score_logs', _LOG_COLUMNS, f"""
+                {_LOG_SELECT}
+                WHERE ({', '.join(ENTRY_COLUMNS)}) IN ({_placeholders(chunk, len(ENTRY_COLUMNS))})
+            """, [row[c] for row in chunk for c in ENTRY_COLUMNS])
+    finally:
+        cursor.close()
+    return len(rows)
+
+
+@click.command('add-scores-unique-key')
+@with_appcontext
+def add_scores_unique_key_command():
+    """Add the (reg_no, year, term, assessment, subject) unique key to scores."""
+    with get_db_connection() as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            if has_unique_key(cursor):
+                click.echo(f"scores already has {UNIQUE_KEY}.")
+                return
+
+            cursor.execute(f"""
+                SELECT {', '.join(ENTRY_COLUMNS)}, COUNT(*) AS copies
+                FROM scores
+                GROUP BY {', '.join(ENTRY_COLUMNS)}
+                HAVING COUNT(*) > 1
+                LIMIT 20
+            """)
+            duplicates = cursor.fetchall()
+            if duplicates:
+                click.echo("Remove the duplicate marks below before adding the key:")
+                for row in duplicates:
+                    click.echo("  " + ", ".join(f"{k}={row[k]}" for k in ENTRY_COLUMNS + ['copies']))
+                raise SystemExit(1)
+
+            cursor.execute(
+                f"ALTER TABLE scores ADD UNIQUE KEY {UNIQUE_KEY} ({', '.join(ENTRY_COLUMNS)})"
+            )
+    click.echo(f"Added {UNIQUE_KEY} to scores.")
@@ -0,0 +1,321 @@
+"""Synthetic school-scale dataset for benchmarking.
+
+``flask seed-benchmark-data`` fills a local MySQL database that already
+has the application schema with a reproducible school:
+
+- ``--years`` study years with three terms each and four assessments;
+- the eight classes the report pages know about (ids 27-33 and 4), three
+  streams each, and the subjects of ``apps.summaries.SUBJECT_GROUPS``;
+- ``--pupils`` pupils spread over the classes, promoted a class per
+  year, with marks drawn from per-pupil ability, per-subject difficulty
+  and noise (about 3% of marks missing);
+- grades, divisions, subject/class teacher/head teacher comments, and a
+  few products and customers for the sales routes.
+
+Pupils, users and products are tagged with ``BN`` reg_nos/names so they
+are easy to tell apart.  The command refuses to run on a database that
+already has pupils unless ``--append`` is given; point it at a scratch
+database, never at the school's.
+"""
+import datetime
+
+import click
+import numpy as np
+from flask.cli import with_appcontext
+
+from apps.db import get_db_connection
+from apps.score_writer import SCORE_COLUMNS
+from apps.summaries import rebuild_summaries, subject_groups
+
+# Classes from the lowest level to the highest, as the report pages expect
+CLASS_LEVELS = [(27, 'P.1'), (28, 'P.2'), (29, 'P.3'), (30, 'P.4'),
+                (31, 'P.5'), (32, 'P.6'), (33, 'P.7 A'), (4, 'P.7')]
+STREAM_NAMES = ['EAST', 'WEST', 'NORTH']
+TERM_NAMES = ['TERM I', 'TERM II', 'TERM III']
+ASSESSMENT_NAMES = ['BOT', 'MOT', 'EOT', 'MOCK']
+EXTRA_SUBJECTS = ['KISWAHILI', 'CAPS']
+
+GRADES = [  # (min, max, letter, remark, weight)
+    (80, 100, 'D1', 'Excellent', 1), (70, 79, 'D2', 'Very good', 2),
+    (65, 69, 'C3', 'Good', 3), (60, 64, 'C4', 'Good', 4),
+    (55, 59, 'C5', 'Fair', 5), (50, 54, 'C6', 'Fair', 6),
+    (45, 49, 'P7', 'Pass', 7), (40, 44, 'P8', 'Pass', 8),
+    (0, 39, 'F9', 'Fail', 9),
+]
+DIVISIONS = [('I', 4, 12), ('II', 13, 23), ('III', 24, 29), ('IV', 30, 34), ('U', 35, 36)]
+COMMENT_BANDS = [(0, 39, 'Needs urgent support'), (40, 59, 'Can do better'),
+                 (60, 79, 'Good work, keep it up'), (80, 100, 'Excellent performance')]
+
+FIRST_NAMES = ['John', 'Mary', 'Peter', 'Grace', 'Isaac', 'Sarah', 'Joseph', 'Ruth', 'Moses',
+               'Esther', 'Brian', 'Faith', 'Daniel', 'Agnes', 'Samuel', 'Joan', 'Ivan', 'Patience']
+LAST_NAMES = ['Okello', 'Namubiru', 'Ssempala', 'Nakato', 'Mugisha', 'Atim', 'Kato', 'Nansubuga',
+              'Opio', 'Akello', 'Tumusiime', 'Nabirye', 'Waiswa', 'Kyomuhendo', 'Ochieng', 'Nalule']
+
+CHUNK_SIZE = 2000
+
+
+def _insert(cursor, table, columns, rows):
+    """Multi-row INSERT of ``rows`` in chunks; returns the first new id."""
+    first_id = None
+    row_sql = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    for start in range(0, len(rows), CHUNK_SIZE):
+        chunk = rows[start:start + CHUNK_SIZE]
+        cursor.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES " + ', '.join([row_sql] * len(chunk)),
+            [value for row in chunk for value in row]
+        )
+        if first_id is None:
+            first_id = cursor.lastrowid
+    return first_id
+
+
+def _ids_by_name(cursor, table, id_column, name_column, names):
+    cursor.execute(
+        f"SELECT {id_column}, {name_column} FROM {table} "
+        f"WHERE {name_column} IN ({', '.join(['%s'] * len(names))})",
+        list(names)
+    )
+    return {name: id_ for id_, name in cursor.fetchall()}
+
+
+def _missing(cursor, table, id_column, name_column, rows):
+    """The rows whose name (first value) is not in ``table`` yet."""
+    existing = _ids_by_name(cursor, table, id_column, name_column, [row[0] for row in rows])
+    return [row for row in rows if row[0] not in existing]
+
+
+def _reference_data(cursor, years, now, user_id):
+    current_year = now.year
+    year_rows = [(str(y), 'Primary') for y in range(current_year - years + 1, current_year + 1)]
+    missing = _missing(cursor, 'study_year', 'year_id', 'year_name', year_rows)
+    if missing:
+        _insert(cursor, 'study_year', ['year_name', 'level'], missing)
+    year_ids = _ids_by_name(cursor, 'study_year', 'year_id', 'year_name', [r[0] for r in year_rows])
+    years_ordered = [year_ids[r[0]] for r in year_rows]
+
+    terms = {}  # (year_id, term_index) -> term_id
+    for y, year_id in zip(range(current_year - years + 1, current_year + 1), years_ordered):
+        cursor.execute("SELECT term_id, term_name FROM terms WHERE year_id = %s", (year_id,))
+        have = {name: term_id for term_id, name in cursor.fetchall()}
+        for i, name in enumerate(TERM_NAMES):
+            if name not in have:
+                start = datetime.date(y, 2 + 4 * i, 1)
+                _insert(cursor, 'terms', ['term_name', 'start_on', 'ends_on', 'year_id', 'status'],
+                        [(name, start, start + datetime.timedelta(days=90), year_id,
+                          'active' if (y, i) == (current_year, 2) else 'closed')])
+                have[name] = cursor.lastrowid
+            terms[(year_id, i)] = have[name]
+
+    missing = _missing(
+        cursor, 'assessment', 'assessment_id', 'assessment_name',
+        [(name, f'{name} (synthetic)') for name in ASSESSMENT_NAMES]
+    )
+    if missing:
+        _insert(cursor, 'assessment', ['assessment_name', 'description'], missing)
+    assessments = _ids_by_name(cursor, 'assessment', 'assessment_id', 'assessment_name', ASSESSMENT_NAMES)
+
+    subject_names = sorted({s for class_id, _ in CLASS_LEVELS for s in subject_groups(class_id)[0]}
+                           | set(EXTRA_SUBJECTS))
+    missing = _missing(
+        cursor, 'subjects', 'subject_id', 'subject_name',
+        [(name, name[:4].replace(' ', ''), f'{name} (synthetic)', 'Primary') for name in subject_names]
+    )
+    if missing:
+        _insert(cursor, 'subjects', ['subject_name', 'subject_code', 'description', 'grade_level'], missing)
+    subjects = _ids_by_name(cursor, 'subjects', 'subject_id', 'subject_name', subject_names)
+
+    cursor.execute(
+        f"SELECT class_id FROM classes WHERE class_id IN ({', '.join(['%s'] * len(CLASS_LEVELS))})",
+        [class_id for class_id, _ in CLASS_LEVELS]
+    )
+    have_classes = {row[0] for row in cursor.fetchall()}
+    missing = [(class_id, name, current_year, user_id)
+               for class_id, name in CLASS_LEVELS if class_id not in have_classes]
+    if missing:
+        _insert(cursor, 'classes', ['class_id', 'class_name', 'year', 'teacher_in_charge'], missing)
+
+    streams = {}  # class_id -> [stream_id, ...]
+    for class_id, class_name in CLASS_LEVELS:
+        cursor.execute("SELECT stream_id FROM stream WHERE class_id = %s ORDER BY stream_id", (class_id,))
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            _insert(cursor, 'stream',
+                    ['stream_name', 'class_id', 'teacher_id', 'room_id', 'description', 'created_at', 'updated_at'],
+                    [(f'{class_name} {s}', class_id, user_id, None, 'synthetic', now, now) for s in STREAM_NAMES])
+            cursor.execute("SELECT stream_id FROM stream WHERE class_id = %s ORDER BY stream_id", (class_id,))
+            ids = [row[0] for row in cursor.fetchall()]
+        streams[class_id] = ids
+
+    return years_ordered, terms, assessments, subjects, streams
+
+
+def _scales_and_comments(cursor, subjects, streams, now, user_id):
+    cursor.execute("SELECT COUNT(*) FROM grades")
+    if not cursor.fetchone()[0]:
+        _insert(cursor, 'grades', ['min_score', 'max_score', 'grade_letter', 'remark', 'weight'], GRADES)
+    cursor.execute("SELECT COUNT(*) FROM division")
+    if not cursor.fetchone()[0]:
+        _insert(cursor, 'division', ['division_name', 'min_score', 'max_score'], DIVISIONS)
+
+    all_streams = [s for ids in streams.values() for s in ids]
+    _insert(cursor, 'subject_comments',
+            ['subject_id', 'stream_id', 'user_id', 'min_score', 'max_score', 'comment', 'created_at', 'updated_at'],
+            [(subject_id, stream_id, user_id, lo, hi, text, now, now)
+             for subject_id in subjects.values() for stream_id in all_streams
+             for lo, hi, text in COMMENT_BANDS])
+    _insert(cursor, 'classteacher_comments',
+            ['user_id', 'stream_id', 'min_score', 'max_score', 'comment', 'created_at', 'updated_at'],
+            [(user_id, stream_id, lo, hi, text, now, now)
+             for stream_id in all_streams for lo, hi, text in COMMENT_BANDS])
+    _insert(cursor, 'headmaster_comments',
+            ['user_id', 'min_score', 'max_score', 'comment', 'created_at', 'updated_at'],
+            [(user_id, lo, hi, text, now, now) for lo, hi, text in COMMENT_BANDS])
+
+
+def _pupils(cursor, rng, count, streams, year_id, term_id):
+    """Insert the pupils; returns (reg_nos, level index, stream position, ability)."""
+    cursor.execute("SELECT COUNT(*) FROM pupils WHERE reg_no LIKE 'BN%'")
+    offset = cursor.fetchone()[0]
+
+    levels = rng.integers(0, len(CLASS_LEVELS), count)
+    stream_pos = rng.integers(0, len(STREAM_NAMES), count)
+    ability = rng.normal(0, 12, count)
+    first = rng.choice(FIRST_NAMES, count)
+    other = rng.choice(FIRST_NAMES + [''] * len(FIRST_NAMES), count)
+    last = rng.choice(LAST_NAMES, count)
+    gender = rng.choice(['Male', 'Female'], count)
+
+    reg_nos, rows = [], []
+    for i in range(count):
+        n = offset + i + 1
+        class_id = CLASS_LEVELS[levels[i]][0]
+        class_streams = streams[class_id]
+        stream_id = class_streams[stream_pos[i] % len(class_streams)]
+        reg_no = f'BN/{n:05d}'
+        reg_nos.append(reg_no)
+        dob = datetime.date(2010 + int(levels[i]) % 8, 1 + n % 12, 1 + n % 28)
+        rows.append((
+            reg_no, str(first[i]), str(other[i]), str(last[i]), f'{n:06d}', f'NIN{n:08d}',
+            f'EMIS{n:07d}', dob, str(gender[i]), class_id, stream_id, datetime.date.today(),
+            year_id, term_id, 'Kampala', 'Synthetic address', '0700000000', '', '', '', '', '',
+            'day' if n % 3 else 'boarding'
+        ))
+    _insert(cursor, 'pupils', [
+        'reg_no', 'first_name', 'other_name', 'last_name', 'index_number', 'nin_number',
+        'emis_number', 'date_of_birth', 'gender', 'class_id', 'stream_id', 'admission_date',
+        'year_id', 'term_id', 'home_district', 'address', 'emergency_contact', 'medical_info',
+        'special_needs', 'attendance_record', 'academic_performance', 'notes', 'residential_status'
+    ], rows)
+    return reg_nos, levels, stream_pos, ability
+
+
+def _scores(cursor, rng, pupils, years, terms, assessments, subjects, streams, user_id, now):
+    reg_nos, levels, stream_pos, ability = pupils
+    difficulty = {name: rng.normal(0, 6) for name in subjects}
+    total = 0
+    rows = []
+
+    for k, year_id in enumerate(years):
+        years_back = len(years) - 1 - k
+        for p in range(len(reg_nos)):
+            level = levels[p] - years_back
+            if level < 0:
+                continue
+            class_id = CLASS_LEVELS[level][0]
+            class_streams = streams[class_id]
+            stream_id = class_streams[stream_pos[p] % len(class_streams)]
+            names = subject_groups(class_id)[0]
+
+            for t in range(len(TERM_NAMES)):
+                for a, assessment_id in enumerate(assessments.values()):
+                    noise = rng.normal(0, 9, len(names))
+                    present = rng.random(len(names)) > 0.03
+                    for name, e, keep in zip(names, noise, present):
+                        if not keep:
+                            continue
+                        mark = int(np.clip(round(62 + ability[p] + difficulty[name] + 2 * a + e), 0, 100))
+                        rows.append((user_id, reg_nos[p], class_id, stream_id, terms[(year_id, t)], year_id,
+                                     assessment_id, subjects[name], mark, None, now, now))
+            if len(rows) >= CHUNK_SIZE:
+                _insert(cursor, 'scores', SCORE_COLUMNS, rows)
+                total += len(rows)
+                rows = []
+    _insert(cursor, 'scores', SCORE_COLUMNS, rows)
+    return total + len(rows)
+
+
+def _shop(cursor):
+    cursor.execute("SELECT COUNT(*) FROM product_list WHERE name LIKE 'BN %'")
+    if cursor.fetchone()[0]:
+        return
+    cursor.execute("INSERT INTO category_list (name) VALUES (%s)", ('BN Stationery',))
+    category_id = cursor.lastrowid
+    cursor.execute(
+        "INSERT INTO sub_category (name, category_id, description) VALUES (%s, %s, %s)",
+        ('BN Books', category_id, 'synthetic')
+    )
+    sub_category_id = cursor.lastrowid
+    _insert(cursor, 'product_list',
+            ['category_id', 'sub_category_id', 'sku', 'name', 'unique_number', 'description', 'quantity', 'image'],
+            [(category_id, sub_category_id, f'BN-{i:03d}', f'BN Item {i}', f'BN{i:05d}', 'synthetic', 10 ** 6, None)
+             for i in range(50)])
+    _insert(cursor, 'customer_list', ['name', 'contact', 'address'],
+            [(f'BN Customer {i}', '0700000000', 'Synthetic') for i in range(20)])
+
+
+def _bench_user(cursor):
+    cursor.execute("SELECT id FROM users WHERE username = %s", ('bench_admin',))
+    row = cursor.fetchone()
+    if row:
+        return row[0]
+    cursor.execute("""
+        INSERT INTO users
+        (username, password, role, first_name, last_name, other_name, profile_image, name_sf, sign_image)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, ('bench_admin', 'bench', 'admin', 'Bench', 'Admin', '', None, 'BA', None))
+    return cursor.lastrowid
+
+
+def seed(pupils=5000, years=5, seed_value=42, append=False, log=print):
+    """Generate the dataset; returns a dict of row counts."""
+    rng = np.random.default_rng(seed_value)
+    now = datetime.datetime.now().replace(microsecond=0)
+
+    with get_db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM pupils")
+            if cursor.fetchone()[0] and not append:
+                raise click.ClickException(
+                    "pupils is not empty; use a scratch database or pass --append."
+                )
+
+            user_id = _bench_user(cursor)
+            year_ids, terms, assessments, subjects, streams = _reference_data(cursor, years, now, user_id)
+            _scales_and_comments(cursor, subjects, streams, now, user_id)
+            log("Reference data, scales and comments ready.")
+
+            current_year = year_ids[-1]
+            generated = _pupils(cursor, rng, pupils, streams, current_year, terms[(current_year, 2)])
+            log(f"{pupils} pupils inserted.")
+
+            score_count = _scores(cursor, rng, generated, year_ids, terms, assessments, subjects,
+                                  streams, user_id, now)
+            log(f"{score_count} scores inserted.")
+
+            _shop(cursor)
+        connection.commit()
+
+    summaries = rebuild_summaries()
+    return {'pupils': pupils, 'scores': score_count, 'summaries': summaries}
+
+
+@click.command('seed-benchmark-data')
+@click.option('--pupils', default=5000, show_default=True, help='Pupils to generate.')
+@click.option('--years', default=5, show_default=True, help='Study years of scores.')
+@click.option('--seed', 'seed_value', default=42, show_default=True, help='Random seed.')
+@click.option('--append', is_flag=True, help='Allow a database that already has pupils.')
+@with_appcontext
+def seed_benchmark_data_command(pupils, years, seed_value, append):
+    """Fill a scratch database with a synthetic school for benchmarking."""
+    counts = seed(pupils, years, seed_value, append, log=click.echo)
+    click.echo(", ".join(f"{k}={v}" for k, v in counts.items()))
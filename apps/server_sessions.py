@@ -0,0 +1,279 @@
+"""Server-side sessions kept in the ``user_sessions`` table.
+
+The browser only holds an opaque random id; the session data lives in
+MySQL, keyed by the id's SHA-256, so every worker and node sees the same
+session.  Each request reads one row by primary key.  The data column is
+only sent when its version differs from the copy in this worker's LRU
+front (``SESSION_CACHE_SIZE`` entries), so most requests read a couple
+of numbers.
+
+Nothing is written for a request that leaves the session unchanged,
+except ``last_seen``, which is refreshed at most every
+``SESSION_TOUCH_INTERVAL`` seconds.  Those refreshes are collected per
+worker and written together, one statement every
+``SESSION_FLUSH_INTERVAL`` seconds.  The cookie is only sent when the id
+changes (new session, login).
+
+The row also drives the login state:
+
+- a session idle for ``SESSION_IDLE_TIMEOUT`` seconds is ended, and
+  ``session.ended`` is ``'inactive'`` for the request that finds it;
+- ``end_user_sessions()`` (forced logout, login elsewhere) marks a
+  user's rows revoked, and their next request sees ``'revoked'``;
+- a user is online while one of their rows has been seen within
+  ``SESSION_IDLE_TIMEOUT`` (``apps.presence``).
+
+Rows of ended sessions are purged by the workers themselves, at most
+every ``SESSION_PURGE_INTERVAL`` seconds.
+"""
+import hashlib
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from flask.sessions import SecureCookieSession, SessionInterface, session_json_serializer
+
+from apps.db import get_db_connection
+
+SESSIONS_TABLE = 'user_sessions'
+
+CREATE_SESSIONS_TABLE = f"""
+    CREATE TABLE IF NOT EXISTS {SESSIONS_TABLE} (
+        sid CHAR(64) NOT NULL PRIMARY KEY,
+        user_id INT NULL,
+        data MEDIUMTEXT NOT NULL,
+        version INT UNSIGNED NOT NULL DEFAULT 1,
+        last_seen DOUBLE NOT NULL,
+        revoked TINYINT(1) NOT NULL DEFAULT 0,
+        KEY idx_user_sessions_user (user_id, last_seen),
+        KEY idx_user_sessions_last_seen (last_seen)
+    )
+"""
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_front = OrderedDict()  # sid hash -> (version, serialized data)
+_touches = {}  # sid hash -> last_seen waiting for the next flush
+_state = {'purged_at': 0.0, 'flushed_at': 0.0}
+_table_ready = False
+
+
+def _ensure_table(cursor):
+    global _table_ready
+    if not _table_ready:
+        cursor.execute(CREATE_SESSIONS_TABLE)
+        _table_ready = True
+
+
+def _key(sid):
+    return hashlib.sha256(sid.encode('utf-8')).hexdigest()
+
+
+def _forget(key):
+    with _lock:
+        _front.pop(key, None)
+
+
+def online_since():
+    """Oldest ``last_seen`` that still counts as online."""
+    return time.time() - current_app.config.get('SESSION_IDLE_TIMEOUT', 1800)
+
+
+class ServerSession(SecureCookieSession):
+    """Session data plus the bookkeeping of its ``user_sessions`` row."""
+
+    def __init__(self, initial=None, sid=None, stored=False, last_seen=0.0, ended=None, ended_user_id=None):
+        super().__init__(initial)
+        self.sid = sid or secrets.token_urlsafe(32)
+        self.sid_changed = sid is None
+        self.stored = stored
+        self.last_seen = last_seen
+        self.ended = ended
+        self.ended_user_id = ended_user_id
+        self.old_sid = None
+
+    def regenerate(self):
+        """Move the data to a fresh id, e.g. on login."""
+        if self.stored and self.old_sid is None:
+            self.old_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.sid_changed = True
+        self.stored = False
+        self.modified = True
+
+
+def end_user_sessions(cursor, user_id):
+    """Revoke every session of a user, in the caller's transaction."""
+    _ensure_table(cursor)
+    cursor.execute(
+        f"UPDATE {SESSIONS_TABLE} SET revoked = 1, data = '', version = version + 1 "
+        "WHERE user_id = %s AND revoked = 0",
+        (user_id,)
+    )
+
+
+class ServerSessionInterface(SessionInterface):
+    serializer = session_json_serializer
+    session_class = ServerSession
+
+    def _write(self, app, statements):
+        """Run session writes on a connection of their own, never the view's."""
+        with app.app_context():
+            with get_db_connection() as connection:
+                with connection.cursor() as cursor:
+                    _ensure_table(cursor)
+                    for sql, params in statements:
+                        cursor.execute(sql, params)
+                connection.commit()
+
+    def open_session(self, app, request):
+        if request.path.startswith(f"{app.static_url_path}/"):
+            return None  # static files get the null session
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return self.session_class()
+
+        key = _key(sid)
+        with _lock:
+            front = _front.get(key)
+            if front:
+                _front.move_to_end(key)
+        with get_db_connection() as connection:
+            with connection.cursor(dictionary=True) as cursor:
+                _ensure_table(cursor)
+                cursor.execute(f"""
+                    SELECT user_id, version, last_seen, revoked,
+                           CASE WHEN version = %s THEN NULL ELSE data END AS data
+                    FROM {SESSIONS_TABLE} WHERE sid = %s
+                """, (front[0] if front else 0, key))
+                row = cursor.fetchone()
+
+        if row is None:
+            _forget(key)
+            return self.session_class()
+        config = app.config
+        with _lock:
+            last_seen = max(row['last_seen'], _touches.get(key, 0.0))
+        idle = time.time() - last_seen > config.get('SESSION_IDLE_TIMEOUT', 1800)
+        if row['revoked'] or idle:
+            _forget(key)
+            self._write(app, [(f"DELETE FROM {SESSIONS_TABLE} WHERE sid = %s", (key,))])
+            if row['user_id'] is None:
+                return self.session_class()
+            return self.session_class(ended='revoked' if row['revoked'] else 'inactive',
+                                      ended_user_id=row['user_id'])
+
+        data = row['data']
+        if data is None:
+            data = front[1]
+        else:
+            with _lock:
+                _front[key] = (row['version'], data)
+                _front.move_to_end(key)
+                while len(_front) > config.get('SESSION_CACHE_SIZE', 1000):
+                    _front.popitem(last=False)
+        try:
+            initial = self.serializer.loads(data)
+        except ValueError:
+            log.warning("Unreadable session data; starting a new session")
+            return self.session_class()
+        return self.session_class(initial, sid=sid, stored=True, last_seen=last_seen)
+
+    def _purge(self, app, now):
+        """Statements dropping rows nobody will come back for, now and then."""
+        config = app.config
+        with _lock:
+            if now - _state['purged_at'] < config.get('SESSION_PURGE_INTERVAL', 600):
+                return []
+            _state['purged_at'] = now
+        idle_cutoff = now - config.get('SESSION_IDLE_TIMEOUT', 1800)
+        # Logged-in rows stay a while longer so a returning user hears why
+        lifetime_cutoff = now - app.permanent_session_lifetime.total_seconds()
+        return [(
+            f"DELETE FROM {SESSIONS_TABLE} WHERE last_seen < %s "
+            "AND (user_id IS NULL OR revoked = 1 OR last_seen < %s)",
+            (idle_cutoff, lifetime_cutoff)
+        )]
+
+    def _flush(self, app, now):
+        """One statement writing the collected last_seen refreshes, when due."""
+        with _lock:
+            if not _touches or now - _state['flushed_at'] < app.config.get('SESSION_FLUSH_INTERVAL', 15):
+                return []
+            touches = list(_touches.items())
+            _touches.clear()
+            _state['flushed_at'] = now
+        return [(
+            f"UPDATE {SESSIONS_TABLE} SET last_seen = GREATEST(last_seen, CASE sid "
+            + ' '.join(['WHEN %s THEN %s'] * len(touches))
+            + f" END) WHERE revoked = 0 AND sid IN ({', '.join(['%s'] * len(touches))})",
+            [value for touch in touches for value in touch] + [key for key, _ in touches]
+        )]
+
+    def save_session(self, app, session, response):
+        if not isinstance(session, ServerSession):
+            return
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        now = time.time()
+        statements = []
+        if session.old_sid:
+            _forget(_key(session.old_sid))
+            statements.append((f"DELETE FROM {SESSIONS_TABLE} WHERE sid = %s", (_key(session.old_sid),)))
+
+        key = _key(session.sid)
+        if not session:
+            if session.stored:
+                _forget(key)
+                statements.append((f"DELETE FROM {SESSIONS_TABLE} WHERE sid = %s", (key,)))
+            if statements:
+                self._write(app, statements + self._purge(app, now))
+            if session.stored or session.old_sid or session.ended:
+                response.delete_cookie(
+                    name, domain=domain, path=path, secure=self.get_cookie_secure(app),
+                    samesite=self.get_cookie_samesite(app), httponly=self.get_cookie_httponly(app)
+                )
+            return
+
+        user_id = session.get('id') if session.get('loggedin') else None
+        if session.modified or not session.stored:
+            data = self.serializer.dumps(dict(session))
+            _forget(key)
+            statements.append((f"""
+                INSERT INTO {SESSIONS_TABLE} (sid, user_id, data, version, last_seen)
+                VALUES (%s, %s, %s, 1, %s)
+                ON DUPLICATE KEY UPDATE user_id = VALUES(user_id), data = VALUES(data),
+                    version = version + 1, last_seen = VALUES(last_seen)
+            """, (key, user_id, data, now)))
+        elif now - session.last_seen >= app.config.get('SESSION_TOUCH_INTERVAL', 60):
+            with _lock:
+                _touches[key] = now
+        statements += self._flush(app, now)
+        if statements:
+            self._write(app, statements + self._purge(app, now))
+
+        if session.sid_changed:
+            response.set_cookie(
+                name, session.sid, expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app),
+                partitioned=self.get_cookie_partitioned(app)
+            )
+
+
+def init_server_sessions(app):
+    """Keep sessions in the database instead of the cookie."""
+    app.config.setdefault('SESSION_IDLE_TIMEOUT', 1800)
+    app.config.setdefault('SESSION_TOUCH_INTERVAL', 60)
+    app.config.setdefault('SESSION_CACHE_SIZE', 1000)
+    app.config.setdefault('SESSION_PURGE_INTERVAL', 600)
+    app.config.setdefault('SESSION_FLUSH_INTERVAL', 15)
+    app.session_interface = ServerSessionInterface()
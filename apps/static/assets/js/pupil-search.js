@@ -0,0 +1,34 @@
+// Lazy-loaded pupil picker: fills <select class="pupil-search"> from the
+// pupil search API as the user types instead of shipping the whole roster.
+$(function () {
+  $('select.pupil-search').each(function () {
+    const $select = $(this);
+    const $form = $select.closest('form');
+
+    $select.select2({
+      allowClear: true,
+      placeholder: '-- Select Pupil --',
+      minimumInputLength: 1,
+      ajax: {
+        url: $select.data('search-url'),
+        dataType: 'json',
+        delay: 200,
+        data: function (params) {
+          return {
+            q: params.term,
+            limit: 20,
+            class_id: $form.find('[name="class_id"]').val() || undefined,
+            stream_id: $form.find('[name="stream_id"]').val() || undefined
+          };
+        },
+        processResults: function (data) {
+          return {
+            results: data.results.map(function (p) {
+              return { id: p.full_name, text: p.full_name.replace(/\s+/g, ' ') + ' (' + p.reg_no + ')' };
+            })
+          };
+        }
+      }
+    });
+  });
+});
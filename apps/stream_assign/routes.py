@@ -18,6 +18,8 @@ from mysql.connector import Error
 
 from apps.stream_assign import blueprint
 from apps import get_db_connection
+from apps.report_cache import invalidate_reports
+from apps.pupil_search import invalidate_pupil_index
 
 import numpy as np
 
@@ -226,6 +228,8 @@ def stream_term_assign():
                 get_kampala_time()
             ))
 
+        invalidate_reports()
+        invalidate_pupil_index()
         connection.commit()
 
         if successful > 0:
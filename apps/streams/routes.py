@@ -9,6 +9,7 @@ import random
 import logging
 import re  # <-- Add this line
 from apps import get_db_connection
+from apps.reference_data import invalidate_reference_data
 from jinja2 import TemplateNotFound
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
@@ -147,6 +148,7 @@ def add_stream():
                     (room_id_int, user_id, stream_id, now, now)
                 )
 
+            invalidate_reference_data('stream')
             connection.commit()
             flash("Stream created successfully!", "success")
             return redirect(url_for('streams_blueprint.streams'))
@@ -247,6 +249,7 @@ def edit_stream(stream_id):
                 SET stream_name = %s, description = %s, room_id = %s, teacher_id = %s
                 WHERE stream_id = %s
             """, (stream_name, description, room_id, teacher_id, stream_id))
+            invalidate_reference_data('stream')
             connection.commit()
 
             # Update or insert room assignment
@@ -338,6 +341,7 @@ def delete_stream(stream_id):
     try:
         # Delete the stream with the given ID
         cursor.execute('DELETE FROM stream WHERE stream_id = %s', (stream_id,))
+        invalidate_reference_data('stream')
         connection.commit()
         flash("Stream deleted successfully.", "success")
     except Exception as e:
@@ -9,6 +9,7 @@ import random
 import logging
 import re  # <-- Add this line
 from apps import get_db_connection
+from apps.reference_data import invalidate_reference_data, reference_rows
 from jinja2 import TemplateNotFound
 
 
@@ -20,8 +21,7 @@ def study_years():
     cursor = connection.cursor(dictionary=True)
 
     # Fetch all study_years from the database
-    cursor.execute('SELECT * FROM study_year')
-    study_years = cursor.fetchall()
+    study_years = reference_rows('study_year')
 
     # Close the cursor and connection
     cursor.close()
@@ -64,6 +64,7 @@ def add_study_years():
                         INSERT INTO study_year (year_name, level)
                         VALUES (%s, %s)
                     ''', (year_name, level))
+                    invalidate_reference_data('study_year')
                     connection.commit()
                     flash("Study year successfully added!", "success")
                     return redirect(url_for('study_years_blueprint.study_years'))
@@ -126,6 +127,7 @@ def edit_study_year(year_id):
                 SET year_name = %s, level = %s
                 WHERE year_id = %s
             """, (year_name, level, year_id))
+            invalidate_reference_data('study_year')
             connection.commit()
 
             flash("Study year updated successfully!", "success")
@@ -171,6 +173,7 @@ def delete_study_years(class_id):
     try:
         # Delete the study_years with the specified ID
         cursor.execute('DELETE FROM study_years WHERE class_id = %s', (class_id,))
+        invalidate_reference_data('study_year')
         connection.commit()
         flash("class deleted successfully.", "success")
     except Exception as e:
@@ -18,6 +18,7 @@ from mysql.connector import Error
 
 from apps.subject_assign import blueprint
 from apps import get_db_connection
+from apps.report_cache import invalidate_reports
 
 import numpy as np
 
@@ -184,6 +185,7 @@ def action_subject_assign():
             """, (subject_id, stream_id, year_id, user_id))
             successful += 1
 
+        invalidate_reports()
         connection.commit()
 
         if successful > 0:
@@ -355,6 +357,7 @@ def action_subject_unassign():
             cursor.execute("DELETE FROM subject_assignment WHERE id = %s", (assignment_id,))
             successful += 1
 
+        invalidate_reports()
         connection.commit()
 
         flash(f"{successful} assignment(s) successfully unassigned.", "success")
@@ -9,6 +9,7 @@ import random
 import logging
 import re  # <-- Add this line
 from apps import get_db_connection
+from apps.report_cache import invalidate_reports
 from jinja2 import TemplateNotFound
 
 
@@ -117,6 +118,7 @@ def add_subject_comments():
                             min_score, max_score, comment,
                             now, now
                         ))
+                        invalidate_reports()
                         connection.commit()
                         flash("Subject comment added successfully!", "success")
 
@@ -214,6 +216,7 @@ def edit_subject_comments(comment_id):
                 min_score, max_score, comment, updated_at,
                 comment_id
             ))
+            invalidate_reports()
             connection.commit()
             flash("Subject comment updated successfully!", "success")
             return redirect(url_for('subject_comments_blueprint.subject_comments'))
@@ -268,6 +271,7 @@ def delete_subject_comments(comment_id):
 
         # Proceed with deletion
         cursor.execute("DELETE FROM subject_comments WHERE comment_id = %s", (comment_id,))
+        invalidate_reports()
         connection.commit()
         flash("Subject comment deleted successfully.", "success")
 
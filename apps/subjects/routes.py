@@ -9,6 +9,7 @@ import random
 import logging
 import re  # <-- Add this line
 from apps import get_db_connection
+from apps.reference_data import invalidate_reference_data, reference_rows
 from jinja2 import TemplateNotFound
 
 
@@ -25,8 +26,7 @@ def subjects():
     cursor = connection.cursor(dictionary=True)
 
     # Fetch all subjects from the database
-    cursor.execute('SELECT * FROM subjects ORDER BY subject_name')
-    subjects = cursor.fetchall()
+    subjects = reference_rows('subjects', order_by='subject_name')
 
     # Close the cursor and connection
     cursor.close()
@@ -59,6 +59,7 @@ def add_subject():
         )
 
         # Commit changes and flash success message
+        invalidate_reference_data('subjects')
         connection.commit()
         flash("Subject successfully added!", "success")
 
@@ -111,6 +112,7 @@ def edit_subject(subject_id):
         ''', (subject_code, subject_name, description, grade_level, subject_id))
 
         # Commit the transaction
+        invalidate_reference_data('subjects')
         connection.commit()
 
         flash("Subject updated successfully!", "success")
@@ -142,6 +144,7 @@ def delete_subject(subjects_id):
     try:
         # Delete the subjects with the specified ID
         cursor.execute('DELETE FROM subjects WHERE subject_id = %s', (subjects_id,))
+        invalidate_reference_data('subjects')
         connection.commit()
         flash("subjects deleted successfully.", "success")
     except Exception as e:
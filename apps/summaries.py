@@ -0,0 +1,465 @@
+"""Per-pupil assessment summaries kept next to the ``scores`` table.
+
+``pupil_assessment_summary`` holds one row per (reg_no, year, term,
+assessment) with the pupil's marks (JSON, by subject_id) and the total,
+average, aggregate, division and completeness the positions pages would
+otherwise recompute from every score row.  Those pages select from this
+table instead of ``scores`` (``SUMMARY_COLUMNS``, ``summary_score_rows()``).
+The score-writing views call ``refresh_summaries()`` inside their
+transaction, and ``flask rebuild-summaries`` recomputes the whole table.
+
+Each row records the ``scale_version`` of the grade and division scales
+it was graded with.  Rows graded with older scales still give the marks,
+but their aggregates are recomputed on the page; after a scale change
+the views queue a rebuild as a background job (``submit_rebuild()``).
+
+The first request of each worker creates the table (or adds the columns
+an older one lacks) and, until a full rebuild has finished, logs an
+error and queues one; the positions pages warn that pupils may be
+missing meanwhile.
+"""
+import json
+import logging
+import threading
+
+import click
+import pandas as pd
+from flask import current_app, flash, request, session, url_for
+from markupsafe import Markup
+from flask.cli import with_appcontext
+from mysql.connector import Error
+
+from apps.db import get_db_connection
+from apps.grading import divisions_for, get_scales, scale_version
+from apps.job_runner import active_job, job_type, submit
+from apps.reference_data import reference_names
+from apps.report_cache import invalidate_reports
+
+log = logging.getLogger(__name__)
+
+SUMMARY_TABLE = 'pupil_assessment_summary'
+REBUILD_JOB = 'summary_rebuild'
+# Pupils rebuilt per transaction by ``rebuild_summaries()``
+REBUILD_CHUNK = 200
+# Table comment set once a full rebuild has filled the table
+BUILT_COMMENT = 'built'
+
+CREATE_SUMMARY_TABLE = f"""
+    CREATE TABLE IF NOT EXISTS {SUMMARY_TABLE} (
+        reg_no VARCHAR(50) NOT NULL,
+        year_id INT NOT NULL,
+        term_id INT NOT NULL,
+        assessment_id INT NOT NULL,
+        class_id INT NULL,
+        stream_id INT NULL,
+        subjects_count INT NOT NULL DEFAULT 0,
+        total_score DECIMAL(10, 2) NOT NULL DEFAULT 0,
+        average_score DECIMAL(6, 2) NOT NULL DEFAULT 0,
+        aggregate INT NOT NULL DEFAULT 0,
+        division VARCHAR(50) NULL,
+        complete TINYINT(1) NOT NULL DEFAULT 0,
+        marks TEXT NULL,
+        scale_version VARCHAR(40) NULL,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (reg_no, year_id, term_id, assessment_id),
+        KEY idx_summary_class (class_id, year_id, term_id, assessment_id)
+    )
+"""
+
+# Subjects counted into the total/average and into the aggregate/division,
+# per class.  These mirror the subject lists of the positions pages.
+CORE_SUBJECTS = sorted(['MTC', 'ENGLISH', 'SST', 'SCIE'])
+LITERACY_SUBJECTS = sorted(['MTC', 'ENGLISH', 'LITERACY 1A', 'LITERACY 1B'])
+SUBJECT_GROUPS = {
+    27: (sorted(['MTC', 'ENGLISH', 'LITERACY 1A', 'LITERACY 1B', 'COMPUTER', 'R.E', 'READING', 'LUGANDA']),
+         LITERACY_SUBJECTS),
+    28: (sorted(['MTC', 'ENGLISH', 'LITERACY 1A', 'LITERACY 1B', 'COMPUTER', 'R.E', 'READING', 'LUGANDA']),
+         LITERACY_SUBJECTS),
+    29: (sorted(['MTC', 'ENGLISH', 'LITERACY 1A', 'LITERACY 1B', 'COMPUTER', 'R.E', 'LUGANDA']),
+         LITERACY_SUBJECTS),
+}
+
+KEY_COLUMNS = ['reg_no', 'year_id', 'term_id', 'assessment_id']
+
+# Select list for the positions pages, with the table aliased ``s``;
+# ``summary_score_rows()`` turns the rows back into score rows.
+SUMMARY_COLUMNS = (
+    "s.marks, s.scale_version, s.total_score, s.subjects_count, s.aggregate, "
+    "s.division, s.complete, s.class_id AS summary_class_id"
+)
+_SUMMARY_FIELDS = [
+    'marks', 'scale_version', 'total_score', 'subjects_count', 'aggregate',
+    'division', 'complete', 'summary_class_id'
+]
+
+_UPSERT = f"""
+    INSERT INTO {SUMMARY_TABLE}
+        (reg_no, year_id, term_id, assessment_id, class_id, stream_id, subjects_count,
+         total_score, average_score, aggregate, division, complete, marks, scale_version)
+    VALUES
+        (%(reg_no)s, %(year_id)s, %(term_id)s, %(assessment_id)s, %(class_id)s, %(stream_id)s,
+         %(subjects_count)s, %(total_score)s, %(average_score)s, %(aggregate)s, %(division)s,
+         %(complete)s, %(marks)s, %(scale_version)s)
+    ON DUPLICATE KEY UPDATE
+        class_id = VALUES(class_id), stream_id = VALUES(stream_id),
+        subjects_count = VALUES(subjects_count), total_score = VALUES(total_score),
+        average_score = VALUES(average_score), aggregate = VALUES(aggregate),
+        division = VALUES(division), complete = VALUES(complete),
+        marks = VALUES(marks), scale_version = VALUES(scale_version)
+"""
+
+_lock = threading.Lock()
+_state = {'checked': False, 'built': False}
+_table_ready = False
+
+
+def subject_groups(class_id):
+    """(total_subjects, aggregate_subjects) used for a class."""
+    try:
+        class_id = int(class_id)
+    except (TypeError, ValueError):
+        pass
+    return SUBJECT_GROUPS.get(class_id, (CORE_SUBJECTS, CORE_SUBJECTS))
+
+
+def _is_built(cursor):
+    cursor.execute(
+        "SELECT TABLE_COMMENT FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (SUMMARY_TABLE,)
+    )
+    row = cursor.fetchone()
+    return bool(row) and row['TABLE_COMMENT'] == BUILT_COMMENT
+
+
+def _ensure_table(cursor):
+    """Create the table, or add the columns an older one lacks; True once built.
+
+    DDL commits implicitly: call it on a connection with nothing pending.
+    """
+    global _table_ready
+    cursor.execute(CREATE_SUMMARY_TABLE)
+    cursor.execute(f"SHOW COLUMNS FROM {SUMMARY_TABLE} LIKE 'scale_version'")
+    if not cursor.fetchall():
+        # Older rows have no marks, so the table needs a full rebuild
+        cursor.execute(f"""
+            ALTER TABLE {SUMMARY_TABLE}
+                ADD COLUMN marks TEXT NULL,
+                ADD COLUMN scale_version VARCHAR(40) NULL,
+                COMMENT = ''
+        """)
+    _table_ready = True
+    return _is_built(cursor)
+
+
+def check_summaries():
+    """Create the summary table and queue its first build, once per worker."""
+    with _lock:
+        if _state['checked']:
+            return
+        _state['checked'] = True
+
+    app = current_app._get_current_object()
+    try:
+        with app.app_context():
+            with get_db_connection() as connection:
+                with connection.cursor(dictionary=True) as cursor:
+                    built = _ensure_table(cursor)
+                connection.commit()
+    except Error as e:
+        log.error("Could not create %s: %s", SUMMARY_TABLE, e)
+        with _lock:
+            _state['checked'] = False
+        return
+
+    with _lock:
+        _state['built'] = _state['built'] or built
+    if built:
+        return
+    job_id = active_job(REBUILD_JOB)
+    if job_id is None:
+        job_id = submit(REBUILD_JOB, message='Waiting to build the pupil summaries.')
+    log.error("%s has not been built yet; the positions pages miss pupils until "
+              "summary rebuild job %s finishes", SUMMARY_TABLE, job_id)
+
+
+def summaries_built():
+    """True once a full rebuild has filled the summary table."""
+    with _lock:
+        if _state['built']:
+            return True
+    try:
+        with get_db_connection() as connection:
+            with connection.cursor(dictionary=True) as cursor:
+                built = _is_built(cursor)
+    except Error as e:
+        log.warning("Could not read the state of %s: %s", SUMMARY_TABLE, e)
+        return False
+    with _lock:
+        _state['built'] = _state['built'] or built
+    return built
+
+
+def _chunks(items, size=500):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _score_rows(cursor, keys=None, reg_nos=None, lock=False):
+    """Score rows (with subject names) for ``keys`` or for the pupils ``reg_nos``.
+
+    With ``lock`` the rows are read ``LOCK IN SHARE MODE``: the read waits
+    for uncommitted score writes and holds new ones off until the caller
+    commits.
+    """
+    sql = """
+        SELECT s.reg_no, s.year_id, s.term_id, s.assessment_id,
+               s.class_id, s.stream_id, s.subject_id, sub.subject_name, s.Mark
+        FROM scores s
+        JOIN subjects sub ON s.subject_id = sub.subject_id
+    """
+    suffix = " ORDER BY s.score_id" + (" LOCK IN SHARE MODE" if lock else "")
+
+    rows = []
+    if reg_nos is not None:
+        for chunk in _chunks(sorted(reg_nos)):
+            cursor.execute(
+                sql + f" WHERE s.reg_no IN ({','.join(['%s'] * len(chunk))})" + suffix, chunk
+            )
+            rows.extend(cursor.fetchall())
+        return rows
+
+    for chunk in _chunks(sorted(keys)):
+        placeholders = ','.join(['(%s, %s, %s, %s)'] * len(chunk))
+        params = [value for key in chunk for value in key]
+        cursor.execute(
+            sql + f" WHERE (s.reg_no, s.year_id, s.term_id, s.assessment_id) IN ({placeholders})"
+            + suffix,
+            params
+        )
+        rows.extend(cursor.fetchall())
+    return rows
+
+
+def summarise(rows):
+    """Summary records for score rows, one per (reg_no, year, term, assessment)."""
+    if not rows:
+        return []
+
+    frame = pd.DataFrame.from_records(rows)
+    frame['Mark'] = pd.to_numeric(frame['Mark'], errors='coerce')
+    # Later rows win, as on the report pages
+    frame = frame.drop_duplicates(KEY_COLUMNS + ['subject_name'], keep='last')
+
+    scales = get_scales()
+    grades, division_scale = scales
+    bands = grades.classify(frame['Mark'].tolist())
+    frame['weight'] = pd.to_numeric(
+        pd.Series([grades.rows[i]['weight'] if i >= 0 else None for i in bands], index=frame.index),
+        errors='coerce'
+    ).fillna(0)
+
+    # A pupil's subject groups follow the class of their first score row
+    first = frame.groupby(KEY_COLUMNS, sort=False)[['class_id', 'stream_id']].first()
+    class_of = frame.groupby(KEY_COLUMNS, sort=False)['class_id'].transform('first')
+    row_groups = [subject_groups(c) for c in class_of]
+    in_total = pd.Series(
+        [subject in g[0] for subject, g in zip(frame['subject_name'], row_groups)], index=frame.index
+    )
+    in_aggregate = pd.Series(
+        [subject in g[1] for subject, g in zip(frame['subject_name'], row_groups)], index=frame.index
+    )
+
+    has_mark = frame['Mark'].notna()
+    frame['_total'] = frame['Mark'].where(in_total & has_mark, 0)
+    frame['_counted'] = (in_total & has_mark).astype(int)
+    frame['_weight'] = frame['weight'].where(in_aggregate & has_mark, 0)
+    frame['_graded'] = (in_aggregate & has_mark).astype(int)
+
+    sums = frame.groupby(KEY_COLUMNS, sort=False)[['_total', '_counted', '_weight', '_graded']].sum()
+    sums = sums.join(first)
+    needed = [len(subject_groups(c)[1]) for c in sums['class_id']]
+
+    average = (sums['_total'] / sums['_counted'].where(sums['_counted'] > 0)).fillna(0).round(2)
+    divisions = divisions_for(sums['_weight'].tolist(), division_scale)
+    version = scale_version(scales)
+
+    marks = {}
+    for key, subject_id, mark in zip(
+        frame[KEY_COLUMNS].itertuples(index=False, name=None), frame['subject_id'], frame['Mark']
+    ):
+        marks.setdefault(key, {})[str(int(subject_id))] = None if pd.isna(mark) else float(mark)
+
+    records = []
+    for key, row, avg, division, need in zip(sums.index, sums.to_dict('records'), average, divisions, needed):
+        records.append({
+            'reg_no': str(key[0]),
+            'year_id': int(key[1]),
+            'term_id': int(key[2]),
+            'assessment_id': int(key[3]),
+            'class_id': None if pd.isna(row['class_id']) else int(row['class_id']),
+            'stream_id': None if pd.isna(row['stream_id']) else int(row['stream_id']),
+            'subjects_count': int(row['_counted']),
+            'total_score': float(row['_total']),
+            'average_score': float(avg),
+            'aggregate': int(row['_weight']),
+            'division': division,
+            'complete': int(row['_graded'] >= need),
+            'marks': json.dumps(marks[key], separators=(',', ':')),
+            'scale_version': version,
+        })
+    return records
+
+
+def _write(cursor, records):
+    for chunk in _chunks(records):
+        cursor.executemany(_UPSERT, chunk)
+
+
+def refresh_summaries(connection, keys):
+    """Recompute the summaries for (reg_no, year_id, term_id, assessment_id) keys.
+
+    Runs on the caller's connection so the summaries are committed (or
+    rolled back) together with the score changes.
+    """
+    keys = {
+        (str(reg_no), int(year_id), int(term_id), int(assessment_id))
+        for reg_no, year_id, term_id, assessment_id in keys
+        if None not in (reg_no, year_id, term_id, assessment_id)
+    }
+    if not keys:
+        return
+
+    if not _table_ready:
+        # check_summaries() could not create it; that was logged
+        return
+    cursor = connection.cursor(dictionary=True)
+    try:
+        records = summarise(_score_rows(cursor, keys))
+        _write(cursor, records)
+
+        # Keys whose scores were all deleted lose their summary row
+        gone = sorted(keys - {tuple(r[c] for c in KEY_COLUMNS) for r in records})
+        for chunk in _chunks(gone):
+            placeholders = ','.join(['(%s, %s, %s, %s)'] * len(chunk))
+            cursor.execute(
+                f"DELETE FROM {SUMMARY_TABLE} "
+                f"WHERE (reg_no, year_id, term_id, assessment_id) IN ({placeholders})",
+                [value for key in chunk for value in key]
+            )
+    finally:
+        cursor.close()
+
+
+def rebuild_summaries(progress=None):
+    """Recompute every summary row from the scores table; returns the row count.
+
+    The table is created if needed.  Pupils are rebuilt ``REBUILD_CHUNK``
+    at a time, each chunk in its own short transaction: their scores are
+    read under a share lock and their summary rows replaced before the
+    commit, so a ``refresh_summaries()`` committed meanwhile is never
+    overwritten with older totals.  ``progress(done, total, message)`` is
+    called after each chunk, and the table is marked built at the end.
+    """
+    progress = progress or (lambda *args: None)
+    count = 0
+    with get_db_connection() as connection:
+        with connection.cursor(dictionary=True) as cursor:
+            built = _ensure_table(cursor)
+            # Pupils with scores, and pupils whose scores are all gone
+            cursor.execute(f"SELECT reg_no FROM scores UNION SELECT reg_no FROM {SUMMARY_TABLE}")
+            reg_nos = sorted(str(row['reg_no']) for row in cursor.fetchall())
+            connection.commit()
+
+            chunks = list(_chunks(reg_nos, REBUILD_CHUNK))
+            progress(0, len(chunks), f"Rebuilding the summaries of {len(reg_nos)} pupils...")
+            for done, chunk in enumerate(chunks, 1):
+                records = summarise(_score_rows(cursor, reg_nos=chunk, lock=True))
+                cursor.execute(
+                    f"DELETE FROM {SUMMARY_TABLE} WHERE reg_no IN ({','.join(['%s'] * len(chunk))})",
+                    chunk
+                )
+                _write(cursor, records)
+                connection.commit()
+                count += len(records)
+                progress(done, len(chunks),
+                         f"Rebuilt the summaries of {min(done * REBUILD_CHUNK, len(reg_nos))} pupils...")
+            if not built:
+                cursor.execute(f"ALTER TABLE {SUMMARY_TABLE} COMMENT = '{BUILT_COMMENT}'")
+                with _lock:
+                    _state['built'] = True
+        # Report pages show the stored summaries
+        invalidate_reports()
+        connection.commit()
+    log.info("Rebuilt %s pupil assessment summaries", count)
+    return count
+
+
+@job_type(REBUILD_JOB, limit=1)
+def rebuild_summaries_job(job, back_url=None):
+    """Build the summaries, or rebuild them after a grades or division scale change."""
+    count = rebuild_summaries(progress=job.progress)
+    return {'message': f"Rebuilt {count} pupil assessment summaries.",
+            'summaries': count, 'back_url': back_url}
+
+
+def submit_rebuild(back_url=None):
+    """Queue a summary rebuild for the current user and flash a link to it."""
+    job_id = submit(REBUILD_JOB, {'back_url': back_url}, user_id=session.get('id'),
+                    message='Waiting to rebuild the pupil summaries.')
+    flash(Markup('Pupil summaries are being rebuilt in the background '
+                 '(<a href="{}">follow the progress</a>).').format(
+        url_for('jobs_blueprint.job_page', job_id=job_id)), "info")
+    return job_id
+
+
+def summary_score_rows(rows, total_subjects, aggregate_subjects=None, by_assessment=False):
+    """Score rows and stored totals from rows selected with ``SUMMARY_COLUMNS``.
+
+    Each summary row becomes one row per subject (subject_id,
+    subject_name, Mark) for ``compute_term_results``; returns
+    ``(rows, summaries)``.  A pupil's stored totals are used only when they
+    were computed with the current scales and the caller's subject groups;
+    other pupils are computed from their marks.
+    """
+    if not summaries_built():
+        flash("Pupil summaries are still being built; some pupils may be missing "
+              "until the rebuild finishes.", "warning")
+    wanted = (sorted(total_subjects), sorted(aggregate_subjects or total_subjects))
+    version = scale_version()
+    subject_names = reference_names('subjects')
+
+    score_rows, summaries = [], {}
+    for row in rows:
+        stored = {field: row.pop(field) for field in _SUMMARY_FIELDS}
+        if (stored['scale_version'] == version
+                and subject_groups(stored['summary_class_id']) == wanted):
+            key = (row['reg_no'], row['assessment_name']) if by_assessment else row['reg_no']
+            summaries[key] = {
+                'total_score': float(stored['total_score']),
+                'subjects_count': int(stored['subjects_count']),
+                'aggregate': int(stored['aggregate']),
+                'division': stored['division'],
+                'complete': bool(stored['complete']),
+            }
+        for subject_id, mark in json.loads(stored['marks'] or '{}').items():
+            name = subject_names.get(int(subject_id))
+            if name is not None:
+                score_rows.append(dict(row, subject_id=int(subject_id), subject_name=name, Mark=mark))
+    return score_rows, summaries
+
+
+@click.command('rebuild-summaries')
+@with_appcontext
+def rebuild_summaries_command():
+    """Recompute the pupil_assessment_summary table from scores."""
+    count = rebuild_summaries()
+    click.echo(f"Rebuilt {count} pupil assessment summaries.")
+
+
+def init_summaries(app):
+    """Create (and if needed build) the summary table on each worker's first request."""
+    @app.before_request
+    def _check_summaries():
+        if request.endpoint != 'static':
+            check_summaries()
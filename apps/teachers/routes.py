@@ -9,6 +9,7 @@ import random
 import logging
 import re  # <-- Add this line
 from apps import get_db_connection
+from apps.reference_data import reference_rows
 from jinja2 import TemplateNotFound
 
 from datetime import datetime
@@ -55,8 +56,7 @@ def add_teacher():
     cursor = connection.cursor(dictionary=True)
 
     # Fetch subjects for dropdown (if needed)
-    cursor.execute("SELECT * FROM subjects ORDER BY subject_name")
-    subjects = cursor.fetchall()
+    subjects = reference_rows('subjects', order_by='subject_name')
 
     if request.method == 'POST':
         # Get form data
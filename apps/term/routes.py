@@ -9,6 +9,7 @@ import random
 import logging
 import re  # <-- Add this line
 from apps import get_db_connection
+from apps.reference_data import invalidate_reference_data, reference_rows
 from jinja2 import TemplateNotFound
 
 
@@ -59,8 +60,7 @@ def add_term():
     cursor = connection.cursor(dictionary=True)
 
     # Fetch all study_years from the database
-    cursor.execute('SELECT * FROM study_year')
-    study_years = cursor.fetchall()
+    study_years = reference_rows('study_year')
     """Handles adding a new term and logs the action with Kampala timestamp."""
     if request.method == 'POST':
         term_name = request.form.get('term_name')
@@ -94,6 +94,7 @@ def add_term():
                         INSERT INTO terms (term_name, start_on, ends_on, year_id, status)
                         VALUES (%s, %s, %s, %s, %s)
                     ''', (term_name, start_on, ends_on, year_id, status))
+                    invalidate_reference_data('terms')
                     connection.commit()
 
                     term_id = cursor.lastrowid  # Get the newly inserted term_id
@@ -208,6 +209,7 @@ def edit_term(term_id):
                 SET term_name = %s, start_on = %s, ends_on = %s, year_id = %s, status = %s
                 WHERE term_id = %s
             """, (term_name, start_on, ends_on, year_id, status, term_id))
+            invalidate_reference_data('terms')
             connection.commit()
 
             # Prepare old and new values for logging (as JSON strings)
@@ -311,6 +313,7 @@ def delete_term(term_id):
 
         # Delete the term
         cursor.execute("DELETE FROM terms WHERE term_id = %s", (term_id,))
+        invalidate_reference_data('terms')
         connection.commit()
 
         # Log the deletion
@@ -0,0 +1,29 @@
+"""Gunicorn settings for APP_CONFIG=production.
+
+    APP_CONFIG=production SECRET_KEY=... gunicorn wsgi:application
+
+WEB_WORKERS and WEB_THREADS size the node and are the same variables
+ProductionConfig reads to size each worker's connection pool.
+"""
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_WORKERS', (os.cpu_count() or 1) * 2 + 1))
+threads = int(os.getenv('WEB_THREADS', 4))
+worker_class = 'gthread'
+
+# Report batches and imports run as background jobs, but streamed
+# exports and batch card downloads can take a while
+timeout = int(os.getenv('WEB_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then; jitter keeps them from restarting together
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+
+# Each worker builds its own app, connection pool and job threads after the fork
+preload_app = False
+
+accesslog = '-'
+errorlog = '-'
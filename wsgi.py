@@ -1,5 +1,5 @@
 from apps import create_app
-from apps.config import Config
+from apps.config import get_config
 
-# Create the Flask application
-application = create_app(Config)
+# Create the Flask application (APP_CONFIG=production for multi-worker deployments)
+application = create_app(get_config())